@@ -5,6 +5,7 @@ linguistic analysis.
 import datetime
 import logging
 import os
+import sys
 from urllib.parse import urlparse, urlunparse, ParseResult
 
 from pyramid.authentication import (
@@ -20,7 +21,8 @@ from sqlalchemy.orm import scoped_session
 
 from old.models import Model, get_session_factory, get_engine, Tag
 from old.lib.constants import ISO_STRFTIME, OLD_NAME_DFLT
-from old.lib.foma_worker import start_foma_worker
+from old.lib.jobs import start_job_scheduler
+from old.lib.metrics import instrument_pool
 
 
 LOGGER = logging.getLogger(__name__)
@@ -145,8 +147,10 @@ class DBSessionFactoryRegistry(object):
         try:
             return self.session_factories[sqlalchemy_url]
         except KeyError:
+            engine = get_engine(settings)
+            instrument_pool(engine.pool, settings.get('old_name', ''))
             self.session_factories[sqlalchemy_url] = scoped_session(
-                get_session_factory(get_engine(settings)))
+                get_session_factory(engine))
             return self.session_factories[sqlalchemy_url]
 
 
@@ -192,6 +196,7 @@ class MyRequest(Request):
         self._beakersession = None
         self._old_name = None
         self._sqlalchemy_url = None
+        self._settings = None
         def session_getter(settings):
             return db_session_factory_registry.get_session(settings)()
         self.session_getter = session_getter
@@ -212,10 +217,36 @@ class MyRequest(Request):
     def sqlalchemy_url(self):
         if self._sqlalchemy_url:
             return self._sqlalchemy_url
-        self.registry.settings['old_name'] = self.old_name
-        self._sqlalchemy_url = build_sqlalchemy_url(self.registry.settings)
+        self._sqlalchemy_url = build_sqlalchemy_url(
+            dict(self.registry.settings, old_name=self.old_name))
         return self._sqlalchemy_url
 
+    @property
+    def settings(self):
+        """The settings of the OLD being requested: a copy of the registry's
+        settings whose ``old_name``, ``sqlalchemy.url`` and ``session.*``
+        values are those of the OLD named in the URL path. The registry's
+        settings are shared by the concurrent requests for all OLDs, so they
+        are never changed per request; views must read the OLD-specific
+        settings from here, e.g., ``h.get_old_directory_path('files',
+        self.request.settings)``.
+        """
+        if self._settings is not None:
+            return self._settings
+        settings = dict(self.registry.settings)
+        settings['old_name'] = self.old_name
+        settings['sqlalchemy.url'] = self.sqlalchemy_url
+        settings['session.url'] = self.sqlalchemy_url
+        lock_dir = settings['session.lock_dir']
+        if os.path.basename(lock_dir.rstrip('/')) != self.old_name:
+            settings['session.lock_dir'] = os.path.join(
+                os.path.dirname(lock_dir), self.old_name)
+        if not settings['session.key'].endswith(
+                '_{}'.format(self.old_name)):
+            settings['session.key'] = 'old_{}'.format(self.old_name)
+        self._settings = settings
+        return self._settings
+
     @property
     def dbsession(self):
         """The dbsession property should return a different dbsession depending
@@ -226,15 +257,32 @@ class MyRequest(Request):
         """
         if self._dbsession:
             return self._dbsession
-        self.registry.settings['sqlalchemy.url'] = self.sqlalchemy_url
         self._dbsession = db_session_factory_registry.get_session(
-            self.registry.settings)()
+            self.settings)()
         self.add_finished_callback(self.close_dbsession)
         return self._dbsession
 
     def close_dbsession(self, request):
-        # pylint: disable=unused-argument
-        self._dbsession.commit()
+        """Commit the request's changes, or roll them back if the request
+        raised or its session is in a failed transaction. The session is
+        thread-local and reused by the next request served by this thread,
+        so it must not be left in a failed transaction.
+
+        An exception that no exception view handles does not set
+        ``request.exception``; it is still being raised, i.e., it is in
+        ``sys.exc_info()``, while the finished callbacks are run.
+        """
+        failed = (request.exception is not None or
+                  sys.exc_info()[0] is not None or
+                  not self._dbsession.is_active)
+        try:
+            if failed:
+                self._dbsession.rollback()
+            else:
+                self._dbsession.commit()
+        except Exception:
+            self._dbsession.rollback()
+            raise
 
     @property
     def session(self):
@@ -243,18 +291,8 @@ class MyRequest(Request):
         """
         if self._beakersession:
             return self._beakersession
-        self.registry.settings['session.url'] = self.sqlalchemy_url
-        if os.path.basename(self.registry.settings[
-                'session.lock_dir'].rstrip('/')) != self.old_name:
-            self.registry.settings['session.lock_dir'] = os.path.join(
-                os.path.dirname(self.registry.settings['session.lock_dir']),
-                self.registry.settings['old_name'])
-        if not self.registry.settings['session.key'].endswith(
-                '_{}'.format(self.old_name)):
-            self.registry.settings['session.key'] = 'old_{}'.format(
-                self.registry.settings['old_name'])
         self._beakersession = beaker_session_factory.get_session(
-            self.registry.settings)(self)
+            self.settings)(self)
         self.add_finished_callback(self.save_beakersession)
         return self._beakersession
 
@@ -286,6 +324,40 @@ ENV_VAR_MAP = {
     'OLD_PERMANENT_STORE': 'permanent_store',
     'OLD_ADD_LANGUAGE_DATA': 'add_language_data',
     'OLD_EMPTY_DATABASE': 'empty_database',
+    'OLD_MORPHEME_REFERENCES_PROCESSES': 'morpheme_references_processes',
+    'OLD_MORPHEME_REFERENCES_CHUNK_SIZE': 'morpheme_references_chunk_size',
+    # Background jobs
+    'OLD_JOBS_WORKERS': 'jobs_workers',
+    'OLD_JOBS_POLL_INTERVAL': 'jobs_poll_interval',
+    'OLD_JOBS_MAX_PER_TENANT': 'jobs_max_per_tenant',
+    'OLD_JOBS_STALE_AFTER': 'jobs_stale_after',
+    'OLD_JOBS_MAX_ATTEMPTS': 'jobs_max_attempts',
+    'OLD_JOBS_TENANTS': 'jobs_tenants',
+    # Parse cache
+    'OLD_PARSE_CACHE_SIZE': 'parse_cache_size',
+    # Search plan cache
+    'OLD_SEARCH_PLAN_CACHE_SIZE': 'search_plan_cache_size',
+    # Search result cache
+    'OLD_RESULT_CACHE_MAX_MB': 'result_cache_max_mb',
+    # Query accounting
+    'OLD_DEBUG_QUERIES': 'debug_queries',
+    # Metrics
+    'OLD_METRICS_ENABLED': 'metrics_enabled',
+    'OLD_METRICS_DIR': 'metrics_dir',
+    'OLD_METRICS_MAX_LABEL_VALUES': 'metrics_max_label_values',
+    # Profiling
+    'OLD_PROFILING_ENABLED': 'profiling_enabled',
+    'OLD_PROFILING_SAMPLE_RATE': 'profiling_sample_rate',
+    'OLD_PROFILING_INTERVAL': 'profiling_interval',
+    'OLD_PROFILING_MAX_PROFILES': 'profiling_max_profiles',
+    # Slow searches
+    'OLD_SLOW_SEARCH_THRESHOLD': 'slow_search_threshold',
+    'OLD_SLOW_SEARCH_LOG_MAX_MB': 'slow_search_log_max_mb',
+    'OLD_SLOW_SEARCH_LOG_BACKUPS': 'slow_search_log_backups',
+    # Corpus files
+    'OLD_CORPUS_EXPORT_MODE': 'corpus_export_mode',
+    'OLD_CORPUS_EXPORT_PROCESSES': 'corpus_export_processes',
+    'OLD_CORPUS_EXPORT_CHUNK_SIZE': 'corpus_export_chunk_size',
     # Email
     'OLD_PASSWORD_RESET_SMTP_SERVER': 'password_reset_smtp_server',
     'OLD_TEST_EMAIL_TO': 'test_email_to',
@@ -348,9 +420,12 @@ def override_settings_with_env_vars(settings):
 def main(global_config, **settings):
     """This function returns a Pyramid WSGI application."""
     # pylint: disable=unused-argument
-    start_foma_worker()
     settings = override_settings_with_env_vars(settings)
+    start_job_scheduler(settings)
     config = Configurator(settings=settings, request_factory=MyRequest)
     config.include('.routes')
     config.add_renderer('json', get_json_renderer())
+    config.add_tween('old.lib.querystats.query_stats_tween_factory')
+    config.add_tween('old.lib.metrics.metrics_tween_factory')
+    config.add_tween('old.lib.profiler.profiler_tween_factory')
     return OLDHeadersMiddleware(config.make_wsgi_app())
@@ -0,0 +1,16 @@
+"""Benchmarks for performance-sensitive parts of the OLD.
+
+Each module in this package is a stand-alone script that can be run with
+``python -m old.benchmarks.<module>``; it prints its timings and exits.
+"""
+
+from bisect import bisect
+
+
+def weighted_choice(rng, population, cum_weights):
+    """Return an element of ``population`` chosen by ``rng`` with the
+    cumulative weights ``cum_weights`` (cf. ``itertools.accumulate``). This is
+    ``rng.choices(population, cum_weights=cum_weights)[0]``, which needs
+    Python 3.6.
+    """
+    return population[bisect(cum_weights, rng.random() * cum_weights[-1])]
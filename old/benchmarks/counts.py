@@ -0,0 +1,140 @@
+# Copyright 2016 Joel Dunham
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""Benchmark the count modes of the offset paginator (cf.
+:func:`old.lib.dbutils.get_paginated_query_results`) on searches over the
+``translations`` and ``tags`` of a synthetic SQLite OLD::
+
+    $ python -m old.benchmarks.counts --forms 50000 --page 200
+
+Every form has two translations and one or two of ten tags. Each search is
+built by ``SQLAQueryBuilder`` and eager loaded as ``SEARCH /forms`` does, and
+its first and ``page``-th pages are fetched in each count mode. The ``cached``
+mode is timed cold (the count is computed) and warm (it is reused); on SQLite
+the ``estimate`` mode falls back to ``cached``.
+"""
+
+import argparse
+import random
+import time
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from old.lib import dbutils
+from old.lib.dbutils import add_pagination, get_eagerloader
+from old.lib.SQLAQueryBuilder import SQLAQueryBuilder
+import old.models as old_models
+from old.models.meta import Base
+
+
+SETTINGS = {'sqlalchemy.url': 'sqlite://'}
+
+SEARCHES = (
+    ('translations', {'filter': [
+        'Translation', 'transcription', 'like', '%a%']}),
+    ('tags', {'filter': ['Tag', 'name', 'in', ['tag 1', 'tag 2', 'tag 3']]}),
+    ('translations and tags', {'filter': ['and', [
+        ['Translation', 'transcription', 'like', '%o%'],
+        ['Form', 'tags', 'name', '=', 'tag 4']]]}),
+)
+
+
+def populate(dbsession, size, seed=0):
+    """Insert ``size`` forms, their translations and their tags."""
+    rng = random.Random(seed)
+    letters = 'ptkmnsaiou'
+
+    def word():
+        return ''.join(rng.choice(letters) for _ in range(rng.randint(3, 10)))
+
+    dbsession.execute(old_models.Tag.__table__.insert(), [
+        {'id': id_, 'name': 'tag %d' % id_} for id_ in range(1, 11)])
+    forms, translations, form_tags = [], [], []
+    for id_ in range(1, size + 1):
+        forms.append({'id': id_, 'UUID': str(id_), 'transcription': word(),
+                      'morpheme_break': '', 'morpheme_gloss': ''})
+        translations.extend({'form_id': id_, 'transcription': word(),
+                             'grammaticality': ''} for _ in range(2))
+        form_tags.extend({'form_id': id_, 'tag_id': tag_id}
+                         for tag_id in rng.sample(range(1, 11),
+                                                  rng.randint(1, 2)))
+    for table, rows in ((old_models.Form.__table__, forms),
+                        (old_models.Translation.__table__, translations),
+                        (old_models.FormTag.__table__, form_tags)):
+        for index in range(0, len(rows), 10000):
+            dbsession.execute(table.insert(), rows[index:index + 10000])
+    dbsession.commit()
+
+
+def get_query(dbsession, search):
+    query = SQLAQueryBuilder(dbsession, 'Form', settings=SETTINGS)\
+        .get_SQLA_query(search)
+    return get_eagerloader('Form', 'search')(query)
+
+
+def time_page(dbsession, search, paginator):
+    dbsession.expunge_all()
+    start = time.time()
+    result = add_pagination(get_query(dbsession, search), dict(paginator))
+    return time.time() - start, result
+
+
+def run(forms, page, items_per_page):
+    engine = create_engine('sqlite://')
+    Base.metadata.create_all(engine)
+    dbsession = sessionmaker(bind=engine)()
+    populate(dbsession, forms)
+    results = []
+    for name, search in SEARCHES:
+        for page_ in (1, page):
+            paginator = {'page': page_, 'items_per_page': items_per_page}
+            dbutils.COUNT_CACHE.clear()
+            result = {'search': name, 'page': page_}
+            items = None
+            for label, count_mode in (('exact', 'exact'),
+                                      ('cached_cold', 'cached'),
+                                      ('cached_warm', 'cached'),
+                                      ('estimate', 'estimate'),
+                                      ('none', 'none')):
+                seconds, page_result = time_page(
+                    dbsession, search, dict(paginator, count_mode=count_mode))
+                result['%s_ms' % label] = 1000 * seconds
+                page_ids = [item['id'] for item in page_result['items']]
+                if items is None:
+                    items = page_ids
+                    result['count'] = page_result['paginator']['count']
+                assert page_ids == items, 'The count modes disagree'
+            results.append(result)
+    dbsession.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark the count modes of paginated form searches.')
+    parser.add_argument('--forms', type=int, default=50000)
+    parser.add_argument('--page', type=int, default=200)
+    parser.add_argument('--items-per-page', type=int, default=10)
+    args = parser.parse_args()
+    print('%d forms, %d items per page' % (args.forms, args.items_per_page))
+    for result in run(args.forms, args.page, args.items_per_page):
+        print('  %(search)-22s page %(page)4d (%(count)6d matches):'
+              '  exact %(exact_ms)7.1f ms  cached %(cached_cold_ms)7.1f /'
+              ' %(cached_warm_ms)6.1f ms  estimate %(estimate_ms)7.1f ms'
+              '  none %(none_ms)7.1f ms' % result)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+# Copyright 2016 Joel Dunham
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""Stand-in for MITLM's ``estimate-ngram`` used by the benchmark suite (cf.
+:mod:`old.benchmarks.suite`) so that LM generation can be timed where MITLM
+is not installed::
+
+    $ python estimate_ngram.py -o 3 -s ModKN -t corpus.txt -wl model.lm
+
+It writes a maximum likelihood bigram model of the corpus (whatever the
+order and smoothing) as an ARPA file and reports it as MITLM does. It must
+not import the ``old`` package: the suite runs it as a script.
+"""
+
+from collections import Counter
+import math
+import sys
+
+
+def estimate(corpus_path, arpa_path):
+    unigrams, bigrams = Counter(), Counter()
+    with open(corpus_path, encoding='utf8') as file_:
+        for line in file_:
+            words = ['<s>'] + line.split() + ['</s>']
+            unigrams.update(words)
+            bigrams.update(zip(words, words[1:]))
+    total = sum(unigrams.values())
+    with open(arpa_path, 'w', encoding='utf8') as file_:
+        file_.write('\\data\\\nngram 1=%d\nngram 2=%d\n\n\\1-grams:\n' % (
+            len(unigrams), len(bigrams)))
+        for word, count in sorted(unigrams.items()):
+            logprob = -99 if word == '<s>' else math.log10(count / total)
+            file_.write('%f\t%s\t0.0\n' % (logprob, word))
+        file_.write('\n\\2-grams:\n')
+        for (first, second), count in sorted(bigrams.items()):
+            file_.write('%f\t%s %s\n' % (
+                math.log10(count / unigrams[first]), first, second))
+        file_.write('\n\\end\\\n')
+
+
+def main():
+    args = dict(zip(sys.argv[1::2], sys.argv[2::2]))
+    estimate(args['-t'], args['-wl'])
+    print('Saving LM to %s' % args['-wl'])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,147 @@
+# Copyright 2016 Joel Dunham
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""Benchmark the ``match`` relation of ``SQLAQueryBuilder`` (full-text
+indexes, cf. :mod:`old.models.fulltext`) against the ``like`` searches that
+it replaces, on a synthetic SQLite OLD::
+
+    $ python -m old.benchmarks.fulltext --forms 50000
+
+Each form has a transcription and a translation of three to six words drawn
+from a vocabulary in which a few words are common and most are rare. Every
+search is timed as a ``like '%...%'`` search and as the equivalent ``match``
+search. The two do not always return the same forms: ``like`` matches
+substrings case-sensitively, ``match`` whole words (or prefixes)
+case-insensitively, so both counts are reported.
+"""
+
+import argparse
+from itertools import accumulate
+import random
+import time
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from old.benchmarks import weighted_choice
+from old.lib.SQLAQueryBuilder import SQLAQueryBuilder
+import old.models as old_models
+from old.models.meta import Base
+
+
+SETTINGS = {'sqlalchemy.url': 'sqlite://'}
+
+# (name, like filter, match filter)
+SEARCHES = (
+    ('rare word',
+     ['Form', 'transcription', 'like', '%kipasu%'],
+     ['Form', 'transcription', 'match', 'kipasu']),
+    ('common word',
+     ['Form', 'transcription', 'like', '%mata%'],
+     ['Form', 'transcription', 'match', 'mata']),
+    ('prefix',
+     ['Form', 'transcription', 'like', '% kipa%'],
+     ['Form', 'transcription', 'match', 'kipa*']),
+    ('phrase',
+     ['Form', 'transcription', 'like', '%mata sino%'],
+     ['Form', 'transcription', 'match', '"mata sino"']),
+    ('translation word',
+     ['Translation', 'transcription', 'like', '%kipasu%'],
+     ['Translation', 'transcription', 'match', 'kipasu']),
+    ('two words',
+     ['and', [['Form', 'transcription', 'like', '%mata%'],
+              ['Form', 'transcription', 'like', '%kipasu%']]],
+     ['Form', 'transcription', 'match', 'mata kipasu']),
+)
+
+
+def get_vocabulary(rng, size=5000):
+    syllables = [c + v for c in 'ptkmnsl' for v in 'aiu']
+    words = {'mata', 'sino', 'kipasu'}
+    while len(words) < size:
+        words.add(''.join(rng.choice(syllables)
+                          for _ in range(rng.randint(2, 4))))
+    return sorted(words)
+
+
+def populate(dbsession, size, seed=0):
+    """Insert ``size`` forms and their translations."""
+    rng = random.Random(seed)
+    vocabulary = get_vocabulary(rng)
+    cum_weights = list(accumulate(
+        50 if word in ('mata', 'sino') else 1 for word in vocabulary))
+
+    def sentence():
+        return ' '.join(weighted_choice(rng, vocabulary, cum_weights)
+                        for _ in range(rng.randint(3, 6)))
+
+    forms, translations = [], []
+    for id_ in range(1, size + 1):
+        forms.append({'id': id_, 'UUID': str(id_),
+                      'transcription': sentence(), 'morpheme_break': '',
+                      'morpheme_gloss': ''})
+        translations.append({'form_id': id_, 'transcription': sentence(),
+                             'grammaticality': ''})
+    for table, rows in ((old_models.Form.__table__, forms),
+                        (old_models.Translation.__table__, translations)):
+        for index in range(0, len(rows), 10000):
+            dbsession.execute(table.insert(), rows[index:index + 10000])
+    dbsession.commit()
+
+
+def time_search(dbsession, filter_, repeat):
+    best = None
+    for _ in range(repeat):
+        dbsession.expunge_all()
+        start = time.time()
+        count = SQLAQueryBuilder(dbsession, 'Form', settings=SETTINGS)\
+            .get_SQLA_query({'filter': filter_}).count()
+        seconds = time.time() - start
+        best = seconds if best is None else min(best, seconds)
+    return best, count
+
+
+def run(forms, repeat):
+    engine = create_engine('sqlite://')
+    Base.metadata.create_all(engine)
+    dbsession = sessionmaker(bind=engine)()
+    populate(dbsession, forms)
+    results = []
+    for name, like_filter, match_filter in SEARCHES:
+        like_seconds, like_count = time_search(dbsession, like_filter, repeat)
+        match_seconds, match_count = time_search(
+            dbsession, match_filter, repeat)
+        results.append({'search': name, 'like_ms': 1000 * like_seconds,
+                        'like_count': like_count,
+                        'match_ms': 1000 * match_seconds,
+                        'match_count': match_count})
+    dbsession.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark full-text match searches against like'
+                    ' searches.')
+    parser.add_argument('--forms', type=int, default=50000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+    print('%d forms, best of %d' % (args.forms, args.repeat))
+    for result in run(args.forms, args.repeat):
+        print('  %(search)-28s like %(like_ms)8.1f ms (%(like_count)6d)'
+              '  match %(match_ms)8.1f ms (%(match_count)6d)' % result)
+
+
+if __name__ == '__main__':
+    main()
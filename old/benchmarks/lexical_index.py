@@ -0,0 +1,127 @@
+# Copyright 2016 Joel Dunham
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""Benchmark the lexical match lookups made while recompiling morphemic
+analyses against the whole database, i.e., ``get_perfect_matches`` and
+``get_partial_matches`` with a ``whole_db`` argument.
+
+Compares the former linear scan of every form for every morpheme against
+:class:`old.views.forms.LexicalIndex` on a synthetic lexicon::
+
+    $ python -m old.benchmarks.lexical_index --forms 100000 --lookups 200
+
+"""
+
+import argparse
+import random
+import time
+
+from old.views.forms import FakeForm, LexicalIndex
+
+
+def generate_lexicon(size, seed=0):
+    """Return ``size`` fake lexical forms with random morpheme breaks and
+    glosses drawn from a vocabulary about a tenth the size of the lexicon (so
+    that there are homophones and synonyms).
+    """
+    rng = random.Random(seed)
+    letters = 'ptkmnsaiou'
+    vocabulary = max(size // 10, 1)
+    shapes = [''.join(rng.choice(letters) for _ in range(rng.randint(2, 6)))
+              for _ in range(vocabulary)]
+    glosses = ['G%d' % i for i in range(vocabulary)]
+    return [FakeForm(id=id_,
+                     morpheme_break=rng.choice(shapes),
+                     morpheme_gloss=rng.choice(glosses),
+                     syntactic_category=None)
+            for id_ in range(1, size + 1)]
+
+
+def get_lookups(lexicon, count, seed=1):
+    """Return ``count`` (morpheme, gloss) pairs, half of which are attested
+    as perfect matches in ``lexicon``.
+    """
+    rng = random.Random(seed)
+    lookups = []
+    for index in range(count):
+        form = rng.choice(lexicon)
+        if index % 2:
+            lookups.append((form.morpheme_break, form.morpheme_gloss))
+        else:
+            lookups.append((form.morpheme_break,
+                            rng.choice(lexicon).morpheme_gloss))
+    return lookups
+
+
+def linear_matches(whole_db, morpheme, gloss):
+    """The pre-index implementation: scan the whole lexicon per lookup."""
+    result = [f for f in whole_db if f.morpheme_break == morpheme and
+              f.morpheme_gloss == gloss]
+    if result:
+        return result, []
+    return ([f for f in whole_db if f.morpheme_break == morpheme],
+            [f for f in whole_db if f.morpheme_gloss == gloss])
+
+
+def indexed_matches(lexical_index, morpheme, gloss):
+    result = lexical_index.get_perfect_matches(morpheme, gloss)
+    if result:
+        return result, []
+    return (lexical_index.get_partial_matches('morpheme_break', morpheme),
+            lexical_index.get_partial_matches('morpheme_gloss', gloss))
+
+
+def run(forms, lookups):
+    lexicon = generate_lexicon(forms)
+    pairs = get_lookups(lexicon, lookups)
+    start = time.time()
+    linear = [linear_matches(lexicon, *pair) for pair in pairs]
+    linear_time = time.time() - start
+    start = time.time()
+    lexical_index = LexicalIndex(lexicon)
+    build_time = time.time() - start
+    start = time.time()
+    indexed = [indexed_matches(lexical_index, *pair) for pair in pairs]
+    indexed_time = time.time() - start
+    assert [[[f.id for f in m] for m in r] for r in linear] == \
+        [[[f.id for f in m] for m in r] for r in indexed], \
+        'Linear and indexed lookups disagree'
+    return {
+        'forms': forms,
+        'lookups': lookups,
+        'linear_seconds': linear_time,
+        'index_build_seconds': build_time,
+        'indexed_seconds': indexed_time,
+        'linear_per_lookup_ms': 1000 * linear_time / lookups,
+        'indexed_per_lookup_ms': 1000 * indexed_time / lookups,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark linear vs. hash-indexed lexical matching.')
+    parser.add_argument('--forms', type=int, default=100000)
+    parser.add_argument('--lookups', type=int, default=200)
+    args = parser.parse_args()
+    result = run(args.forms, args.lookups)
+    print('Lexicon of %(forms)d forms, %(lookups)d morpheme lookups' % result)
+    print('  linear scan:   %(linear_seconds).3fs'
+          ' (%(linear_per_lookup_ms).3f ms/lookup)' % result)
+    print('  hash index:    %(indexed_seconds).3fs'
+          ' (%(indexed_per_lookup_ms).4f ms/lookup)'
+          ' + %(index_build_seconds).3fs to build' % result)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,573 @@
+# Copyright 2016 Joel Dunham
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""Concurrent HTTP load test of the OLD: a mix of traffic from ``--clients``
+concurrent clients over one or more OLDs (tenants)::
+
+    $ python -m old.benchmarks.load config.ini blaold okaold --generate \\
+          --forms 2000 --clients 16 --duration 60 \\
+          --mix read=40,search=25,write=15,upload=10,parse=10 \\
+          --output load.json
+
+The OLD app of the config file is served by waitress (with ``--threads``
+threads) on a free local port. Each client is a thread with its own HTTP
+session, logged in as the administrator of every tenant; until
+``--duration`` seconds have passed, it picks a tenant at random and then an
+operation of the mix by weight:
+
+- ``read``: ``GET /forms/<id>`` or a page of ``GET /forms``;
+- ``search``: a ``SEARCH /forms`` of the transcriptions, morpheme breaks or
+  translations;
+- ``write``: a ``PUT /forms/<id>`` of a lexical item's gloss, which is
+  percolated to the forms that contain it;
+- ``upload``: a ``POST /files`` of a short base64-encoded WAV file; and
+- ``parse``: a ``PUT /morphologicalparsers/<id>/parse`` of a few words, with
+  the first compiled parser of the tenant (left out of the mix of tenants
+  without one, or if foma is not installed).
+
+The tenants must exist (``--generate`` (re-)creates them as synthetic OLDs,
+cf. :mod:`old.benchmarks.synthetic`). The glosses written are restored and
+the files uploaded are deleted afterwards.
+
+The report gives the throughput, the error rate and the 50th, 90th, 95th and
+99th percentile and maximum latencies (milliseconds) of all requests, of
+each operation and of each tenant. Lock contention is detected in the errors
+logged by the server (e.g., SQLite's ``database is locked``, MySQL's lock
+wait timeouts and deadlocks) and, on MySQL, in the change of the server's
+table and row lock wait counters (e.g., MyISAM's ``Table_locks_waited``).
+Finally, the number of files of each tenant is checked against its uploads,
+which would reveal requests that were served by another tenant's database.
+"""
+
+import argparse
+import base64
+from collections import Counter, OrderedDict
+import datetime
+import io
+import itertools
+import json
+import logging
+import platform
+import random
+import sys
+import threading
+import time
+import traceback
+import uuid
+import wave
+
+import requests
+from waitress.server import create_server
+
+from old import (
+    build_sqlalchemy_url,
+    db_session_factory_registry,
+    main as get_app,
+)
+from old.benchmarks import synthetic, weighted_choice
+from old.benchmarks.suite import FORM_PARAMS
+import old.lib.helpers as h
+
+
+LOGGER = logging.getLogger(__name__)
+
+JSON_HEADERS = {'Content-Type': 'application/json'}
+DEFAULT_MIX = OrderedDict([('read', 40), ('search', 25), ('write', 15),
+                           ('upload', 10), ('parse', 10)])
+DEFAULT_CLIENTS = 8
+DEFAULT_DURATION = 30
+LEXICAL_ITEMS = 50
+PERCENTILES = (50, 90, 95, 99)
+SEARCH_FILTERS = (
+    ['Form', 'transcription', 'like', '%ka%'],
+    ['Form', 'transcription', 'like', 'mi%'],
+    ['Form', 'morpheme_break', 'regex', '^(pa|li)'],
+    ['Translation', 'transcription', 'like', '%1%'],
+    ['and', [['Form', 'syntactic_category', 'name', '=', 'V'],
+             ['Form', 'morpheme_gloss', 'like', '%1%']]],
+)
+# The texts that identify the lock contention errors of SQLite and MySQL.
+LOCK_ERRORS = (
+    'database is locked',
+    'database table is locked',
+    'Lock wait timeout exceeded',
+    'Deadlock found',
+    'was locked with a READ lock',
+)
+MYSQL_LOCK_STATUS = ('Table_locks_immediate', 'Table_locks_waited',
+                     'Innodb_row_lock_waits', 'Innodb_row_lock_time')
+
+
+class LoadTestError(Exception):
+    pass
+
+
+class LockDetector(logging.Handler):
+    """Counts the exceptions logged while serving requests (by class) and the
+    lock contention errors among them (by the texts of ``LOCK_ERRORS``).
+    """
+
+    def __init__(self):
+        super().__init__(logging.ERROR)
+        self.exceptions = Counter()
+        self.locks = Counter()
+
+    def emit(self, record):
+        if not record.exc_info:
+            return
+        exc_type = record.exc_info[0]
+        text = ''.join(traceback.format_exception(*record.exc_info))
+        self.exceptions[exc_type.__name__] += 1
+        for lock_error in LOCK_ERRORS:
+            if lock_error in text:
+                self.locks[lock_error] += 1
+                break
+
+
+def get_wav(seconds=0.1, rate=8000):
+    """Return a WAV file of ``seconds`` of silence."""
+    buffer_ = io.BytesIO()
+    with wave.open(buffer_, 'wb') as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(rate)
+        wav.writeframes(b'\x00\x00' * int(seconds * rate))
+    return buffer_.getvalue()
+
+
+def percentile(sorted_values, percent):
+    """Return the ``percent`` percentile of ``sorted_values`` (nearest
+    rank).
+    """
+    if not sorted_values:
+        return None
+    rank = max(1, -(-len(sorted_values) * percent // 100))
+    return sorted_values[int(rank) - 1]
+
+
+def summarize(samples, seconds):
+    """Return the number of requests, errors, throughput, error rate and
+    latency percentiles of ``samples``.
+    """
+    durations = sorted(sample['ms'] for sample in samples)
+    errors = [sample for sample in samples if sample['error']]
+    summary = OrderedDict([
+        ('requests', len(samples)),
+        ('errors', len(errors)),
+        ('error_rate', len(errors) / len(samples) if samples else 0.0),
+        ('throughput', len(samples) / seconds if seconds else 0.0),
+    ])
+    for percent in PERCENTILES:
+        summary['p%d' % percent] = percentile(durations, percent)
+    summary['max'] = durations[-1] if durations else None
+    summary['error_kinds'] = dict(Counter(
+        sample['error'] for sample in errors))
+    return summary
+
+
+class Tenant(object):
+    """The fixtures of the load test in the OLD ``old_name``: the lexical
+    items written to, the words parsed, the parser and the files uploaded.
+    """
+
+    def __init__(self, old_name, settings):
+        self.old_name = old_name
+        self.settings = settings
+        self.forms = 0
+        self.files = 0
+        self.lexical_items = []
+        self.words = []
+        self.parser_id = None
+        self.mix = OrderedDict()
+        self.operations = []
+        self.cum_weights = []
+        self.uploaded = []
+        self.written = set()
+
+    def setup(self, client, mix):
+        self.forms = client.request(
+            self, 'get', 'forms?page=1&items_per_page=1').json()[
+                'paginator']['count']
+        self.files = client.request(
+            self, 'get', 'files?page=1&items_per_page=1').json()[
+                'paginator']['count']
+        self.lexical_items = client.request(self, 'search', 'forms', {
+            'query': {'filter': ['Form', 'syntactic_category', 'name', 'in',
+                                 ['N', 'V']],
+                      'order_by': ['Form', 'id', 'asc']},
+            'paginator': {'page': 1, 'items_per_page': LEXICAL_ITEMS}})\
+            .json()['items']
+        if not self.forms or not self.lexical_items:
+            raise LoadTestError('OLD "%s" has no forms or lexical items; use'
+                                ' --generate.' % self.old_name)
+        self.words = [item['transcription'] for item in self.lexical_items]
+        if h.foma_installed():
+            for parser in client.request(
+                    self, 'get', 'morphologicalparsers').json():
+                if parser.get('compile_succeeded'):
+                    self.parser_id = parser['id']
+                    break
+        self.mix = OrderedDict(
+            (operation, weight) for operation, weight in mix.items()
+            if weight and (operation != 'parse' or self.parser_id))
+        self.operations = list(self.mix)
+        self.cum_weights = list(itertools.accumulate(self.mix.values()))
+        if 'parse' in mix and mix['parse'] and 'parse' not in self.mix:
+            LOGGER.warning('OLD "%s" has no compiled morphological parser (or'
+                           ' foma is not installed): no parse requests.',
+                           self.old_name)
+
+    def get_write_params(self, lexical_item, gloss):
+        return dict(
+            FORM_PARAMS,
+            transcription=lexical_item['transcription'],
+            morpheme_break=lexical_item['morpheme_break'],
+            morpheme_gloss=gloss,
+            syntactic_category=lexical_item['syntactic_category']['id'],
+            translations=[{'transcription': translation['transcription'],
+                           'grammaticality': translation['grammaticality']}
+                          for translation in lexical_item['translations']])
+
+    def teardown(self, client):
+        """Restore the glosses written and delete the files uploaded."""
+        for lexical_item in self.lexical_items:
+            if lexical_item['id'] in self.written:
+                client.request(
+                    self, 'put', 'forms/%d' % lexical_item['id'],
+                    self.get_write_params(lexical_item,
+                                          lexical_item['morpheme_gloss']))
+        for id_ in self.uploaded:
+            client.request(self, 'delete', 'files/%d' % id_)
+
+
+class Client(threading.Thread):
+    """A client of the load test: sends requests of the tenants' mixes until
+    ``deadline`` and records their samples.
+    """
+
+    writes = itertools.count(1)
+
+    def __init__(self, index, url, tenants, deadline, seed=0):
+        super().__init__(name='load-client-%d' % index, daemon=True)
+        self.url = url
+        self.tenants = tenants
+        self.deadline = deadline
+        self.rng = random.Random('%s-%d' % (seed, index))
+        self.session = requests.Session()
+        self.samples = []
+        self.wav = base64.b64encode(get_wav()).decode('ascii')
+
+    def request(self, tenant, method, path, params=None, check=True):
+        response = self.session.request(
+            method.upper(), '%s/%s/%s' % (self.url, tenant.old_name, path),
+            data=None if params is None else json.dumps(params),
+            headers=JSON_HEADERS)
+        if check and response.status_code != 200:
+            raise LoadTestError('%s %s of %s returned %s: %s' % (
+                method.upper(), path, tenant.old_name, response.status_code,
+                response.text[:500]))
+        return response
+
+    def login(self):
+        for tenant in self.tenants:
+            self.request(tenant, 'post', 'login/authenticate',
+                         {'username': 'admin', 'password': 'adminA_1'})
+
+    def run(self):
+        while time.time() < self.deadline:
+            tenant = self.rng.choice(self.tenants)
+            operation = weighted_choice(
+                self.rng, tenant.operations, tenant.cum_weights)
+            start = time.perf_counter()
+            try:
+                response = getattr(self, operation)(tenant)
+                error = (None if response.status_code == 200 else
+                         'HTTP %d' % response.status_code)
+            except requests.RequestException as exc:
+                response, error = None, exc.__class__.__name__
+            self.samples.append({
+                'operation': operation,
+                'tenant': tenant.old_name,
+                'ms': 1000 * (time.perf_counter() - start),
+                'error': error})
+            if operation == 'upload' and not error:
+                tenant.uploaded.append(response.json()['id'])
+
+    # Operations
+    ###########################################################################
+
+    def read(self, tenant):
+        if self.rng.random() < 0.5:
+            return self.request(tenant, 'get', 'forms/%d' % self.rng.randint(
+                1, tenant.forms), check=False)
+        return self.request(
+            tenant, 'get', 'forms?page=%d&items_per_page=50' %
+            self.rng.randint(1, max(1, min(20, tenant.forms // 50))),
+            check=False)
+
+    def search(self, tenant):
+        return self.request(tenant, 'search', 'forms', {
+            'query': {'filter': self.rng.choice(SEARCH_FILTERS)},
+            'paginator': {'page': 1, 'items_per_page': 50}}, check=False)
+
+    def write(self, tenant):
+        lexical_item = self.rng.choice(tenant.lexical_items)
+        tenant.written.add(lexical_item['id'])
+        # Each gloss written is new, so no update is rejected as unchanged.
+        return self.request(
+            tenant, 'put', 'forms/%d' % lexical_item['id'],
+            tenant.get_write_params(lexical_item, '%s.%d' % (
+                lexical_item['morpheme_gloss'], next(self.writes))),
+            check=False)
+
+    def upload(self, tenant):
+        return self.request(tenant, 'post', 'files', {
+            'filename': 'load_%s.wav' % uuid.uuid4().hex,
+            'description': 'load test',
+            'date_elicited': '',
+            'elicitor': '',
+            'speaker': '',
+            'utterance_type': '',
+            'tags': [],
+            'forms': [],
+            'base64_encoded_file': self.wav}, check=False)
+
+    def parse(self, tenant):
+        return self.request(
+            tenant, 'put', 'morphologicalparsers/%d/parse' % tenant.parser_id,
+            {'transcriptions': self.rng.sample(
+                tenant.words, min(5, len(tenant.words)))}, check=False)
+
+
+def get_mysql_lock_status(settings):
+    """Return the MySQL server's lock wait counters, or ``{}`` if the OLD
+    is not on MySQL.
+    """
+    if settings.get('db.rdbms') != 'mysql':
+        return {}
+    dbsession = db_session_factory_registry.get_session(settings)()
+    try:
+        return {name: int(value) for name, value in dbsession.execute(
+            'SHOW GLOBAL STATUS WHERE Variable_name IN (%s)' % ', '.join(
+                "'%s'" % name for name in MYSQL_LOCK_STATUS))}
+    finally:
+        dbsession.close()
+
+
+class LoadTest(object):
+    """Serves the OLD app of ``settings`` and runs the load test of the
+    ``old_names`` tenants.
+    """
+
+    def __init__(self, settings, old_names, clients=DEFAULT_CLIENTS,
+                 duration=DEFAULT_DURATION, mix=DEFAULT_MIX, threads=None,
+                 seed=0):
+        self.settings = dict(settings, testing='0', readonly='0')
+        self.tenants = []
+        for old_name in old_names:
+            tenant_settings = dict(settings, old_name=old_name)
+            tenant_settings['sqlalchemy.url'] = build_sqlalchemy_url(
+                tenant_settings)
+            self.tenants.append(Tenant(old_name, tenant_settings))
+        self.clients = clients
+        self.duration = duration
+        self.mix = mix
+        self.threads = threads or clients
+        self.seed = seed
+
+    def run(self):
+        detector = LockDetector()
+        logging.getLogger().addHandler(detector)
+        server = create_server(
+            get_app({'__file__': self.settings.get('__file__'),
+                     'here': self.settings.get('here')}, **self.settings),
+            host='127.0.0.1', port=0, threads=self.threads)
+        thread = threading.Thread(target=server.run, daemon=True)
+        thread.start()
+        url = 'http://127.0.0.1:%s' % server.effective_port
+        try:
+            admin = Client(-1, url, self.tenants, 0)
+            admin.login()
+            for tenant in self.tenants:
+                tenant.setup(admin, self.mix)
+            mysql_before = get_mysql_lock_status(self.tenants[0].settings)
+            clients = [Client(index, url, self.tenants, 0, self.seed)
+                       for index in range(self.clients)]
+            for client in clients:
+                client.login()
+            detector.exceptions.clear()
+            detector.locks.clear()
+            start = time.time()
+            for client in clients:
+                client.deadline = start + self.duration
+                client.start()
+            for client in clients:
+                client.join()
+            seconds = time.time() - start
+            mysql_after = get_mysql_lock_status(self.tenants[0].settings)
+            exceptions, locks = dict(detector.exceptions), dict(detector.locks)
+            isolation = self.check_isolation(admin)
+            for tenant in self.tenants:
+                tenant.teardown(admin)
+        finally:
+            logging.getLogger().removeHandler(detector)
+            server.close()
+        samples = [sample for client in clients for sample in client.samples]
+        return OrderedDict([
+            ('datetime', datetime.datetime.utcnow().isoformat()),
+            ('rdbms', self.settings.get('db.rdbms')),
+            ('python', platform.python_version()),
+            ('platform', platform.platform()),
+            ('clients', self.clients),
+            ('threads', self.threads),
+            ('duration', seconds),
+            ('mix', {tenant.old_name: tenant.mix for tenant in self.tenants}),
+            ('total', summarize(samples, seconds)),
+            ('operations', OrderedDict(
+                (operation, summarize(
+                    [sample for sample in samples
+                     if sample['operation'] == operation], seconds))
+                for operation in self.mix
+                if any(sample['operation'] == operation
+                       for sample in samples))),
+            ('tenants', OrderedDict(
+                (tenant.old_name, summarize(
+                    [sample for sample in samples
+                     if sample['tenant'] == tenant.old_name], seconds))
+                for tenant in self.tenants)),
+            ('server_exceptions', exceptions),
+            ('lock_errors', locks),
+            ('mysql_lock_waits', {
+                name: mysql_after[name] - mysql_before.get(name, 0)
+                for name in mysql_after}),
+            ('isolation', isolation),
+        ])
+
+    def check_isolation(self, admin):
+        """Return, for each tenant, its number of files and the number
+        expected from its uploads (which differ if any upload was written to
+        the wrong database).
+        """
+        isolation = OrderedDict()
+        for tenant in self.tenants:
+            files = admin.request(
+                tenant, 'get', 'files?page=1&items_per_page=1').json()[
+                    'paginator']['count']
+            expected = tenant.files + len(tenant.uploaded)
+            isolation[tenant.old_name] = {
+                'files': files, 'expected_files': expected,
+                'ok': files == expected}
+        return isolation
+
+
+def parse_mix(value):
+    """Parse a mix such as ``'read=40,search=25,write=15'``."""
+    mix = OrderedDict()
+    for item in value.split(','):
+        operation, _, weight = item.partition('=')
+        operation = operation.strip()
+        if operation not in DEFAULT_MIX:
+            raise argparse.ArgumentTypeError(
+                'Unknown operation "%s"; choose among %s.' % (
+                    operation, ', '.join(DEFAULT_MIX)))
+        try:
+            mix[operation] = float(weight)
+        except ValueError:
+            raise argparse.ArgumentTypeError(
+                'Invalid weight "%s" of operation "%s".' % (
+                    weight, operation))
+    return mix
+
+
+def format_ms(value):
+    return '%8.1f' % value if value is not None else '%8s' % '-'
+
+
+def print_summary(name, summary):
+    print('%-16s %7d %6.1f%% %8.1f %s' % (
+        name, summary['requests'], 100 * summary['error_rate'],
+        summary['throughput'], ' '.join(
+            format_ms(summary[key]) for key in
+            ['p%d' % percent for percent in PERCENTILES] + ['max'])))
+
+
+def print_report(report):
+    print('%d clients, %d server threads, %.1f s' % (
+        report['clients'], report['threads'], report['duration']))
+    print('%-16s %7s %7s %8s %s' % (
+        '', 'reqs', 'errors', 'req/s', ' '.join(
+            '%8s' % name for name in
+            ['p%d ms' % percent for percent in PERCENTILES] + ['max ms'])))
+    print_summary('total', report['total'])
+    for operation, summary in report['operations'].items():
+        print_summary(operation, summary)
+    for old_name, summary in report['tenants'].items():
+        print_summary(old_name, summary)
+    for kind, count in sorted(report['total']['error_kinds'].items()):
+        print('errors: %s x %d' % (kind, count))
+    for name, count in sorted(report['server_exceptions'].items()):
+        print('server exceptions: %s x %d' % (name, count))
+    for lock_error, count in report['lock_errors'].items():
+        print('LOCK CONTENTION: "%s" x %d' % (lock_error, count))
+    for name, count in sorted(report['mysql_lock_waits'].items()):
+        print('mysql: %s +%d' % (name, count))
+    for old_name, isolation in report['isolation'].items():
+        if not isolation['ok']:
+            print('ISOLATION: %s has %d files, expected %d' % (
+                old_name, isolation['files'], isolation['expected_files']))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Load test the OLD with concurrent clients over several'
+                    ' OLDs.')
+    parser.add_argument('config_file', metavar='CONFIG_FILE')
+    parser.add_argument('old_names', metavar='OLD_NAME', nargs='+')
+    parser.add_argument('--clients', type=int, default=DEFAULT_CLIENTS)
+    parser.add_argument('--threads', type=int,
+                        help='waitress threads (default: --clients).')
+    parser.add_argument('--duration', type=float, default=DEFAULT_DURATION,
+                        help='Seconds of load.')
+    parser.add_argument('--mix', type=parse_mix, default=DEFAULT_MIX,
+                        help='Weighted operations, among %s, e.g., "%s".' % (
+                            ', '.join(DEFAULT_MIX), ','.join(
+                                '%s=%s' % item for item in
+                                DEFAULT_MIX.items())))
+    parser.add_argument('--output', help='Write the report as JSON here.')
+    parser.add_argument('--generate', action='store_true',
+                        help='(Re-)generate the synthetic OLDs first.')
+    synthetic.add_size_arguments(parser)
+    args = parser.parse_args()
+    settings = synthetic.get_settings(args.config_file, args.old_names[0])
+    if args.generate:
+        sizes = {name: getattr(args, name) for name in synthetic.DEFAULTS}
+        for old_name in args.old_names:
+            synthetic.generate(
+                synthetic.get_settings(args.config_file, old_name),
+                replace=True, **sizes)
+    try:
+        report = LoadTest(settings, args.old_names, clients=args.clients,
+                          duration=args.duration, mix=args.mix,
+                          threads=args.threads, seed=args.seed).run()
+    except LoadTestError as error:
+        print(error)
+        sys.exit(1)
+    print_report(report)
+    if args.output:
+        with open(args.output, 'w') as file_:
+            json.dump(report, file_, indent=2)
+
+
+if __name__ == '__main__':
+    main()
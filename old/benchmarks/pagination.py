@@ -0,0 +1,159 @@
+# Copyright 2016 Joel Dunham
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""Benchmark offset (``page``) vs. keyset (``cursor``) pagination of the
+forms index, i.e., :func:`old.lib.dbutils.add_pagination`, on a synthetic
+SQLite forms table::
+
+    $ python -m old.benchmarks.pagination --forms 100000 --page 5000
+
+Each page is fetched through the same eager-loading query that ``GET /forms``
+uses. The offset mode is timed with and without the ``count`` query (a
+client-supplied ``count`` skips it); the cursor mode never counts.
+"""
+
+import argparse
+import random
+import time
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.sql import asc, collate, desc
+
+from old.lib.dbutils import (
+    add_pagination,
+    eagerload_form,
+    encode_cursor,
+    get_cursor_signature,
+    get_keyset_order,
+)
+import old.models as old_models
+from old.models.meta import Base
+
+
+def populate(dbsession, size, seed=0):
+    """Insert ``size`` forms with random transcriptions."""
+    rng = random.Random(seed)
+    letters = 'ptkmnsaiou'
+    form_table = old_models.Form.__table__
+    chunk = []
+    for id_ in range(1, size + 1):
+        chunk.append({
+            'id': id_,
+            'UUID': str(id_),
+            'transcription': ''.join(
+                rng.choice(letters) for _ in range(rng.randint(3, 12))),
+            'morpheme_break': '',
+            'morpheme_gloss': ''})
+        if len(chunk) == 10000:
+            dbsession.execute(form_table.insert(), chunk)
+            chunk = []
+    if chunk:
+        dbsession.execute(form_table.insert(), chunk)
+    dbsession.commit()
+
+
+def get_query(dbsession, order_by):
+    query = eagerload_form(dbsession.query(old_models.Form))
+    return query.order_by(order_by)
+
+
+def get_cursor_to_page(dbsession, order_by, page, items_per_page):
+    """Return the cursor that a client would hold after walking to the end of
+    page ``page - 1``.
+    """
+    if page == 1:
+        return ''
+    query = get_query(dbsession, order_by)
+    sort_expression, descending, primary_key = get_keyset_order(query)
+    direction = desc if descending else asc
+    model, value = query.order_by(None)\
+        .order_by(direction(sort_expression), direction(primary_key))\
+        .add_columns(sort_expression)\
+        .offset((page - 1) * items_per_page - 1).limit(1).one()
+    return encode_cursor(get_cursor_signature(sort_expression, descending),
+                         value, model.id)
+
+
+def time_page(dbsession, order_by, paginator, repeats):
+    best = None
+    for _ in range(repeats):
+        dbsession.expunge_all()
+        start = time.time()
+        result = add_pagination(get_query(dbsession, order_by),
+                                dict(paginator))
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, [item['id'] for item in result['items']]
+
+
+def run(forms, page, items_per_page, repeats):
+    engine = create_engine('sqlite://')
+    Base.metadata.create_all(engine)
+    dbsession = sessionmaker(bind=engine)()
+    populate(dbsession, forms)
+    orderings = [
+        ('id', asc(old_models.Form.id)),
+        ('transcription',
+         asc(collate(old_models.Form.transcription, 'NOCASE')))]
+    results = []
+    for name, order_by in orderings:
+        for page_ in (1, page):
+            offset_time, offset_ids = time_page(
+                dbsession, order_by,
+                {'page': page_, 'items_per_page': items_per_page}, repeats)
+            offset_nocount_time, _ = time_page(
+                dbsession, order_by,
+                {'page': page_, 'items_per_page': items_per_page,
+                 'count': forms}, repeats)
+            cursor = get_cursor_to_page(dbsession, order_by, page_,
+                                        items_per_page)
+            cursor_time, cursor_ids = time_page(
+                dbsession, order_by,
+                {'cursor': cursor, 'items_per_page': items_per_page}, repeats)
+            if name == 'id':
+                assert offset_ids == cursor_ids, \
+                    'Offset and cursor pages disagree'
+            results.append({
+                'order_by': name,
+                'page': page_,
+                'offset_ms': 1000 * offset_time,
+                'offset_nocount_ms': 1000 * offset_nocount_time,
+                'cursor_ms': 1000 * cursor_time})
+    dbsession.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark offset vs. cursor pagination of forms.')
+    parser.add_argument('--forms', type=int, default=100000)
+    parser.add_argument('--page', type=int, default=5000)
+    parser.add_argument('--items-per-page', type=int, default=10)
+    parser.add_argument('--repeats', type=int, default=3)
+    args = parser.parse_args()
+    if args.page * args.items_per_page > args.forms:
+        parser.error('--page is beyond the last page of forms')
+    print('%d forms, %d items per page (best of %d)' % (
+        args.forms, args.items_per_page, args.repeats))
+    for result in run(args.forms, args.page, args.items_per_page,
+                      args.repeats):
+        print('  order by %(order_by)-13s page %(page)5d:'
+              '  offset %(offset_ms)8.2f ms'
+              '  offset w/o count %(offset_nocount_ms)8.2f ms'
+              '  cursor %(cursor_ms)8.2f ms' % result)
+
+
+if __name__ == '__main__':
+    main()
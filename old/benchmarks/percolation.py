@@ -0,0 +1,166 @@
+# Copyright 2016 Joel Dunham
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""Benchmark the percolation of a syntactic category rename to the forms
+that contain its lexical items, on a synthetic SQLite OLD::
+
+    $ python -m old.benchmarks.percolation --lexical 500 --forms 20000
+
+The OLD has ``lexical`` nouns of category N, as many verbs of category V and
+``forms`` sentences, each of which contains two nouns and a verb. N is
+renamed and the change is percolated first form by form (the former loop
+over ``Forms.update_forms_containing_this_form_as_morpheme``) and then as a
+set (``Forms.update_forms_containing_these_forms_as_morphemes``). The
+analyses percolated as a set must equal those of a full recompilation. (The
+per-form loop is timed only: each batched UPDATE leaves the forms loaded in
+the session stale, so later iterations may undo earlier ones.)
+"""
+
+import argparse
+import random
+import time
+from types import SimpleNamespace
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import old.models as old_models
+import old.models.modelbuilders as omb
+from old.lib.dbutils import DBUtils
+from old.models.meta import Base
+from old.views.forms import Forms
+
+
+def populate(dbsession, lexical, forms, seed=0):
+    """Add the user, categories, lexical items and sentences of the synthetic
+    OLD, index the sentences' morphemes and return the N category and the
+    user.
+    """
+    rng = random.Random(seed)
+    dbsession.add(omb.generate_default_application_settings())
+    user = omb.generate_default_user()
+    dbsession.add(user)
+    N = old_models.SyntacticCategory(name='N', type='lexical')
+    V = old_models.SyntacticCategory(name='V', type='lexical')
+    dbsession.add_all([N, V])
+    dbsession.flush()
+    nouns, verbs = [], []
+    for index in range(lexical):
+        for category, items, prefix in ((N, nouns, 'n'), (V, verbs, 'v')):
+            form = omb.generate_default_form()
+            form.transcription = form.morpheme_break = '%s%d' % (prefix, index)
+            form.morpheme_gloss = '%s%d' % (prefix.upper(), index)
+            form.syntactic_category = category
+            form.syntactic_category_string = category.name
+            form.enterer = form.modifier = user
+            items.append(form)
+    dbsession.add_all(nouns + verbs)
+    for _ in range(forms):
+        first, second = rng.sample(nouns, 2)
+        verb = rng.choice(verbs)
+        form = omb.generate_default_form()
+        form.transcription = form.morpheme_break = '%s-s %s %s' % (
+            first.morpheme_break, verb.morpheme_break, second.morpheme_break)
+        form.morpheme_gloss = '%s-PL %s %s' % (
+            first.morpheme_gloss, verb.morpheme_gloss, second.morpheme_gloss)
+        form.enterer = form.modifier = user
+        dbsession.add(form)
+    dbsession.flush()
+    DBUtils(dbsession).rebuild_form_morpheme_index()
+    dbsession.commit()
+    return N, user
+
+
+def get_analyses(dbsession):
+    table = old_models.Form.__table__
+    return dbsession.execute(
+        table.select().with_only_columns([
+            table.c.id, table.c.syntactic_category_string,
+            table.c.break_gloss_category, table.c.morpheme_break_ids])
+        .order_by(table.c.id)).fetchall()
+
+
+def rename(dbsession, category, name, percolate):
+    category.name = name
+    dbsession.flush()
+    start = time.time()
+    percolate(category.forms)
+    seconds = time.time() - start
+    dbsession.commit()
+    return seconds
+
+
+def run(lexical, forms):
+    engine = create_engine('sqlite://')
+    Base.metadata.create_all(engine)
+    dbsession = sessionmaker(bind=engine)()
+    N, user = populate(dbsession, lexical, forms)
+    request = SimpleNamespace(
+        dbsession=dbsession,
+        registry=SimpleNamespace(settings={'sqlalchemy.url': 'sqlite://'}),
+        session={'user': {'id': user.id}},
+        response=SimpleNamespace(headers={}))
+    view = Forms(request)
+
+    def compile_all():
+        """Compile the analyses of all forms against all lexical items."""
+        dbsession.expire_all()
+        all_forms = dbsession.query(old_models.Form).all()
+        view.update_morpheme_references_of_forms(
+            all_forms, view.db.get_morpheme_delimiters(),
+            whole_db=[form for form in all_forms if view.is_lexical(form)])
+        dbsession.commit()
+
+    # Percolation only updates the forms whose analyses have been compiled.
+    compile_all()
+
+    def per_form(lexical_items):
+        for form in lexical_items:
+            view.update_forms_containing_this_form_as_morpheme(form)
+
+    per_form_seconds = rename(dbsession, N, 'Noun', per_form)
+    stats = {}
+
+    def as_set(lexical_items):
+        stats.update(
+            view.update_forms_containing_these_forms_as_morphemes(
+                lexical_items))
+
+    set_seconds = rename(dbsession, N, 'Nn', as_set)
+    set_analyses = get_analyses(dbsession)
+    compile_all()
+    assert set_analyses == get_analyses(dbsession), \
+        'Set-based percolation disagrees with a full recompilation'
+    dbsession.close()
+    return dict(stats, per_form_seconds=per_form_seconds,
+                set_seconds=set_seconds)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark per-form vs. set-based percolation of a'
+                    ' syntactic category rename.')
+    parser.add_argument('--lexical', type=int, default=500)
+    parser.add_argument('--forms', type=int, default=20000)
+    args = parser.parse_args()
+    result = run(args.lexical, args.forms)
+    print('Renaming a category of %(lexical_items)d lexical items contained'
+          ' in %(forms)d forms' % result)
+    print('  per form:  %(per_form_seconds).3fs' % result)
+    print('  as a set:  %(set_seconds).3fs (find %(find_ms).1f ms,'
+          ' update %(update_ms).1f ms)' % result)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+# Copyright 2016 Joel Dunham
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""Benchmark the trigram prefilter of the ``regex`` relation of
+``SQLAQueryBuilder`` (cf. :mod:`old.lib.trigrams`) on a synthetic SQLite OLD
+(that of :mod:`old.benchmarks.fulltext`)::
+
+    $ python -m old.benchmarks.regex --forms 50000
+
+Every pattern is timed as ``SEARCH /forms`` runs it (prefiltered through the
+trigram index when the pattern requires substrings) and as a plain
+``REGEXP`` scan, which calls the Python ``regexp`` function on every row.
+"""
+
+import argparse
+import time
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from old.benchmarks.fulltext import SETTINGS, populate
+from old.lib.SQLAQueryBuilder import SQLAQueryBuilder
+from old.lib.trigrams import get_trigram_query
+import old.models as old_models
+from old.models.meta import Base
+
+
+PATTERNS = (
+    'kipasu',
+    'mata sino',
+    '^mata',
+    'k[iu]pa',
+    '(kipa|lusa)su',
+    'ma.*si',
+    'su$',
+)
+
+
+def time_query(dbsession, get_query, repeat):
+    best = None
+    for _ in range(repeat):
+        dbsession.expunge_all()
+        start = time.time()
+        count = get_query().count()
+        seconds = time.time() - start
+        best = seconds if best is None else min(best, seconds)
+    return best, count
+
+
+def run(forms, repeat):
+    old_models.patch_sqlite(SETTINGS)
+    engine = create_engine('sqlite://')
+    Base.metadata.create_all(engine)
+    dbsession = sessionmaker(bind=engine)()
+    populate(dbsession, forms)
+    results = []
+    for pattern in PATTERNS:
+        indexed_seconds, indexed_count = time_query(
+            dbsession, lambda: SQLAQueryBuilder(
+                dbsession, 'Form', settings=SETTINGS).get_SQLA_query(
+                    {'filter': ['Form', 'transcription', 'regex', pattern]}),
+            repeat)
+        scan_seconds, scan_count = time_query(
+            dbsession, lambda: dbsession.query(old_models.Form).filter(
+                old_models.Form.transcription.op('regexp')(pattern)),
+            repeat)
+        assert indexed_count == scan_count, 'The prefilter lost matches'
+        results.append({'pattern': pattern,
+                        'trigrams': get_trigram_query(pattern) or '-',
+                        'count': scan_count,
+                        'indexed_ms': 1000 * indexed_seconds,
+                        'scan_ms': 1000 * scan_seconds})
+    dbsession.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark trigram prefiltered regex searches.')
+    parser.add_argument('--forms', type=int, default=50000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+    print('%d forms, best of %d' % (args.forms, args.repeat))
+    for result in run(args.forms, args.repeat):
+        print('  %(pattern)-14s (%(count)6d)  scan %(scan_ms)8.1f ms'
+              '  prefiltered %(indexed_ms)8.1f ms  %(trigrams)s' % result)
+
+
+if __name__ == '__main__':
+    main()
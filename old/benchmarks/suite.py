@@ -0,0 +1,506 @@
+# Copyright 2016 Joel Dunham
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""Reproducible benchmark suite of the OLD's requests on a synthetic OLD (cf.
+:mod:`old.benchmarks.synthetic`)::
+
+    $ python -m old.benchmarks.suite run config.ini benchold \\
+          --generate --output before.json
+    $ ... change the code ...
+    $ python -m old.benchmarks.suite run config.ini benchold \\
+          --generate --output after.json
+    $ python -m old.benchmarks.suite compare before.json after.json
+
+``run`` (re-)generates the synthetic OLD if ``--generate`` is given (with
+the size arguments of :mod:`old.benchmarks.synthetic`), builds the OLD app
+of the config file in-process (WebTest), logs in as the administrator and
+times ``--repeat`` requests of each scenario (after an untimed one):
+
+- ``index``: ``GET /forms``, one of the first ten pages of 100;
+- ``show``: ``GET /forms/<id>``;
+- ``search_simple``: a ``like`` search of the transcriptions;
+- ``search_joined``: a search of the forms' tags and translations;
+- ``search_regex``: a ``regex`` search of the morpheme breaks;
+- ``create_form``: ``POST /forms`` of an analysed sentence, whose analysis is
+  compiled against the lexicon;
+- ``update_lexical_item``: ``PUT /forms/<id>`` of a lexical item's gloss,
+  which is percolated to the forms that contain it;
+- ``create_collection``: ``POST /collections`` of a collection referencing
+  forms and collections, which are expanded;
+- ``write_corpus``: ``PUT /corpora/<id>/writetofile`` (synchronously);
+- ``generate_morphology``: ``PUT /morphologies/<id>/generate``, until its
+  background job is done; and
+- ``generate_lm``: ``PUT /morphemelanguagemodels/<id>/generate``, until its
+  background job is done, with the stand-in ``estimate-ngram`` of
+  :mod:`old.benchmarks.estimate_ngram` so that MITLM need not be installed.
+
+The models created by a scenario are deleted after it. The results (the
+minimum, median, mean and maximum durations in milliseconds of each scenario
+and the sizes of the OLD, the database and the host) are written as JSON to
+``--output``. ``compare`` reports the change of the median of each scenario
+between two result files and exits with status 1 if any scenario is
+``--tolerance`` (a fraction) slower and at least ``--min-ms`` milliseconds
+slower.
+"""
+
+import argparse
+import datetime
+import json
+import logging
+import os
+import platform
+import shutil
+import statistics
+import stat
+import sys
+import tempfile
+import time
+
+import webtest
+
+from old import main as get_app
+from old.benchmarks import estimate_ngram, synthetic
+
+
+LOGGER = logging.getLogger(__name__)
+
+JSON_HEADERS = {'Content-Type': 'application/json'}
+DEFAULT_REPEAT = 10
+DEFAULT_TOLERANCE = 0.2
+DEFAULT_MIN_MS = 1.0
+JOB_TIMEOUT = 600
+
+FORM_PARAMS = {
+    'transcription': '',
+    'phonetic_transcription': '',
+    'narrow_phonetic_transcription': '',
+    'morpheme_break': '',
+    'grammaticality': '',
+    'morpheme_gloss': '',
+    'translations': [],
+    'comments': '',
+    'speaker_comments': '',
+    'elicitation_method': '',
+    'tags': [],
+    'syntactic_category': '',
+    'speaker': '',
+    'elicitor': '',
+    'verifier': '',
+    'source': '',
+    'status': 'tested',
+    'date_elicited': '',
+    'syntax': '',
+    'semantics': ''
+}
+
+
+class BenchmarkError(Exception):
+    pass
+
+
+class Benchmark(object):
+    """Runs the scenarios against the OLD ``settings['old_name']``."""
+
+    def __init__(self, settings, repeat=DEFAULT_REPEAT):
+        self.settings = dict(settings, testing='0', readonly='0',
+                             corpus_export_mode='sync')
+        self.old_name = self.settings['old_name']
+        self.repeat = repeat
+        self.app = webtest.TestApp(get_app(
+            {'__file__': self.settings.get('__file__'),
+             'here': self.settings.get('here')}, **self.settings))
+        webtest.lint.valid_methods = tuple(
+            set(webtest.lint.valid_methods) | {'SEARCH'})
+        self.request('post', 'login/authenticate',
+                      {'username': 'admin', 'password': 'adminA_1'})
+        self.cleanup = []
+
+    def url(self, path):
+        return '/%s/%s' % (self.old_name, path)
+
+    def request(self, method, path, params=None, status=200):
+        """Return the JSON body of the ``method`` request of ``path`` with
+        the JSON ``params``; raise ``BenchmarkError`` if its status is not
+        ``status``.
+        """
+        body = None if params is None else json.dumps(params).encode('utf8')
+        response = self.app.request(
+            self.url(path), method=method.upper(), body=body,
+            headers=JSON_HEADERS, expect_errors=True)
+        if response.status_int != status:
+            raise BenchmarkError('%s %s returned %s: %s' % (
+                method.upper(), path, response.status, response.text[:500]))
+        return response.json_body if response.text else None
+
+    def time(self, name, setup, action):
+        """Time ``action(setup(index))`` for ``index`` in ``range(repeat)``
+        after an untimed call with index -1 (which warms the caches); the
+        models created are deleted afterwards.
+        """
+        durations = []
+        try:
+            action(setup(-1))
+            for index in range(self.repeat):
+                argument = setup(index)
+                start = time.perf_counter()
+                action(argument)
+                durations.append(1000 * (time.perf_counter() - start))
+        finally:
+            for path in reversed(self.cleanup):
+                self.request('delete', path)
+            self.cleanup = []
+        LOGGER.info('%s: median %.1f ms', name, statistics.median(durations))
+        return {'min': min(durations),
+                'median': statistics.median(durations),
+                'mean': statistics.mean(durations),
+                'max': max(durations),
+                'durations': durations}
+
+    def get_sizes(self):
+        sizes = {}
+        for name, path in (('forms', 'forms'), ('tags', 'tags'),
+                           ('files', 'files'),
+                           ('collections', 'collections'),
+                           ('corpora', 'corpora')):
+            sizes[name] = self.request(
+                'get', path + '?page=1&items_per_page=1')['paginator']['count']
+        return sizes
+
+    # Scenarios
+    ###########################################################################
+
+    def scenario_index(self):
+        return self.time(
+            'index', lambda index: 1 + index % 10,
+            lambda page: self.request(
+                'get', 'forms?page=%d&items_per_page=100&order_by_model=Form'
+                '&order_by_attribute=id&order_by_direction=asc' % page))
+
+    def scenario_show(self):
+        forms = self.get_sizes()['forms']
+        return self.time(
+            'show', lambda index: 1 + (index * 7919) % forms,
+            lambda id_: self.request('get', 'forms/%d' % id_))
+
+    def search(self, filter_):
+        return self.request('search', 'forms', {
+            'query': {'filter': filter_},
+            'paginator': {'page': 1, 'items_per_page': 100}})
+
+    def scenario_search_simple(self):
+        return self.time(
+            'search_simple',
+            lambda index: ['ka', 'mi', 'su', 'pa', 'li'][index % 5],
+            lambda value: self.search(
+                ['Form', 'transcription', 'like', '%%%s%%' % value]))
+
+    def scenario_search_joined(self):
+        return self.time(
+            'search_joined', lambda index: index,
+            lambda index: self.search(['and', [
+                ['Tag', 'name', '=', 'tag %d' % index],
+                ['Translation', 'transcription', 'like', '%%%d%%' % index]]]))
+
+    def scenario_search_regex(self):
+        return self.time(
+            'search_regex',
+            lambda index: ['^ka', 'mi-', 'su$', '(pa|li)ta', 'n[aiu]s'][
+                index % 5],
+            lambda pattern: self.search(
+                ['Form', 'morpheme_break', 'regex', pattern]))
+
+    def get_lexical_items(self, category, count):
+        return self.request('search', 'forms', {
+            'query': {'filter': ['Form', 'syntactic_category', 'name', '=',
+                                 category],
+                      'order_by': ['Form', 'id', 'asc']},
+            'paginator': {'page': 1, 'items_per_page': count}})['items']
+
+    def scenario_create_form(self):
+        nouns = self.get_lexical_items('N', 10)
+        verbs = self.get_lexical_items('V', 10)
+        suffixes = self.get_lexical_items('Agr', 10)
+
+        def setup(index):
+            words = [(nouns[index % len(nouns)], suffixes[0]),
+                     (verbs[index % len(verbs)],
+                      suffixes[index % len(suffixes)]),
+                     (nouns[-1 - index % len(nouns)], None)]
+            return dict(
+                FORM_PARAMS,
+                transcription=' '.join(
+                    stem['morpheme_break'] +
+                    (suffix['morpheme_break'] if suffix else '')
+                    for stem, suffix in words),
+                morpheme_break=' '.join(
+                    stem['morpheme_break'] +
+                    ('-' + suffix['morpheme_break'] if suffix else '')
+                    for stem, suffix in words),
+                morpheme_gloss=' '.join(
+                    stem['morpheme_gloss'] +
+                    ('-' + suffix['morpheme_gloss'] if suffix else '')
+                    for stem, suffix in words),
+                translations=[{'transcription': 'benchmark %d' % index,
+                               'grammaticality': ''}])
+
+        def create(params):
+            form = self.request('post', 'forms', params)
+            self.cleanup.append('forms/%d' % form['id'])
+
+        return self.time('create_form', setup, create)
+
+    def scenario_update_lexical_item(self):
+        noun = self.get_lexical_items('N', 1)[0]
+        params = dict(
+            FORM_PARAMS,
+            transcription=noun['transcription'],
+            morpheme_break=noun['morpheme_break'],
+            syntactic_category=noun['syntactic_category']['id'],
+            translations=[{'transcription': translation['transcription'],
+                           'grammaticality': translation['grammaticality']}
+                          for translation in noun['translations']])
+        gloss = noun['morpheme_gloss']
+        current = {'gloss': gloss}
+
+        def update(params_):
+            self.request('put', 'forms/%d' % noun['id'], params_)
+            current['gloss'] = params_['morpheme_gloss']
+
+        try:
+            # The gloss alternates so that every update is a change.
+            return self.time(
+                'update_lexical_item',
+                lambda index: dict(params, morpheme_gloss='%s%s' % (
+                    gloss, '' if index % 2 == 0 else 'x')),
+                update)
+        finally:
+            if current['gloss'] != gloss:
+                update(dict(params, morpheme_gloss=gloss))
+
+    def scenario_create_collection(self):
+        collections = self.get_sizes()['collections']
+
+        def setup(index):
+            contents = '\n\n'.join(
+                ['form[%d]' % (1 + (index * 31 + offset) % 100)
+                 for offset in range(10)] +
+                ['collection[%d]' % (1 + (index * 13 + offset) % collections)
+                 for offset in range(min(3, collections))])
+            return {'title': 'Benchmark %d' % index, 'type': 'other',
+                    'url': '', 'description': '',
+                    'markup_language': 'reStructuredText',
+                    'contents': contents, 'speaker': '', 'source': '',
+                    'elicitor': '', 'enterer': '', 'date_elicited': '',
+                    'tags': [], 'files': []}
+
+        def create(params):
+            collection = self.request('post', 'collections', params)
+            self.cleanup.append('collections/%d' % collection['id'])
+
+        return self.time('create_collection', setup, create)
+
+    def scenario_write_corpus(self):
+        return self.time(
+            'write_corpus', lambda index: index,
+            lambda index: self.request(
+                'put', 'corpora/1/writetofile',
+                {'format': 'transcriptions only', 'mode': 'sync'}))
+
+    def wait_for_generation(self, path):
+        """Request the generation of the model at ``path`` and poll it until
+        its ``generate_attempt`` changes.
+        """
+        attempt = self.request('get', path)['generate_attempt']
+        self.request('put', path + '/generate')
+        deadline = time.time() + JOB_TIMEOUT
+        while time.time() < deadline:
+            model = self.request('get', path)
+            if model['generate_attempt'] != attempt:
+                return model
+            time.sleep(0.01)
+        raise BenchmarkError('%s was not generated within %d seconds' % (
+            path, JOB_TIMEOUT))
+
+    def scenario_generate_morphology(self):
+        morphology = self.request('post', 'morphologies', {
+            'name': 'Benchmark morphology', 'description': '',
+            'lexicon_corpus': 1, 'rules_corpus': 1, 'script_type': 'lexc',
+            'extract_morphemes_from_rules_corpus': False, 'rules': '',
+            'rich_upper': True, 'rich_lower': False,
+            'include_unknowns': False})
+        self.cleanup.append('morphologies/%d' % morphology['id'])
+        return self.time(
+            'generate_morphology', lambda index: index,
+            lambda index: self.wait_for_generation(
+                'morphologies/%d' % morphology['id']))
+
+    def scenario_generate_lm(self):
+        directory = tempfile.mkdtemp()
+        path = os.path.join(directory, 'estimate-ngram')
+        with open(path, 'w') as file_:
+            file_.write('#!/bin/sh\nexec %s %s "$@"\n' % (
+                sys.executable, estimate_ngram.__file__))
+        os.chmod(path, os.stat(path).st_mode | stat.S_IEXEC)
+        environ_path = os.environ.get('PATH', '')
+        os.environ['PATH'] = directory + os.pathsep + environ_path
+        try:
+            lm = self.request('post', 'morphemelanguagemodels', {
+                'name': 'Benchmark LM', 'description': '', 'corpus': 1,
+                'vocabulary_morphology': '', 'toolkit': 'mitlm',
+                'order': 2, 'smoothing': '', 'categorial': False})
+            self.cleanup.append('morphemelanguagemodels/%d' % lm['id'])
+
+            def generate(index):
+                lm_ = self.wait_for_generation(
+                    'morphemelanguagemodels/%d' % lm['id'])
+                if lm_['generate_succeeded'] is not True:
+                    raise BenchmarkError(lm_['generate_message'])
+
+            return self.time('generate_lm', lambda index: index, generate)
+        finally:
+            os.environ['PATH'] = environ_path
+            shutil.rmtree(directory, ignore_errors=True)
+
+    def run(self, names=None):
+        """Run the scenarios ``names`` (all by default) and return their
+        results.
+        """
+        names = names or get_scenario_names()
+        results = {}
+        for name in names:
+            results[name] = getattr(self, 'scenario_' + name)()
+        return results
+
+
+def get_scenario_names():
+    return [name[len('scenario_'):] for name in Benchmark.__dict__
+            if name.startswith('scenario_')]
+
+
+def run(settings, repeat=DEFAULT_REPEAT, names=None):
+    """Return the results of the scenarios ``names`` on the OLD of
+    ``settings``.
+    """
+    benchmark = Benchmark(settings, repeat)
+    scenarios = benchmark.run(names)
+    return {
+        'datetime': datetime.datetime.utcnow().isoformat(),
+        'old_name': settings['old_name'],
+        'rdbms': settings.get('db.rdbms'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'repeat': repeat,
+        'sizes': benchmark.get_sizes(),
+        'scenarios': scenarios,
+    }
+
+
+def compare(base, new, tolerance=DEFAULT_TOLERANCE, min_ms=DEFAULT_MIN_MS):
+    """Return the comparisons of the scenarios of the results ``base`` and
+    ``new``: a list of dicts with the scenario, the two medians (``None`` if
+    the scenario is missing), their ratio and whether it is a regression.
+    """
+    comparisons = []
+    for name in sorted(set(base['scenarios']) | set(new['scenarios'])):
+        base_ms = base['scenarios'].get(name, {}).get('median')
+        new_ms = new['scenarios'].get(name, {}).get('median')
+        comparison = {'scenario': name, 'base_ms': base_ms, 'new_ms': new_ms,
+                      'ratio': None, 'regression': False}
+        if base_ms is not None and new_ms is not None:
+            comparison['ratio'] = new_ms / base_ms if base_ms else None
+            comparison['regression'] = (
+                new_ms > base_ms * (1 + tolerance) and
+                new_ms - base_ms >= min_ms)
+        comparisons.append(comparison)
+    return comparisons
+
+
+def format_ms(value):
+    return '%10.1f' % value if value is not None else '%10s' % '-'
+
+
+def print_comparisons(base, new, comparisons):
+    if base.get('sizes') != new.get('sizes'):
+        print('Warning: the OLDs differ in size: %s vs. %s' % (
+            base.get('sizes'), new.get('sizes')))
+    print('%-22s %10s %10s %8s' % ('scenario', 'base ms', 'new ms', 'change'))
+    for comparison in comparisons:
+        ratio = comparison['ratio']
+        print('%-22s %s %s %8s%s' % (
+            comparison['scenario'], format_ms(comparison['base_ms']),
+            format_ms(comparison['new_ms']),
+            '%+.1f%%' % (100 * (ratio - 1)) if ratio is not None else '-',
+            '  REGRESSION' if comparison['regression'] else ''))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark the OLD on a synthetic OLD and compare runs.')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+    run_parser = subparsers.add_parser(
+        'run', help='Run the scenarios and write their results.')
+    run_parser.add_argument('config_file', metavar='CONFIG_FILE')
+    run_parser.add_argument('old_name', metavar='OLD_NAME')
+    run_parser.add_argument('--output', default='benchmark.json')
+    run_parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT)
+    run_parser.add_argument(
+        '--scenarios', help='Comma-delimited scenarios to run, among %s.'
+        % ', '.join(get_scenario_names()))
+    run_parser.add_argument('--generate', action='store_true',
+                            help='(Re-)generate the synthetic OLD first.')
+    synthetic.add_size_arguments(run_parser)
+    compare_parser = subparsers.add_parser(
+        'compare', help='Compare two result files.')
+    compare_parser.add_argument('base')
+    compare_parser.add_argument('new')
+    compare_parser.add_argument('--tolerance', type=float,
+                                default=DEFAULT_TOLERANCE)
+    compare_parser.add_argument('--min-ms', type=float,
+                                default=DEFAULT_MIN_MS)
+    args = parser.parse_args()
+
+    if args.command == 'compare':
+        with open(args.base) as file_:
+            base = json.load(file_)
+        with open(args.new) as file_:
+            new = json.load(file_)
+        comparisons = compare(base, new, args.tolerance, args.min_ms)
+        print_comparisons(base, new, comparisons)
+        sys.exit(1 if any(comparison['regression']
+                          for comparison in comparisons) else 0)
+
+    settings = synthetic.get_settings(args.config_file, args.old_name)
+    names = args.scenarios.split(',') if args.scenarios else None
+    unknown = set(names or ()) - set(get_scenario_names())
+    if unknown:
+        parser.error('unknown scenarios: %s' % ', '.join(sorted(unknown)))
+    if args.generate:
+        sizes = {name: getattr(args, name) for name in synthetic.DEFAULTS}
+        synthetic.generate(settings, replace=True, **sizes)
+    try:
+        results = run(settings, args.repeat, names)
+    except BenchmarkError as error:
+        print(error)
+        sys.exit(1)
+    with open(args.output, 'w') as file_:
+        json.dump(results, file_, indent=2)
+    for name, result in results['scenarios'].items():
+        print('%-22s median %10.1f ms  (min %.1f, max %.1f)' % (
+            name, result['median'], result['min'], result['max']))
+    print('Wrote %s' % args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,181 @@
+# Copyright 2021 Joel Dunham
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""Benchmark full vs. incremental synchronization of a follower with a leader
+(cf. :mod:`old.lib.sync`) on synthetic SQLite OLDs::
+
+    $ python -m old.benchmarks.sync --rows 200000 --changed 0.01
+
+The leader has ``rows`` rows, half forms and half translations. The follower
+is first synchronized in full; then ``changed`` of the leader's forms are
+modified, a tenth as many translations are deleted and as many forms are
+added, and the follower is synchronized again, both in full and
+incrementally. Each sync is timed on the leader (watermark query plus NDJSON
+rows) and on the follower (applying the deltas); the bytes that would be
+transferred are reported too. The legacy protocol (``last_modified`` plus
+all tables) is timed on the leader for comparison.
+"""
+
+import argparse
+import datetime
+import json
+import random
+import time
+
+from sqlalchemy import create_engine
+
+import old.lib.sync as oldsync
+import old.models as old_models
+from old.models.meta import Base
+
+
+def populate(connection, size, seed=0):
+    """Insert ``size // 2`` forms, each with one translation, all last
+    modified a year ago.
+    """
+    rng = random.Random(seed)
+    letters = 'ptkmnsaiou'
+    form_table = old_models.Form.__table__
+    translation_table = old_models.Translation.__table__
+    modified = datetime.datetime.utcnow() - datetime.timedelta(days=365)
+    forms, translations = [], []
+    for id_ in range(1, size // 2 + 1):
+        transcription = ''.join(
+            rng.choice(letters) for _ in range(rng.randint(3, 12)))
+        forms.append({
+            'id': id_, 'UUID': str(id_), 'transcription': transcription,
+            'morpheme_break': '', 'morpheme_gloss': '',
+            'datetime_entered': modified, 'datetime_modified': modified})
+        translations.append({
+            'id': id_, 'form_id': id_, 'transcription': transcription[::-1],
+            'grammaticality': '', 'datetime_modified': modified})
+        if len(forms) == 10000:
+            connection.execute(form_table.insert(), forms)
+            connection.execute(translation_table.insert(), translations)
+            forms, translations = [], []
+    if forms:
+        connection.execute(form_table.insert(), forms)
+        connection.execute(translation_table.insert(), translations)
+
+
+def mutate(connection, size, fraction, seed=1):
+    """Modify ``fraction`` of the leader's forms, delete a tenth as many
+    translations and add as many forms.
+    """
+    rng = random.Random(seed)
+    form_table = old_models.Form.__table__
+    translation_table = old_models.Translation.__table__
+    forms = size // 2
+    count = max(1, int(forms * fraction))
+    now = datetime.datetime.utcnow()
+    for id_ in rng.sample(range(1, forms + 1), count):
+        connection.execute(
+            form_table.update().where(form_table.c.id == id_)
+            .values(transcription='changed', datetime_modified=now))
+    deleted = rng.sample(range(1, forms + 1), max(1, count // 10))
+    connection.execute(
+        translation_table.delete().where(translation_table.c.id.in_(deleted)))
+    # New rows may keep old modification times (as backups do).
+    connection.execute(form_table.insert(), [
+        {'id': forms + index + 1, 'UUID': 'new%d' % index,
+         'transcription': 'new', 'morpheme_break': '', 'morpheme_gloss': '',
+         'datetime_modified': now - datetime.timedelta(days=365)}
+        for index in range(max(1, count // 10))])
+
+
+def time_sync(leader, follower, watermark):
+    """Synchronize ``follower`` with ``leader`` since ``watermark`` (in full
+    if it is ``None``) and return the timings, sizes and next watermark.
+    """
+    start = time.time()
+    changes = oldsync.get_changes(
+        leader, watermark and oldsync.decode_watermark(watermark))
+    changes = json.loads(json.dumps(changes))
+    changes_bytes = len(json.dumps(changes))
+    tables = {tname: [int(id_) for id_ in delta['changed']]
+              for tname, delta in changes['tables'].items()
+              if delta['changed']}
+    lines = list(oldsync.iter_ndjson(leader, tables))
+    leader_time = time.time() - start
+    start = time.time()
+    transaction = follower.begin()
+    oldsync.apply_deltas(follower, changes, oldsync.load_ndjson(lines),
+                         prune=watermark is None)
+    transaction.commit()
+    follower_time = time.time() - start
+    return {'leader_ms': 1000 * leader_time,
+            'follower_ms': 1000 * follower_time,
+            'bytes': changes_bytes + sum(len(line) for line in lines),
+            'rows': len(lines) - 1,
+            'watermark': changes['watermark']}
+
+
+def time_legacy(leader):
+    """Time the legacy protocol's leader side: ``last_modified`` plus every
+    row of every table as one JSON document.
+    """
+    start = time.time()
+    last_modified = oldsync.get_last_modified(leader)
+    rows = {}
+    for tname, row in oldsync.iter_rows(leader, '*'):
+        rows.setdefault(tname, {})[row['id']] = row
+    size = len(json.dumps(last_modified)) + len(json.dumps(
+        rows, default=oldsync._json_default))
+    return {'leader_ms': 1000 * (time.time() - start), 'bytes': size}
+
+
+def run(rows, fraction):
+    leader_engine = create_engine('sqlite://')
+    follower_engine = create_engine('sqlite://')
+    for engine in (leader_engine, follower_engine):
+        Base.metadata.create_all(engine)
+    leader = leader_engine.connect()
+    follower = follower_engine.connect()
+    with leader.begin():
+        populate(leader, rows)
+    initial = time_sync(leader, follower, None)
+    with leader.begin():
+        mutate(leader, rows, fraction)
+    results = {
+        'initial full': initial,
+        'legacy full': time_legacy(leader),
+        'incremental': time_sync(leader, follower, initial['watermark']),
+        'full': time_sync(leader, follower, None)}
+    assert (oldsync.get_last_modified(leader) ==
+            oldsync.get_last_modified(follower)), 'The follower is out of sync'
+    leader.close()
+    follower.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark full vs. incremental sync.')
+    parser.add_argument('--rows', type=int, default=200000)
+    parser.add_argument('--changed', type=float, default=0.01,
+                        help='fraction of the forms changed between syncs')
+    args = parser.parse_args()
+    print('%d rows, %.2f%% of the forms changed' % (
+        args.rows, 100 * args.changed))
+    for name, result in run(args.rows, args.changed).items():
+        result.setdefault('follower_ms', 0)
+        result.setdefault('rows', 0)
+        print('  %-13s leader %10.2f ms  follower %10.2f ms'
+              '  %12d bytes  %7d rows' % (
+                  name, result['leader_ms'], result['follower_ms'],
+                  result['bytes'], result['rows']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,367 @@
+# Copyright 2016 Joel Dunham
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""Generate a deterministic synthetic OLD for the benchmark suite (cf.
+:mod:`old.benchmarks.suite`)::
+
+    $ python -m old.benchmarks.synthetic config.ini benchold --forms 20000
+
+The OLD is created in the database and store of the config file's settings
+(SQLite or MySQL; for MySQL, the database must exist). It has the default
+users (``admin``, ``contributor`` and ``viewer``), ``lexical`` lexical items
+(nouns, verbs and agreement suffixes) and ``forms - lexical`` sentences of
+two to five words, a ``density`` fraction of which are morphologically
+analysed in terms of the lexical items (their analyses are compiled and
+their morphemes indexed, as the OLD would have done). Forms are
+tagged with up to two of ``tags`` tags and ``files`` files (metadata only)
+are associated with one to three forms each. Each of the ``collections``
+collections references forms and every fourth one also references earlier
+collections. Each of the ``corpora`` corpora has ``corpus_forms`` forms.
+
+The same arguments and ``seed`` always generate the same OLD (up to the
+users' password salts). The script refuses to add to an OLD that already has
+forms unless ``--replace`` is given, in which case its tables are dropped and
+re-created.
+"""
+
+import argparse
+import datetime
+import logging
+import random
+import sys
+import uuid
+
+from pyramid.paster import get_appsettings
+from sqlalchemy.sql import func
+
+from old import (
+    build_sqlalchemy_url,
+    db_session_factory_registry,
+    override_settings_with_env_vars
+)
+from old.lib.constants import (
+    COLLECTION_REFERENCE_PATTERN,
+    COLLECTION_TYPES,
+    FORM_REFERENCE_PATTERN
+)
+import old.lib.helpers as h
+from old.lib.morpheme_references import MorphemeReferencesRebuild
+import old.models as old_models
+import old.models.modelbuilders as omb
+from old.models.meta import Base
+
+
+LOGGER = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'forms': 10000,
+    'lexical': 1000,
+    'density': 0.8,
+    'tags': 50,
+    'files': 500,
+    'collections': 200,
+    'corpora': 5,
+    'corpus_forms': 1000,
+    'seed': 0,
+}
+SIZES = ('forms', 'lexical', 'tags', 'files', 'collections', 'corpora',
+         'corpus_forms')
+BATCH_SIZE = 5000
+SYLLABLES = [c + v for c in 'ptkmnsl' for v in 'aiu']
+EPOCH = datetime.datetime(2016, 1, 1)
+
+
+def get_settings(config_file, old_name):
+    settings = get_appsettings(config_file, options={})
+    settings['old_name'] = old_name
+    settings = override_settings_with_env_vars(settings)
+    settings['sqlalchemy.url'] = build_sqlalchemy_url(settings)
+    return settings
+
+
+class Generator(object):
+    """Writes a synthetic OLD of the sizes in ``sizes`` (cf. ``DEFAULTS``)
+    through ``dbsession``.
+    """
+
+    def __init__(self, dbsession, settings, **sizes):
+        self.dbsession = dbsession
+        self.settings = settings
+        self.sizes = dict(DEFAULTS, **sizes)
+        self.rng = random.Random(self.sizes['seed'])
+        self.lexical_ids = []
+        self.sentence_ids = []
+
+    def uuid(self):
+        return str(uuid.UUID(int=self.rng.getrandbits(128), version=4))
+
+    def insert(self, model, rows):
+        table = model.__table__
+        for index in range(0, len(rows), BATCH_SIZE):
+            self.dbsession.execute(table.insert(),
+                                   rows[index:index + BATCH_SIZE])
+
+    def run(self):
+        """Generate the OLD and return its sizes."""
+        self.add_users_and_settings()
+        self.add_forms()
+        self.add_tags()
+        self.add_files()
+        self.add_collections()
+        self.add_corpora()
+        self.dbsession.commit()
+        self.compile_analyses()
+        return self.sizes
+
+    def add_users_and_settings(self):
+        self.dbsession.add_all([
+            omb.generate_default_administrator(settings=self.settings),
+            omb.generate_default_contributor(settings=self.settings),
+            omb.generate_default_viewer(settings=self.settings),
+            omb.generate_default_application_settings(),
+            omb.generate_default_home_page(),
+            omb.generate_default_help_page(),
+            omb.generate_restricted_tag(),
+            omb.generate_foreign_word_tag()])
+        self.dbsession.flush()
+        self.user_id = self.dbsession.query(old_models.User.id).filter(
+            old_models.User.username == 'admin').scalar()
+        self.categories = {}
+        for name, type_ in (('N', 'lexical'), ('V', 'lexical'),
+                            ('Agr', 'lexical'), ('S', 'sentential')):
+            category = old_models.SyntacticCategory(name=name, type=type_)
+            self.dbsession.add(category)
+            self.dbsession.flush()
+            self.categories[name] = category.id
+
+    def get_shapes(self, count):
+        shapes = set()
+        while len(shapes) < count:
+            shapes.add(''.join(self.rng.choice(SYLLABLES)
+                               for _ in range(self.rng.randint(2, 3))))
+        return sorted(shapes)
+
+    def form_row(self, id_, transcription, break_='', gloss='',
+                 category=None, syntax=''):
+        datetime_ = EPOCH + datetime.timedelta(minutes=id_)
+        return {
+            'id': id_, 'UUID': self.uuid(), 'transcription': transcription,
+            'morpheme_break': break_, 'morpheme_gloss': gloss,
+            'grammaticality': '', 'status': 'tested', 'syntax': syntax,
+            'syntactic_category_string': '', 'break_gloss_category': '',
+            'morpheme_break_ids': 'null', 'morpheme_gloss_ids': 'null',
+            'syntacticcategory_id': self.categories.get(category),
+            'enterer_id': self.user_id, 'modifier_id': self.user_id,
+            'datetime_entered': datetime_, 'datetime_modified': datetime_}
+
+    def add_forms(self):
+        """Add the lexical items (40% nouns, 40% verbs and 20% agreement
+        suffixes) and then the sentences.
+        """
+        lexical = self.sizes['lexical']
+        shapes = self.get_shapes(lexical)
+        items = {'N': [], 'V': [], 'Agr': []}
+        forms, translations = [], []
+        for index, shape in enumerate(shapes):
+            id_ = index + 1
+            category = ('N', 'V', 'N', 'V', 'Agr')[index % 5]
+            gloss = ('%s%d' % (category, id_)).lower() if category != 'Agr' \
+                else 'AGR%d' % id_
+            items[category].append((shape, gloss))
+            forms.append(self.form_row(id_, shape, shape, gloss, category))
+            translations.append({'form_id': id_, 'transcription': gloss,
+                                 'grammaticality': ''})
+            self.lexical_ids.append(id_)
+        for id_ in range(lexical + 1, self.sizes['forms'] + 1):
+            words = []
+            for position in range(self.rng.randint(2, 5)):
+                category = 'V' if position == 1 else 'N'
+                stem = self.rng.choice(items[category])
+                if items['Agr'] and self.rng.random() < 0.5:
+                    words.append((category, stem,
+                                  self.rng.choice(items['Agr'])))
+                else:
+                    words.append((category, stem, None))
+            transcription = ' '.join(
+                stem[0] + (suffix[0] if suffix else '')
+                for _, stem, suffix in words)
+            if self.rng.random() < self.sizes['density']:
+                break_ = ' '.join(stem[0] + ('-' + suffix[0] if suffix else '')
+                                  for _, stem, suffix in words)
+                gloss = ' '.join(stem[1] + ('-' + suffix[1] if suffix else '')
+                                 for _, stem, suffix in words)
+            else:
+                break_ = gloss = ''
+            syntax = '(S %s)' % ' '.join(
+                '(%s %s)' % (category, stem[0]) for category, stem, _ in words)
+            forms.append(self.form_row(id_, transcription, break_, gloss, 'S',
+                                       syntax))
+            translations.append({'form_id': id_,
+                                 'transcription': 'translation %d' % id_,
+                                 'grammaticality': ''})
+            self.sentence_ids.append(id_)
+        self.insert(old_models.Form, forms)
+        self.insert(old_models.Translation, translations)
+
+    def get_form_ids(self):
+        return self.lexical_ids + self.sentence_ids
+
+    def add_tags(self):
+        first_id = self.dbsession.query(
+            func.max(old_models.Tag.id)).scalar() + 1
+        tags = [{'id': first_id + index, 'name': 'tag %d' % index,
+                 'description': 'Synthetic tag %d.' % index}
+                for index in range(self.sizes['tags'])]
+        if not tags:
+            return
+        self.insert(old_models.Tag, tags)
+        form_tags = []
+        for form_id in self.get_form_ids():
+            for tag in self.rng.sample(tags, min(len(tags),
+                                                 self.rng.randint(0, 2))):
+                form_tags.append({'form_id': form_id, 'tag_id': tag['id']})
+        self.insert(old_models.FormTag, form_tags)
+
+    def add_files(self):
+        files, form_files = [], []
+        form_ids = self.get_form_ids()
+        for id_ in range(1, self.sizes['files'] + 1):
+            filename = 'synthetic_%05d.jpg' % id_
+            files.append({
+                'id': id_, 'filename': filename, 'name': filename,
+                'MIME_type': 'image/jpeg',
+                'size': self.rng.randint(10000, 1000000),
+                'description': 'Synthetic file %d.' % id_,
+                'enterer_id': self.user_id,
+                'datetime_entered': EPOCH, 'datetime_modified': EPOCH})
+            for form_id in self.rng.sample(form_ids, min(
+                    len(form_ids), self.rng.randint(1, 3))):
+                form_files.append({'form_id': form_id, 'file_id': id_})
+        self.insert(old_models.File, files)
+        self.insert(old_models.FormFile, form_files)
+
+    def add_collections(self):
+        """Add collections whose contents reference forms and, for every
+        fourth one, earlier collections; their unpacked contents, HTML and
+        forms are set as the Collections view would set them.
+        """
+        sentence_ids = self.sentence_ids or self.lexical_ids
+        unpacked = {}
+        collections, collection_forms = [], []
+        for id_ in range(1, self.sizes['collections'] + 1):
+            lines = ['Collection %d' % id_, '']
+            lines += ['form[%d]' % form_id for form_id in self.rng.sample(
+                sentence_ids, min(len(sentence_ids),
+                                  self.rng.randint(3, 15)))]
+            if id_ % 4 == 0:
+                lines += ['', ''.join('collection[%d]' % other for other in
+                                      self.rng.sample(range(1, id_),
+                                                      min(2, id_ - 1)))]
+            contents = '\n'.join(lines)
+            unpacked[id_] = COLLECTION_REFERENCE_PATTERN.sub(
+                lambda match: unpacked[int(match.group(1))], contents)
+            collections.append({
+                'id': id_, 'UUID': self.uuid(),
+                'title': 'Collection %d' % id_,
+                'type': self.rng.choice(COLLECTION_TYPES),
+                'markup_language': 'reStructuredText',
+                'contents': contents, 'contents_unpacked': unpacked[id_],
+                'html': h.get_HTML_from_contents(unpacked[id_],
+                                                 'reStructuredText'),
+                'enterer_id': self.user_id, 'modifier_id': self.user_id,
+                'datetime_entered': EPOCH, 'datetime_modified': EPOCH})
+            collection_forms += [
+                {'collection_id': id_, 'form_id': form_id}
+                for form_id in sorted(set(map(
+                    int, FORM_REFERENCE_PATTERN.findall(unpacked[id_]))))]
+        self.insert(old_models.Collection, collections)
+        self.insert(old_models.CollectionForm, collection_forms)
+
+    def add_corpora(self):
+        form_ids = self.get_form_ids()
+        corpora, corpus_forms = [], []
+        for id_ in range(1, self.sizes['corpora'] + 1):
+            ids = sorted(self.rng.sample(form_ids, min(
+                len(form_ids), self.sizes['corpus_forms'])))
+            corpora.append({
+                'id': id_, 'UUID': self.uuid(), 'name': 'Corpus %d' % id_,
+                'description': 'Synthetic corpus %d.' % id_,
+                'content': ','.join(map(str, ids)),
+                'enterer_id': self.user_id, 'modifier_id': self.user_id,
+                'datetime_entered': EPOCH, 'datetime_modified': EPOCH})
+            corpus_forms += [{'corpus_id': id_, 'form_id': form_id}
+                             for form_id in ids]
+        self.insert(old_models.Corpus, corpora)
+        self.insert(old_models.CorpusForm, corpus_forms)
+
+    def compile_analyses(self):
+        """Compile the morphological analyses of all forms and index their
+        morphemes, as ``PUT /forms/update_morpheme_references`` would.
+        """
+        MorphemeReferencesRebuild(self.dbsession, self.settings,
+                                  self.user_id).run()
+
+
+def generate(settings, replace=False, **sizes):
+    """Generate the synthetic OLD of ``settings['old_name']`` and return its
+    sizes.
+    """
+    dbsession = db_session_factory_registry.get_session(settings)()
+    try:
+        if replace:
+            Base.metadata.drop_all(bind=dbsession.bind, checkfirst=True)
+        Base.metadata.create_all(bind=dbsession.bind, checkfirst=True)
+        if sizes.get('lexical', DEFAULTS['lexical']) < 5:
+            raise ValueError('The OLD must have at least 5 lexical items.')
+        if dbsession.query(func.count(old_models.Form.id)).scalar():
+            raise ValueError('OLD "%s" already has forms; use --replace to'
+                             ' re-create it.' % settings['old_name'])
+        h.create_OLD_directories(settings)
+        return Generator(dbsession, settings, **sizes).run()
+    finally:
+        dbsession.close()
+
+
+def add_size_arguments(parser):
+    for name in SIZES:
+        parser.add_argument('--' + name.replace('_', '-'), type=int,
+                            default=DEFAULTS[name])
+    parser.add_argument('--density', type=float, default=DEFAULTS['density'],
+                        help='Fraction of the sentences that are'
+                             ' morphologically analysed.')
+    parser.add_argument('--seed', type=int, default=DEFAULTS['seed'])
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Generate a deterministic synthetic OLD.')
+    parser.add_argument('config_file', metavar='CONFIG_FILE')
+    parser.add_argument('old_name', metavar='OLD_NAME')
+    parser.add_argument('--replace', action='store_true',
+                        help='Drop and re-create the tables of the OLD.')
+    add_size_arguments(parser)
+    args = parser.parse_args()
+    settings = get_settings(args.config_file, args.old_name)
+    sizes = {name: getattr(args, name) for name in DEFAULTS}
+    try:
+        sizes = generate(settings, replace=args.replace, **sizes)
+    except ValueError as error:
+        print(error)
+        sys.exit(1)
+    print('Generated OLD "%s": %s' % (settings['old_name'], ', '.join(
+        '%s %s' % (value, name) for name, value in sorted(sizes.items()))))
+
+
+if __name__ == '__main__':
+    main()
@@ -109,6 +109,30 @@ against the Form model.
         >>>     )
         >>> )).outerjoin(translation_alias, Form.translations)
 
+Query plans: a query's filter and order by expressions with their literal
+values replaced by placeholders is its *shape*. The filter & order by
+expressions and the joins that a shape generates (with the values as SQLAlchemy
+bind parameters) are built once and cached per process (cf. :class:`PlanCache`
+and the ``search_plan_cache_size`` setting); later queries with the same shape
+only convert their values and bind them to the cached plan. Plans hold no
+per-request state: the restricted filtering, eager loading and pagination of the
+views are applied to each query after it is built from its plan.
+
+Full-text matches: the ``match`` relation searches the full-text indexes of
+the free-text columns listed in ``old.models.fulltext.FULLTEXT_COLUMNS``
+(FTS5 tables on SQLite, ``FULLTEXT`` indexes on MySQL) instead of scanning
+every value as ``like '%...%'`` and ``regex`` do. Its value is a full-text
+query with words, prefixes (``dog*``), phrases (``"the dog"``) and the
+operators ``AND``, ``OR`` and ``NOT`` (cf. :mod:`old.lib.fulltextquery`),
+and it combines with the other filters as usual::
+
+        >>> ['and', [['Form', 'transcription', 'match', 'dog* NOT "hot dog"'],
+        >>>          ['Form', 'syntactic_category', 'name', '=', 'N']]]
+
+The order by expression ``['Form', 'transcription', 'relevance']`` orders the
+results by how well they match the first ``match`` filter on
+``Form.transcription``, best first.
+
 Note also that SQLAQueryBuilder detects the RDBMS and issues collate commands
 where necessary to ensure that pattern matches are case-sensitive while ordering
 is not.
@@ -126,20 +150,43 @@ like 'a':
         >>>         Form.transcription.like('%1%'))))
 """
 
+from collections import OrderedDict
 import datetime
+import hashlib
+import json
 import logging
+import threading
 
-from sqlalchemy.sql import or_, and_, not_, asc, desc
+from sqlalchemy.sql import (
+    or_, and_, not_, asc, desc, bindparam, func, literal_column, select)
 from sqlalchemy.exc import OperationalError, InvalidRequestError
-from sqlalchemy.sql.expression import collate
+from sqlalchemy.sql.expression import BinaryExpression, collate
 from sqlalchemy.orm import aliased
 from sqlalchemy.types import Unicode, UnicodeText
 
+from old.lib.fulltextquery import FullTextQueryError, get_match_query
+from old.lib.metrics import register_collector
+from old.lib.trigrams import get_trigram_query
 from old.lib.utils import normalize
 import old.models as old_models
+from old.models.fulltext import (
+    FULLTEXT_COLUMNS,
+    TRIGRAM_COLUMNS,
+    get_fts_table,
+    sqlite_supports
+)
 
 
 LOGGER = logging.getLogger(__name__)
+# Every query built is logged (at INFO) to this logger so that the workload
+# can be replayed, e.g., by the index advisor (cf. old.lib.indexadvisor).
+QUERY_LOGGER = logging.getLogger(__name__ + '.queries')
+QUERY_LOG_MARKER = 'SQLAQueryBuilder query:'
+# The default maximum number of query plans cached per process, cf. the
+# ``search_plan_cache_size`` setting.
+DEFAULT_PLAN_CACHE_SIZE = 1000
+# Prefix of the names of the bind parameters of query plans.
+PLAN_PARAM_PREFIX = 'search_param_'
 
 
 try:
@@ -215,6 +262,158 @@ class OLDSearchParseError(Exception):
         return self.errors
 
 
+class Param(object):
+    """Placeholder for the ``index``-th literal value of a query in its shape,
+    cf. :meth:`SQLAQueryBuilder.get_query_shape`.
+    """
+
+    def __init__(self, index):
+        self.index = index
+
+    def __repr__(self):
+        return ':%s%d' % (PLAN_PARAM_PREFIX, self.index)
+
+
+class QueryPlan(object):
+    """The reusable part of the queries of a given shape: their filter and
+    order by expressions (with bind parameters in place of the literal
+    values), their joins and the specs ``(name, model_name, attribute_name,
+    relation_name)`` needed to convert the values of a query of this shape to
+    the values of its bind parameters.
+    """
+
+    def __init__(self, shape_id, model_name, filter_expression,
+                 order_by_expression, joins, params):
+        self.shape_id = shape_id
+        self.model_name = model_name
+        self.filter_expression = filter_expression
+        self.order_by_expression = order_by_expression
+        self.joins = joins
+        self.params = params
+        self.sql = None
+        self.hits = 0
+        self.misses = 1
+
+    def get_stats(self):
+        return {'shape': self.shape_id,
+                'model': self.model_name,
+                'params': len(self.params),
+                'hits': self.hits,
+                'misses': self.misses,
+                'sql': self.sql}
+
+
+class PlanCache(object):
+    """A thread-safe map from query shape keys to :class:`QueryPlan`
+    instances that holds at most ``max_size`` of them, evicting the least
+    recently used.
+    """
+
+    def __init__(self, max_size=DEFAULT_PLAN_CACHE_SIZE):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._store = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._store)
+
+    def get(self, key):
+        """Return the plan of ``key`` (counting a hit) or ``None`` (counting a
+        miss).
+        """
+        with self._lock:
+            plan = self._store.get(key)
+            if plan is None:
+                self.misses += 1
+                return None
+            self._store.move_to_end(key)
+            plan.hits += 1
+            self.hits += 1
+            return plan
+
+    def put(self, key, plan):
+        with self._lock:
+            previous = self._store.get(key)
+            if previous is not None:
+                # Another thread built the same plan concurrently.
+                plan.hits += previous.hits
+                plan.misses += previous.misses
+            self._store[key] = plan
+            self._store.move_to_end(key)
+            while len(self._store) > self.max_size:
+                self._store.popitem(last=False)
+
+    def get_stats(self):
+        """Return the hit and miss counts of this cache and those of each of
+        its shapes, the most used first.
+        """
+        with self._lock:
+            plans = list(self._store.values())
+            stats = {'size': len(plans), 'max_size': self.max_size,
+                     'hits': self.hits, 'misses': self.misses}
+        stats['shapes'] = sorted(
+            (plan.get_stats() for plan in plans),
+            key=lambda shape: (-shape['hits'], shape['shape']))
+        return stats
+
+    def clear(self):
+        with self._lock:
+            self._store.clear()
+            self.hits = self.misses = 0
+
+
+PLAN_CACHE = None
+PLAN_CACHE_LOCK = threading.Lock()
+
+
+def get_plan_cache(settings):
+    """Return the query plan cache shared by all of the threads (and OLDs) of
+    this process, or ``None`` if the ``search_plan_cache_size`` setting is 0.
+    Plans can be shared by OLDs because the shape keys include the RDBMS and
+    plans contain no data.
+    """
+    global PLAN_CACHE
+    max_size = int(settings.get('search_plan_cache_size',
+                                DEFAULT_PLAN_CACHE_SIZE))
+    if max_size <= 0:
+        return None
+    with PLAN_CACHE_LOCK:
+        if PLAN_CACHE is None:
+            PLAN_CACHE = PlanCache(max_size)
+        PLAN_CACHE.max_size = max_size
+        return PLAN_CACHE
+
+
+def get_shape_id(key):
+    """Return the short id of the query shape whose key is ``key``."""
+    return hashlib.sha1(key[-1].encode('utf8')).hexdigest()[:12]
+
+
+def get_plan_cache_stats():
+    """Return the statistics of this process's query plan cache (cf.
+    :meth:`PlanCache.get_stats`) or ``None`` if no plan has been cached.
+    """
+    if PLAN_CACHE is None:
+        return None
+    return PLAN_CACHE.get_stats()
+
+
+@register_collector
+def collect_plan_cache_metrics(registry):
+    cache = PLAN_CACHE
+    if cache is None:
+        return
+    lookups = registry.counter(
+        'old_search_plan_cache_lookups_total', 'Search plan cache lookups.',
+        ('result',))
+    lookups.set(cache.hits, result='hit')
+    lookups.set(cache.misses, result='miss')
+    registry.gauge('old_search_plan_cache_entries',
+                   'Query shapes in the search plan cache.').set(len(cache))
+
+
 class SQLAQueryBuilder(object):
     """Generate an SQLAlchemy query object from a Python dictionary.
 
@@ -247,9 +446,30 @@ class SQLAQueryBuilder(object):
         self.primary_key = primary_key
         if not settings:
             settings = {}
+        self.settings = settings
         self.RDBMSName = get_RDBMS_name(settings) # i.e., mysql or sqlite
+        # The plan of the last query built and whether it was cached.
+        self.plan = None
+        self.plan_hit = False
+        self._plan_params = None
+        # Maps (model name, attribute name) pairs to the (model, value) pairs
+        # of their first match filter, for ordering by relevance.
+        self._matches = {}
 
     def get_SQLA_query(self, python):
+        self.plan = None
+        self.plan_hit = False
+        plan_cache = get_plan_cache(self.settings)
+        if plan_cache is None or not isinstance(python, dict):
+            query = self._get_SQLA_query(python)
+        else:
+            query = self._get_planned_SQLA_query(python, plan_cache)
+        if QUERY_LOGGER.isEnabledFor(logging.INFO):
+            QUERY_LOGGER.info('%s %s %s', QUERY_LOG_MARKER, self.model_name,
+                              json.dumps(python, sort_keys=True, default=str))
+        return query
+
+    def _get_SQLA_query(self, python):
         self.clear_errors()
         filter_expression = self.get_SQLA_filter(python.get('filter'))
         order_by_expression = self._get_SQLA_order_by(python.get('order_by'), self.primary_key)
@@ -260,11 +480,169 @@ class SQLAQueryBuilder(object):
         query = self._add_joins_to_query(query)
         return query
 
+    def _get_planned_SQLA_query(self, python, plan_cache):
+        """Return the query of ``python`` built from the cached plan of its
+        shape, building and caching the plan first if necessary. Queries
+        whose shape generates errors are built (and their errors raised) the
+        uncached way so that the error messages name the offending values.
+        """
+        shape, values = self.get_query_shape(python)
+        try:
+            key = self.get_query_shape_key(shape)
+        except (TypeError, ValueError):  # not JSON-serializable
+            return self._get_SQLA_query(python)
+        plan = plan_cache.get(key)
+        if plan is None:
+            plan = self._get_query_plan(key, shape)
+            if plan is None:
+                return self._get_SQLA_query(python)
+            plan_cache.put(key, plan)
+        else:
+            self.plan_hit = True
+        self.plan = plan
+        self.clear_errors()
+        params = {}
+        for name, model_name, attribute_name, relation_name in plan.params:
+            index = int(name[len(PLAN_PARAM_PREFIX):])
+            params[name] = self._get_value(
+                values[index], model_name, attribute_name, relation_name)
+        self._raise_search_parse_error_if_necessary()
+        query = self._get_planned_query(plan)
+        if params:
+            query = query.params(**params)
+        return query
+
+    def _get_planned_query(self, plan):
+        query = self._get_base_query()
+        query = query.filter(plan.filter_expression)
+        query = query.order_by(plan.order_by_expression)
+        for join in plan.joins:
+            query = query.outerjoin(join[0], join[1])
+        return query
+
+    def _get_query_plan(self, key, shape):
+        """Return a new :class:`QueryPlan` for ``shape`` or ``None`` if the
+        shape generates errors.
+        """
+        self.clear_errors()
+        self.joins = []
+        self._plan_params = []
+        try:
+            filter_expression = self.get_SQLA_filter(shape['filter'])
+            order_by_expression = self._get_SQLA_order_by(
+                shape['order_by'], self.primary_key)
+            params = self._plan_params
+        finally:
+            self._plan_params = None
+        joins, self.joins = self.joins, []
+        if self.errors:
+            self.clear_errors()
+            return None
+        plan = QueryPlan(
+            get_shape_id(key), self.model_name, filter_expression,
+            order_by_expression, joins, params)
+        try:
+            plan.sql = str(self._get_planned_query(plan).statement.compile(
+                dialect=self.dbsession.get_bind().dialect))
+        except Exception as error:  # The SQL is only informative.
+            LOGGER.debug('Unable to compile the SQL of query plan %s: %s',
+                         plan.shape_id, error)
+        return plan
+
+    def get_query_shape(self, python):
+        """Return the shape of the Python query ``python`` and the list of the
+        literal values lifted out of it. In the shape, every value compared
+        with an attribute that is a column is replaced by a :class:`Param`
+        whose index is that of the value in the list. ``None`` values, values
+        compared with relations (e.g., ``['Form', 'enterer', '=', None]``)
+        and lists (other than those of ``in``) stay in the shape since they
+        change the structure of the SQL. So do the regex patterns of trigram
+        indexed attributes on SQLite, since their trigram prefilter depends
+        on the pattern.
+        """
+        values = []
+        shape = {
+            'filter': self._get_filter_shape(python.get('filter'), values),
+            'order_by': python.get('order_by')}
+        return shape, values
+
+    def get_query_shape_id(self, python):
+        """Return the id of the shape of the Python query ``python``, i.e.,
+        that of the plan of the queries of that shape.
+        """
+        shape, _ = self.get_query_shape(python or {})
+        return get_shape_id(self.get_query_shape_key(shape))
+
+    def get_query_shape_key(self, shape):
+        """Return the cache key of ``shape``: the RDBMS affects the collations
+        and the value conversions of the plan.
+        """
+        return (self.RDBMSName, mysql_engine, self.model_name,
+                self.primary_key, json.dumps(
+                    shape, sort_keys=True, default=self._serialize_param))
+
+    @staticmethod
+    def _serialize_param(param):
+        if isinstance(param, Param):
+            return {'param': param.index}
+        raise TypeError('%r is not JSON serializable' % (param,))
+
+    def _get_filter_shape(self, python, values):
+        if not isinstance(python, list) or not python:
+            return python
+        if python[0] in ('and', 'or'):
+            if len(python) > 1 and isinstance(python[1], list):
+                return [python[0],
+                        [self._get_filter_shape(x, values) for x in python[1]]
+                       ] + python[2:]
+            return python
+        if python[0] == 'not':
+            if len(python) > 1:
+                return [python[0], self._get_filter_shape(python[1], values)
+                       ] + python[2:]
+            return python
+        if len(python) == 4:
+            model_name, attribute_name, relation_name, value = python
+        elif len(python) == 5:
+            try:
+                model_name = self.schema[python[0]][python[1]].get(
+                    'foreign_model')
+            except (KeyError, TypeError):
+                return python
+            attribute_name, relation_name, value = python[2:]
+        else:
+            return python
+        if not self._is_liftable(model_name, attribute_name, relation_name,
+                                 value):
+            return python
+        values.append(value)
+        return python[:-1] + [Param(len(values) - 1)]
+
+    def _is_liftable(self, model_name, attribute_name, relation_name, value):
+        """Return ``True`` if ``value`` can be a bind parameter of the plan."""
+        try:
+            attribute_dict = self.schema[model_name][attribute_name]
+            relation_dict = self.relations[relation_name]
+        except (KeyError, TypeError):
+            return False
+        if attribute_dict.get('foreign_model'):
+            return False
+        scalar_types = (str, int, float)
+        relation_name = relation_dict.get('alias', relation_name)
+        if relation_name == 'regexp' and self._has_trigram_index(
+                model_name, attribute_name):
+            return False
+        if relation_name == 'in_':
+            return (isinstance(value, list) and bool(value) and
+                    all(isinstance(x, scalar_types) for x in value))
+        return isinstance(value, scalar_types)
+
     def get_SQLA_filter(self, python):
         """Return the SQLAlchemy filter expression generable by the input Python
         data structure or raise an OLDSearchParseError if the data structure is
         invalid.
         """
+        self._matches = {}
         return self._python2sqla(python)
 
     def get_SQLA_order_by(self, order_by, primary_key='id'):
@@ -282,6 +660,9 @@ class SQLAQueryBuilder(object):
         if order_by is None:
             return default_order_by
         try:
+            if order_by[2:3] == ['relevance']:
+                return self._get_relevance_order_by(
+                    order_by[0], order_by[1], default_order_by)
             model_name = self._get_model_name(order_by[0])
             attribute_name = self._get_attribute_name(order_by[1], model_name)
             model = self._get_model(model_name)
@@ -302,6 +683,30 @@ class SQLAQueryBuilder(object):
                 'OrderByError', 'The provided order by expression was invalid.')
             return default_order_by
 
+    def _get_relevance_order_by(self, model_name, attribute_name,
+                                default_order_by):
+        """Return the expression that orders the results by their relevance
+        to the first match filter on ``model_name.attribute_name``, most
+        relevant first.
+        """
+        try:
+            model, value = self._matches[(model_name, attribute_name)]
+        except (KeyError, TypeError):
+            self._add_to_errors(
+                'OrderByError', 'Ordering by relevance requires a match filter'
+                ' on %s.%s.' % (model_name, attribute_name))
+            return default_order_by
+        if self.RDBMSName == 'mysql':
+            return desc(self._get_match_column(
+                getattr(model, attribute_name)).match(value))
+        # FTS5's bm25() is negative and smaller the better the match; rows
+        # that only match other filters get 0.
+        fts_table = get_fts_table(self._get_table_name(model_name))
+        score = select([func.bm25(literal_column(fts_table.name))]).where(
+            and_(fts_table.c[attribute_name].op('MATCH')(value),
+                 fts_table.c.rowid == model.id)).as_scalar()
+        return asc(func.coalesce(score, 0))
+
     def clear_errors(self):
         self.errors = {}
 
@@ -408,7 +813,8 @@ class SQLAQueryBuilder(object):
         '__ge__': {},
         '>=': {'alias': '__ge__'},
         'in_': {},
-        'in': {'alias': 'in_'}
+        'in': {'alias': 'in_'},
+        'match': {}
     }
 
     equality_relations = {
@@ -585,6 +991,20 @@ class SQLAQueryBuilder(object):
             'enterer': {'foreign_model': 'User', 'type': 'scalar'},
             'datetime_modified': {'value_converter': '_get_datetime_value'}
         },
+        'Job': {
+            'id': {},
+            'kind': {},
+            'status': {},
+            'priority': {},
+            'error': {},
+            'attempts': {},
+            'worker': {},
+            'enterer': {'foreign_model': 'User', 'type': 'scalar'},
+            'datetime_entered': {'value_converter': '_get_datetime_value'},
+            'datetime_started': {'value_converter': '_get_datetime_value'},
+            'datetime_finished': {'value_converter': '_get_datetime_value'},
+            'datetime_modified': {'value_converter': '_get_datetime_value'}
+        },
         'File': {
             'id': {},
             'filename': {},
@@ -934,6 +1354,10 @@ class SQLAQueryBuilder(object):
                     ' possible' % (self.model_name, model_name))
         return model
 
+    def _get_table_name(self, model_name):
+        return getattr(old_models, self.model_aliases.get(
+            model_name, model_name)).__table__.name
+
     def _get_attribute_model_name(self, attribute_name, model_name):
         """Returns the name of the model X that stores the data for the attribute
         A of model M, e.g., the attribute_model_name for model_name='Form' and
@@ -1048,8 +1472,11 @@ class SQLAQueryBuilder(object):
     def _get_relation(self, relation_name, attribute, attribute_name, model_name):
         try:
             if relation_name == 'regexp':
-                op = getattr(attribute, 'op')
-                relation = op('regexp')
+                relation = self._get_regexp_relation(
+                    attribute, attribute_name, model_name)
+            elif relation_name == 'match':
+                relation = self._get_match_relation(
+                    attribute, attribute_name, model_name)
             else:
                 relation = getattr(attribute, relation_name)
         except AttributeError:  # attribute can be None
@@ -1060,6 +1487,83 @@ class SQLAQueryBuilder(object):
                     relation_name, model_name, attribute_name))
         return relation
 
+    def _has_trigram_index(self, model_name, attribute_name):
+        if self.RDBMSName != 'sqlite' or not sqlite_supports('trigram'):
+            return False
+        try:
+            table_name = self._get_table_name(model_name)
+        except AttributeError:
+            return False
+        return attribute_name in TRIGRAM_COLUMNS.get(table_name, ())
+
+    def _get_regexp_relation(self, attribute, attribute_name, model_name):
+        """Return the function that returns the regex filter of
+        ``attribute``. On SQLite, the ``regexp`` function is Python code called
+        for every row, so if ``attribute`` has a trigram index, the rows are
+        first narrowed down to those that contain the substrings that the
+        pattern requires (if any, cf. :mod:`old.lib.trigrams`).
+        """
+        regexp = attribute.op('regexp')
+        if not self._has_trigram_index(model_name, attribute_name):
+            return regexp
+        entity = attribute.parent.entity
+        nullable = attribute.property.columns[0].nullable
+        trigram_table = get_fts_table(
+            self._get_table_name(model_name), 'trigram')
+
+        def relation(value):
+            query = get_trigram_query(value) if isinstance(value, str) \
+                else None
+            if query is None:
+                return regexp(value)
+            candidates = entity.id.in_(
+                select([trigram_table.c.rowid]).where(
+                    trigram_table.c[attribute_name].op('MATCH')(query)))
+            if nullable:
+                # regexp() is NULL for NULL values; keep the negation of the
+                # filter NULL (i.e., false) for them too.
+                candidates = or_(candidates, attribute.is_(None))
+            return and_(candidates, regexp(value))
+        return relation
+
+    def _get_match_relation(self, attribute, attribute_name, model_name):
+        """Return the function that returns the full-text match filter of
+        ``attribute`` for a (converted) full-text query.
+        """
+        if attribute is None:
+            raise AttributeError(attribute_name)
+        table_name = self._get_table_name(model_name)
+        if attribute_name not in FULLTEXT_COLUMNS.get(table_name, ()):
+            self._add_to_errors(
+                '%s.%s' % (model_name, attribute_name),
+                'There is no full-text index of %s.%s' % (
+                    model_name, attribute_name))
+            return None
+        if self.RDBMSName == 'mysql':
+            return self._get_match_column(attribute).match
+        if not sqlite_supports('fts'):
+            self._add_to_errors(
+                '%s.%s' % (model_name, attribute_name),
+                'Full-text search is not available: the SQLite library of'
+                ' this OLD lacks FTS5')
+            return None
+        # The model may be an alias of the table, e.g., Translation when
+        # searching forms.
+        entity = attribute.parent.entity
+        fts_table = get_fts_table(table_name)
+        return lambda value: entity.id.in_(
+            select([fts_table.c.rowid]).where(
+                fts_table.c[attribute_name].op('MATCH')(value)))
+
+    @staticmethod
+    def _get_match_column(attribute):
+        """Return ``attribute`` without the COLLATE of
+        :meth:`_collate_attribute`: MySQL's MATCH takes columns only.
+        """
+        if isinstance(attribute, BinaryExpression):
+            return attribute.left
+        return attribute
+
     ############################################################################
     # Value getters
     ############################################################################
@@ -1085,8 +1589,13 @@ class SQLAQueryBuilder(object):
 
     def _get_value(self, value, model_name, attribute_name, relation_name):
         """Unicode normalize & modify the value using a value_converter (if necessary)."""
+        if isinstance(value, Param):
+            return self._get_plan_param(
+                value, model_name, attribute_name, relation_name)
         # unicode normalize (NFD) search patterns; we might want to parameterize this
         value = self._normalize(value)
+        if relation_name == 'match':
+            return self._get_match_value(value, model_name, attribute_name)
         value_converter = self._get_value_converter(attribute_name, model_name)
         if value_converter is not None:
             if isinstance(value, list):
@@ -1095,6 +1604,26 @@ class SQLAQueryBuilder(object):
                 value = value_converter(value)
         return value
 
+    def _get_match_value(self, value, model_name, attribute_name):
+        """Return the full-text query ``value`` in the syntax of the RDBMS."""
+        try:
+            return get_match_query(value, self.RDBMSName)
+        except FullTextQueryError as error:
+            self._add_to_errors(
+                '%s.%s.match' % (model_name, attribute_name),
+                'Invalid full-text query %s: %s' % (repr(value), error))
+            return value
+
+    def _get_plan_param(self, param, model_name, attribute_name,
+                        relation_name):
+        """Return the bind parameter of ``param`` while building a plan and
+        record how to get its value.
+        """
+        name = '%s%d' % (PLAN_PARAM_PREFIX, param.index)
+        self._plan_params.append(
+            (name, model_name, attribute_name, relation_name))
+        return bindparam(name, expanding=relation_name == 'in_')
+
     ############################################################################
     # Filter expression getters
     ############################################################################
@@ -1240,8 +1769,12 @@ class SQLAQueryBuilder(object):
                 attribute_name, model, model_name)
             relation = self._get_relation(
                 relation_name, attribute, attribute_name, model_name)
-            return self._get_filter_expression(
+            filter_expression = self._get_filter_expression(
                 relation, value, model_name, attribute_name, relation_name)
+            if relation_name == 'match' and filter_expression is not None:
+                self._matches.setdefault(
+                    (model_name, attribute_name), (model, value))
+            return filter_expression
         attribute_model_name = self._get_attribute_model_name(
             attribute_name, model_name)
         attribute_model_attribute_name = self._get_attribute_name(
@@ -19,7 +19,9 @@ RSRC_TO_DIR = {
     'morphologicalparser': 'morphological_parsers',
     'morpheme_language_models': 'morpheme_language_models',
     'morphemelanguagemodels': 'morpheme_language_models',
-    'morphemelanguagemodel': 'morpheme_language_models'
+    'morphemelanguagemodel': 'morpheme_language_models',
+    'profiles': 'profiles',
+    'slow_searches': 'slow_searches'
 }
 
 
@@ -82,19 +84,27 @@ COLLECTION_TYPES = (
 # Corpus formats -- determine how a corpus is rendered as a file, e.g., a
 # treebank will output a file containing representations of phrase structure for
 # each form in the corpus and the file will be called ``corpus_1.tbk`` ...
+# The ``writer`` of a format serializes a row that has (at least) the form
+# table ``columns`` listed, cf. ``old.lib.corpusexport``.
 CORPUS_FORMATS = {
     'treebank': {
         'extension': 'tbk',
         'suffix': '',
+        'columns': ('id', 'syntax'),
         'writer': lambda f: '(TOP-%d %s)\n' % (f.id, f.syntax)
     },
     'transcriptions only': {
         'extension': 'txt',
         'suffix': '_transcriptions',
+        'columns': ('id', 'transcription'),
         'writer': lambda f: '%s\n' % f.transcription
     }
 }
 
+# Corpus files are written either within the ``writetofile`` request or by a
+# background job.
+CORPUS_EXPORT_MODES = ('sync', 'async')
+
 
 # This is the regex for finding form references in the contents of collections.
 FORM_REFERENCE_PATTERN = re.compile(r'[Ff]orm\[([0-9]+)\]')
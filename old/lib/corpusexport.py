@@ -0,0 +1,411 @@
+# Copyright 2016 Joel Dunham
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""Writing corpora to files, as requested via ``PUT /corpora/id/writetofile``.
+
+A corpus file is written by a :class:`CorpusFileWriter`, either within the
+request (the "sync" mode) or by a background job (the "async" mode, cf.
+:func:`old.lib.foma_worker.write_corpus_file` and :func:`export_corpus_file`):
+
+- the corpus's forms are streamed in chunks of ``corpus_export_chunk_size``
+  via column-only Core selects, i.e., only the columns that the format's
+  writer needs are fetched and no ORM objects are built. The forms of a
+  ``form_search`` corpus are read in id order; those of a content-defined
+  corpus in the order (and with the repetitions) of the content's references;
+- each form is serialized by the writer of the format in
+  ``old.lib.constants.CORPUS_FORMATS``: adding a format there (with its
+  ``columns`` and ``writer``) is all that is needed to support it;
+- the serialized forms are written to the plain file and, in blocks of
+  ``BLOCK_SIZE`` bytes, compressed in parallel by ``corpus_export_processes``
+  worker processes. Each block is a complete gzip member and the members are
+  concatenated in order, which yields a valid (multi-member) gzip file;
+- the files are written under temporary names and moved into place once
+  complete, so that a file being re-written can still be served;
+- in the async mode, the corpus file model records the export's ``status``
+  (queued, writing, ready or failed) and its progress (``forms_written`` of
+  ``forms_total``); these are part of the corpus's ``files`` entries. Every
+  update of the status or progress also sets the model's
+  ``datetime_modified``, a heartbeat: an export whose heartbeat is older than
+  :data:`STALE_AFTER` seconds is assumed to have died (cf.
+  :func:`export_is_pending`) and may be requested again.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+import gzip
+from io import BytesIO
+from itertools import islice
+import logging
+import multiprocessing
+import os
+from subprocess import call
+import sys
+from uuid import uuid4
+
+from sqlalchemy.sql import exists, func, select
+
+import old.lib.constants as oldc
+import old.lib.helpers as h
+import old.models as old_models
+
+
+LOGGER = logging.getLogger(__name__)
+DEFAULT_CHUNK_SIZE = 1000
+DEFAULT_PROCESSES = 2
+# Size (in bytes of serialized forms) of the blocks compressed as separate
+# gzip members.
+BLOCK_SIZE = 1024 * 1024
+COMPRESS_LEVEL = 9
+DEFAULT_EXPORT_MODE = 'sync'
+# A queued or writing export whose corpus file has not been touched for this
+# many seconds is assumed to have died and may be queued again.
+STALE_AFTER = 600
+
+
+def get_export_mode(settings):
+    """Return the export mode used when ``PUT /corpora/id/writetofile``
+    requests do not specify one.
+    """
+    mode = settings.get('corpus_export_mode')
+    if mode in oldc.CORPUS_EXPORT_MODES:
+        return mode
+    return DEFAULT_EXPORT_MODE
+
+
+def export_is_pending(corpus_file):
+    """Return ``True`` if the export of ``corpus_file`` is queued or being
+    written and its heartbeat is recent.
+    """
+    if corpus_file.status not in ('queued', 'writing'):
+        return False
+    if corpus_file.datetime_modified is None:
+        return False
+    return ((h.now() - corpus_file.datetime_modified).total_seconds() <
+            STALE_AFTER)
+
+
+def get_corpus_directory_path(corpus_id, settings):
+    """Return the path to the directory of the corpus with id ``corpus_id``.
+    """
+    return os.path.join(h.get_old_directory_path('corpora', settings),
+                        'corpus_%d' % corpus_id)
+
+
+def get_corpus_filename(corpus_id, format_):
+    """Return the name of the file of the corpus in format ``format_``."""
+    format_spec = oldc.CORPUS_FORMATS[format_]
+    return 'corpus_%d%s.%s' % (
+        corpus_id, format_spec['suffix'], format_spec['extension'])
+
+
+def get_corpus_file_path(corpus_id, format_, settings):
+    """Return the path to the file of the corpus in format ``format_``."""
+    return os.path.join(get_corpus_directory_path(corpus_id, settings),
+                        get_corpus_filename(corpus_id, format_))
+
+
+def compress_block(block):
+    """Return ``block`` compressed as a single gzip member. The member has no
+    timestamp, so that identical corpora yield identical files.
+    """
+    buffer_ = BytesIO()
+    with gzip.GzipFile(fileobj=buffer_, mode='wb',
+                       compresslevel=COMPRESS_LEVEL, mtime=0) as member:
+        member.write(block)
+    return buffer_.getvalue()
+
+
+def create_tgrep2_corpus_file(gzipped_corpus_file_path, out_path):
+    """Use TGrep2 to create the .t2c corpus file ``out_path`` from the gzipped
+    file of phrase-structure trees. Return ``out_path`` or ``False`` if it
+    could not be created.
+    """
+    if not h.command_line_program_installed('tgrep2'):
+        return False
+    with open(os.devnull, 'w') as fnull:
+        call(['tgrep2', '-p', gzipped_corpus_file_path, out_path],
+             stdout=fnull, stderr=fnull)
+    if os.path.exists(out_path):
+        return out_path
+    return False
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+class CompressedWriter:
+    """Writes the blocks of bytes it is given to ``file_`` as consecutive gzip
+    members. With more than one process, blocks are compressed in a (lazily
+    started) process pool while the next blocks are being read; the members
+    are still written in order.
+    """
+
+    def __init__(self, file_, processes):
+        self.file_ = file_
+        self.processes = processes
+        self.pool = None
+        self.pending = []
+        self.members = 0
+
+    def write(self, block, last=False):
+        if self.processes > 1 and not (last and self.pool is None):
+            if self.pool is None:
+                pool_kwargs = {}
+                if sys.version_info >= (3, 7):
+                    pool_kwargs['mp_context'] = multiprocessing.get_context(
+                        'spawn')
+                self.pool = ProcessPoolExecutor(max_workers=self.processes,
+                                                **pool_kwargs)
+            self.pending.append(self.pool.submit(compress_block, block))
+            while len(self.pending) > 2 * self.processes:
+                self._write_member(self.pending.pop(0).result())
+        else:
+            self._drain()
+            self._write_member(compress_block(block))
+
+    def close(self):
+        try:
+            self._drain()
+        finally:
+            if self.pool is not None:
+                # The blocks still pending after a failure are not needed.
+                for future in self.pending:
+                    future.cancel()
+                self.pending = []
+                self.pool.shutdown()
+                self.pool = None
+
+    def _drain(self):
+        while self.pending:
+            self._write_member(self.pending.pop(0).result())
+
+    def _write_member(self, member):
+        self.file_.write(member)
+        self.members += 1
+
+
+class CorpusFileWriter:
+    """Write the corpus with id ``corpus_id`` to its file in format
+    ``format_`` (plus the gzipped copy and, for treebanks, the TGrep2 file).
+    Example usage::
+
+        result = CorpusFileWriter(dbsession, settings, corpus.id,
+                                  'treebank').run()
+
+    :param dbsession: SQLAlchemy session; it is only read from.
+    :param dict settings: the OLD's settings (used to locate the corpus's
+        directory and to read ``corpus_export_chunk_size`` and
+        ``corpus_export_processes``).
+    :param int corpus_id: id of the corpus.
+    :param str format_: a key of ``oldc.CORPUS_FORMATS``.
+    :param progress: optional callable; it is called with the number of forms
+        written and the total number of forms after each chunk.
+    """
+
+    def __init__(self, dbsession, settings, corpus_id, format_,
+                 progress=None):
+        self.dbsession = dbsession
+        self.settings = settings
+        self.corpus_id = corpus_id
+        self.format_ = format_
+        self.format_spec = oldc.CORPUS_FORMATS[format_]
+        self.progress = progress
+        self.chunk_size = max(1, h.get_int(settings.get(
+            'corpus_export_chunk_size')) or DEFAULT_CHUNK_SIZE)
+        processes = h.get_int(settings.get('corpus_export_processes'))
+        self.processes = (DEFAULT_PROCESSES if processes is None
+                          else processes)
+        self.path = get_corpus_file_path(corpus_id, format_, settings)
+        self.forms_total = 0
+        self.forms_written = 0
+
+    def run(self):
+        """Write the files and return a dict with the ``filename`` of the
+        corpus file, the number of ``forms_written`` and whether any of them
+        is ``restricted``.
+        """
+        corpus_table = old_models.Corpus.__table__
+        corpus = self.dbsession.execute(
+            select([corpus_table.c.form_search_id, corpus_table.c.content])
+            .where(corpus_table.c.id == self.corpus_id)).first()
+        if corpus is None:
+            raise ValueError('There is no corpus with id %d' % self.corpus_id)
+        if corpus.form_search_id:  # ``form_search`` value negates any content.
+            references = None
+            self.forms_total = self._count_forms()
+        else:
+            references = list(old_models.Corpus.get_form_references(
+                corpus.content or ''))
+            self.forms_total = len(references)
+        restricted = self._is_restricted()
+        h.make_directory_safely(os.path.dirname(self.path))
+        token = uuid4().hex
+        paths = [self.path, '%s.gz' % self.path]
+        if self.format_ == 'treebank':
+            paths.append('%s.t2c' % self.path)
+        temp_paths = ['%s.%s.part' % (path, token) for path in paths]
+        try:
+            self._write(references, temp_paths[0], temp_paths[1])
+            if len(paths) == 3 and not create_tgrep2_corpus_file(
+                    temp_paths[1], temp_paths[2]):
+                paths.pop()
+                temp_paths.pop()
+            for temp_path, path in zip(temp_paths, paths):
+                os.replace(temp_path, path)
+        finally:
+            for temp_path in temp_paths:
+                _remove(temp_path)
+        LOGGER.info('Wrote %d forms of corpus %d to %s.', self.forms_written,
+                    self.corpus_id, self.path)
+        return {'filename': os.path.basename(self.path),
+                'forms_written': self.forms_written,
+                'restricted': restricted}
+
+    def _write(self, references, plain_path, gzip_path):
+        writer = self.format_spec['writer']
+        with open(plain_path, 'wb') as plain_file, \
+                open(gzip_path, 'wb') as gzip_file:
+            compressor = CompressedWriter(gzip_file, self.processes)
+            try:
+                block = []
+                block_size = 0
+                for rows in self._iter_chunks(references):
+                    data = ''.join(writer(row) for row in rows).encode('utf8')
+                    plain_file.write(data)
+                    block.append(data)
+                    block_size += len(data)
+                    if block_size >= BLOCK_SIZE:
+                        compressor.write(b''.join(block))
+                        block = []
+                        block_size = 0
+                    self.forms_written += len(rows)
+                    if self.progress:
+                        self.progress(self.forms_written, self.forms_total)
+                # An empty corpus still gets a (single, empty) gzip member.
+                if block or not compressor.members and not compressor.pending:
+                    compressor.write(b''.join(block), last=True)
+            finally:
+                compressor.close()
+
+    def _get_columns(self):
+        form_table = old_models.Form.__table__
+        names = self.format_spec.get('columns') or [
+            column.key for column in form_table.columns]
+        return [form_table.c[name] for name in names]
+
+    def _iter_chunks(self, references):
+        """Yield the (column-only) rows of the forms to be written, in
+        chunks.
+        """
+        form_table = old_models.Form.__table__
+        corpus_form = old_models.CorpusForm.__table__
+        columns = self._get_columns()
+        if 'id' not in [column.key for column in columns]:
+            columns.append(form_table.c.id)
+        in_corpus = form_table.join(
+            corpus_form, (corpus_form.c.form_id == form_table.c.id) &
+            (corpus_form.c.corpus_id == self.corpus_id))
+        if references is None:
+            last_id = 0
+            while True:
+                rows = self.dbsession.execute(
+                    select(columns).select_from(in_corpus)
+                    .where(form_table.c.id > last_id)
+                    .order_by(form_table.c.id)
+                    .limit(self.chunk_size)).fetchall()
+                if not rows:
+                    break
+                last_id = rows[-1].id
+                yield rows
+            return
+        references = iter(references)
+        while True:
+            ids = list(islice(references, self.chunk_size))
+            if not ids:
+                break
+            rows = {row.id: row for row in self.dbsession.execute(
+                select(columns).select_from(in_corpus)
+                .where(form_table.c.id.in_(set(ids))))}
+            try:
+                yield [rows[id_] for id_ in ids]
+            except KeyError as error:
+                raise ValueError(
+                    'Form %s is referenced in the content of corpus %d but it'
+                    ' is not one of its forms' % (error, self.corpus_id))
+
+    def _count_forms(self):
+        corpus_form = old_models.CorpusForm.__table__
+        return self.dbsession.execute(
+            select([func.count(func.distinct(corpus_form.c.form_id))])
+            .where(corpus_form.c.corpus_id == self.corpus_id)).scalar()
+
+    def _is_restricted(self):
+        """Return ``True`` if any of the corpus's forms is tagged
+        "restricted".
+        """
+        corpus_form = old_models.CorpusForm.__table__
+        form_tag = old_models.FormTag.__table__
+        tag = old_models.Tag.__table__
+        return bool(self.dbsession.execute(select([exists(
+            select([corpus_form.c.id]).select_from(
+                corpus_form
+                .join(form_tag, form_tag.c.form_id == corpus_form.c.form_id)
+                .join(tag, tag.c.id == form_tag.c.tag_id))
+            .where((corpus_form.c.corpus_id == self.corpus_id) &
+                   (tag.c.name == 'restricted')))])).scalar())
+
+
+def export_corpus_file(dbsession, settings, corpus_file_id, user_id):
+    """Write the corpus file with id ``corpus_file_id``, recording the export's
+    status and progress on its model as it goes. This is the body of the
+    ``write_corpus_file`` background job.
+    """
+    corpus_file_table = old_models.CorpusFile.__table__
+    corpus_table = old_models.Corpus.__table__
+
+    def update(**values):
+        values.setdefault('datetime_modified', h.now())
+        dbsession.execute(
+            corpus_file_table.update()
+            .where(corpus_file_table.c.id == corpus_file_id).values(**values))
+        dbsession.commit()
+
+    corpus_file = dbsession.execute(
+        select([corpus_file_table.c.corpus_id, corpus_file_table.c.format])
+        .where(corpus_file_table.c.id == corpus_file_id)).first()
+    if corpus_file is None or corpus_file.corpus_id is None:
+        raise ValueError('There is no corpus file with id %d' % corpus_file_id)
+    writer = CorpusFileWriter(
+        dbsession, settings, corpus_file.corpus_id, corpus_file.format,
+        progress=lambda written, total: update(forms_written=written,
+                                                forms_total=total))
+    update(status='writing', forms_written=0, message=None)
+    try:
+        result = writer.run()
+    except Exception as error:
+        dbsession.rollback()
+        update(status='failed', message=str(error))
+        raise
+    now = h.now()
+    dbsession.execute(
+        corpus_table.update()
+        .where(corpus_table.c.id == corpus_file.corpus_id)
+        .values(datetime_modified=now))
+    update(status='ready', forms_written=result['forms_written'],
+           forms_total=writer.forms_total, restricted=result['restricted'],
+           modifier_id=user_id, datetime_modified=now)
+    return result
@@ -3,156 +3,252 @@ that involves the SQLA session should be moved here.
 
 """
 
-from collections import namedtuple
+import base64
+from collections import OrderedDict
+import datetime
+from functools import lru_cache
+from itertools import zip_longest
+import json
 import re
+import threading
 from uuid import UUID
+import zlib
 
+from formencode import Invalid
+from formencode.api import FancyValidator
 from formencode.schema import Schema
-from formencode.validators import Int
-from sqlalchemy.orm import subqueryload, joinedload
-from sqlalchemy.sql import or_, not_, desc, asc
-
+from formencode.validators import Int, OneOf, StringBoolean
+from sqlalchemy import inspect
+from sqlalchemy.orm import Load
+from sqlalchemy.sql import and_, or_, not_, desc, asc, select
+from sqlalchemy.sql import operators
+from sqlalchemy.sql.elements import UnaryExpression
+
+from old.lib import slowsearch
+from old.lib.resultcache import get_dependent_tables, get_watermark
+from old.lib.tenantcache import get_tenant_data, get_tenant_key
 from old.lib.utils import esc_RE_meta_chars
 import old.models as old_models
 from old.models.meta import Base
 
 
+# How paginated results are counted, cf. get_paginated_query_results.
+COUNT_MODES = ('exact', 'cached', 'estimate', 'none')
+
+
 class PaginatorSchema(Schema):
     allow_extra_fields = True
     filter_extra_fields = False
     items_per_page = Int(not_empty=True, min=1)
     page = Int(not_empty=True, min=1)
+    count_mode = OneOf(COUNT_MODES, if_missing='exact')
+
+
+class Cursor(FancyValidator):
+    """Decode an opaque keyset pagination cursor (cf.
+    :func:`encode_cursor`). The empty string (the first page) decodes to
+    ``None``.
+    """
+
+    messages = {'invalid': 'Invalid pagination cursor.'}
+
+    def _convert_to_python(self, value, state):
+        if not value:
+            return None
+        try:
+            signature, sort_value, last_id = json.loads(
+                base64.urlsafe_b64decode(value.encode('ascii')).decode('utf8'))
+            return {'token': value,
+                    'signature': signature,
+                    'value': _decode_cursor_value(sort_value),
+                    'id': int(last_id)}
+        except (TypeError, ValueError, UnicodeError, base64.binascii.Error):
+            raise Invalid(self.message('invalid', state), value, state)
+
+
+class CursorPaginatorSchema(Schema):
+    allow_extra_fields = True
+    filter_extra_fields = False
+    items_per_page = Int(not_empty=True, min=1)
+    cursor = Cursor(if_missing=None)
+    with_count = StringBoolean(if_missing=False)
 
 
 ##########################################################################
 # Eager loading of model queries
 ##########################################################################
 
-# It appears that SQLAlchemy does not query the db to retrieve a relational
-# scalar when the foreign key id col value is NULL. Therefore, eager loading
-# on relational scalars is pointless if not wasteful. However, collections
-# that will always be accessed should always be eager loaded.
+# Loading plans declare, for each model, the relationships that its
+# serialization touches, i.e., those accessed by ``get_dict`` (and, where a
+# view returns it, ``get_full_dict``). Plans are keyed by action ('index',
+# 'search', 'show', 'history'); the 'default' plan covers any action without
+# its own entry and the 'minimal' action (``minimal_model``) loads nothing.
+#
+# A relationship path may be dotted, e.g., 'forms.enterer', and may be paired
+# with an explicit strategy, e.g., ('files', 'subquery'). Otherwise the
+# strategy follows from the relationship: scalars (many-to-one) are joined
+# into the main query, which neither multiplies its rows nor interferes with
+# LIMIT, while collections are loaded with one extra SELECT ... IN query each,
+# which avoids the cartesian product of joining several collections.
+#
+# Views can override the plans of their model via
+# ``ReadonlyResources.loading_plan``.
+
+# Maps strategy names to the names of the ``sqlalchemy.orm.Load`` methods
+# that apply them.
+LOADER_STRATEGIES = {
+    'joined': 'joinedload',
+    'selectin': 'selectinload',
+    'subquery': 'subqueryload',
+}
+
+FORM_RELATIONSHIPS = (
+    'elicitor', 'enterer', 'modifier', 'verifier', 'speaker',
+    'elicitation_method', 'syntactic_category', 'source',
+    'source.crossref_source', 'translations', 'files', 'tags')
+
+COLLECTION_RELATIONSHIPS = (
+    'speaker', 'source', 'source.crossref_source', 'elicitor', 'enterer',
+    'modifier', 'tags', 'files')
+
+
+def _nested(relationship, paths):
+    return tuple('%s.%s' % (relationship, path) for path in paths)
+
+
+LOADING_PLANS = {
+    'ApplicationSettings': {'default': (
+        'storage_orthography', 'input_orthography', 'output_orthography',
+        'unrestricted_users')},
+    # Collections are returned with their forms by ``get_full_dict`` when
+    # shown individually.
+    'Collection': {
+        'default': COLLECTION_RELATIONSHIPS,
+        'show': (COLLECTION_RELATIONSHIPS + ('forms',) +
+                 _nested('forms', FORM_RELATIONSHIPS))},
+    'Corpus': {'default': (
+        'enterer', 'modifier', 'form_search', 'tags', 'files')},
+    # A file's dict contains the full dicts of its forms.
+    'File': {'default': (
+        'enterer', 'elicitor', 'speaker', 'tags', 'parent_file', 'forms') +
+        _nested('forms', FORM_RELATIONSHIPS)},
+    'Form': {'default': FORM_RELATIONSHIPS},
+    'FormSearch': {'default': ('enterer',)},
+    'Job': {'default': ('enterer',)},
+    'Keyboard': {'default': ('enterer', 'modifier')},
+    'MorphemeLanguageModel': {'default': (
+        'corpus', 'vocabulary_morphology', 'enterer', 'modifier')},
+    'MorphologicalParser': {'default': (
+        'phonology', 'morphology', 'language_model', 'enterer', 'modifier')},
+    'Morphology': {'default': (
+        'lexicon_corpus', 'rules_corpus', 'enterer', 'modifier')},
+    'Phonology': {'default': ('enterer', 'modifier')},
+    'Source': {'default': ('file', 'crossref_source')},
+    'User': {'default': ('input_orthography', 'output_orthography')},
+}
+
+
+def get_loading_plan(model_name, action=None, plan=None):
+    """Return the relationship paths to eagerly load when ``action`` is
+    performed on ``model_name`` models. ``plan`` is an optional dict of
+    action-specific overrides of ``LOADING_PLANS[model_name]``.
+    """
+    if action == 'minimal':
+        return ()
+    plans = dict(LOADING_PLANS.get(model_name, {}))
+    plans.update(plan or {})
+    return tuple(path if isinstance(path, str) else tuple(path)
+                 for path in plans.get(action, plans.get('default', ())))
+
+
+@lru_cache(maxsize=None)
+def get_loader_options(model_name, paths):
+    """Return the SQLAlchemy loader options that eagerly load the relationship
+    ``paths`` of ``model_name`` models.
+    """
+    options = []
+    for path in paths:
+        strategy = None
+        if isinstance(path, tuple):
+            path, strategy = path
+        model_ = getattr(old_models, model_name)
+        option = Load(model_)
+        keys = path.split('.')
+        for index, key in enumerate(keys):
+            attribute = getattr(model_, key)
+            relationship = attribute.property
+            if strategy and index == len(keys) - 1:
+                name = strategy
+            elif relationship.uselist:
+                name = 'selectin'
+            else:
+                name = 'joined'
+            option = getattr(option, LOADER_STRATEGIES[name])(attribute)
+            model_ = relationship.mapper.class_
+        options.append(option)
+    return tuple(options)
 
 
-def get_eagerloader(model_name):
-    return locals().get('eagerload_' + model_name, lambda x: x)
+def get_eagerloader(model_name, action=None, plan=None):
+    """Return a function that adds the eager loading options of the loading
+    plan for ``action`` on ``model_name`` models to a query.
+    """
+    options = get_loader_options(
+        model_name, get_loading_plan(model_name, action, plan))
+    if not options:
+        return lambda query: query
+    return lambda query: query.options(*options)
 
 
 def eagerload_form(query):
-    return query.options(
-        #subqueryload(old_models.Form.elicitor),
-        subqueryload(old_models.Form.enterer),   # All forms *should* have enterers
-        subqueryload(old_models.Form.modifier),
-        #subqueryload(old_models.Form.verifier),
-        #subqueryload(old_models.Form.speaker),
-        #subqueryload(old_models.Form.elicitation_method),
-        #subqueryload(old_models.Form.syntactic_category),
-        #subqueryload(old_models.Form.source),
-        joinedload(old_models.Form.translations),
-        joinedload(old_models.Form.files),
-        joinedload(old_models.Form.tags))
+    return get_eagerloader('Form')(query)
 
 
 def eagerload_application_settings(query):
-    return query.options(
-        subqueryload(old_models.ApplicationSettings.input_orthography),
-        subqueryload(old_models.ApplicationSettings.output_orthography),
-        subqueryload(old_models.ApplicationSettings.storage_orthography)
-    )
+    return get_eagerloader('ApplicationSettings')(query)
 
 
 def eagerload_collection(query, eagerload_forms=False):
-    """Eagerload the relational attributes of collections most likely to
-    have values.
-    subqueryload(old_models.Collection.speaker),
-    subqueryload(old_models.Collection.elicitor),
-    subqueryload(old_models.Collection.source),
+    """Eagerload the relational attributes of collections (and, optionally,
+    those of their forms).
     """
-    if eagerload_forms:
-        return query.options(
-            subqueryload(old_models.Collection.enterer),
-            subqueryload(old_models.Collection.modifier),
-            subqueryload(old_models.Collection.forms),
-            joinedload(old_models.Collection.tags),
-            joinedload(old_models.Collection.files))
-    return query.options(
-        subqueryload(old_models.Collection.enterer),
-        subqueryload(old_models.Collection.modifier),
-        joinedload(old_models.Collection.tags),
-        joinedload(old_models.Collection.files))
+    return get_eagerloader(
+        'Collection', 'show' if eagerload_forms else None)(query)
 
 
 def eagerload_corpus(query, eagerload_forms=False):
-    """Eagerload the relational attributes of corpora most likely to have
-    values.
+    """Eagerload the relational attributes of corpora (and, optionally, their
+    forms).
     """
     if eagerload_forms:
-        return query.options(
-            subqueryload(old_models.Corpus.enterer),
-            subqueryload(old_models.Corpus.modifier),
-            subqueryload(old_models.Corpus.forms),
-            joinedload(old_models.Corpus.tags))
-    return query.options(
-        subqueryload(old_models.Corpus.enterer),
-        subqueryload(old_models.Corpus.modifier),
-        joinedload(old_models.Corpus.tags))
+        return get_eagerloader('Corpus', plan={'default': (
+            get_loading_plan('Corpus') + ('forms',) +
+            _nested('forms', FORM_RELATIONSHIPS))})(query)
+    return get_eagerloader('Corpus')(query)
 
 
 def eagerload_file(query):
-    return query.options(
-        subqueryload(old_models.File.enterer),
-        subqueryload(old_models.File.elicitor),
-        subqueryload(old_models.File.speaker),
-        subqueryload(old_models.File.parent_file),
-        joinedload(old_models.File.tags),
-        joinedload(old_models.File.forms))
-
-
-def eagerload_form_search(query):
-    # return query.options(subqueryload(old_models.FormSearch.enterer))
-    return query
+    return get_eagerloader('File')(query)
 
 
 def eagerload_phonology(query):
-    return query.options(
-        subqueryload(old_models.Phonology.enterer),
-        subqueryload(old_models.Phonology.modifier))
+    return get_eagerloader('Phonology')(query)
 
 
 def eagerload_morpheme_language_model(query):
-    return query.options(
-        subqueryload(old_models.MorphemeLanguageModel.corpus),
-        subqueryload(
-            old_models.MorphemeLanguageModel.vocabulary_morphology),
-        subqueryload(old_models.MorphemeLanguageModel.enterer),
-        subqueryload(old_models.MorphemeLanguageModel.modifier))
+    return get_eagerloader('MorphemeLanguageModel')(query)
 
 
 def eagerload_morphological_parser(query):
-    return query.options(
-        subqueryload(old_models.MorphologicalParser.phonology),
-        subqueryload(old_models.MorphologicalParser.morphology),
-        subqueryload(old_models.MorphologicalParser.language_model),
-        subqueryload(old_models.MorphologicalParser.enterer),
-        subqueryload(old_models.MorphologicalParser.modifier))
+    return get_eagerloader('MorphologicalParser')(query)
 
 
 def eagerload_morphology(query):
-    return query.options(
-        subqueryload(old_models.Morphology.lexicon_corpus),
-        subqueryload(old_models.Morphology.rules_corpus),
-        subqueryload(old_models.Morphology.enterer),
-        subqueryload(old_models.Morphology.modifier))
+    return get_eagerloader('Morphology')(query)
 
 
 def eagerload_user(query):
-    """
-    return query.options(
-        #subqueryload(old_models.User.input_orthography),
-        #subqueryload(old_models.User.output_orthography)
-    )
-    """
-    return query
+    return get_eagerloader('User')(query)
 
 
 def minimal(models_array):
@@ -173,30 +269,302 @@ def minimal_model(model):
 
 
 def get_paginated_query_results(query, paginator):
-    if 'count' not in paginator:
-        paginator['count'] = query.count()
+    """Return one offset-paginated page of ``query``'s results. The
+    paginator's ``count_mode`` determines how the matches are counted:
+
+    - ``exact``: by a ``COUNT`` query (the default);
+    - ``cached``: by a ``COUNT`` query whose result is reused until the tables
+      of the query's model change, cf. :func:`get_cached_count`;
+    - ``estimate``: by the RDBMS's query planner, cf.
+      :func:`estimate_count`; where no estimate is available, the count is
+      ``cached``;
+    - ``none``: not at all.
+
+    A client-supplied ``count`` is trusted, i.e., not counted (``provided``).
+    The paginator returned reports the ``count_mode`` used and whether there
+    is a next page (``has_more``); in the ``estimate`` and ``none`` modes the
+    latter is known by fetching the first row after the page (the rows of
+    queries with joins are not their models, so the page itself cannot be
+    fetched with an extra row).
+    """
+    count_mode = paginator.get('count_mode') or 'exact'
+    with slowsearch.phase('count'):
+        if 'count' in paginator:
+            count_mode = 'provided'
+        elif count_mode == 'exact':
+            paginator['count'] = count_query(query)
+        elif count_mode == 'cached':
+            paginator['count'] = get_cached_count(query)
+        elif count_mode == 'estimate':
+            paginator['count'] = estimate_count(query)
+            if paginator['count'] is None:
+                count_mode = 'cached'
+                paginator['count'] = get_cached_count(query)
     start, end = _get_start_and_end_from_paginator(paginator)
-    items = query.slice(start, end).all()
-    if paginator.get('minimal'):
-        items = minimal(items)
-    else:
-        items = [mod.get_dict() for mod in items]
+    with slowsearch.phase('page'):
+        items = query.slice(start, end).all()
+        if count_mode in ('estimate', 'none'):
+            paginator['has_more'] = bool(
+                _get_count_query(query).offset(end).limit(1).all())
+        else:
+            paginator['has_more'] = end < paginator['count']
+    paginator['count_mode'] = count_mode
+    with slowsearch.phase('serialize'):
+        if paginator.get('minimal'):
+            items = minimal(items)
+        else:
+            items = [mod.get_dict() for mod in items]
     return {
         'paginator': paginator,
         'items': items
     }
 
 
+def _get_count_query(query):
+    """Return ``query`` without the clauses that cannot change its count:
+    eager loading and ordering.
+    """
+    return query.enable_eagerloads(False).order_by(None)
+
+
+def count_query(query):
+    """Return the number of rows of ``query``, counted exactly."""
+    return _get_count_query(query).count()
+
+
+# The maximum number of counts memoized per process by get_cached_count.
+COUNT_CACHE_SIZE = 1000
+COUNT_CACHE = OrderedDict()
+COUNT_CACHE_LOCK = threading.Lock()
+
+
+def get_cached_count(query):
+    """Return the number of rows of ``query``, reusing the count of an
+    identical query (same SQL and parameters, same OLD) if none of the tables
+    of its model (and of their relations, cf.
+    ``old.lib.resultcache.get_dependent_tables``) have changed since. Counts
+    are not reused if the changes cannot be noticed (cf.
+    ``old.lib.resultcache.get_watermark``).
+    """
+    dbsession = query.session
+    count_query_ = _get_count_query(query)
+    compiled = count_query_.statement.compile(
+        dialect=dbsession.get_bind().dialect)
+    params = dict(compiled.params)
+    params.update(count_query_._params)  # pylint: disable=protected-access
+    key = (get_tenant_key(dbsession), str(compiled),
+           json.dumps(params, sort_keys=True, default=str))
+    watermark = get_watermark(dbsession, get_dependent_tables(
+        query.column_descriptions[0]['entity'].__name__))
+    if watermark is None:
+        return count_query_.count()
+    with COUNT_CACHE_LOCK:
+        cached_watermark, count = COUNT_CACHE.get(key, (None, None))
+        if count is not None and cached_watermark == watermark:
+            COUNT_CACHE.move_to_end(key)
+            return count
+    count = count_query_.count()
+    with COUNT_CACHE_LOCK:
+        COUNT_CACHE[key] = watermark, count
+        COUNT_CACHE.move_to_end(key)
+        while len(COUNT_CACHE) > COUNT_CACHE_SIZE:
+            COUNT_CACHE.popitem(last=False)
+    return count
+
+
+def estimate_count(query):
+    """Return the query planner's estimate of the number of rows of ``query``
+    or ``None`` if the RDBMS does not estimate them (SQLite's plans have no
+    row estimates). MySQL's estimate is that of the rows of the queried model's
+    table (``rows`` times the ``filtered`` percentage of ``EXPLAIN``).
+    """
+    dbsession = query.session
+    if dbsession.get_bind().dialect.name != 'mysql':
+        return None
+    # Imported here because the index advisor imports the query builder.
+    from old.lib.indexadvisor import Explain
+    count_query_ = _get_count_query(query)
+    table_name = inspect(
+        query.column_descriptions[0]['entity']).local_table.name
+    rows = dbsession.execute(
+        Explain(count_query_.statement),
+        count_query_._params).fetchall()  # pylint: disable=protected-access
+    for row in rows:
+        row = dict(row)
+        if row.get('table') == table_name and row.get('rows') is not None:
+            filtered = row.get('filtered')
+            filtered = 100.0 if filtered is None else float(filtered)
+            return int(round(int(row['rows']) * filtered / 100))
+    return None
+
+
 def add_pagination(query, paginator):
+    """Return the results of ``query`` as a list of models or, if
+    ``paginator`` requests a page, as ``{'paginator': ..., 'items': ...}``.
+    A paginator with a ``cursor`` key (the empty string for the first page)
+    is paginated by keyset; otherwise ``page`` is used as an offset.
+    """
+    slowsearch.record_query(query)
+    if (paginator and 'cursor' in paginator and
+            paginator.get('items_per_page') is not None):
+        paginator = CursorPaginatorSchema.to_python(paginator)
+        return get_cursor_paginated_query_results(query, paginator)
     if (paginator and paginator.get('page') is not None and
             paginator.get('items_per_page') is not None):
         # raises formencode.Invalid if paginator is invalid
         paginator = PaginatorSchema.to_python(paginator)
         return get_paginated_query_results(query, paginator)
     else:
+        with slowsearch.phase('page'):
+            items = query.all()
         if paginator and paginator.get('minimal'):
-            return minimal(query.all())
-        return query.all()
+            with slowsearch.phase('serialize'):
+                return minimal(items)
+        return items
+
+
+###############################################################################
+# Keyset (cursor) pagination
+###############################################################################
+
+# Instead of counting the matches and skipping ``(page - 1) * items_per_page``
+# rows (which gets linearly slower the deeper the page), keyset pagination
+# remembers the sort value and primary key of the last item returned and seeks
+# past it with a WHERE clause, so every page costs the same. The OLD always
+# orders by a single expression (cf. ``SQLAQueryBuilder._get_SQLA_order_by``);
+# the primary key is added as a tie-breaker.
+#
+# NULLs sort first in ascending and last in descending order in both MySQL and
+# SQLite, which is what the seek predicates below assume.
+
+
+def encode_cursor(signature, sort_value, last_id):
+    """Return an opaque, URL-safe cursor pointing just past the item with
+    primary key ``last_id`` and sort value ``sort_value``.
+    """
+    return base64.urlsafe_b64encode(json.dumps(
+        [signature, _encode_cursor_value(sort_value), last_id]
+    ).encode('utf8')).decode('ascii')
+
+
+def _encode_cursor_value(value):
+    if isinstance(value, datetime.datetime):
+        return {'datetime': value.isoformat()}
+    if isinstance(value, datetime.date):
+        return {'date': value.isoformat()}
+    return value
+
+
+def _decode_cursor_value(value):
+    if isinstance(value, dict):
+        if 'datetime' in value:
+            try:
+                return datetime.datetime.strptime(
+                    value['datetime'], '%Y-%m-%dT%H:%M:%S.%f')
+            except ValueError:
+                return datetime.datetime.strptime(
+                    value['datetime'], '%Y-%m-%dT%H:%M:%S')
+        if 'date' in value:
+            return datetime.datetime.strptime(
+                value['date'], '%Y-%m-%d').date()
+        raise ValueError('Unrecognized cursor value')
+    return value
+
+
+def get_keyset_order(query):
+    """Return ``(sort_expression, descending, primary_key)`` for ``query``,
+    based on the first expression in its ORDER BY clause (or its primary key
+    if it is unordered).
+    """
+    primary_key = inspect(
+        query.column_descriptions[0]['entity']).primary_key[0]
+    order_by = query._order_by  # pylint: disable=protected-access
+    if not order_by:
+        return primary_key, False, primary_key
+    clause = order_by[0]
+    if (isinstance(clause, UnaryExpression) and
+            clause.modifier in (operators.asc_op, operators.desc_op)):
+        return (clause.element, clause.modifier is operators.desc_op,
+                primary_key)
+    return clause, False, primary_key
+
+
+def get_cursor_signature(sort_expression, descending):
+    """Return a short digest of the ordering; a cursor is only valid for the
+    ordering that produced it.
+    """
+    direction = desc if descending else asc
+    return '%08x' % zlib.crc32(str(direction(sort_expression)).encode('utf8'))
+
+
+def get_seek_predicate(sort_expression, descending, primary_key, cursor):
+    """Return the WHERE clause that selects the rows that sort after the
+    cursor's (sort value, primary key) position.
+    """
+    value, last_id = cursor['value'], cursor['id']
+    if descending:
+        after_id = primary_key < last_id
+    else:
+        after_id = primary_key > last_id
+    if sort_expression.compare(primary_key):
+        return primary_key < value if descending else primary_key > value
+    if value is None:
+        if descending:
+            return and_(sort_expression.is_(None), after_id)
+        return or_(sort_expression.isnot(None),
+                   and_(sort_expression.is_(None), after_id))
+    if descending:
+        return or_(sort_expression < value,
+                   and_(sort_expression == value, after_id),
+                   sort_expression.is_(None))
+    return or_(sort_expression > value,
+               and_(sort_expression == value, after_id))
+
+
+def get_cursor_paginated_query_results(query, paginator):
+    """Return one keyset-paginated page of ``query``'s results. The
+    ``paginator`` returned has a ``next_cursor`` value (``None`` on the last
+    page) and, only if ``with_count`` was requested, a ``count``.
+    """
+    items_per_page = paginator['items_per_page']
+    cursor = paginator.pop('cursor')
+    sort_expression, descending, primary_key = get_keyset_order(query)
+    direction = desc if descending else asc
+    signature = get_cursor_signature(sort_expression, descending)
+    if paginator.get('with_count'):
+        with slowsearch.phase('count'):
+            paginator['count'] = count_query(query)
+    query = query.order_by(None).order_by(
+        direction(sort_expression), direction(primary_key))
+    if cursor:
+        if cursor['signature'] != signature:
+            raise Invalid('Invalid pagination cursor.', cursor, None,
+                          error_dict={'cursor': Invalid(
+                              'The pagination cursor does not match the'
+                              ' requested ordering.', cursor, None)})
+        query = query.filter(get_seek_predicate(
+            sort_expression, descending, primary_key, cursor))
+    with slowsearch.phase('page'):
+        rows = query.add_columns(sort_expression.label('keyset_value'))\
+            .limit(items_per_page + 1).all()
+    next_cursor = None
+    if len(rows) > items_per_page:
+        rows = rows[:items_per_page]
+        last_model, last_value = rows[-1]
+        next_cursor = encode_cursor(
+            signature, last_value, getattr(last_model, primary_key.key))
+    items = [row[0] for row in rows]
+    with slowsearch.phase('serialize'):
+        if paginator.get('minimal'):
+            items = minimal(items)
+        else:
+            items = [mod.get_dict() for mod in items]
+    paginator['cursor'] = cursor and cursor['token']
+    paginator['next_cursor'] = next_cursor
+    return {
+        'paginator': paginator,
+        'items': items
+    }
 
 
 def get_model_names():
@@ -236,6 +604,43 @@ def _filter_restricted_models_from_query(model_name, query, user):
     return query.filter(or_(enterer_condition, unrestricted_condition))
 
 
+def get_form_morpheme_rows(form_id, morpheme_break, morpheme_gloss,
+                            syntactic_category_string, morpheme_delimiters):
+    """Return the ``form_morpheme`` rows (as dicts) for a form with the
+    supplied morphological values. Words are split on whitespace and morphemes
+    on the morpheme delimiters, just as in the forms view's
+    ``_compile_morphemic_analysis``. Break, gloss and category morphemes are
+    aligned by position; where the analysis is inconsistent the missing values
+    are ``None``.
+    """
+    delimiters = [d for d in morpheme_delimiters if d]
+    if delimiters:
+        splitter = re.compile(
+            '[%s]' % ''.join(esc_RE_meta_chars(d) for d in delimiters)).split
+    else:
+        splitter = lambda word: [word]
+    max_length = old_models.FormMorpheme.max_length
+    def truncate(value):
+        return value if value is None else value[:max_length]
+    rows = []
+    for word_index, words in enumerate(zip_longest(
+            (morpheme_break or '').split(),
+            (morpheme_gloss or '').split(),
+            (syntactic_category_string or '').split())):
+        morphemes = [splitter(word) if word else [] for word in words]
+        for morpheme_index, (shape, gloss, category) in enumerate(
+                zip_longest(*morphemes)):
+            rows.append({
+                'form_id': form_id,
+                'word_index': word_index,
+                'morpheme_index': morpheme_index,
+                'shape': truncate(shape),
+                'gloss': truncate(gloss),
+                'category': truncate(category)
+            })
+    return rows
+
+
 class DBUtils:
     """Mixin for resource (view) classes (and anything with access to the
     request) that provides access to the database via a ``dbsession`` attribute.
@@ -248,15 +653,36 @@ class DBUtils:
         else:
             self.settings = {}
         self._current_app_set = None
-        self._foreign_word_transcriptions = None
+        self._tenant_data = None
+
+    @property
+    def tenant_data(self):
+        """The cached per-OLD data, cf. :mod:`old.lib.tenantcache`. They are
+        revalidated once per ``DBUtils`` instance and whenever this process
+        changes them.
+        """
+        if self._tenant_data is None or self._tenant_data.invalidated:
+            self._tenant_data = get_tenant_data(self.dbsession)
+            self._current_app_set = None
+        return self._tenant_data
+
+    @property
+    def app_settings(self):
+        """A read-only snapshot of the current application settings, or
+        ``None``. Prefer this to ``current_app_set`` unless the model itself
+        (e.g., its relations) is needed.
+        """
+        return self.tenant_data.app_set
 
     @property
     def current_app_set(self):
         """The ApplicationSettings model with the highest id is considered the
         current one.
         """
-        if not self._current_app_set:
-            self._current_app_set = self.get_current_app_set()
+        app_set_id = self.tenant_data.app_set_id
+        if not self._current_app_set and app_set_id:
+            self._current_app_set = self.dbsession.query(
+                old_models.ApplicationSettings).get(app_set_id)
         return self._current_app_set
 
     def get_current_app_set(self):
@@ -268,27 +694,29 @@ class DBUtils:
                 desc(old_models.ApplicationSettings.id)).first()
 
     def get_object_language_id(self):
-        return getattr(self.current_app_set, 'object_language_id', 'old')
+        return getattr(self.app_settings, 'object_language_id', 'old')
 
     def get_grammaticalities(self):
-        return getattr(self.current_app_set, 'grammaticalities_list', [])
+        return getattr(self.app_settings, 'grammaticalities_list', [])
 
     def get_morpheme_delimiters(self, type_='list'):
         """Return the morpheme delimiters from app settings as an object of
         type ``type_``."""
         if type_ == 'list':
-            return getattr(self.current_app_set, 'morpheme_delimiters_list', [])
-        return getattr(self.current_app_set, 'morpheme_delimiters', '')
+            return getattr(self.app_settings, 'morpheme_delimiters_list', [])
+        return getattr(self.app_settings, 'morpheme_delimiters', '')
 
-    def get_unrestricted_users(self):
-        """Return the list of unrestricted users in the current application
-        settings.
+    def get_unrestricted_user_ids(self):
+        """Return the set of the ids of the unrestricted users in the current
+        application settings.
         """
-        return getattr(self.current_app_set, 'unrestricted_users', [])
+        return self.tenant_data.unrestricted_user_ids
 
     def get_restricted_tag(self):
-        return self.dbsession.query(old_models.Tag).filter(
-            old_models.Tag.name == 'restricted').first()
+        return self._get_tag(self.tenant_data.restricted_tag_id)
+
+    def get_restricted_tag_id(self):
+        return self.tenant_data.restricted_tag_id
 
     def user_is_unrestricted(self, user):
         """Return True if the user is an administrator, unrestricted or there
@@ -296,9 +724,9 @@ class DBUtils:
         """
         if user.role == 'administrator':
             return True
-        if not self.get_restricted_tag():
+        if not self.get_restricted_tag_id():
             return True
-        if user in self.get_unrestricted_users():
+        if user.id in self.get_unrestricted_user_ids():
             return True
         return False
 
@@ -314,11 +742,15 @@ class DBUtils:
         return []
 
     def get_foreign_word_tag(self):
-        return self.dbsession.query(old_models.Tag).filter(
-            old_models.Tag.name=='foreign word').first()
+        return self._get_tag(self.tenant_data.foreign_word_tag_id)
 
     def get_foreign_word_tag_id(self):
-        return self.get_foreign_word_tag().id
+        return self.tenant_data.foreign_word_tag_id
+
+    def _get_tag(self, tag_id):
+        if tag_id:
+            return self.dbsession.query(old_models.Tag).get(tag_id)
+        return None
 
     @property
     def foreign_word_transcriptions(self):
@@ -329,33 +761,14 @@ class DBUtils:
         transcriptions (narrow phonetic, broad phonetic, orthographic,
         morphemic) of foreign words.
         """
-        if not self._foreign_word_transcriptions:
-            foreign_words = self.get_foreign_words()
-            foreign_word_narrow_phonetic_transcriptions = []
-            foreign_word_broad_phonetic_transcriptions = []
-            foreign_word_orthographic_transcriptions = []
-            foreign_word_morphemic_transcriptions = []
-            for fw in foreign_words:
-                if fw.narrow_phonetic_transcription:
-                    foreign_word_narrow_phonetic_transcriptions.append(
-                        fw.narrow_phonetic_transcription)
-                if fw.phonetic_transcription:
-                    foreign_word_broad_phonetic_transcriptions.append(
-                        fw.phonetic_transcription)
-                if fw.morpheme_break:
-                    foreign_word_morphemic_transcriptions.append(fw.morpheme_break)
-                foreign_word_orthographic_transcriptions.append(fw.transcription)
-            FWTrans = namedtuple('FWTrans', ['narrow_phonetic',
-                                             'broad_phonetic',
-                                             'orthographic',
-                                             'morpheme_break'])
-            self._foreign_word_transcriptions = FWTrans(
-                foreign_word_narrow_phonetic_transcriptions,
-                foreign_word_broad_phonetic_transcriptions,
-                foreign_word_orthographic_transcriptions,
-                foreign_word_morphemic_transcriptions
-            )
-        return self._foreign_word_transcriptions
+        return self.tenant_data.foreign_word_transcriptions
+
+    def get_transcription_inventory(self, type_):
+        """Return the ``Inventory`` of the current application settings for
+        transcriptions of type ``type_``, cf.
+        ``ApplicationSettings.get_transcription_inventory``.
+        """
+        return self.tenant_data.get_transcription_inventory(type_)
 
     ###########################################################################
     # Convenience getters for resource collections
@@ -463,11 +876,12 @@ class DBUtils:
                 self.dbsession.execute(table.delete())
         self.dbsession.flush()
 
-    def get_model_and_previous_versions(self, model_name, id_):
+    def get_model_and_previous_versions(self, model_name, id_, plan=None):
         """Return a model and its previous versions.
         :param str model_name: a model name, e.g., 'Form'
         :param str id_: the ``id`` or ``UUID`` value of the model whose history
             is requested.
+        :param dict plan: optional overrides of the model's loading plan.
         :returns: a tuple whose first element is the model and whose second
             element is a list of the model's backup models.
         """
@@ -475,8 +889,7 @@ class DBUtils:
         previous_versions = []
         try:
             id_ = int(id_)
-            # add eagerload function ...
-            model_ = get_eagerloader(model_name)(
+            model_ = get_eagerloader(model_name, 'history', plan)(
                 self.dbsession.query(getattr(old_models, model_name))).get(id_)
             if model_:
                 previous_versions = self.get_backups_by_UUID(model_name,
@@ -548,3 +961,80 @@ class DBUtils:
                 '([%s])' % ''.join([esc_RE_meta_chars(d) for d in
                                     morpheme_delimiters])).split
         return morpheme_splitter
+
+    ###########################################################################
+    # Form-morpheme inverted index
+    ###########################################################################
+
+    def index_form_morphemes(self, forms, morpheme_delimiters=None):
+        """(Re-)index the morphemes of ``forms``, an iterable of
+        ``(id, morpheme_break, morpheme_gloss, syntactic_category_string)``
+        tuples, in the ``form_morpheme`` table.
+        """
+        if morpheme_delimiters is None:
+            morpheme_delimiters = self.get_morpheme_delimiters()
+        forms = list(forms)
+        self.unindex_form_morphemes([form[0] for form in forms])
+        rows = []
+        for form in forms:
+            rows.extend(get_form_morpheme_rows(*form, morpheme_delimiters))
+        if rows:
+            self.dbsession.execute(
+                old_models.FormMorpheme.__table__.insert(), rows)
+
+    def unindex_form_morphemes(self, form_ids, chunk_size=500):
+        """Remove the ``form_morpheme`` rows of the forms with ``form_ids``."""
+        table = old_models.FormMorpheme.__table__
+        form_ids = list(form_ids)
+        for start in range(0, len(form_ids), chunk_size):
+            self.dbsession.execute(table.delete().where(
+                table.c.form_id.in_(form_ids[start:start + chunk_size])))
+
+    def rebuild_form_morpheme_index(self, chunk_size=1000):
+        """Rebuild the entire ``form_morpheme`` table, reading the forms in
+        id-ordered chunks. Returns the number of forms indexed.
+        """
+        form_table = old_models.Form.__table__
+        morpheme_delimiters = self.get_morpheme_delimiters()
+        self.dbsession.execute(old_models.FormMorpheme.__table__.delete())
+        last_id = 0
+        count = 0
+        while True:
+            forms = self.dbsession.execute(
+                select([form_table.c.id,
+                        form_table.c.morpheme_break,
+                        form_table.c.morpheme_gloss,
+                        form_table.c.syntactic_category_string])
+                .where(form_table.c.id > last_id)
+                .order_by(form_table.c.id)
+                .limit(chunk_size)).fetchall()
+            if not forms:
+                break
+            rows = []
+            for form in forms:
+                rows.extend(get_form_morpheme_rows(*form, morpheme_delimiters))
+            if rows:
+                self.dbsession.execute(
+                    old_models.FormMorpheme.__table__.insert(), rows)
+            last_id = forms[-1][0]
+            count += len(forms)
+        return count
+
+    def get_ids_of_forms_containing_morphemes(self, shapes=(), glosses=()):
+        """Return the sorted ids of all forms that contain a morpheme whose
+        shape is in ``shapes`` or whose gloss is in ``glosses``.
+        """
+        table = old_models.FormMorpheme.__table__
+        max_length = old_models.FormMorpheme.max_length
+        shapes = {shape[:max_length] for shape in shapes if shape}
+        glosses = {gloss[:max_length] for gloss in glosses if gloss}
+        conditions = []
+        if shapes:
+            conditions.append(table.c.shape.in_(shapes))
+        if glosses:
+            conditions.append(table.c.gloss.in_(glosses))
+        if not conditions:
+            return []
+        return [row[0] for row in self.dbsession.execute(
+            select([table.c.form_id]).where(or_(*conditions))
+            .distinct().order_by(table.c.form_id))]
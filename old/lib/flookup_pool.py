@@ -0,0 +1,257 @@
+# Copyright 2016 Joel Dunham
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""Pool of long-lived flookup co-processes.
+
+Applying a foma FST used to mean writing the inputs to a temporary file,
+writing a shell script that pipes that file into ``flookup``, running the
+script and then parsing the output file. For parsers and for the
+phonology/morphology apply views this meant reloading the (possibly very large)
+compiled binary on every request. This module keeps one ``flookup`` process
+alive per (binary path, direction) pair and talks to it over its stdin/stdout
+pipes.
+
+flookup echoes each input line as ``input<TAB>output`` lines followed by a
+blank line, so a batch of inputs is written in one go (from a helper thread, so
+that neither side can block on a full pipe) and the replies are read until one
+blank line per input has been seen.
+
+A process is (re)started when:
+
+- the binary's modification time changes (i.e., the FST was recompiled),
+- the process has died or a pipe has broken, or
+- it has sat idle for longer than ``idle_timeout`` seconds (idle processes are
+  evicted lazily whenever the pool is used).
+
+Any failure raises :class:`FlookupPoolError`; callers (cf.
+``FomaFST.apply``) fall back to the temporary file method in that case.
+"""
+
+import atexit
+import logging
+import os
+import select
+from subprocess import Popen, PIPE, DEVNULL
+import threading
+import time
+
+
+LOGGER = logging.getLogger(__name__)
+
+
+class FlookupPoolError(Exception):
+    pass
+
+
+class FlookupProcess(object):
+    """A single ``flookup`` co-process for one binary applied in one
+    direction.
+    """
+
+    def __init__(self, binary_path, direction, timeout=60):
+        self.binary_path = binary_path
+        self.direction = direction
+        self.timeout = timeout
+        self.mtime = os.path.getmtime(binary_path)
+        self.lock = threading.Lock()
+        self.last_used = time.time()
+        self._buffer = b''
+        cmd = ['flookup', '-b']
+        if direction != 'up':
+            cmd.append('-i')
+        cmd.append(binary_path)
+        try:
+            self.process = Popen(cmd, stdin=PIPE, stdout=PIPE,
+                                 stderr=DEVNULL, bufsize=0)
+        except OSError as error:
+            raise FlookupPoolError(
+                'Unable to start flookup: %s' % error)
+
+    def is_alive(self):
+        return self.process.poll() is None
+
+    def is_stale(self):
+        """Return ``True`` if the binary has been recompiled (or removed)
+        since this process was started.
+        """
+        try:
+            return os.path.getmtime(self.binary_path) != self.mtime
+        except OSError:
+            return True
+
+    def apply(self, inputs):
+        """Send ``inputs`` (a list of strings) to flookup and return the list
+        of raw ``input<TAB>output`` lines that it replies with.
+        """
+        self.last_used = time.time()
+        if not inputs:
+            return []
+        payload = ''.join('%s\n' % input_ for input_ in inputs).encode('utf8')
+        write_errors = []
+        writer = threading.Thread(
+            target=self._write, args=(payload, write_errors))
+        writer.daemon = True
+        writer.start()
+        try:
+            lines = self._read_replies(len(inputs))
+        except FlookupPoolError:
+            # Kill the process before joining the writer: a writer blocked on
+            # a full stdin pipe then fails at once instead of costing a
+            # second timeout.
+            self.close()
+            raise
+        finally:
+            writer.join(self.timeout)
+        if write_errors:
+            raise FlookupPoolError(
+                'Error writing to flookup: %s' % write_errors[0])
+        self.last_used = time.time()
+        return lines
+
+    def _write(self, payload, errors):
+        try:
+            self.process.stdin.write(payload)
+            self.process.stdin.flush()
+        except (OSError, ValueError) as error:
+            errors.append(error)
+
+    def _read_replies(self, count):
+        """Read output lines until ``count`` blank reply separators have been
+        seen.
+        """
+        lines = []
+        deadline = time.time() + self.timeout
+        fd = self.process.stdout.fileno()
+        while count:
+            newline = self._buffer.find(b'\n')
+            if newline == -1:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise FlookupPoolError('flookup timed out')
+                ready, _, _ = select.select([fd], [], [], remaining)
+                if not ready:
+                    raise FlookupPoolError('flookup timed out')
+                chunk = os.read(fd, 65536)
+                if not chunk:
+                    raise FlookupPoolError('flookup exited unexpectedly')
+                self._buffer += chunk
+                continue
+            line = self._buffer[:newline].decode('utf8', 'replace')
+            self._buffer = self._buffer[newline + 1:]
+            if line.strip():
+                lines.append(line)
+            else:
+                count -= 1
+        return lines
+
+    def close(self):
+        try:
+            self.process.stdin.close()
+        except Exception:
+            pass
+        try:
+            self.process.kill()
+            self.process.wait(1)
+        except Exception:
+            pass
+
+
+class FlookupPool(object):
+    """Registry of :class:`FlookupProcess` instances keyed by
+    ``(binary_path, direction)``.
+    """
+
+    def __init__(self, idle_timeout=600, timeout=60, batch_size=1000):
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self.batch_size = batch_size
+        self.processes = {}
+        self.lock = threading.Lock()
+
+    def apply(self, binary_path, direction, inputs):
+        """Apply the FST at ``binary_path`` to ``inputs`` in ``direction``
+        ('up' or 'down') and return the raw flookup output lines. A crashed
+        process is restarted and the batch retried once.
+        """
+        try:
+            return self._apply(binary_path, direction, inputs)
+        except FlookupPoolError as error:
+            LOGGER.warning('flookup co-process for %s failed (%s);'
+                           ' restarting it', binary_path, error)
+            self.evict(binary_path, direction)
+            return self._apply(binary_path, direction, inputs)
+
+    def _apply(self, binary_path, direction, inputs):
+        process = self.get_process(binary_path, direction)
+        lines = []
+        with process.lock:
+            for start in range(0, len(inputs), self.batch_size):
+                lines.extend(
+                    process.apply(inputs[start:start + self.batch_size]))
+        return lines
+
+    def get_process(self, binary_path, direction):
+        """Return a live, up-to-date flookup process for ``binary_path``,
+        starting (or restarting) one if necessary.
+        """
+        if not os.path.isfile(binary_path):
+            raise FlookupPoolError('There is no binary at %s' % binary_path)
+        key = (binary_path, direction)
+        with self.lock:
+            self._evict_idle()
+            process = self.processes.get(key)
+            if process and (not process.is_alive() or process.is_stale()):
+                LOGGER.info('Restarting stale flookup co-process for %s',
+                            binary_path)
+                self._close(key)
+                process = None
+            if not process:
+                process = FlookupProcess(binary_path, direction,
+                                         timeout=self.timeout)
+                self.processes[key] = process
+            return process
+
+    def evict(self, binary_path, direction=None):
+        """Close the process(es) for ``binary_path``; if ``direction`` is
+        ``None`` both directions are evicted.
+        """
+        directions = ('up', 'down') if direction is None else (direction,)
+        with self.lock:
+            for direction_ in directions:
+                self._close((binary_path, direction_))
+
+    def close_all(self):
+        with self.lock:
+            for key in list(self.processes):
+                self._close(key)
+
+    def _evict_idle(self):
+        now = time.time()
+        for key, process in list(self.processes.items()):
+            if (now - process.last_used > self.idle_timeout and
+                    not process.lock.locked()):
+                LOGGER.info('Evicting idle flookup co-process for %s', key[0])
+                self._close(key)
+
+    def _close(self, key):
+        process = self.processes.pop(key, None)
+        if process:
+            process.close()
+
+    def __len__(self):
+        return len(self.processes)
+
+
+FLOOKUP_POOL = FlookupPool()
+atexit.register(FLOOKUP_POOL.close_all)
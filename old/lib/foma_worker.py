@@ -12,48 +12,36 @@
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
 
-"""This module contains some multithreading worker and queue logic plus the
-functionality -- related to foma compilation ang LM estimation -- that the
-worther thread initiates.
-
-The the foma worker compiles foma FST phonology, morphology and morphophonology
-scripts and estimates morpheme language models.  Having a worker perform these
-tasks in a separate thread from that processing the HTTP request allows us to
-immediately respond to the user.
-
-The foma worker can only run a callable that is a global in
-:mod:`old.lib.foma_worker` and which takes keyword
-arguments.  Example usage::
-
-    from old.lib.foma_worker import FOMA_WORKER_Q
-    FOMA_WORKER_Q.put({
-        'id': h.generate_salt(),
-        'func': 'compile_foma_script',
-        'args': {
-            'model_name': 'Phonology',
-            'model_id': phonology.id,
-            'script_dir_path': phonology_dir_path,
-            'user_id': session['user'].id,
-            'verification_string': 'defined phonology: ',
-            'timeout': h.phonology_compile_timeout
-        }
-    })
-
-Cf. http://www.chrismoos.com/2009/03/04/pylons-worker-threads.
-
-For an introduction to Python threading, see
-http://www.ibm.com/developerworks/aix/library/au-threadingpython/.
+"""The handlers of the background jobs related to foma compilation and LM
+estimation (plus the morpheme references rebuild and the writing of corpus
+files), cf. :mod:`old.lib.jobs`.
+
+Compiling foma FST phonology, morphology and morphophonology scripts and
+estimating morpheme language models can take a long time. Having the job
+scheduler's worker threads perform these tasks allows us to immediately
+respond to the user. Each handler takes the job's arguments plus the
+``settings`` of the job's OLD as keyword arguments and returns a
+JSON-serializable summary of what it did, which is stored as the job's result.
+Example usage::
+
+    from old.lib.jobs import enqueue_job
+    enqueue_job(self.request, 'compile_phonology', {
+        'phonology_id': phonology.id,
+        'user_id': self.logged_in_user.id,
+        'timeout': oldc.PHONOLOGY_COMPILE_TIMEOUT
+    }, user_id=self.logged_in_user.id)
 """
 
 import logging
-import queue
-import threading
 from uuid import uuid4
 
 from sqlalchemy.orm import scoped_session
 
 import old.lib.constants as oldc
+from old.lib.corpusexport import export_corpus_file
+from old.lib.jobs import get_engine, job_handler
 import old.lib.helpers as h
+from old.lib.morpheme_references import MorphemeReferencesRebuild
 import old.models as old_models
 from old.models.morphologicalparser import Cache
 
@@ -65,43 +53,13 @@ LOGGER.addHandler(HANDLER)
 LOGGER.setLevel(logging.DEBUG)
 
 
-################################################################################
-# WORKER THREAD & QUEUE
-################################################################################
-
-
-FOMA_WORKER_Q = queue.Queue(1)
-
-
-class FomaWorkerThread(threading.Thread):
-    """Define the foma worker."""
-
-    def run(self):
-        while True:
-            msg = FOMA_WORKER_Q.get()
-            try:
-                LOGGER.debug('FomaWorkerThread trying to call %s',
-                             msg.get('func'))
-                globals()[msg.get('func')](**msg.get('args'))
-            except Exception as error:
-                LOGGER.warning('Unable to process in worker thread: %s %s',
-                               error.__class__.__name__, error)
-            FOMA_WORKER_Q.task_done()
-
-
-def start_foma_worker():
-    """Called in ``main`` of :mod:`old.__init__.py`."""
-    foma_worker = FomaWorkerThread()
-    foma_worker.setDaemon(True)
-    foma_worker.start()
-    foma_worker2 = FomaWorkerThread()
-    foma_worker2.setDaemon(True)
-    foma_worker2.start()
-
-
 def get_dbsession_from_settings(settings):
+    """Return a new session factory for the OLD configured in ``settings``.
+    The factory's sessions are independent of those of the request handling
+    threads but they share the OLD's engine with all other jobs.
+    """
     return scoped_session(
-        old_models.get_session_factory(old_models.get_engine(settings)))
+        old_models.get_session_factory(get_engine(settings)))
 
 
 def get_local_logger():
@@ -116,6 +74,7 @@ def get_local_logger():
 ################################################################################
 
 
+@job_handler('compile_phonology')
 def compile_phonology(**kwargs):
     """Compile the foma script of a phonology and save it to the db with values
     that indicate compilation success.
@@ -127,9 +86,12 @@ def compile_phonology(**kwargs):
         phonology.compile(kwargs['timeout'])
         phonology.datetime_modified = h.now()
         phonology.modifier_id = kwargs['user_id']
+        result = {'compile_succeeded': phonology.compile_succeeded,
+                  'compile_message': phonology.compile_message}
     finally:
         dbsession.commit()
         dbsession.close()
+    return result
 
 
 ################################################################################
@@ -137,6 +99,7 @@ def compile_phonology(**kwargs):
 ################################################################################
 
 
+@job_handler('generate_and_compile_morphology')
 def generate_and_compile_morphology(**kwargs):
     """Generate a foma script for a morphology and (optionally) compile it.
     :param int kwargs['morphology_id']: id of a morphology.
@@ -165,9 +128,13 @@ def generate_and_compile_morphology(**kwargs):
         morphology.generate_attempt = str(uuid4())
         morphology.modifier_id = kwargs['user_id']
         morphology.datetime_modified = h.now()
+        result = {'generate_attempt': morphology.generate_attempt,
+                  'compile_succeeded': morphology.compile_succeeded,
+                  'compile_message': morphology.compile_message}
     finally:
         dbsession.commit()
         dbsession.close()
+    return result
 
 
 ################################################################################
@@ -175,6 +142,7 @@ def generate_and_compile_morphology(**kwargs):
 ################################################################################
 
 
+@job_handler('generate_language_model')
 def generate_language_model(**kwargs):
     """Write the requisite files (corpus, vocab, ARPA, LMTrie) of a morpheme LM
     to disk.
@@ -182,8 +150,8 @@ def generate_language_model(**kwargs):
         LM.
     :param int/float kwargs['timeout']: seconds to allow for ARPA file creation.
     :param str kwargs['user_id']: ``id`` value of an OLD user.
-    :returns: ``None``; side-effect is to change relevant attributes of LM
-        object.
+    :returns: the outcome of the generation; side-effect is to change
+        relevant attributes of LM object.
     """
     try:
         dbsession = get_dbsession_from_settings(kwargs['settings'])()
@@ -226,11 +194,16 @@ def generate_language_model(**kwargs):
         langmod.generate_attempt = str(uuid4())
         langmod.modifier_id = kwargs['user_id']
         langmod.datetime_modified = h.now()
+        result = {'generate_attempt': langmod.generate_attempt,
+                  'generate_succeeded': langmod.generate_succeeded,
+                  'generate_message': langmod.generate_message}
     finally:
         dbsession.commit()
         dbsession.close()
+    return result
 
 
+@job_handler('compute_perplexity')
 def compute_perplexity(**kwargs):
     """Evaluate the LM by attempting to calculate its perplexity and changing
     some attribute values to reflect the attempt.
@@ -256,15 +229,20 @@ def compute_perplexity(**kwargs):
         langmod.perplexity_attempt = str(uuid4())
         langmod.modifier_id = kwargs['user_id']
         langmod.datetime_modified = h.now()
+        result = {'perplexity_attempt': langmod.perplexity_attempt,
+                  'perplexity_computed': langmod.perplexity_computed,
+                  'perplexity': langmod.perplexity}
     finally:
         dbsession.commit()
         dbsession.close()
+    return result
 
 
 ################################################################################
 # MORPHOLOGICAL PARSER (MORPHOPHONOLOGY)
 ################################################################################
 
+@job_handler('generate_and_compile_parser')
 def generate_and_compile_parser(**kwargs):
     """Write the parser's morphophonology FST script to file and compile it if
     ``compile_`` is True.  Generate the language model and pickle it.
@@ -286,6 +264,49 @@ def generate_and_compile_parser(**kwargs):
         if parser.changed:
             parser.cache.clear(persist=True)
         dbsession.add(parser)
+        result = {'generate_succeeded': parser.generate_succeeded,
+                  'generate_message': parser.generate_message,
+                  'compile_succeeded': parser.compile_succeeded,
+                  'compile_message': parser.compile_message}
     finally:
         dbsession.commit()
         dbsession.close()
+    return result
+
+
+################################################################################
+# MORPHEME REFERENCES
+################################################################################
+
+@job_handler('rebuild_morpheme_references')
+def rebuild_morpheme_references(**kwargs):
+    """Recompile the morphological analysis-related attributes of every form,
+    cf. :mod:`old.lib.morpheme_references`.
+    """
+    dbsession = get_dbsession_from_settings(kwargs['settings'])()
+    try:
+        status = MorphemeReferencesRebuild(
+            dbsession, kwargs['settings'], kwargs['user_id']).run()
+    finally:
+        dbsession.close()
+    return {key: status.get(key)
+            for key in ('processed', 'updated', 'total', 'resumed')}
+
+
+################################################################################
+# CORPUS FILES
+################################################################################
+
+@job_handler('write_corpus_file')
+def write_corpus_file(**kwargs):
+    """Write a corpus to the file of a corpus file model, recording the
+    export's progress on the model, cf. :mod:`old.lib.corpusexport`.
+    """
+    dbsession = get_dbsession_from_settings(kwargs['settings'])()
+    try:
+        result = export_corpus_file(dbsession, kwargs['settings'],
+                                    kwargs['corpus_file_id'],
+                                    kwargs['user_id'])
+    finally:
+        dbsession.close()
+    return {key: result[key] for key in ('filename', 'forms_written')}
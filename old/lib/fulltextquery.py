@@ -0,0 +1,206 @@
+# Copyright 2016 Joel Dunham
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""The query language of the ``match`` relation of ``SQLAQueryBuilder``,
+which searches the full-text indexes of :mod:`old.models.fulltext`.
+
+A query is a boolean combination of terms:
+
+- ``dog`` matches the word "dog";
+- ``dog*`` matches the words that begin with "dog";
+- ``"the dog"`` matches the phrase "the dog" (and ``"the dog"*`` the
+  phrases that begin with "the" followed by a word beginning with "dog");
+- ``a b`` and ``a AND b`` match the values that match both ``a`` and ``b``;
+- ``a OR b`` matches the values that match either;
+- ``a NOT b`` matches the values that match ``a`` but not ``b``; and
+- parentheses group, e.g., ``(dog OR cat) NOT "hot dog"``.
+
+``NOT`` binds tighter than ``AND``, which binds tighter than ``OR``, as in
+SQLite's FTS5. A parsed query is rendered as an FTS5 query
+(:func:`to_fts5`) or as a MySQL boolean mode query
+(:func:`to_mysql_boolean`). Note that MySQL ignores the words shorter than
+its minimum token size and its stopwords, and does not support prefixes of
+words that contain punctuation.
+"""
+
+import re
+
+
+TOKEN_RE = re.compile(r'\s*(?:"([^"]*)"(\*?)|(\()|(\))|([^\s()"]+))')
+OPERATORS = ('AND', 'OR', 'NOT')
+MYSQL_WORD_RE = re.compile(r'^\w+$')
+
+
+class FullTextQueryError(Exception):
+    pass
+
+
+def tokenize(query):
+    """Return the tokens of ``query``: ``('term', text, prefix)``,
+    ``('phrase', text, prefix)``, ``('(',)``, ``(')',)`` or
+    ``('op', operator)`` tuples.
+    """
+    tokens = []
+    position = 0
+    query = query.strip()
+    while position < len(query):
+        match = TOKEN_RE.match(query, position)
+        if match is None:
+            raise FullTextQueryError('Unbalanced quotation marks')
+        phrase, phrase_prefix, open_, close, word = match.groups()
+        if phrase is not None:
+            if not phrase.strip():
+                raise FullTextQueryError('Empty phrase')
+            tokens.append(('phrase', phrase, bool(phrase_prefix)))
+        elif open_:
+            tokens.append(('(',))
+        elif close:
+            tokens.append((')',))
+        elif word in OPERATORS:
+            tokens.append(('op', word))
+        else:
+            text = word.rstrip('*')
+            if not text:
+                raise FullTextQueryError('A prefix must not be empty')
+            tokens.append(('term', text, word != text))
+        position = match.end()
+    return tokens
+
+
+def parse(query):
+    """Return the tree of the full-text query ``query``: a term or phrase
+    token, or an ``('and', children)``, ``('or', children)`` or
+    ``('not', positive, negatives)`` tuple. Raise
+    :class:`FullTextQueryError` if ``query`` is invalid.
+    """
+    if not isinstance(query, str):
+        raise FullTextQueryError('A full-text query must be a string')
+    tokens = tokenize(query)
+    if not tokens:
+        raise FullTextQueryError('Empty query')
+    tree, position = _parse_or(tokens, 0)
+    if position < len(tokens):
+        raise FullTextQueryError('Unexpected %s' % _describe(tokens[position]))
+    return tree
+
+
+def _describe(token):
+    if token[0] in ('term', 'phrase', 'op'):
+        return '"%s"' % token[1]
+    return '"%s"' % token[0]
+
+
+def _parse_or(tokens, position):
+    children = []
+    while True:
+        child, position = _parse_and(tokens, position)
+        children.append(child)
+        if position < len(tokens) and tokens[position] == ('op', 'OR'):
+            position += 1
+            continue
+        break
+    return (children[0] if len(children) == 1 else ('or', children)), position
+
+
+def _parse_and(tokens, position):
+    children = []
+    while True:
+        child, position = _parse_not(tokens, position)
+        children.append(child)
+        if position >= len(tokens):
+            break
+        if tokens[position] == ('op', 'AND'):
+            position += 1
+        elif tokens[position][0] not in ('term', 'phrase', '('):
+            break
+    return (children[0] if len(children) == 1 else ('and', children)), position
+
+
+def _parse_not(tokens, position):
+    positive, position = _parse_primary(tokens, position)
+    negatives = []
+    while position < len(tokens) and tokens[position] == ('op', 'NOT'):
+        negative, position = _parse_primary(tokens, position + 1)
+        negatives.append(negative)
+    if negatives:
+        return ('not', positive, negatives), position
+    return positive, position
+
+
+def _parse_primary(tokens, position):
+    if position >= len(tokens):
+        raise FullTextQueryError('Unexpected end of query')
+    token = tokens[position]
+    if token[0] in ('term', 'phrase'):
+        return token, position + 1
+    if token[0] == '(':
+        tree, position = _parse_or(tokens, position + 1)
+        if position >= len(tokens) or tokens[position][0] != ')':
+            raise FullTextQueryError('Unbalanced parentheses')
+        return tree, position + 1
+    raise FullTextQueryError('Unexpected %s' % _describe(token))
+
+
+###############################################################################
+# Renderers
+###############################################################################
+
+def to_fts5(tree):
+    """Return the FTS5 query of ``tree``. Every term is quoted so that
+    punctuation in it is tokenized as FTS5 tokenizes the indexed values.
+    """
+    kind = tree[0]
+    if kind in ('term', 'phrase'):
+        quoted = '"%s"' % tree[1].replace('"', '""')
+        return quoted + ' *' if tree[2] else quoted
+    if kind == 'not':
+        return ' NOT '.join(_group(child, to_fts5)
+                            for child in [tree[1]] + tree[2])
+    return (' %s ' % kind.upper()).join(
+        _group(child, to_fts5) for child in tree[1])
+
+
+def to_mysql_boolean(tree):
+    """Return the MySQL boolean mode query of ``tree``: the children of
+    ``AND`` are required (``+``), those of ``OR`` optional and the negated
+    terms of ``NOT`` excluded (``-``).
+    """
+    kind = tree[0]
+    if kind in ('term', 'phrase'):
+        if kind == 'term' and MYSQL_WORD_RE.match(tree[1]):
+            return tree[1] + '*' if tree[2] else tree[1]
+        return '"%s"' % tree[1].replace('"', ' ')
+    if kind == 'not':
+        return ' '.join(['+' + _group(tree[1], to_mysql_boolean)] + [
+            '-' + _group(child, to_mysql_boolean) for child in tree[2]])
+    if kind == 'and':
+        return ' '.join('+' + _group(child, to_mysql_boolean)
+                        for child in tree[1])
+    return ' '.join(_group(child, to_mysql_boolean) for child in tree[1])
+
+
+def _group(tree, render):
+    if tree[0] in ('and', 'or', 'not'):
+        return '(%s)' % render(tree)
+    return render(tree)
+
+
+def get_match_query(query, RDBMSName):
+    """Return the full-text query ``query`` in the syntax of ``RDBMSName``
+    (``'sqlite'`` or ``'mysql'``).
+    """
+    tree = parse(query)
+    if RDBMSName == 'mysql':
+        return to_mysql_boolean(tree)
+    return to_fts5(tree)
@@ -0,0 +1,340 @@
+# Copyright 2016 Joel Dunham
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""Index advisor: replay the search queries that ``SQLAQueryBuilder`` has
+logged (cf. ``SQLAQueryBuilder.QUERY_LOGGER``) against an OLD's database,
+ask the RDBMS (MySQL or SQLite) how it would execute them and report
+
+- the indexes that the models declare but that the database lacks,
+- the tables that are scanned in full, together with the filtered columns of
+  those tables that no index starts with (i.e., candidate missing indexes),
+  and
+- the indexes of the scanned tables that no replayed query uses.
+
+Example usage::
+
+    entries = parse_query_log(open('old.log'))
+    report = advise(dbsession, entries, settings)
+    print(format_report(report))
+
+See also ``old/scripts/index_advisor.py``, which does the above from the
+command line.
+"""
+
+from collections import Counter
+import json
+import logging
+import re
+
+from sqlalchemy import inspect
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.orm.properties import RelationshipProperty
+from sqlalchemy.sql.expression import ClauseElement, Executable
+
+from old.lib.SQLAQueryBuilder import (
+    OLDSearchParseError,
+    QUERY_LOG_MARKER,
+    QUERY_LOGGER,
+    SQLAQueryBuilder
+)
+import old.models as old_models
+from old.models.meta import Base
+
+
+LOGGER = logging.getLogger(__name__)
+
+# Relations that a B-tree index on the filtered column can serve.
+INDEXABLE_RELATIONS = ('=', '<', '<=', '>', '>=', 'in')
+
+SQLITE_PLAN_RE = re.compile(
+    r'^(?P<op>SCAN|SEARCH) (?:TABLE )?(?P<table>\S+)(?: AS (?P<alias>\S+))?'
+    r'(?: USING (?:COVERING |AUTOMATIC (?:COVERING |PARTIAL )*)?INDEX'
+    r' (?P<index>\S+))?')
+
+
+class Explain(Executable, ClauseElement):
+    """An ``EXPLAIN`` (MySQL) or ``EXPLAIN QUERY PLAN`` (SQLite) of a select
+    statement.
+    """
+
+    def __init__(self, statement):
+        self.statement = statement
+
+
+@compiles(Explain)
+def _compile_explain(element, compiler, **kwargs):
+    return 'EXPLAIN %s' % compiler.process(element.statement, **kwargs)
+
+
+@compiles(Explain, 'sqlite')
+def _compile_explain_sqlite(element, compiler, **kwargs):
+    return 'EXPLAIN QUERY PLAN %s' % compiler.process(
+        element.statement, **kwargs)
+
+
+def parse_query_log(lines):
+    """Return a ``Counter`` of the ``(model_name, query_json)`` pairs logged
+    by ``SQLAQueryBuilder`` in ``lines``, e.g., the lines of an OLD log file.
+    """
+    entries = Counter()
+    for line in lines:
+        _, marker, logged = line.partition(QUERY_LOG_MARKER)
+        if not marker:
+            continue
+        try:
+            model_name, query = logged.strip().split(' ', 1)
+            json.loads(query)
+        except ValueError:
+            LOGGER.warning('Ignoring an unparseable query log line: %s',
+                           line.strip())
+            continue
+        entries[(model_name, query)] += 1
+    return entries
+
+
+def get_existing_indexes(connection):
+    """Return a dict from the names of the model tables that exist in the
+    database of ``connection`` to dicts from the names of their indexes to
+    the lists of the columns indexed.
+    """
+    inspector = inspect(connection)
+    table_names = set(inspector.get_table_names())
+    return {
+        table_name: {index['name']: index['column_names']
+                     for index in inspector.get_indexes(table_name)}
+        for table_name in Base.metadata.tables if table_name in table_names}
+
+
+def get_missing_declared_indexes(connection, existing=None):
+    """Return the ``Index`` objects that the models declare on existing
+    tables but that the database of ``connection`` lacks.
+    """
+    if existing is None:
+        existing = get_existing_indexes(connection)
+    missing = []
+    for table in Base.metadata.sorted_tables:
+        if table.name not in existing:
+            continue
+        for index in sorted(table.indexes, key=lambda index: index.name):
+            if index.name not in existing[table.name]:
+                missing.append(index)
+    return missing
+
+
+def _get_table_name(name):
+    """Return the name of the model table that ``name``, a table name or a
+    SQLAlchemy alias thereof (e.g., ``translation_1``), refers to, or
+    ``None``.
+    """
+    tables = Base.metadata.tables
+    if name in tables:
+        return name
+    name = re.sub(r'_\d+$', '', name)
+    if name in tables:
+        return name
+    return None
+
+
+def parse_sqlite_plan(rows):
+    """Return the steps of a SQLite query plan as ``(table, index, scan)``
+    triples; ``scan`` is true if the whole table is read.
+    """
+    steps = []
+    for row in rows:
+        match = SQLITE_PLAN_RE.match(row[-1])
+        if not match:
+            continue
+        table = _get_table_name(match.group('alias') or match.group('table'))
+        if table is None:
+            continue
+        index = match.group('index')
+        steps.append((table, index,
+                      match.group('op') == 'SCAN' and index is None))
+    return steps
+
+
+def parse_mysql_plan(rows):
+    """Return the steps of a MySQL query plan as ``(table, index, scan)``
+    triples; ``scan`` is true if the whole table is read.
+    """
+    steps = []
+    for row in rows:
+        row = dict(row)
+        table = _get_table_name(row.get('table') or '')
+        if table is None:
+            continue
+        index = row.get('key')
+        if index == 'PRIMARY':
+            index = None
+        steps.append((table, index, row.get('type') == 'ALL'))
+    return steps
+
+
+def explain(connection, statement):
+    """Return the steps of the plan of ``statement`` (cf.
+    :func:`parse_sqlite_plan`).
+    """
+    rows = connection.execute(Explain(statement)).fetchall()
+    if connection.dialect.name == 'sqlite':
+        return parse_sqlite_plan(rows)
+    return parse_mysql_plan(rows)
+
+
+def _iter_filter_leaves(filter_):
+    if not isinstance(filter_, list) or not filter_:
+        return
+    if filter_[0] in ('and', 'or'):
+        for operand in (filter_[1] if len(filter_) > 1 else []):
+            yield from _iter_filter_leaves(operand)
+    elif filter_[0] == 'not':
+        if len(filter_) > 1:
+            yield from _iter_filter_leaves(filter_[1])
+    elif len(filter_) in (4, 5):
+        yield filter_
+
+
+def get_filter_columns(query):
+    """Return the set of ``(table, column)`` pairs that the filter of
+    ``query`` (a Python search query) compares with an indexable relation.
+    """
+    columns = set()
+    for leaf in _iter_filter_leaves(query.get('filter')):
+        model = getattr(old_models, str(leaf[0]), None)
+        table = getattr(model, '__table__', None)
+        if table is None:
+            continue
+        if len(leaf) == 5:
+            prop = getattr(getattr(model, leaf[1], None), 'property', None)
+            if not isinstance(prop, RelationshipProperty):
+                continue
+            table = prop.mapper.class_.__table__
+            column, relation = leaf[2], leaf[3]
+        else:
+            column, relation = leaf[1], leaf[2]
+        if relation in INDEXABLE_RELATIONS and column in table.c:
+            columns.add((table.name, column))
+    return columns
+
+
+def advise(dbsession, entries, settings=None):
+    """Replay the logged queries in ``entries`` (cf. :func:`parse_query_log`)
+    on the database of ``dbsession`` and return a report dict with the keys
+
+    - ``queries``, ``replayed`` and ``failed``: the numbers of distinct
+      queries logged, replayed and not replayable (e.g., invalid),
+    - ``declared_missing``: ``(table, index, columns)`` triples of declared
+      but absent indexes,
+    - ``scans``: a dict from table names to the numbers of (logged, not
+      distinct) queries that scan them in full,
+    - ``missing``: ``(table, column, count)`` triples of the filtered columns
+      of fully scanned tables that no index starts with,
+    - ``used``: a dict from index names to the numbers of queries using them,
+      and
+    - ``unused``: ``(table, index, columns)`` triples of the indexes of the
+      tables in the replayed plans that no replayed query uses.
+    """
+    connection = dbsession.connection()
+    existing = get_existing_indexes(connection)
+    leading_columns = {
+        (table_name, columns[0])
+        for table_name, indexes in existing.items()
+        for columns in indexes.values() if columns}
+    scans = Counter()
+    missing = Counter()
+    used = Counter()
+    planned_tables = set()
+    replayed = failed = 0
+    # Replaying must not log the queries again.
+    level = QUERY_LOGGER.level
+    QUERY_LOGGER.setLevel(logging.WARNING)
+    try:
+        for (model_name, query_json), count in sorted(entries.items()):
+            query = json.loads(query_json)
+            try:
+                statement = SQLAQueryBuilder(
+                    dbsession, model_name=model_name, settings=settings
+                ).get_SQLA_query(query).statement
+                steps = explain(connection, statement)
+            except (OLDSearchParseError, SQLAlchemyError, AttributeError,
+                    TypeError) as error:
+                LOGGER.warning('Unable to replay %s query %s: %s', model_name,
+                               query_json, error)
+                failed += 1
+                continue
+            replayed += 1
+            filter_columns = get_filter_columns(query)
+            scanned = set()
+            for table_name, index, scan in steps:
+                planned_tables.add(table_name)
+                if index:
+                    used[index] += count
+                if scan:
+                    scanned.add(table_name)
+            for table_name in scanned:
+                scans[table_name] += count
+            for table_name, column in filter_columns:
+                if (table_name in scanned and
+                        (table_name, column) not in leading_columns):
+                    missing[(table_name, column)] += count
+    finally:
+        QUERY_LOGGER.setLevel(level)
+    return {
+        'queries': len(entries),
+        'replayed': replayed,
+        'failed': failed,
+        'declared_missing': [
+            (index.table.name, index.name,
+             [column.name for column in index.columns])
+            for index in get_missing_declared_indexes(connection, existing)],
+        'scans': dict(scans),
+        'missing': [(table_name, column, count) for (table_name, column), count
+                    in missing.most_common()],
+        'used': dict(used),
+        'unused': [
+            (table_name, index_name, columns)
+            for table_name in sorted(planned_tables)
+            for index_name, columns in sorted(
+                existing.get(table_name, {}).items())
+            if index_name not in used]}
+
+
+def format_report(report):
+    """Return the report returned by :func:`advise` as text."""
+    lines = ['Replayed %(replayed)d of %(queries)d distinct queries'
+             ' (%(failed)d failed).' % report]
+    if report['declared_missing']:
+        lines.append('Indexes declared by the models but missing from the'
+                     ' database:')
+        lines.extend('  %s.%s (%s)' % (table_name, index_name,
+                                       ', '.join(columns))
+                     for table_name, index_name, columns
+                     in report['declared_missing'])
+    if report['scans']:
+        lines.append('Full table scans (queries):')
+        lines.extend('  %s: %d' % item for item in sorted(
+            report['scans'].items(), key=lambda item: -item[1]))
+    if report['missing']:
+        lines.append('Candidate missing indexes (queries):')
+        lines.extend('  %s.%s: %d' % item for item in report['missing'])
+    if report['used']:
+        lines.append('Indexes used (queries):')
+        lines.extend('  %s: %d' % item for item in sorted(
+            report['used'].items(), key=lambda item: -item[1]))
+    if report['unused']:
+        lines.append('Unused indexes of the tables queried:')
+        lines.extend('  %s.%s (%s)' % (table_name, index_name,
+                                       ', '.join(columns))
+                     for table_name, index_name, columns in report['unused'])
+    return '\n'.join(lines)
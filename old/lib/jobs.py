@@ -0,0 +1,460 @@
+# Copyright 2016 Joel Dunham
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""Durable background job scheduler.
+
+Long-running tasks (foma compilation, LM estimation, parser generation, the
+morpheme references rebuild) are recorded as rows of the ``job`` table of the
+OLD that requested them and are run by the worker threads of a
+:class:`JobScheduler`. A view enqueues a job within its own transaction::
+
+    from old.lib.jobs import enqueue_job
+    job = enqueue_job(self.request, 'compile_phonology',
+                      {'phonology_id': phonology.id, 'timeout': 30},
+                      user_id=self.logged_in_user.id)
+
+and the scheduler is woken up once the request's transaction has been
+committed. A job is run by the handler registered for its ``kind`` with the
+:func:`job_handler` decorator; the handler is called with the job's (JSON)
+arguments plus the ``settings`` of the job's OLD and its (JSON-serializable)
+return value is stored as the job's result::
+
+    @job_handler('compile_phonology')
+    def compile_phonology(**kwargs):
+        ...
+
+Since the queue is a table, queued jobs survive restarts and any number of
+OLD processes can run workers against the same databases: a job is claimed by
+an atomic ``UPDATE ... WHERE status = 'queued'``. Queued jobs are claimed in
+order of descending ``priority`` and then of age, one job per OLD (tenant) per
+round so that a busy OLD cannot starve the others. A running job's
+``datetime_modified`` value is its heartbeat; jobs whose worker stops beating
+(e.g., because its process died) are re-queued or, after ``jobs_max_attempts``
+attempts, failed.
+
+Settings: ``jobs_workers`` (worker threads per process), ``jobs_poll_interval``
+(seconds between polls for jobs enqueued by other processes),
+``jobs_max_per_tenant`` (maximum concurrently running jobs per OLD; 0 for no
+limit), ``jobs_stale_after`` (seconds without a heartbeat after which a
+running job is considered abandoned), ``jobs_max_attempts`` and
+``jobs_tenants`` (comma-delimited names of OLDs to poll from startup; OLDs are
+otherwise polled once a job has been enqueued for them by this process).
+"""
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import datetime
+import json
+import logging
+import os
+import socket
+import threading
+import time
+
+from sqlalchemy.sql import and_, func, select
+
+from old.lib import metrics
+from old.lib.utils import get_int
+from old.models import Job
+import old.models as old_models
+
+
+LOGGER = logging.getLogger(__name__)
+
+JOB_HANDLERS = {}
+
+DEFAULT_WORKERS = 2
+DEFAULT_POLL_INTERVAL = 5
+DEFAULT_STALE_AFTER = 600
+DEFAULT_MAX_ATTEMPTS = 3
+# Number of queued jobs considered per claim attempt; a claim only fails if
+# other workers claim all of them first.
+CLAIM_CANDIDATES = 5
+
+
+def job_handler(kind):
+    """Decorator that registers the decorated function as the handler of jobs
+    of kind ``kind``.
+    """
+    def decorator(func):
+        JOB_HANDLERS[kind] = func
+        return func
+    return decorator
+
+
+###############################################################################
+# Engines
+###############################################################################
+
+_ENGINES = {}
+_ENGINES_LOCK = threading.Lock()
+
+
+def get_engine(settings):
+    """Return the SQLAlchemy engine of the OLD configured in ``settings``,
+    creating it only the first time it is requested so that its connection
+    pool is shared by all of the jobs (and job polls) of that OLD.
+    """
+    sqlalchemy_url = settings['sqlalchemy.url']
+    with _ENGINES_LOCK:
+        try:
+            return _ENGINES[sqlalchemy_url]
+        except KeyError:
+            _ENGINES[sqlalchemy_url] = old_models.get_engine(settings)
+            return _ENGINES[sqlalchemy_url]
+
+
+def get_tenant_settings(request):
+    """Return a copy of the settings of the OLD being requested (cf.
+    ``MyRequest.settings``) that background jobs can keep after the request.
+    """
+    return dict(request.settings)
+
+
+###############################################################################
+# Enqueueing
+###############################################################################
+
+def enqueue_job(request, kind, args, user_id=None, priority=0):
+    """Add a queued job of kind ``kind`` to the database of the OLD being
+    requested and return it. The job is committed along with the rest of the
+    request's changes and the scheduler is notified of it after that.
+
+    :param request: the Pyramid request.
+    :param str kind: the name of a registered job handler.
+    :param dict args: the (JSON-serializable) keyword arguments of the
+        handler; the OLD's ``settings`` are supplied by the scheduler.
+    :param int user_id: the id of the user requesting the job.
+    :param int priority: jobs with higher priorities are run first.
+    """
+    settings = get_tenant_settings(request)
+    JOB_SCHEDULER.add_tenant(settings)
+    dbsession = request.dbsession
+    job = Job(kind=kind, status='queued', priority=priority,
+              args=json.dumps(args), attempts=0, enterer_id=user_id)
+    dbsession.add(job)
+    dbsession.flush()
+    # The request's dbsession is committed by a finished callback that was
+    # registered when the dbsession was first accessed, i.e., before this one.
+    request.add_finished_callback(
+        lambda request: JOB_SCHEDULER.notify(settings))
+    LOGGER.info('Queued %s job %d in OLD %s.', kind, job.id,
+                settings['old_name'])
+    return job
+
+
+###############################################################################
+# Scheduler
+###############################################################################
+
+class JobScheduler(object):
+    """Claims the queued jobs of the OLDs (tenants) it knows of and runs them
+    in a pool of worker threads. Cf. the module docstring.
+    """
+
+    def __init__(self):
+        self.tenants = OrderedDict()
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.dispatcher = None
+        self.executor = None
+        # Ids of the jobs being run by this process's workers, by OLD name.
+        self.running = {}
+        self.workers = DEFAULT_WORKERS
+        self.poll_interval = DEFAULT_POLL_INTERVAL
+        self.max_per_tenant = 0
+        self.stale_after = DEFAULT_STALE_AFTER
+        self.max_attempts = DEFAULT_MAX_ATTEMPTS
+        self.worker_id = '%s:%d' % (socket.gethostname(), os.getpid())
+        self._next_tenant = 0
+
+    def configure(self, settings):
+        def get_setting(name, default):
+            value = get_int(settings.get(name))
+            return default if value is None else value
+        self.workers = max(1, get_setting('jobs_workers', DEFAULT_WORKERS))
+        self.poll_interval = max(0.1, get_setting(
+            'jobs_poll_interval', DEFAULT_POLL_INTERVAL))
+        self.max_per_tenant = max(0, get_setting('jobs_max_per_tenant', 0))
+        self.stale_after = get_setting('jobs_stale_after',
+                                       DEFAULT_STALE_AFTER)
+        self.max_attempts = max(1, get_setting('jobs_max_attempts',
+                                               DEFAULT_MAX_ATTEMPTS))
+
+    def start(self, settings):
+        """Start the dispatcher thread and the worker pool (once) and
+        register the OLDs named in ``settings``.
+        """
+        with self.lock:
+            if self.dispatcher is None:
+                self.configure(settings)
+                # No thread_name_prefix: it needs Python 3.6.
+                self.executor = ThreadPoolExecutor(max_workers=self.workers)
+                self.dispatcher = threading.Thread(
+                    target=self._dispatch, name='old-job-dispatcher',
+                    daemon=True)
+                self.dispatcher.start()
+        # Deferred import: the handler modules import this one.
+        # pylint: disable=unused-import
+        import old.lib.foma_worker
+        # Avoid a circular import: the package imports this module.
+        from old import build_sqlalchemy_url
+        tenant_names = [settings['old_name']] + [
+            name.strip() for name in settings.get('jobs_tenants', '').split(',')
+            if name.strip()]
+        for old_name in tenant_names:
+            tenant_settings = dict(settings)
+            tenant_settings['old_name'] = old_name
+            tenant_settings['sqlalchemy.url'] = build_sqlalchemy_url(
+                tenant_settings)
+            try:
+                self.add_tenant(tenant_settings)
+            except Exception as error:
+                LOGGER.warning('Unable to poll OLD %s for jobs: %s %s',
+                               old_name, error.__class__.__name__, error)
+        self.wakeup.set()
+
+    def add_tenant(self, settings):
+        """Make the scheduler poll the OLD configured in ``settings``, creating
+        its ``job`` table if necessary.
+        """
+        old_name = settings['old_name']
+        with self.lock:
+            if old_name in self.tenants:
+                return
+        Job.__table__.create(bind=get_engine(settings), checkfirst=True)
+        with self.lock:
+            self.tenants.setdefault(old_name, dict(settings))
+            self.running.setdefault(old_name, set())
+
+    def notify(self, settings=None):
+        """Wake the dispatcher up, e.g., because a job has been enqueued."""
+        if settings is not None:
+            self.add_tenant(settings)
+        self.wakeup.set()
+
+    def stats(self):
+        with self.lock:
+            return {old_name: len(job_ids)
+                    for old_name, job_ids in self.running.items()}
+
+    # Dispatcher thread
+    ###########################################################################
+
+    def _dispatch(self):
+        while True:
+            self.wakeup.wait(self.poll_interval)
+            self.wakeup.clear()
+            for old_name, settings in self._get_tenants():
+                try:
+                    self._maintain(old_name, settings)
+                except Exception as error:
+                    LOGGER.warning('Unable to maintain the jobs of OLD %s: %s'
+                                   ' %s', old_name, error.__class__.__name__,
+                                   error)
+            self._claim_all()
+
+    def _get_tenants(self):
+        with self.lock:
+            return list(self.tenants.items())
+
+    def _free_slots(self):
+        with self.lock:
+            return self.workers - sum(len(job_ids) for job_ids in
+                                      self.running.values())
+
+    def _claim_all(self):
+        """Claim jobs round-robin across the OLDs, at most one per OLD per
+        round, until the workers are busy or no OLD has claimable jobs.
+        """
+        claimed = True
+        while claimed:
+            claimed = False
+            tenants = self._get_tenants()
+            if not tenants:
+                return
+            start = self._next_tenant % len(tenants)
+            self._next_tenant += 1
+            for old_name, settings in tenants[start:] + tenants[:start]:
+                if self._free_slots() <= 0:
+                    return
+                with self.lock:
+                    if (self.max_per_tenant and
+                            len(self.running[old_name]) >= self.max_per_tenant):
+                        continue
+                try:
+                    job = self._claim(settings)
+                except Exception as error:
+                    LOGGER.warning('Unable to claim a job in OLD %s: %s %s',
+                                   old_name, error.__class__.__name__, error)
+                    continue
+                if job:
+                    claimed = True
+                    with self.lock:
+                        self.running[old_name].add(job['id'])
+                    self.executor.submit(self._run, old_name, settings, job)
+
+    def _claim(self, settings):
+        """Atomically mark the next queued job of the OLD as running and
+        return its id, kind and arguments, or ``None`` if there is none.
+        """
+        job_table = Job.__table__
+        with get_engine(settings).connect() as connection:
+            candidates = connection.execute(
+                select([job_table.c.id, job_table.c.kind, job_table.c.args,
+                        job_table.c.attempts])
+                .where(job_table.c.status == 'queued')
+                .order_by(job_table.c.priority.desc(), job_table.c.id)
+                .limit(CLAIM_CANDIDATES)).fetchall()
+            for id_, kind, args, attempts in candidates:
+                now = datetime.datetime.utcnow()
+                result = connection.execute(
+                    job_table.update()
+                    .where(and_(job_table.c.id == id_,
+                                job_table.c.status == 'queued'))
+                    .values(status='running',
+                            worker=self.worker_id,
+                            attempts=(attempts or 0) + 1,
+                            datetime_started=now,
+                            datetime_modified=now))
+                if result.rowcount == 1:
+                    return {'id': id_, 'kind': kind,
+                            'args': json.loads(args or '{}')}
+        return None
+
+    def _maintain(self, old_name, settings):
+        """Beat the hearts of the OLD's jobs that this process is running and
+        recover the ones that have been abandoned by other workers.
+        """
+        job_table = Job.__table__
+        now = datetime.datetime.utcnow()
+        with self.lock:
+            running = list(self.running.get(old_name, ()))
+        with get_engine(settings).connect() as connection:
+            if running:
+                connection.execute(
+                    job_table.update()
+                    .where(and_(job_table.c.id.in_(running),
+                                job_table.c.status == 'running'))
+                    .values(datetime_modified=now))
+            if self.stale_after <= 0:
+                return
+            stale = connection.execute(
+                select([job_table.c.id, job_table.c.attempts])
+                .where(and_(
+                    job_table.c.status == 'running',
+                    job_table.c.datetime_modified <
+                    now - datetime.timedelta(seconds=self.stale_after)))
+            ).fetchall()
+            for id_, attempts in stale:
+                if id_ in running:
+                    continue
+                values = {'status': 'queued', 'datetime_modified': now}
+                if (attempts or 0) >= self.max_attempts:
+                    values = {'status': 'failed', 'datetime_finished': now,
+                              'datetime_modified': now,
+                              'error': 'The job was abandoned by its worker'
+                                       ' too many times.'}
+                LOGGER.warning('Job %d of OLD %s was abandoned by its worker;'
+                               ' setting its status to %s.', id_, old_name,
+                               values['status'])
+                connection.execute(
+                    job_table.update()
+                    .where(and_(job_table.c.id == id_,
+                                job_table.c.status == 'running'))
+                    .values(**values))
+
+    # Worker threads
+    ###########################################################################
+
+    def _run(self, old_name, settings, job):
+        values = {}
+        start = time.time()
+        try:
+            handler = JOB_HANDLERS.get(job['kind'])
+            if handler is None:
+                raise ValueError('There is no handler for jobs of kind %s.'
+                                 % job['kind'])
+            LOGGER.info('Running %s job %d of OLD %s.', job['kind'],
+                        job['id'], old_name)
+            result = handler(settings=dict(settings), **job['args'])
+            values = {'status': 'succeeded', 'result': json.dumps(result)}
+        except Exception as error:
+            LOGGER.warning('%s job %d of OLD %s failed: %s %s', job['kind'],
+                           job['id'], old_name, error.__class__.__name__,
+                           error)
+            values = {'status': 'failed',
+                      'error': '%s: %s' % (error.__class__.__name__, error)}
+        finally:
+            metrics.REGISTRY.histogram(
+                'old_jobs_duration_seconds',
+                'Duration of background jobs by kind and status.',
+                ('kind', 'status')).observe(
+                    time.time() - start, kind=job['kind'],
+                    status=values.get('status', 'failed'))
+            try:
+                self._finish(settings, job['id'], values)
+            except Exception as error:
+                LOGGER.warning('Unable to record the result of job %d of OLD'
+                               ' %s: %s %s', job['id'], old_name,
+                               error.__class__.__name__, error)
+            with self.lock:
+                self.running[old_name].discard(job['id'])
+            self.wakeup.set()
+
+    @staticmethod
+    def _finish(settings, job_id, values):
+        job_table = Job.__table__
+        now = datetime.datetime.utcnow()
+        values.update({'datetime_finished': now, 'datetime_modified': now})
+        with get_engine(settings).connect() as connection:
+            connection.execute(
+                job_table.update()
+                .where(job_table.c.id == job_id)
+                .values(**values))
+
+
+JOB_SCHEDULER = JobScheduler()
+
+
+@metrics.register_collector
+def collect_running_jobs(registry):
+    running = registry.gauge(
+        'old_jobs_running', 'Jobs being run by the workers of this process.',
+        ('old',))
+    for old_name, count in JOB_SCHEDULER.stats().items():
+        running.set(count, old=old_name)
+
+
+def collect_queued_jobs(registry):
+    """Count the queued jobs of the OLDs that this process polls. Every
+    process sees the same queues, so this is a scrape collector.
+    """
+    queued = registry.gauge(
+        'old_jobs_queued', 'Jobs waiting for a worker.', ('old',))
+    job_table = Job.__table__
+    for old_name, settings in JOB_SCHEDULER._get_tenants():
+        with get_engine(settings).connect() as connection:
+            queued.set(connection.execute(
+                select([func.count()]).select_from(job_table)
+                .where(job_table.c.status == 'queued')).scalar(),
+                old=old_name)
+
+
+metrics.register_collector(collect_queued_jobs, scope='scrape')
+
+
+def start_job_scheduler(settings):
+    """Called in ``main`` of :mod:`old.__init__.py`."""
+    JOB_SCHEDULER.start(settings)
@@ -0,0 +1,474 @@
+# Copyright 2016 Joel Dunham
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""Operational metrics, served in the Prometheus text format by ``GET
+/metrics`` (cf. :mod:`old.views.metrics`) if the ``metrics_enabled`` setting
+is true.
+
+Each process records its metrics in :data:`REGISTRY`, a thread-safe
+:class:`MetricsRegistry` of counters, gauges and histograms::
+
+    from old.lib import metrics
+    metrics.REGISTRY.counter(
+        'old_parse_cache_lookups_total', 'Parse cache lookups.',
+        ('result',)).inc(3, result='miss')
+
+Values that other modules already keep (e.g., the statistics of the search
+plan and result caches) are copied into the registry by *collectors*
+(:func:`register_collector`) just before it is read. Scrape collectors
+(``scope='scrape'``) report values that are the same for all processes,
+e.g., the number of queued jobs in the database, and are only called by the
+process that serves the request.
+
+Multiple processes: if the ``metrics_dir`` setting names a directory, each
+process writes its metrics to a ``metrics-<pid>.json`` file in it (at most
+every :data:`FLUSH_INTERVAL` seconds, after a request) and ``GET /metrics``
+returns the sums of the metrics of all of the files. The gauges of files
+that have not been written for :data:`STALE_AFTER` seconds (e.g., those of
+dead processes) are ignored; the directory should be emptied when the server
+is restarted.
+
+Label cardinality: a label of a metric takes at most
+``metrics_max_label_values`` distinct values; values beyond those are
+recorded as ``other``.
+
+The metrics:
+
+- ``old_http_requests_total`` (``old``, ``status``) and
+  ``old_http_request_duration_seconds`` (``route``, ``method``): requests,
+  recorded by :func:`metrics_tween_factory`.
+- ``old_db_pool_checkout_seconds`` and ``old_db_pool_checked_out`` (``old``):
+  the time spent getting a connection from an OLD's pool (waiting or
+  connecting) and the connections in use, cf. :func:`instrument_pool`.
+- ``old_jobs_duration_seconds`` (``kind``, ``status``), ``old_jobs_running``
+  and ``old_jobs_queued`` (``old``): background jobs, cf.
+  :mod:`old.lib.jobs`.
+- ``old_parse_cache_lookups_total``, ``old_search_plan_cache_*`` and
+  ``old_result_cache_*``: cache counters and sizes.
+"""
+
+from collections import OrderedDict
+import glob
+import json
+import logging
+import math
+import os
+import tempfile
+import threading
+import time
+
+from pyramid.settings import asbool
+from sqlalchemy import event
+
+
+LOGGER = logging.getLogger(__name__)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                   10.0, 30.0, 60.0, 300.0)
+DEFAULT_MAX_LABEL_VALUES = 100
+OVERFLOW_LABEL_VALUE = 'other'
+# Seconds between the writes of a process's metrics to metrics_dir.
+FLUSH_INTERVAL = 5
+# Seconds after which the gauges of an unwritten metrics file are ignored.
+STALE_AFTER = 300
+
+
+class Metric(object):
+    """A named counter, gauge or histogram whose values are keyed by the
+    tuples of the values of its labels. Its values are guarded by the lock of
+    its registry.
+    """
+
+    def __init__(self, registry, name, type_, help_, labelnames=(),
+                 buckets=DEFAULT_BUCKETS):
+        self.registry = registry
+        self.name = name
+        self.type = type_
+        self.help = help_
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets) if type_ == 'histogram' else ()
+        self.values = OrderedDict()
+        self._label_values = [set() for _ in self.labelnames]
+
+    def _get_key(self, labels):
+        """Return the key of ``labels``; the values that would exceed the
+        cardinality limit of their label are replaced by ``other``.
+        """
+        if set(labels) != set(self.labelnames):
+            raise ValueError('Metric %s has the labels %s, not %s' % (
+                self.name, ', '.join(self.labelnames),
+                ', '.join(sorted(labels))))
+        key = []
+        for name, seen in zip(self.labelnames, self._label_values):
+            value = str(labels[name])
+            if value not in seen:
+                if len(seen) >= self.registry.max_label_values:
+                    value = OVERFLOW_LABEL_VALUE
+                seen.add(value)
+            key.append(value)
+        return tuple(key)
+
+    def inc(self, amount=1, **labels):
+        with self.registry.lock:
+            key = self._get_key(labels)
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        with self.registry.lock:
+            self.values[self._get_key(labels)] = value
+
+    def observe(self, value, **labels):
+        """Add ``value`` to a histogram: its values are lists of the counts
+        of each bucket (plus ``+Inf``), the sum and the count.
+        """
+        with self.registry.lock:
+            key = self._get_key(labels)
+            counts = self.values.get(key)
+            if counts is None:
+                counts = self.values[key] = [0] * (len(self.buckets) + 3)
+            index = next((index for index, bound in enumerate(self.buckets)
+                          if value <= bound), len(self.buckets))
+            counts[index] += 1
+            counts[-2] += value
+            counts[-1] += 1
+
+    def to_dict(self):
+        return {'type': self.type, 'help': self.help,
+                'labelnames': list(self.labelnames),
+                'buckets': list(self.buckets),
+                'samples': [[list(key), value] for key, value in
+                            self.values.items()]}
+
+
+class MetricsRegistry(object):
+    """A thread-safe collection of the metrics of a process."""
+
+    def __init__(self, max_label_values=DEFAULT_MAX_LABEL_VALUES):
+        self.max_label_values = max_label_values
+        self.lock = threading.RLock()
+        self.metrics = OrderedDict()
+
+    def _get_metric(self, name, type_, help_, labelnames, **kwargs):
+        with self.lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = self.metrics[name] = Metric(
+                    self, name, type_, help_, labelnames, **kwargs)
+            elif metric.type != type_:
+                raise ValueError('Metric %s is a %s' % (name, metric.type))
+            return metric
+
+    def counter(self, name, help_, labelnames=()):
+        return self._get_metric(name, 'counter', help_, labelnames)
+
+    def gauge(self, name, help_, labelnames=()):
+        return self._get_metric(name, 'gauge', help_, labelnames)
+
+    def histogram(self, name, help_, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._get_metric(name, 'histogram', help_, labelnames,
+                                buckets=buckets)
+
+    def to_dict(self):
+        with self.lock:
+            return OrderedDict((name, metric.to_dict())
+                               for name, metric in self.metrics.items())
+
+    def clear(self):
+        with self.lock:
+            self.metrics.clear()
+
+
+REGISTRY = MetricsRegistry()
+
+PROCESS_COLLECTORS = []
+SCRAPE_COLLECTORS = []
+
+
+def register_collector(collector, scope='process'):
+    """Register ``collector``, a function that records values in the
+    registry it is passed. Process collectors are called with this process's
+    registry before it is read; scrape collectors are called with a new
+    registry when the metrics are served.
+    """
+    collectors = SCRAPE_COLLECTORS if scope == 'scrape' else PROCESS_COLLECTORS
+    if collector not in collectors:
+        collectors.append(collector)
+    return collector
+
+
+def _run_collectors(collectors, registry):
+    for collector in collectors:
+        try:
+            collector(registry)
+        except Exception as error:
+            LOGGER.warning('Metrics collector %s failed: %s %s',
+                           collector.__name__, error.__class__.__name__,
+                           error)
+
+
+def get_process_metrics():
+    """Return the metrics of this process as a dict."""
+    _run_collectors(PROCESS_COLLECTORS, REGISTRY)
+    return REGISTRY.to_dict()
+
+
+###############################################################################
+# Multiple processes
+###############################################################################
+
+_LAST_FLUSH = {'time': 0.0}
+_FLUSH_LOCK = threading.Lock()
+
+
+def get_metrics_path(directory, pid=None):
+    return os.path.join(directory, 'metrics-%d.json' % (pid or os.getpid()))
+
+
+def write_metrics(directory):
+    """Atomically write the metrics of this process to its file in
+    ``directory``.
+    """
+    os.makedirs(directory, exist_ok=True)
+    descriptor, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    with os.fdopen(descriptor, 'w') as file_:
+        json.dump(get_process_metrics(), file_)
+    os.replace(tmp_path, get_metrics_path(directory))
+
+
+def flush_metrics(settings, force=False):
+    """Write the metrics of this process to the ``metrics_dir`` directory (if
+    there is one) unless they were written in the last
+    :data:`FLUSH_INTERVAL` seconds.
+    """
+    directory = settings.get('metrics_dir')
+    if not directory:
+        return
+    now = time.time()
+    with _FLUSH_LOCK:
+        if not force and now - _LAST_FLUSH['time'] < FLUSH_INTERVAL:
+            return
+        _LAST_FLUSH['time'] = now
+    try:
+        write_metrics(directory)
+    except (OSError, TypeError, ValueError) as error:
+        LOGGER.warning('Unable to write the metrics to %s: %s %s', directory,
+                       error.__class__.__name__, error)
+
+
+def merge_metrics(snapshots):
+    """Return the sum of the metrics dicts in ``snapshots``, a list of
+    ``(metrics, stale)`` pairs; the gauges of stale snapshots are ignored.
+    """
+    merged = OrderedDict()
+    for metrics, stale in snapshots:
+        for name, metric in metrics.items():
+            if stale and metric['type'] == 'gauge':
+                continue
+            target = merged.get(name)
+            if target is None:
+                target = merged[name] = dict(metric, samples=OrderedDict())
+            elif target['type'] != metric['type']:
+                continue
+            samples = target['samples']
+            for key, value in metric['samples']:
+                key = tuple(key)
+                if key not in samples:
+                    samples[key] = value
+                elif metric['type'] == 'histogram':
+                    samples[key] = [x + y for x, y in
+                                    zip(samples[key], value)]
+                else:
+                    samples[key] += value
+    for metric in merged.values():
+        metric['samples'] = [[list(key), value] for key, value in
+                             metric['samples'].items()]
+    return merged
+
+
+def get_metrics(settings):
+    """Return the metrics of this process or, if there is a ``metrics_dir``,
+    the sums of the metrics of all of the processes that write to it.
+    """
+    directory = settings.get('metrics_dir')
+    own = get_process_metrics()
+    if not directory:
+        return own
+    snapshots = [(own, False)]
+    own_path = get_metrics_path(directory)
+    now = time.time()
+    for path in sorted(glob.glob(os.path.join(directory, 'metrics-*.json'))):
+        if path == own_path:
+            continue
+        try:
+            stale = now - os.path.getmtime(path) > STALE_AFTER
+            with open(path) as file_:
+                snapshots.append((json.load(file_), stale))
+        except (OSError, ValueError) as error:
+            LOGGER.warning('Unable to read the metrics in %s: %s %s', path,
+                           error.__class__.__name__, error)
+    return merge_metrics(snapshots)
+
+
+###############################################################################
+# Prometheus text format
+###############################################################################
+
+def _format_value(value):
+    if value is None:
+        return 'NaN'
+    if isinstance(value, float):
+        if math.isinf(value):
+            return '+Inf' if value > 0 else '-Inf'
+        return repr(value)
+    return str(value)
+
+
+def _format_labels(names, values):
+    if not names:
+        return ''
+    return '{%s}' % ','.join(
+        '%s="%s"' % (name, value.replace('\\', r'\\').replace('\n', r'\n')
+                     .replace('"', r'\"'))
+        for name, value in zip(names, values))
+
+
+def render_metrics(metrics):
+    """Return the metrics dict ``metrics`` in the Prometheus text format."""
+    lines = []
+    for name, metric in metrics.items():
+        lines.append('# HELP %s %s' % (
+            name, metric['help'].replace('\\', r'\\').replace('\n', r'\n')))
+        lines.append('# TYPE %s %s' % (name, metric['type']))
+        labelnames = metric['labelnames']
+        for values, value in metric['samples']:
+            if metric['type'] != 'histogram':
+                lines.append('%s%s %s' % (
+                    name, _format_labels(labelnames, values),
+                    _format_value(value)))
+                continue
+            cumulative = 0
+            bounds = [_format_value(float(bound))
+                      for bound in metric['buckets']] + ['+Inf']
+            for bound, count in zip(bounds, value):
+                cumulative += count
+                lines.append('%s_bucket%s %d' % (
+                    name, _format_labels(labelnames + ['le'],
+                                         values + [bound]), cumulative))
+            labels = _format_labels(labelnames, values)
+            lines.append('%s_sum%s %s' % (name, labels,
+                                          _format_value(value[-2])))
+            lines.append('%s_count%s %d' % (name, labels, value[-1]))
+    return '\n'.join(lines) + '\n'
+
+
+def render(settings):
+    """Return all of the metrics (including those of the scrape collectors)
+    in the Prometheus text format.
+    """
+    flush_metrics(settings, force=True)
+    metrics = get_metrics(settings)
+    scraped = MetricsRegistry(REGISTRY.max_label_values)
+    _run_collectors(SCRAPE_COLLECTORS, scraped)
+    metrics.update(scraped.to_dict())
+    return render_metrics(metrics)
+
+
+###############################################################################
+# Requests
+###############################################################################
+
+def metrics_tween_factory(handler, registry):
+    """Return a tween that, if the ``metrics_enabled`` setting is true,
+    records the duration of each request by route and method and counts the
+    requests by OLD and status.
+    """
+    settings = registry.settings
+    try:
+        REGISTRY.max_label_values = int(settings.get(
+            'metrics_max_label_values', DEFAULT_MAX_LABEL_VALUES))
+    except ValueError:
+        REGISTRY.max_label_values = DEFAULT_MAX_LABEL_VALUES
+    requests = REGISTRY.counter(
+        'old_http_requests_total', 'HTTP requests by OLD and status.',
+        ('old', 'status'))
+    durations = REGISTRY.histogram(
+        'old_http_request_duration_seconds',
+        'Duration of HTTP requests by route and method.', ('route', 'method'))
+
+    def metrics_tween(request):
+        if not asbool(settings.get('metrics_enabled', False)):
+            return handler(request)
+        start = time.time()
+        status = 500
+        try:
+            response = handler(request)
+            status = response.status_int
+            return response
+        finally:
+            route = getattr(request, 'matched_route', None)
+            durations.observe(time.time() - start,
+                              route=route.name if route else 'none',
+                              method=request.method)
+            requests.inc(old=(request.matchdict or {}).get('old_name', ''),
+                         status=status)
+            flush_metrics(settings)
+
+    return metrics_tween
+
+
+###############################################################################
+# Database connection pools
+###############################################################################
+
+def instrument_pool(pool, old_name):
+    """Record the time spent getting connections from ``pool`` (the pool of
+    the engine of the OLD ``old_name``) and the number of connections checked
+    out of it.
+    """
+    checkout_seconds = REGISTRY.histogram(
+        'old_db_pool_checkout_seconds',
+        'Time spent getting a database connection from the pool (waiting for'
+        ' a free connection or connecting).', ('old',))
+    checked_out = REGISTRY.gauge(
+        'old_db_pool_checked_out',
+        'Database connections checked out of the pool.', ('old',))
+    checked_out.inc(0, old=old_name)
+    # ``Pool._do_get`` is where a checkout waits for a connection (or makes
+    # one); SQLAlchemy has no event that fires before it.
+    do_get = pool._do_get
+
+    def timed_do_get():
+        start = time.time()
+        try:
+            return do_get()
+        finally:
+            checkout_seconds.observe(time.time() - start, old=old_name)
+
+    pool._do_get = timed_do_get
+
+    @event.listens_for(pool, 'checkout')
+    def on_checkout(dbapi_connection, connection_record, connection_proxy):
+        # pylint: disable=unused-argument,unused-variable
+        checked_out.inc(old=old_name)
+
+    @event.listens_for(pool, 'checkin')
+    def on_checkin(dbapi_connection, connection_record):
+        # pylint: disable=unused-argument,unused-variable
+        checked_out.dec(old=old_name)
+
+    return pool
@@ -0,0 +1,367 @@
+# Copyright 2016 Joel Dunham
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""Background rebuild of the morphological analysis-related attributes
+(``morpheme_break_ids``, ``morpheme_gloss_ids``, ``syntactic_category_string``
+and ``break_gloss_category``) of every form in an OLD.
+
+The rebuild is requested via ``PUT /forms/update_morpheme_references`` and run
+as a background job (cf.
+:func:`old.lib.foma_worker.rebuild_morpheme_references`):
+
+- the lexicon (id, break, gloss and category of every form) is read once,
+  pickled to a file next to the status file and hash-indexed by each worker
+  process on its first task (cf. :class:`old.views.forms.LexicalIndex`);
+- the forms are then streamed in id-ordered chunks and each chunk's analyses
+  are compiled in parallel across a process pool;
+- the changed forms of each chunk are written back (and re-indexed in the
+  ``form_morpheme`` table) in the chunk's own transaction;
+- after each chunk, the id of its last form is checkpointed to a JSON status
+  file in the OLD's store directory so that an interrupted rebuild resumes
+  where it left off; the same file is served by
+  ``GET /forms/update_morpheme_references``.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+import datetime
+from itertools import repeat
+import json
+import logging
+import multiprocessing
+import os
+import pickle
+import sys
+
+from sqlalchemy import bindparam
+from sqlalchemy.sql import func, select
+
+from old.lib.dbutils import DBUtils
+import old.lib.helpers as h
+import old.models as old_models
+
+
+LOGGER = logging.getLogger(__name__)
+STATUS_FILE_NAME = 'morpheme_references_rebuild.json'
+LEXICON_FILE_NAME = 'morpheme_references_lexicon.pickle'
+# The format of the timestamps of the status file.
+DATETIME_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+# A running rebuild whose status has not been touched for this many seconds is
+# assumed to have died and may be resumed.
+STALE_AFTER = 600
+DEFAULT_CHUNK_SIZE = 1000
+DEFAULT_PROCESSES = 2
+
+
+###############################################################################
+# Status / checkpoint file
+###############################################################################
+
+def get_status_path(settings):
+    return os.path.join(settings['permanent_store'], settings['old_name'],
+                        STATUS_FILE_NAME)
+
+
+def read_status(settings):
+    """Return the status dict of the most recent rebuild of this OLD's
+    morpheme references, or ``{'status': 'not started'}``.
+    """
+    try:
+        with open(get_status_path(settings)) as filei:
+            return json.load(filei)
+    except (OSError, ValueError):
+        return {'status': 'not started'}
+
+
+def write_status(settings, status):
+    """Atomically write ``status`` to the status file, stamping it with the
+    current time as a heartbeat.
+    """
+    # Not ``isoformat``, which omits zero microseconds.
+    status['datetime_modified'] = datetime.datetime.utcnow().strftime(
+        DATETIME_FORMAT)
+    path = get_status_path(settings)
+    h.make_directory_safely(os.path.dirname(path))
+    tmp_path = '%s.%s' % (path, os.getpid())
+    with open(tmp_path, 'w') as fileo:
+        json.dump(status, fileo)
+    os.replace(tmp_path, path)
+    return status
+
+
+def rebuild_is_running(status):
+    """Return ``True`` if ``status`` describes a rebuild that is queued or
+    running and whose heartbeat is recent.
+    """
+    if status.get('status') not in ('queued', 'running'):
+        return False
+    try:
+        modified = datetime.datetime.strptime(
+            status['datetime_modified'], DATETIME_FORMAT)
+    except (KeyError, ValueError):
+        return False
+    return ((datetime.datetime.utcnow() - modified).total_seconds() <
+            STALE_AFTER)
+
+
+def get_resume_point(status):
+    """Return the id of the last form whose references were written by an
+    interrupted rebuild, or 0 if the rebuild should start from scratch.
+    """
+    if status.get('status') in ('queued', 'running', 'failed'):
+        return status.get('last_id') or 0
+    return 0
+
+
+###############################################################################
+# Worker process side
+###############################################################################
+
+_WORKER_STATE = {}
+
+
+def get_worker_state(lexicon_path, morpheme_delimiters):
+    """Return the state of this process for compiling against the lexicon
+    pickled at ``lexicon_path``. The lexicon is loaded and hash-indexed on
+    the first call of each rebuild only.
+
+    :param str lexicon_path: path to a pickled list of ``(id, morpheme_break,
+        morpheme_gloss, category_name)`` tuples for every form in the
+        database.
+    :param list morpheme_delimiters: morpheme delimiters as strings.
+    """
+    key = (lexicon_path, os.path.getmtime(lexicon_path),
+           tuple(morpheme_delimiters))
+    if _WORKER_STATE.get('key') != key:
+        with open(lexicon_path, 'rb') as filei:
+            lexicon = pickle.load(filei)
+        _WORKER_STATE.clear()
+        _WORKER_STATE.update(build_worker_state(lexicon, morpheme_delimiters),
+                             key=key)
+    return _WORKER_STATE
+
+
+def build_worker_state(lexicon, morpheme_delimiters):
+    """Hash-index ``lexicon``, a list of ``(id, morpheme_break,
+    morpheme_gloss, category_name)`` tuples.
+    """
+    # Imported here to keep the view layer out of the module's import-time
+    # dependencies.
+    from old.views.forms import (
+        FakeForm,
+        FakeSyntacticCategory,
+        Forms,
+        LexicalIndex,
+    )
+    forms = [FakeForm(id=id_, morpheme_break=mb, morpheme_gloss=mg,
+                      syntactic_category=(None if sc is None else
+                                          FakeSyntacticCategory(name=sc)))
+             for id_, mb, mg, sc in lexicon]
+    return {
+        'forms_view': Forms(None),
+        'form_cls': FakeForm,
+        'lexical_index': LexicalIndex(forms),
+        'morpheme_delimiters': morpheme_delimiters,
+        'cache': {}
+    }
+
+
+def compile_analyses(forms, lexicon_path, morpheme_delimiters):
+    """Compile the morphemic analyses of ``forms``, a list of ``(id,
+    morpheme_break, morpheme_gloss)`` triples, against the lexicon pickled at
+    ``lexicon_path`` (cf. :func:`get_worker_state`).
+
+    :returns: a list of ``(id, morpheme_break_ids, morpheme_gloss_ids,
+        syntactic_category_string, break_gloss_category)`` tuples.
+    """
+    state = get_worker_state(lexicon_path, morpheme_delimiters)
+    results = []
+    for id_, morpheme_break, morpheme_gloss in forms:
+        form = state['form_cls'](id=id_, morpheme_break=morpheme_break or '',
+                                 morpheme_gloss=morpheme_gloss or '')
+        analysis = state['forms_view'].compile_morphemic_analysis(
+            form, state['morpheme_delimiters'],
+            whole_db=state['lexical_index'], cache=state['cache'])
+        results.append((id_,) + tuple(analysis[:4]))
+    return results
+
+
+###############################################################################
+# Driver
+###############################################################################
+
+def get_lexicon(dbsession):
+    form_table = old_models.Form.__table__
+    category_table = old_models.SyntacticCategory.__table__
+    return [tuple(row) for row in dbsession.execute(
+        select([form_table.c.id,
+                form_table.c.morpheme_break,
+                form_table.c.morpheme_gloss,
+                category_table.c.name])
+        .select_from(form_table.outerjoin(
+            category_table,
+            form_table.c.syntacticcategory_id == category_table.c.id))
+        .order_by(form_table.c.id))]
+
+
+def split(sequence, parts):
+    """Split ``sequence`` into (at most) ``parts`` contiguous sub-lists."""
+    size = max(1, -(-len(sequence) // max(parts, 1)))
+    return [sequence[i:i + size] for i in range(0, len(sequence), size)]
+
+
+class MorphemeReferencesRebuild(object):
+    """Rebuild the morpheme references of all forms in the OLD whose database
+    ``dbsession`` is bound to. Usage::
+
+        MorphemeReferencesRebuild(dbsession, settings, user_id).run()
+
+    :param dbsession: SQLAlchemy session; it is committed once per chunk.
+    :param dict settings: the OLD's settings (used to locate the status file
+        and to read ``morpheme_references_chunk_size`` and
+        ``morpheme_references_processes``).
+    :param int user_id: id of the user to record as modifier.
+    """
+
+    def __init__(self, dbsession, settings, user_id):
+        self.dbsession = dbsession
+        self.settings = settings
+        self.user_id = user_id
+        self.chunk_size = max(1, h.get_int(settings.get(
+            'morpheme_references_chunk_size')) or DEFAULT_CHUNK_SIZE)
+        processes = h.get_int(settings.get('morpheme_references_processes'))
+        self.processes = (DEFAULT_PROCESSES if processes is None
+                          else processes)
+        self.db = DBUtils(dbsession, settings)
+        self.status = None
+
+    def run(self):
+        status = read_status(self.settings)
+        last_id = get_resume_point(status)
+        if last_id:
+            LOGGER.info('Resuming the morpheme references rebuild after form'
+                        ' %d.', last_id)
+            status['resumed'] = status.get('resumed', 0) + 1
+        else:
+            status = {'processed': 0, 'updated': 0,
+                      'started': datetime.datetime.utcnow().strftime(
+                          DATETIME_FORMAT)}
+        form_table = old_models.Form.__table__
+        status.update({'status': 'running', 'last_id': last_id,
+                       'total': self.dbsession.execute(
+                           select([func.count(form_table.c.id)])).scalar()})
+        status.pop('error', None)
+        self.status = write_status(self.settings, status)
+        morpheme_delimiters = self.db.get_morpheme_delimiters()
+        lexicon_path = os.path.join(os.path.dirname(
+            get_status_path(self.settings)), LEXICON_FILE_NAME)
+        with open(lexicon_path, 'wb') as fileo:
+            pickle.dump(get_lexicon(self.dbsession), fileo,
+                        pickle.HIGHEST_PROTOCOL)
+        self.dbsession.commit()
+        try:
+            if self.processes > 1:
+                pool_kwargs = {}
+                if sys.version_info >= (3, 7):
+                    pool_kwargs['mp_context'] = multiprocessing.get_context(
+                        'spawn')
+                with ProcessPoolExecutor(max_workers=self.processes,
+                                         **pool_kwargs) as pool:
+                    self._run_chunks(
+                        lambda batches: [r for rs in pool.map(
+                            compile_analyses, batches, repeat(lexicon_path),
+                            repeat(morpheme_delimiters)) for r in rs],
+                        morpheme_delimiters)
+            else:
+                self._run_chunks(
+                    lambda batches: [r for batch in batches
+                                     for r in compile_analyses(
+                                         batch, lexicon_path,
+                                         morpheme_delimiters)],
+                    morpheme_delimiters)
+        except Exception as error:
+            self.dbsession.rollback()
+            LOGGER.warning('The morpheme references rebuild failed after form'
+                           ' %s: %s %s', self.status['last_id'],
+                           error.__class__.__name__, error)
+            self.status.update({'status': 'failed', 'error': str(error)})
+            write_status(self.settings, self.status)
+            raise
+        finally:
+            _WORKER_STATE.clear()
+            os.remove(lexicon_path)
+        self.status.update({
+            'status': 'finished',
+            'finished': datetime.datetime.utcnow().strftime(
+                DATETIME_FORMAT)})
+        write_status(self.settings, self.status)
+        LOGGER.info('Rebuilt the morpheme references of %d forms (%d'
+                    ' updated).', self.status['processed'],
+                    self.status['updated'])
+        return self.status
+
+    def _run_chunks(self, compile_batches, morpheme_delimiters):
+        form_table = old_models.Form.__table__
+        batches_per_chunk = max(self.processes, 1)
+        while True:
+            forms = self.dbsession.execute(
+                select([form_table.c.id,
+                        form_table.c.morpheme_break,
+                        form_table.c.morpheme_gloss,
+                        form_table.c.morpheme_break_ids,
+                        form_table.c.morpheme_gloss_ids,
+                        form_table.c.syntactic_category_string,
+                        form_table.c.break_gloss_category])
+                .where(form_table.c.id > self.status['last_id'])
+                .order_by(form_table.c.id)
+                .limit(self.chunk_size)).fetchall()
+            if not forms:
+                break
+            results = compile_batches(split(
+                [tuple(form[:3]) for form in forms], batches_per_chunk))
+            updated = self._write_chunk(forms, results, morpheme_delimiters)
+            self.dbsession.commit()
+            self.status['last_id'] = forms[-1][0]
+            self.status['processed'] += len(forms)
+            self.status['updated'] += updated
+            write_status(self.settings, self.status)
+
+    def _write_chunk(self, forms, results, morpheme_delimiters):
+        """Write the changed analyses of one chunk and re-index the chunk's
+        morphemes. Returns the number of forms updated.
+        """
+        existing = {form[0]: tuple(form[3:]) for form in forms}
+        modification_datetime = h.now()
+        buffer_ = [{
+            'id_': id_,
+            'morpheme_break_ids': mbi,
+            'morpheme_gloss_ids': mgi,
+            'syntactic_category_string': scs,
+            'break_gloss_category': bgc,
+            'modifier_id': self.user_id,
+            'datetime_modified': modification_datetime
+        } for id_, mbi, mgi, scs, bgc in results
+                   if (mbi, mgi, scs, bgc) != existing[id_]]
+        if buffer_:
+            form_table = old_models.Form.__table__
+            update = form_table.update()\
+                .where(form_table.c.id == bindparam('id_'))\
+                .values(**{k: bindparam(k) for k in buffer_[0] if k != 'id_'})
+            self.dbsession.execute(update, buffer_)
+        # The morpheme delimiters may have changed since the forms were last
+        # indexed, so every form in the chunk is re-indexed.
+        self.db.index_form_morphemes(
+            [(form[0], form[1], form[2], result[3])
+             for form, result in zip(forms, results)],
+            morpheme_delimiters)
+        return len(buffer_)
@@ -56,6 +56,7 @@ import unicodedata
 from uuid import uuid4
 
 from old.lib import simplelm
+from old.lib.flookup_pool import FLOOKUP_POOL, FlookupPoolError
 
 
 LOGGER = logging.getLogger(__name__)
@@ -513,11 +514,10 @@ class FomaFST(Command):
     def apply(self, direction, input_, boundaries=None):
         """Foma-apply the inputs in the direction of ``direction``.
 
-        The method used is to write two files -- inputs.txt containing a newline-delimited
-        list thereof and apply.sh which is a shell script that invokes flookup on inputs.txt
-        to create outputs.txt -- and then parse the foma/flookup-generated outputs.txt file
-        and then delete the three temporary files.  A more efficient implementation might be
-        possible.
+        The inputs are sent to a persistent flookup co-process for the
+        compiled binary (cf. :mod:`old.lib.flookup_pool`). If that fails, or if
+        ``self.use_flookup_pool`` is false, we fall back to
+        :func:`apply_via_files`.
 
         :param str direction: 'up' or 'down', i.e., the direction in which to use the transducer
         :param str/list input_: a transcription string or list thereof.
@@ -525,10 +525,8 @@ class FomaFST(Command):
             them from the outputs.
         :returns: a dictionary: ``{input1: [output1, output2, ...], input2: [...], ...}``
         """
-        LOGGER.debug('in apply')
         boundaries = boundaries if boundaries is not None else getattr(
             self, 'boundaries', False)
-        LOGGER.debug('in apply got boundaries: %s', boundaries)
         if isinstance(input_, str):
             inputs = [input_]
         elif isinstance(input_, (list, tuple)):
@@ -536,11 +534,41 @@ class FomaFST(Command):
         else:
             LOGGER.debug('in apply; returning None, bad type %s', type(input))
             return None
-        LOGGER.debug('in apply ensured input_ is a list')
+        # flookup reads one input per line.
+        inputs = [input_.replace('\n', ' ') for input_ in inputs]
+        if boundaries:
+            inputs = [input_.join([self.word_boundary_symbol,
+                                   self.word_boundary_symbol])
+                      for input_ in inputs]
+        binary_path = self.get_file_path('binary')
+        if self.use_flookup_pool:
+            try:
+                lines = FLOOKUP_POOL.apply(binary_path, direction, inputs)
+            except FlookupPoolError as error:
+                LOGGER.warning('Unable to apply %s via the flookup pool (%s);'
+                               ' falling back to temporary files.',
+                               binary_path, error)
+            else:
+                return self.foma_output_file2dict(
+                    lines, remove_word_boundaries=boundaries)
+        return self.apply_via_files(direction, inputs, boundaries)
+
+    def apply_via_files(self, direction, inputs, boundaries):
+        """Foma-apply ``inputs`` by writing two files -- inputs.txt containing
+        a newline-delimited list thereof and apply.sh which is a shell script
+        that invokes flookup on inputs.txt to create outputs.txt -- and then
+        parsing the foma/flookup-generated outputs.txt file and deleting the
+        three temporary files. This starts a new flookup process (which must
+        load the binary) on each call.
+
+        :param str direction: 'up' or 'down'.
+        :param list inputs: input strings, word boundaries already added.
+        :param bool boundaries: whether to remove word boundary symbols from
+            the outputs.
+        :returns: a dictionary: ``{input1: [output1, output2, ...], ...}``
+        """
         directory = self.directory
-        LOGGER.debug('in apply got directory')
         random_string = self.generate_salt()
-        LOGGER.debug('in apply generated salt')
         inputs_file_path = os.path.join(
             directory, 'inputs_%s.txt' % random_string)
         outputs_file_path = os.path.join(
@@ -548,47 +576,37 @@ class FomaFST(Command):
         apply_file_path = os.path.join(
             directory, 'apply_%s.sh' % random_string)
         binary_path = self.get_file_path('binary')
-        LOGGER.debug('in apply got paths')
         # Write the inputs to an '\n'-delimited file
         with codecs.open(inputs_file_path, 'w', 'utf8') as f:
-            if boundaries:
-                f.write(
-                    '\n'.join(
-                        input_.join([self.word_boundary_symbol,
-                                     self.word_boundary_symbol])
-                        for input_ in inputs))
-            else:
-                f.write('\n'.join(inputs))
-        LOGGER.debug('in apply wrote inputs to disk')
+            f.write('\n'.join(inputs))
         # Write the shell script that pipes the input file into flookup
         with codecs.open(apply_file_path, 'w', 'utf8') as f:
             f.write('#!/bin/sh\ncat %s | flookup %s%s' % (
                 inputs_file_path,
                 {'up': '', 'down': '-i '}.get(direction, '-i '),
                 binary_path))
-        LOGGER.debug('in apply wrote apply shell script')
         os.chmod(apply_file_path, 0o744)
-        LOGGER.debug('in apply made executable')
         # Execute the shell script and pipe its output to the output file
         with open(os.devnull, 'w') as devnull:
             with codecs.open(outputs_file_path, 'w', 'utf8') as outfile:
                 p = Popen(apply_file_path, shell=False, stdout=outfile, stderr=devnull)
         p.communicate()
-        LOGGER.debug('in apply called the apply shell script')
         # Parse the output file, clean up and return the parsed outputs
         with codecs.open(outputs_file_path, 'r', 'utf8') as f:
             result = self.foma_output_file2dict(f, remove_word_boundaries=boundaries)
-        LOGGER.debug('in apply wrote result to output file')
         os.remove(inputs_file_path)
         os.remove(outputs_file_path)
         os.remove(apply_file_path)
-        LOGGER.debug('in apply remove tmp files and about to return result')
         return result
 
+    # Set to ``False`` to always apply via temporary files and a fresh
+    # flookup process.
+    use_flookup_pool = True
+
     def foma_output_file2dict(self, file_, remove_word_boundaries=True):
         """Return the output file of a flookup apply request into a dictionary.
-        :param file file_: utf8-encoded file object with tab-delimited i/o
-            pairs.
+        :param file file_: utf8-encoded file object (or list of lines) with
+            tab-delimited i/o pairs.
         :param bool remove_word_boundaries: toggles whether word boundaries are
             removed in the output
         :returns: dictionary of the form ``{i1: [01, 02, ...], i2: [...],
@@ -703,6 +721,8 @@ class FomaFST(Command):
             LOGGER.debug('in compile got exception %s %s',
                          e, e.__class__.__name__)
             self.compile_message = 'Compilation attempt raised an error.'
+        # Any flookup co-processes for the old binary are now out of date.
+        FLOOKUP_POOL.evict(binary_path)
         if self.compile_succeeded:
             LOGGER.debug('in compile compile succeeded')
             os.chmod(binary_path, 0o744)
@@ -872,9 +892,11 @@ class LanguageModel(Command, Parse):
     subprocess control.
     Primary read methods are ``get_probabilities`` and ``get_probability_one``.
     Primary write methods are ``write_arpa`` and ``generate_trie``, which
-    should be called in that order and which assume appropriate values for
-    ``self.n`` and ``self.smoothing`` as well as a corpus (and possibly a
-    vocabulary) file written at ``self.get_file_path('corpus')`` (and at
+    should be called in that order (the latter writes the ARPA file's model in
+    the memory-mappable format of ``simplelm.binarylm``) and which assume
+    appropriate values for ``self.n`` and ``self.smoothing`` as well as a
+    corpus (and possibly a vocabulary) file written at
+    ``self.get_file_path('corpus')`` (and at
     ``self.get_file_path('vocabulary')``).
     .. note::
         At present, only support for the MITLM toolkit is implemented.
@@ -921,7 +943,9 @@ class LanguageModel(Command, Parse):
             self._file_type2extension.update({
                 'corpus': '.txt',
                 'arpa': '.lm',
-                'trie': '.pickle',
+                'trie': '.trie',
+                # LMTree pickles are written by earlier versions only.
+                'trie_pickle': '.pickle',
                 'vocabulary': '.vocab'
             })
             return self._file_type2extension
@@ -959,13 +983,13 @@ class LanguageModel(Command, Parse):
 
         :param list morpheme_sequence_list: a list of strings/unicode obejcts, each
             representing a morpheme.
-        :param instance trie: a simplelm.LMTree instance encoding the LM.
+        :param instance trie: a simplelm.BinaryLM instance encoding the LM.
         :returns: the log prob of the morpheme sequence.
 
         """
         if not trie:
             trie = self.trie
-        return simplelm.compute_sentence_prob(trie, morpheme_sequence_list)
+        return trie.compute_sentence_prob(morpheme_sequence_list)
 
     def write_arpa(self, timeout):
         """Write ARPA-formatted LM file to disk.
@@ -1017,33 +1041,38 @@ class LanguageModel(Command, Parse):
         return False
 
     def generate_trie(self):
-        """Load the contents of an ARPA-formatted LM file into a
-        ``simplelm.LMTree`` instance and pickle it.
+        """Convert the contents of an ARPA-formatted LM file to a binary LM
+        file (cf. ``simplelm.binarylm``) and load it.
         :returns: None; if successful, ``self.get_file_path('trie')`` points to
-            a pickled ``simplelm.LMTree`` instance.
+            a binary LM file.
         """
-        self._trie = simplelm.load_arpa(self.get_file_path('arpa'), 'utf8')
-        with open(self.get_file_path('trie'), 'wb') as fileo:
-            pickle.dump(self._trie, fileo)
+        simplelm.arpa_to_binary_lm(self.get_file_path('arpa'),
+                                   self.get_file_path('trie'), 'utf8')
+        self._trie = simplelm.BinaryLM(self.get_file_path('trie'))
 
     @property
     def trie(self):
-        """Return the ``simplelm.LMTree`` instance representing a trie
-        interface to the LM if one is available or can be generated.
+        """Return the ``simplelm.BinaryLM`` instance representing a trie
+        interface to the LM if one is available or can be generated. The LM
+        file is memory-mapped, so processes that load the same LM share its
+        pages. The pickled ``simplelm.LMTree`` of an LM generated by an earlier
+        version is converted.
         """
-        if isinstance(getattr(self, '_trie', None), simplelm.LMTree):
+        if isinstance(getattr(self, '_trie', None), simplelm.BinaryLM):
             return self._trie
-        else:
+        trie_path = self.get_file_path('trie')
+        pickle_path = self.get_file_path('trie_pickle')
+        try:
+            if not os.path.isfile(trie_path) and os.path.isfile(pickle_path):
+                simplelm.pickle_to_binary_lm(pickle_path, trie_path)
+            self._trie = simplelm.BinaryLM(trie_path)
+            return self._trie
+        except (OSError, ValueError, pickle.UnpicklingError):
             try:
-                with open(self.get_file_path('trie'), 'rb') as filei:
-                    self._trie = pickle.load(filei)
+                self.generate_trie()
                 return self._trie
-            except (FileNotFoundError, pickle.UnpicklingError):
-                try:
-                    self.generate_trie()
-                    return self._trie
-                except Exception:
-                    return None
+            except Exception:
+                return None
 
 
 class Cache:
@@ -1058,6 +1087,7 @@ class Cache:
     - ``__setitem__(k, v)``
     - ``__getitem__(k)``
     - ``get(k, default)``
+    - ``get_many(keys)``
     - ``persist()``
     """
 
@@ -1088,6 +1118,9 @@ class Cache:
     def get(self, k, default=None):
         return self._store.get(k, default)
 
+    def get_many(self, keys):
+        return {k: self._store[k] for k in keys if k in self._store}
+
     def update(self, dict_, **kwargs):
         old_keys = self._store.keys()
         self._store.update(dict_, **kwargs)
@@ -1180,11 +1213,11 @@ class MorphologicalParser(FomaFST, Parse):
         parsed = {}
         unparsed = []
         LOGGER.debug('in parse set vars')
+        cached = self.cache.get_many(transcriptions)
         for transcription in transcriptions:
             LOGGER.debug('in parse triaging %s', transcription)
-            cached_parse, cached_candidates = self.cache.get(transcription, (False, False))
-            if cached_parse is not False:
-                parsed[transcription] = cached_parse, cached_candidates
+            if transcription in cached:
+                parsed[transcription] = cached[transcription]
             else:
                 unparsed.append(transcription)
         LOGGER.debug('in parse done triage')
@@ -0,0 +1,258 @@
+# Copyright 2016 Joel Dunham
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""On-demand sampling profiler of requests.
+
+If the ``profiling_enabled`` setting is true, :func:`profiler_tween_factory`
+profiles
+
+- the requests that have an ``X-OLD-Profile: 1`` header and whose session
+  is that of a logged in administrator (the header of anyone else is
+  ignored) and
+- a ``profiling_sample_rate`` fraction (0 to 1) of all requests.
+
+A :class:`StackSampler` thread records the stack of the thread serving the
+request every ``profiling_interval`` milliseconds, which costs the request
+little (the profiled code is not traced) but misses calls shorter than the
+interval. The samples are stored in the collapsed stack format, one
+``frame;frame;...;frame count`` line per distinct stack (the input of
+``flamegraph.pl`` and speedscope), in
+``<permanent_store>/<old_name>/profiles/<id>.collapsed``, with the request's
+method, path, status and duration in ``<id>.json``. Only the
+``profiling_max_profiles`` most recent profiles of an OLD are kept. The id of
+a profile is returned in the ``X-OLD-Profile`` response header and
+administrators can get the profile from ``GET /<old_name>/profiles/<id>``
+(cf. :mod:`old.views.profiles`).
+"""
+
+from collections import Counter
+import datetime
+import glob
+import json
+import logging
+import os
+import random
+import re
+import sys
+import threading
+import time
+from uuid import uuid4
+
+from pyramid.settings import asbool
+
+from old.lib.utils import get_old_directory_path, make_directory_safely
+
+
+LOGGER = logging.getLogger(__name__)
+
+PROFILE_HEADER = 'X-OLD-Profile'
+DEFAULT_INTERVAL = 5  # milliseconds
+DEFAULT_MAX_PROFILES = 100
+PROFILE_ID_RE = re.compile(r'^\d{8}T\d{12}-[0-9a-f]{8}$')
+
+
+def get_frame_name(frame):
+    """Return the name of ``frame``'s function in a collapsed stack, e.g.,
+    ``old.lib.SQLAQueryBuilder:SQLAQueryBuilder.get_SQLA_query:1234``.
+    """
+    code = frame.f_code
+    return '%s:%s:%d' % (
+        frame.f_globals.get('__name__', '?'),
+        getattr(code, 'co_qualname', code.co_name),
+        code.co_firstlineno)
+
+
+def collapse(frame):
+    """Return the collapsed stack of ``frame``, outermost frame first."""
+    names = []
+    while frame is not None:
+        names.append(get_frame_name(frame).replace(';', ',')
+                     .replace(' ', '_'))
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+class StackSampler(object):
+    """A thread that counts the stacks of the thread ``thread_id`` every
+    ``interval`` seconds until it is stopped.
+    """
+
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True,
+                                        name='old-profiler')
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+        return self
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                self.stacks[collapse(frame)] += 1
+                self.samples += 1
+
+    def to_collapsed(self):
+        return ''.join('%s %d\n' % (stack, count)
+                       for stack, count in sorted(self.stacks.items()))
+
+
+###############################################################################
+# Storage
+###############################################################################
+
+def get_profiles_path(settings, old_name):
+    return get_old_directory_path('profiles', dict(settings, old_name=old_name))
+
+
+def new_profile_id():
+    """Return a new profile id; ids sort chronologically."""
+    return '%s-%s' % (datetime.datetime.utcnow().strftime('%Y%m%dT%H%M%S%f'),
+                      uuid4().hex[:8])
+
+
+def save_profile(settings, old_name, sampler, meta):
+    """Store the samples of ``sampler`` and ``meta`` as a new profile of the
+    OLD ``old_name``, delete the profiles beyond the retention cap and return
+    the id of the new profile.
+    """
+    directory = get_profiles_path(settings, old_name)
+    make_directory_safely(directory)
+    profile_id = new_profile_id()
+    meta = dict(meta, id=profile_id, samples=sampler.samples,
+                interval=int(sampler.interval * 1000))
+    with open(os.path.join(directory, profile_id + '.collapsed'), 'w') as file_:
+        file_.write(sampler.to_collapsed())
+    with open(os.path.join(directory, profile_id + '.json'), 'w') as file_:
+        json.dump(meta, file_)
+    try:
+        max_profiles = max(1, int(settings.get('profiling_max_profiles',
+                                               DEFAULT_MAX_PROFILES)))
+    except ValueError:
+        max_profiles = DEFAULT_MAX_PROFILES
+    for old_id in get_profile_ids(settings, old_name)[:-max_profiles]:
+        delete_profile(settings, old_name, old_id)
+    return profile_id
+
+
+def get_profile_ids(settings, old_name):
+    """Return the ids of the stored profiles of ``old_name``, oldest
+    first.
+    """
+    directory = get_profiles_path(settings, old_name)
+    return sorted(os.path.basename(path)[:-len('.json')] for path in
+                  glob.glob(os.path.join(directory, '*.json')))
+
+
+def get_profile_meta(settings, old_name, profile_id):
+    path = os.path.join(get_profiles_path(settings, old_name),
+                        profile_id + '.json')
+    with open(path) as file_:
+        return json.load(file_)
+
+
+def get_profile_path(settings, old_name, profile_id):
+    """Return the path of the collapsed stacks of the profile ``profile_id``
+    or ``None`` if there is no such profile.
+    """
+    if not PROFILE_ID_RE.match(profile_id or ''):
+        return None
+    path = os.path.join(get_profiles_path(settings, old_name),
+                        profile_id + '.collapsed')
+    return path if os.path.isfile(path) else None
+
+
+def delete_profile(settings, old_name, profile_id):
+    directory = get_profiles_path(settings, old_name)
+    for extension in ('.collapsed', '.json'):
+        try:
+            os.remove(os.path.join(directory, profile_id + extension))
+        except OSError:
+            pass
+
+
+###############################################################################
+# Tween
+###############################################################################
+
+def _is_administrator(request):
+    try:
+        return request.session.get('user', {}).get('role') == 'administrator'
+    except Exception:  # e.g., there is no OLD
+        return False
+
+
+def profiler_tween_factory(handler, registry):
+    """Return a tween that profiles the requests selected by the profiling
+    settings, cf. the module docstring.
+    """
+    settings = registry.settings
+
+    def profiler_tween(request):
+        if not asbool(settings.get('profiling_enabled', False)):
+            return handler(request)
+        # Only the header of a logged in administrator starts the sampler.
+        requested = (request.headers.get(PROFILE_HEADER) == '1' and
+                     _is_administrator(request))
+        try:
+            sample_rate = float(settings.get('profiling_sample_rate') or 0)
+        except ValueError:
+            sample_rate = 0
+        sampled = sample_rate > 0 and random.random() < sample_rate
+        if not (requested or sampled):
+            return handler(request)
+        try:
+            interval = float(settings.get('profiling_interval') or
+                             DEFAULT_INTERVAL) / 1000
+        except ValueError:
+            interval = DEFAULT_INTERVAL / 1000
+        sampler = StackSampler(threading.get_ident(), interval).start()
+        start = time.time()
+        try:
+            response = handler(request)
+        finally:
+            sampler.stop()
+        duration = time.time() - start
+        old_name = (request.matchdict or {}).get('old_name')
+        if not old_name:
+            return response
+        route = getattr(request, 'matched_route', None)
+        try:
+            profile_id = save_profile(settings, old_name, sampler, {
+                'method': request.method,
+                'path': request.path,
+                'route': route.name if route else None,
+                'status': response.status_int,
+                'duration': round(duration, 6),
+                'datetime': datetime.datetime.utcnow().isoformat()})
+        except OSError as error:
+            LOGGER.warning('Unable to save the profile of %s %s: %s',
+                           request.method, request.path, error)
+            return response
+        response.headers[PROFILE_HEADER] = profile_id
+        LOGGER.info('Profiled %s %s in %d samples as %s.', request.method,
+                    request.path, sampler.samples, profile_id)
+        return response
+
+    return profiler_tween
@@ -0,0 +1,253 @@
+# Copyright 2016 Joel Dunham
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""Accounting of the SQL statements that a request issues.
+
+A :class:`QueryStats` instance counts the statements executed by the current
+thread while it is being collected (cf. :func:`collect`), the time spent
+executing them and how many times each statement *shape* (its SQL, in which
+the values are already bind parameters) is repeated. A shape that is
+repeated :data:`N_PLUS_ONE_THRESHOLD` or more times is probably an N+1
+pattern: typically the lazy load of a relationship of each model of a page,
+e.g., ``SELECT ... FROM tag, formtag WHERE ? = formtag.form_id ...`` for
+``Form.tags``. The relationships whose lazy loads look like a repeated shape
+are reported with it.
+
+If the ``debug_queries`` setting is true, :func:`query_stats_tween_factory`
+collects the statements of every request, returns the totals in the
+``X-OLD-Query-Count``, ``X-OLD-Query-Time`` (milliseconds),
+``X-OLD-Query-Shapes`` and (if any) ``X-OLD-Query-N-Plus-One`` response
+headers, and logs the probable N+1 patterns as warnings.
+"""
+
+from collections import Counter
+from contextlib import contextmanager
+import logging
+import re
+import threading
+import time
+
+from pyramid.settings import asbool
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import class_mapper
+
+from old.models.meta import Base
+
+
+LOGGER = logging.getLogger(__name__)
+
+# A statement shape executed this many times in a request is flagged as a
+# probable N+1 pattern.
+N_PLUS_ONE_THRESHOLD = 10
+
+IN_LIST_RE = re.compile(r'\((?:\s*(?:\?|%s)\s*,)+\s*(?:\?|%s)\s*\)')
+PARAM = r'(?:\?|%s|%\(\w+\)s|:\w+)'
+COLUMN = r'[`"]?(\w+)[`"]?\.[`"]?(\w+)[`"]?'
+BOUND_COLUMN_RE = re.compile(r'%s\s*=\s*%s|%s\s*=\s*%s' % (
+    COLUMN, PARAM, PARAM, COLUMN))
+
+
+def get_shape(statement):
+    """Return the shape of ``statement``: its whitespace normalized and its
+    lists of ``IN`` parameters collapsed (they vary in length).
+    """
+    return IN_LIST_RE.sub('(?...)', ' '.join(statement.split()))
+
+
+class QueryStats(object):
+    """The statements executed while collecting, their total duration and
+    the number of executions of each shape.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.shapes = Counter()
+
+    def record(self, statement, seconds):
+        self.count += 1
+        self.seconds += seconds
+        self.shapes[get_shape(statement)] += 1
+
+    def get_n_plus_one(self, threshold=N_PLUS_ONE_THRESHOLD):
+        """Return a list of ``(shape, count, relationships)`` triples, one for
+        each shape executed at least ``threshold`` times, most repeated
+        first; ``relationships`` are the names (e.g., ``'Form.tags'``) of
+        the relationships whose lazy loads have that shape.
+        """
+        return [(shape, count, get_lazy_load_relationships(shape))
+                for shape, count in self.shapes.most_common()
+                if count >= threshold]
+
+    def get_headers(self):
+        headers = {
+            'X-OLD-Query-Count': str(self.count),
+            'X-OLD-Query-Time': '%.1f' % (1000 * self.seconds),
+            'X-OLD-Query-Shapes': str(len(self.shapes)),
+        }
+        n_plus_one = self.get_n_plus_one()
+        if n_plus_one:
+            headers['X-OLD-Query-N-Plus-One'] = '; '.join(
+                '%s=%d' % (' or '.join(relationships) or 'unknown', count)
+                for _, count, relationships in n_plus_one)
+        return headers
+
+
+###############################################################################
+# Collection
+###############################################################################
+
+_ACTIVE = threading.local()
+START_TIMES_KEY = 'old_query_stats_start_times'
+
+
+def _get_active():
+    try:
+        return _ACTIVE.stats
+    except AttributeError:
+        _ACTIVE.stats = []
+        return _ACTIVE.stats
+
+
+@contextmanager
+def collect(stats=None):
+    """Record the statements that the current thread executes in the block in
+    ``stats`` (a new :class:`QueryStats` by default), which is yielded.
+    Collections can be nested.
+    """
+    if stats is None:
+        stats = QueryStats()
+    active = _get_active()
+    active.append(stats)
+    try:
+        yield stats
+    finally:
+        active.remove(stats)
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def start_timer(conn, cursor, statement, parameters, context, executemany):
+    # pylint: disable=unused-argument,too-many-arguments
+    if _get_active():
+        conn.info.setdefault(START_TIMES_KEY, []).append(time.time())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def record_statement(conn, cursor, statement, parameters, context,
+                     executemany):
+    # pylint: disable=unused-argument,too-many-arguments
+    active = _get_active()
+    start_times = conn.info.get(START_TIMES_KEY)
+    if not active or not start_times:
+        return
+    seconds = time.time() - start_times.pop()
+    for stats in active:
+        stats.record(statement, seconds)
+
+
+@event.listens_for(Engine, 'handle_error')
+def discard_timer(exception_context):
+    """Discard the start time of a statement that failed, so that it is not
+    taken for the start time of the connection's next statement.
+    """
+    connection = exception_context.connection
+    if connection is None:
+        return
+    start_times = connection.info.get(START_TIMES_KEY)
+    if start_times:
+        start_times.pop()
+
+
+###############################################################################
+# Lazy load shapes
+###############################################################################
+
+LAZY_LOAD_SIGNATURES = None
+
+
+def _get_lazy_load_signatures():
+    """Return a list of ``(signature, relationship name)`` pairs where the
+    signature of a relationship is the set of ``'table.column'`` strings that
+    its lazy loads compare with bind parameters: the foreign key of a
+    one-to-many relationship, the primary key of the target of a many-to-one
+    relationship or the parent's column of the association table of a
+    many-to-many relationship.
+    """
+    global LAZY_LOAD_SIGNATURES
+    if LAZY_LOAD_SIGNATURES is not None:
+        return LAZY_LOAD_SIGNATURES
+    signatures = []
+    for name, model_cls in sorted(Base._decl_class_registry.items()):
+        if not isinstance(model_cls, type):
+            continue  # the registry's module registry
+        mapper = class_mapper(model_cls)
+        for relationship in mapper.relationships:
+            signature = frozenset(
+                '%s.%s' % (remote.table.name, remote.name)
+                for local, remote in relationship.local_remote_pairs
+                if relationship.secondary is None or
+                local.table is mapper.local_table)
+            signatures.append((signature, '%s.%s' % (name, relationship.key)))
+    LAZY_LOAD_SIGNATURES = signatures
+    return signatures
+
+
+def get_bound_columns(shape):
+    """Return the set of ``'table.column'`` strings that ``shape`` compares
+    with bind parameters.
+    """
+    columns = set()
+    for match in BOUND_COLUMN_RE.finditer(shape):
+        groups = match.groups()
+        table, column = groups[:2] if groups[0] else groups[2:]
+        columns.add('%s.%s' % (table, column))
+    return columns
+
+
+def get_lazy_load_relationships(shape):
+    """Return the sorted names of the relationships whose lazy loads could
+    have produced ``shape``.
+    """
+    if not shape.lstrip().upper().startswith('SELECT'):
+        return []
+    columns = get_bound_columns(shape)
+    return sorted(name for signature, name in _get_lazy_load_signatures()
+                  if signature and signature == columns)
+
+
+###############################################################################
+# Tween
+###############################################################################
+
+def query_stats_tween_factory(handler, registry):
+    """Return a tween that, if the ``debug_queries`` setting is true, adds the
+    query accounting headers to the responses and logs probable N+1
+    patterns.
+    """
+
+    def query_stats_tween(request):
+        if not asbool(registry.settings.get('debug_queries', False)):
+            return handler(request)
+        with collect() as stats:
+            response = handler(request)
+        response.headers.update(stats.get_headers())
+        for shape, count, relationships in stats.get_n_plus_one():
+            LOGGER.warning(
+                'Probable N+1 queries in %s %s: %d x %s (%s)', request.method,
+                request.path, count, shape,
+                ', '.join(relationships) or 'unknown relationship')
+        return response
+
+    return query_stats_tween
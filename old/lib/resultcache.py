@@ -0,0 +1,309 @@
+# Copyright 2016 Joel Dunham
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""Process-level cache of the serialized (JSON) responses of the ``index``
+and ``search`` actions of the resource views, cf.
+``ReadonlyResources._get_cached_result``. The cache is opt-in: it is only
+used if the ``result_cache_max_mb`` setting is greater than 0, and it holds
+at most that many megabytes of responses, evicting the least recently used.
+
+Responses are keyed by OLD (i.e., tenant), resource, action, normalized
+request parameters (the JSON query and paginator, or the GET parameters) and
+the restriction class of the user (cf.
+``ReadonlyResources._get_result_cache_restriction``).
+
+Each response is stored with the watermarks of the tables its results are
+built from (:func:`get_dependent_tables`): the model's table and those of
+its relations, two levels deep. A cached response is only returned if these
+watermarks are unchanged, so a write to, e.g., the ``translation`` table
+invalidates the cached form searches but not the cached searches over
+sources. A table's watermark (:func:`get_watermark`) combines
+
+- its greatest id (inserts),
+- its latest ``datetime_modified`` value (updates), except for association
+  tables (e.g., ``formtag``), whose rows are only inserted and deleted and
+  whose ``datetime_modified`` columns are not indexed,
+- the id of its latest tombstone (deletes, cf. :mod:`old.lib.sync`) and
+- the number of committed transactions of this process that wrote to it,
+  which makes the writes of this process visible even if they leave the
+  above unchanged.
+
+The first three are read with a single query, so the writes of other
+processes are noticed too. (The ``language`` table has neither
+``datetime_modified`` values nor tombstones, but it is never written to.)
+The deletes of a database without a tombstone table cannot be noticed, so
+its responses are not cached.
+
+The headers that are set while a response is built (e.g.,
+``X-OLD-Search-Plan``) are cached with it and returned with it.
+"""
+
+from collections import OrderedDict
+import logging
+import threading
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import class_mapper
+from sqlalchemy.sql import func, select
+from sqlalchemy.sql.expression import Delete, Insert, Update
+
+from old.lib.metrics import register_collector
+from old.lib.sync import has_tombstone_table
+from old.lib.tenantcache import get_tenant_key
+import old.models as old_models
+from old.models.meta import Base
+
+
+LOGGER = logging.getLogger(__name__)
+
+# Depth of the relations whose tables a cached response depends on: the
+# dicts of the models include those of their related models, which may
+# include those of theirs.
+DEPENDENCY_DEPTH = 2
+
+
+class ResultCache(object):
+    """A thread-safe map from request keys to ``(watermark, body, headers)``
+    triples that holds at most ``max_bytes`` bytes of bodies, evicting the
+    least recently used.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.stats = {'hits': 0, 'misses': 0, 'stale': 0, 'evictions': 0}
+        self._store = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._store)
+
+    def get(self, key, watermark):
+        """Return the ``(body, headers)`` pair cached for ``key`` if it was
+        cached as of ``watermark``, else ``None``.
+        """
+        with self._lock:
+            try:
+                cached_watermark, body, headers = self._store[key]
+            except KeyError:
+                self.stats['misses'] += 1
+                return None
+            if cached_watermark != watermark:
+                self._pop(key)
+                self.stats['stale'] += 1
+                self.stats['misses'] += 1
+                return None
+            self._store.move_to_end(key)
+            self.stats['hits'] += 1
+            return body, headers
+
+    def put(self, key, watermark, body, headers=()):
+        """Cache ``body`` and ``headers`` (a sequence of name/value pairs)
+        for ``key`` as of ``watermark``.
+        """
+        if len(body) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._store:
+                self._pop(key)
+            self._store[key] = watermark, body, tuple(headers)
+            self.bytes += len(body)
+            while self.bytes > self.max_bytes:
+                self._pop(next(iter(self._store)))
+                self.stats['evictions'] += 1
+
+    def _pop(self, key):
+        _, body, _ = self._store.pop(key)
+        self.bytes -= len(body)
+
+    def get_stats(self):
+        """Return the hit, miss, stale (i.e., invalidated) and eviction counts
+        of this cache, its hit rate and its size.
+        """
+        with self._lock:
+            stats = dict(self.stats, entries=len(self._store),
+                         bytes=self.bytes, max_bytes=self.max_bytes)
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = stats['hits'] / lookups if lookups else None
+        return stats
+
+    def clear(self):
+        with self._lock:
+            self._store.clear()
+            self.bytes = 0
+
+
+RESULT_CACHE = None
+RESULT_CACHE_LOCK = threading.Lock()
+
+
+def get_result_cache(settings):
+    """Return the result cache shared by all of the threads (and OLDs) of this
+    process, or ``None`` if the ``result_cache_max_mb`` setting is 0 (the
+    default).
+    """
+    global RESULT_CACHE
+    try:
+        max_bytes = int(float(settings.get('result_cache_max_mb') or 0) *
+                        1024 * 1024)
+    except ValueError:
+        max_bytes = 0
+    if max_bytes <= 0:
+        return None
+    with RESULT_CACHE_LOCK:
+        if RESULT_CACHE is None:
+            RESULT_CACHE = ResultCache(max_bytes)
+        RESULT_CACHE.max_bytes = max_bytes
+        return RESULT_CACHE
+
+
+@register_collector
+def collect_result_cache_metrics(registry):
+    cache = RESULT_CACHE
+    if cache is None:
+        return
+    stats = cache.get_stats()
+    lookups = registry.counter(
+        'old_result_cache_lookups_total', 'Result cache lookups.',
+        ('result',))
+    lookups.set(stats['hits'], result='hit')
+    lookups.set(stats['misses'], result='miss')
+    registry.counter(
+        'old_result_cache_stale_total',
+        'Cached results invalidated by writes to their tables.').set(
+            stats['stale'])
+    registry.counter(
+        'old_result_cache_evictions_total',
+        'Cached results evicted to make room.').set(stats['evictions'])
+    registry.gauge('old_result_cache_entries',
+                   'Responses in the result cache.').set(stats['entries'])
+    registry.gauge('old_result_cache_bytes',
+                   'Bytes of responses in the result cache.').set(
+                       stats['bytes'])
+
+
+###############################################################################
+# Watermarks
+###############################################################################
+
+DEPENDENT_TABLES = {}
+
+
+def get_dependent_tables(model_name):
+    """Return the sorted names of the tables that the dicts of the
+    ``model_name`` models are built from.
+    """
+    try:
+        return DEPENDENT_TABLES[model_name]
+    except KeyError:
+        pass
+    tables = set()
+    mappers = [class_mapper(getattr(old_models, model_name))]
+    for _ in range(DEPENDENCY_DEPTH + 1):
+        related = []
+        for mapper in mappers:
+            tables.add(mapper.local_table.name)
+            for relationship in mapper.relationships:
+                if relationship.secondary is not None:
+                    tables.add(relationship.secondary.name)
+                related.append(relationship.mapper)
+        mappers = related
+    DEPENDENT_TABLES[model_name] = tables = tuple(sorted(tables))
+    return tables
+
+
+ASSOCIATION_TABLES = None
+
+
+def get_association_tables():
+    """Return the set of the names of the association tables of the
+    many-to-many relationships of the models.
+    """
+    global ASSOCIATION_TABLES
+    if ASSOCIATION_TABLES is not None:
+        return ASSOCIATION_TABLES
+    tables = set()
+    for model_cls in Base._decl_class_registry.values():
+        if not isinstance(model_cls, type):
+            continue  # the registry's module registry
+        for relationship in class_mapper(model_cls).relationships:
+            if relationship.secondary is not None:
+                tables.add(relationship.secondary.name)
+    ASSOCIATION_TABLES = tables
+    return tables
+
+
+def get_watermark(dbsession, table_names):
+    """Return the watermark of the tables named ``table_names`` in the
+    database of ``dbsession``: a tuple that changes whenever a row of one of
+    the tables is inserted, updated or deleted. Return ``None`` if the
+    database has no tombstone table, i.e., if deletes cannot be noticed.
+    """
+    if not has_tombstone_table(dbsession.connection()):
+        return None
+    tables = Base.metadata.tables
+    tombstone = tables['tombstone']
+    association_tables = get_association_tables()
+    scalars = []
+    for table_name in table_names:
+        table = tables[table_name]
+        scalars.append(select([func.max(table.c.id)]))
+        if ('datetime_modified' in table.c and
+                table_name not in association_tables):
+            scalars.append(select([func.max(table.c.datetime_modified)]))
+        scalars.append(select([func.max(tombstone.c.id)]).where(
+            tombstone.c.table_name == table_name))
+    watermark = tuple(dbsession.execute(
+        select([scalar.as_scalar() for scalar in scalars])).first())
+    tenant = get_tenant_key(dbsession)
+    return watermark + tuple(GENERATIONS.get((tenant, table_name), 0)
+                             for table_name in table_names)
+
+
+# Maps (tenant, table name) pairs to the number of committed transactions of
+# this process that wrote to the table.
+GENERATIONS = {}
+GENERATIONS_LOCK = threading.Lock()
+WRITTEN_TABLES_KEY = 'old_result_cache_written_tables'
+
+
+@event.listens_for(Engine, 'before_execute')
+def record_written_table(connection, clauseelement, multiparams, params):
+    """Remember the tables that the current transaction of ``connection``
+    writes to (if results are being cached).
+    """
+    # pylint: disable=unused-argument
+    if RESULT_CACHE is None or not isinstance(
+            clauseelement, (Insert, Update, Delete)):
+        return
+    connection.info.setdefault(WRITTEN_TABLES_KEY, set()).add(
+        clauseelement.table.name)
+
+
+@event.listens_for(Engine, 'commit')
+def advance_generations(connection):
+    tables = connection.info.pop(WRITTEN_TABLES_KEY, None)
+    if not tables:
+        return
+    tenant = get_tenant_key(connection)
+    with GENERATIONS_LOCK:
+        for table_name in tables:
+            key = tenant, table_name
+            GENERATIONS[key] = GENERATIONS.get(key, 0) + 1
+
+
+@event.listens_for(Engine, 'rollback')
+def forget_written_tables(connection):
+    connection.info.pop(WRITTEN_TABLES_KEY, None)
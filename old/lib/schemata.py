@@ -211,7 +211,7 @@ class ValidMorphemeBreakTranscription(UnicodeString):
     def _validate_python(self, value, state):
         transcription = h.to_single_space(h.normalize(value))
         morpheme_break_is_orthographic = (
-            state.db.current_app_set.morpheme_break_is_orthographic)
+            state.db.app_settings.morpheme_break_is_orthographic)
         inventory = 'phonemic inventory'
         if morpheme_break_is_orthographic:
             inventory = 'storage orthography'
@@ -233,11 +233,8 @@ def form_is_foreign_word(form_dict, db):
     """
     tag_ids = [h.get_int(id) for id in form_dict.get('tags', [])]
     tag_ids = [id for id in tag_ids if id]
-    try:
-        foreign_word_tag_id = db.get_foreign_word_tag().id
-    except AttributeError:
-        foreign_word_tag_id = None
-    if foreign_word_tag_id in tag_ids:
+    foreign_word_tag_id = db.get_foreign_word_tag_id()
+    if foreign_word_tag_id and foreign_word_tag_id in tag_ids:
         return True
     return False
 
@@ -251,8 +248,8 @@ def transcription_is_valid(db, transcription, validation_name, inventory_name):
     attribute of the Application Settings meta object whose value is the
     appropriate Inventory object for the transcription.
     """
-    if getattr(db.current_app_set, validation_name, None) == 'Error':
-        inv = db.current_app_set.get_transcription_inventory(inventory_name, db)
+    if getattr(db.app_settings, validation_name, None) == 'Error':
+        inv = db.get_transcription_inventory(inventory_name)
         return inv.string_is_valid(transcription)
     return True
 
@@ -300,9 +297,10 @@ class ValidOLDModelObject(FancyValidator):
             else:
                 if (    self.model_name in ('Form', 'File', 'Collection') and
                         getattr(state, 'user', None)):
-                    unrestricted_users = state.db.get_unrestricted_users()
+                    unrestricted_user_ids = (
+                        state.db.get_unrestricted_user_ids())
                     if state.user.is_authorized_to_access_model(
-                            model_object, unrestricted_users):
+                            model_object, unrestricted_user_ids):
                         return model_object
                     else:
                         model_name_eng=h.camel_case2lower_space(self.model_name)
@@ -547,9 +545,10 @@ class ValidAudioVideoFile(FancyValidator):
             else:
                 if h.is_audio_video_file(file_object):
                     if file_object.parent_file is None:
-                        unrestricted_users = state.db.get_unrestricted_users()
+                        unrestricted_user_ids = \
+                            state.db.get_unrestricted_user_ids()
                         if state.user.is_authorized_to_access_model(
-                                file_object, unrestricted_users):
+                                file_object, unrestricted_user_ids):
                             return file_object
                         else:
                             raise Invalid(
@@ -1311,6 +1310,7 @@ class CorpusFormatSchema(Schema):
     allow_extra_fields = True
     filter_extra_fields = True
     format = OneOf(oldc.CORPUS_FORMATS.keys(), not_empty=True)
+    mode = OneOf(oldc.CORPUS_EXPORT_MODES, if_missing=None)
 
 
 class MorphologyRules(UnicodeString):
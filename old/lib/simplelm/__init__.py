@@ -29,5 +29,12 @@
 # Python package out of Novak's SimpleLM project. 
 
 from .evaluatelm import load_arpa, compute_sentence_prob, LMTree
+from .binarylm import (
+    BinaryLM,
+    arpa_to_binary_lm,
+    lmtree_to_binary_lm,
+    pickle_to_binary_lm,
+)
 
-__all__ = ['load_arpa', 'compute_sentence_prob', 'LMTree']
+__all__ = ['load_arpa', 'compute_sentence_prob', 'LMTree', 'BinaryLM',
+           'arpa_to_binary_lm', 'lmtree_to_binary_lm', 'pickle_to_binary_lm']
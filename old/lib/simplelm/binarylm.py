@@ -0,0 +1,380 @@
+# Copyright 2016 Joel Dunham
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""Compact, memory-mappable binary format for n-gram language models.
+
+An :class:`LMTree` holds one Python object (and one dict) per n-gram and has
+to be unpickled in full by every process that uses it. A binary LM file holds
+the same model in flat arrays that are ``mmap``-ed read-only, so that loading
+is (nearly) free and all of the processes that use a model share its pages.
+
+File layout (little-endian, sections aligned to 8 bytes):
+
+- header: magic, format version, maximum order, vocabulary size and the
+  number of n-grams of each order;
+- vocabulary: the words, UTF-8 encoded and sorted bytewise, as an array of
+  ``vocabulary size + 1`` uint32 offsets into a blob; a word's id is its rank;
+- for each order ``n``: except for unigrams, whose indices are their word
+  ids, the sorted uint64 keys of the n-grams, where an n-gram's key is
+  ``index of its (n-1)-gram prefix * vocabulary size + id of its last word``;
+  then ``count`` float32 (log10) probabilities and, except for the maximum
+  order, ``count`` float32 backoff weights (in key order).
+
+An n-gram is thus found by one binary search (``bisect``, in C) per word. As
+in an :class:`LMTree` built by
+:func:`load_arpa`, every prefix of an n-gram and every word is itself an
+n-gram of the model (with probability and backoff 0.0 if it is not in the
+source model), so scores are the same as those of
+:func:`compute_sentence_prob`, up to float32 rounding.
+
+Usage::
+
+    arpa_to_binary_lm('lm.arpa', 'lm.bin')      # or pickle_to_binary_lm
+    lm = BinaryLM('lm.bin')
+    lm.compute_sentence_prob(['<s>', 'a', 'b', '</s>'])
+
+Files are written to a temporary path and then renamed so that processes that
+have mapped a previous version of a file are unaffected by its replacement.
+"""
+
+from array import array
+from bisect import bisect_left
+import codecs
+import mmap
+import os
+import pickle
+import re
+import struct
+import sys
+
+from .evaluatelm import LMTree
+
+
+MAGIC = b'OLDNGLM\x00'
+VERSION = 1
+HEADER = struct.Struct('<8sIII')
+ALIGNMENT = 8
+# Bound on the number of memoized word ids per loaded model.
+MAX_MEMOIZED_IDS = 100000
+
+
+def _align(offset):
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+
+def _to_little_endian(values):
+    if sys.byteorder != 'little':
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values
+
+
+class BinaryLM(object):
+    """A read-only n-gram LM backed by a memory-mapped binary LM file. It
+    provides the read interface of :class:`LMTree` (``max_order`` and
+    ``get_ngram_p``) as well as a faster :meth:`compute_sentence_prob`.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as filei:
+            self._mmap = mmap.mmap(filei.fileno(), 0, access=mmap.ACCESS_READ)
+        self._views = []
+        buffer_ = memoryview(self._mmap)
+        self._views.append(buffer_)
+        try:
+            magic, version, self.max_order, self.vocab_size = \
+                HEADER.unpack_from(buffer_, 0)
+        except struct.error:
+            magic = version = None
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ValueError('%s is not a binary n-gram LM file.' % path)
+        offset = HEADER.size
+        counts = struct.unpack_from('<%dI' % self.max_order, buffer_, offset)
+        offset = _align(offset + 4 * self.max_order)
+        self._vocab_offsets, offset = self._section(
+            buffer_, offset, 'I', self.vocab_size + 1)
+        blob_length = self._vocab_offsets[-1]
+        self._vocab_blob = buffer_[offset:offset + blob_length]
+        self._views.append(self._vocab_blob)
+        offset = _align(offset + blob_length)
+        # Order n's (keys, probabilities, backoffs) at index n.
+        self._orders = [None]
+        for order, count in enumerate(counts, 1):
+            keys = None
+            if order > 1:
+                keys, offset = self._section(buffer_, offset, 'Q', count)
+            probs, offset = self._section(buffer_, offset, 'f', count)
+            bows = None
+            if order < self.max_order:
+                bows, offset = self._section(buffer_, offset, 'f', count)
+            self._orders.append((keys, probs, bows))
+        self._ids = {}
+
+    def _section(self, buffer_, offset, typecode, length):
+        """Return a typed view of the ``length`` items that start at
+        ``offset`` in ``buffer_`` and the offset of the next section.
+        """
+        size = struct.calcsize(typecode) * length
+        view = buffer_[offset:offset + size]
+        if sys.byteorder == 'little':
+            view = view.cast(typecode)
+        else:
+            view = array(typecode, view.tobytes())
+            view.byteswap()
+        self._views.append(view)
+        return view, _align(offset + size)
+
+    def close(self):
+        for view in reversed(self._views):
+            if isinstance(view, memoryview):
+                view.release()
+        self._views = []
+        self._orders = []
+        self._mmap.close()
+
+    def __getstate__(self):
+        return {'path': self.path}
+
+    def __setstate__(self, state):
+        self.__init__(state['path'])
+
+    def word(self, id_):
+        offsets = self._vocab_offsets
+        return self._vocab_blob[offsets[id_]:offsets[id_ + 1]]\
+            .tobytes().decode('utf8')
+
+    def word_id(self, word):
+        """Return the id of ``word`` or ``None`` if it is not in the
+        vocabulary.
+        """
+        try:
+            return self._ids[word]
+        except KeyError:
+            pass
+        key = word.encode('utf8')
+        offsets = self._vocab_offsets
+        blob = self._vocab_blob
+        low, high = 0, self.vocab_size
+        while low < high:
+            middle = (low + high) // 2
+            if blob[offsets[middle]:offsets[middle + 1]].tobytes() < key:
+                low = middle + 1
+            else:
+                high = middle
+        id_ = None
+        if (low < self.vocab_size and
+                blob[offsets[low]:offsets[low + 1]].tobytes() == key):
+            id_ = low
+        if len(self._ids) >= MAX_MEMOIZED_IDS:
+            self._ids.clear()
+        self._ids[word] = id_
+        return id_
+
+    def _get_ngram_p(self, ids):
+        """Cf. :meth:`get_ngram_p`; ``ids`` are word ids."""
+        bow = 0.0
+        index = -1
+        for order, id_ in enumerate(ids, 1):
+            if order > self.max_order or id_ is None:
+                return bow, False
+            keys, _, bows = self._orders[order]
+            if keys is None:
+                index = id_
+            else:
+                key = index * self.vocab_size + id_
+                index = bisect_left(keys, key)
+                if index == len(keys) or keys[index] != key:
+                    return bow, False
+            bow = 0.0 if bows is None else bows[index]
+        if not ids:
+            return 0.0, True
+        return self._orders[len(ids)][1][index], True
+
+    def get_ngram_p(self, ngram, i=0):
+        """Return the probability of the n-gram ``ngram[i:]`` (a list of
+        words) and ``True`` if it is in the model. Otherwise, return the
+        backoff weight of its longest prefix in the model and ``False``. Cf.
+        :meth:`LMTree.get_ngram_p`.
+        """
+        return self._get_ngram_p([self.word_id(word) for word in ngram[i:]])
+
+    def compute_sentence_prob(self, sentence):
+        """Return the log10 probability of ``sentence``, a list of words. Cf.
+        :func:`compute_sentence_prob`; unlike it, this does not consume
+        ``sentence``.
+        """
+        ids = [self.word_id(word) for word in sentence]
+        total = 0.0
+        ngram = ids[:1]
+        for id_ in ids[1:]:
+            # A history longer than the maximum order backs off with weight
+            # 0.0 anyway, so it is truncated up front.
+            if len(ngram) >= self.max_order:
+                del ngram[0]
+            ngram.append(id_)
+            prob, is_prob = self._get_ngram_p(ngram)
+            total += prob
+            while not is_prob:
+                del ngram[0]
+                prob, is_prob = self._get_ngram_p(ngram)
+                total += prob
+        return total
+
+
+###############################################################################
+# Converters
+###############################################################################
+
+def write_binary_lm(ngrams, path, max_order=None):
+    """Write the n-grams in ``ngrams`` to a binary LM file at ``path``.
+
+    :param iterable ngrams: ``(words, prob, bow)`` triples where ``words`` is
+        a tuple of strings; the first triple for a given n-gram wins.
+    :param str path: the path of the file to write.
+    :param int max_order: the order of the model; defaults to the length of
+        the longest n-gram.
+    """
+    orders = {}
+    for words, prob, bow in ngrams:
+        orders.setdefault(len(words), {}).setdefault(tuple(words), (prob, bow))
+    if not orders:
+        raise ValueError('Cannot write a language model with no n-grams.')
+    max_order = max([max_order or 0] + list(orders))
+    # Make every prefix of an n-gram and every word an n-gram of the model.
+    for order in range(max_order, 1, -1):
+        for words in list(orders.get(order, ())):
+            orders.setdefault(order - 1, {}).setdefault(words[:-1], (0.0, 0.0))
+            orders.setdefault(1, {}).setdefault(words[-1:], (0.0, 0.0))
+    vocabulary = sorted((words[0] for words in orders.get(1, ())),
+                        key=lambda word: word.encode('utf8'))
+    vocab_size = len(vocabulary)
+    encoded = [word.encode('utf8') for word in vocabulary]
+    vocab_offsets = array('I', [0])
+    for word in encoded:
+        vocab_offsets.append(vocab_offsets[-1] + len(word))
+    sections = [_to_little_endian(vocab_offsets).tobytes(), b''.join(encoded)]
+    counts = []
+    word_ids = {word: id_ for id_, word in enumerate(vocabulary)}
+    # The indices of the n-grams of the previous order.
+    indices = {}
+    for order in range(1, max_order + 1):
+        if order == 1:
+            entries = sorted((word_ids[words[0]], prob, bow, words)
+                             for words, (prob, bow) in orders[1].items())
+        else:
+            entries = sorted(
+                (indices[words[:-1]] * vocab_size + word_ids[words[-1]],
+                 prob, bow, words)
+                for words, (prob, bow) in orders.get(order, {}).items())
+            sections.append(_to_little_endian(
+                array('Q', [entry[0] for entry in entries])).tobytes())
+        indices = {entry[3]: index for index, entry in enumerate(entries)}
+        counts.append(len(entries))
+        sections.append(_to_little_endian(
+            array('f', [entry[1] for entry in entries])).tobytes())
+        if order < max_order:
+            sections.append(_to_little_endian(
+                array('f', [entry[2] for entry in entries])).tobytes())
+    header = (HEADER.pack(MAGIC, VERSION, max_order, vocab_size) +
+              struct.pack('<%dI' % max_order, *counts))
+    tmp_path = '%s.%d.tmp' % (path, os.getpid())
+    with open(tmp_path, 'wb') as fileo:
+        offset = 0
+        for section in [header] + sections:
+            fileo.write(b'\x00' * (_align(offset) - offset))
+            offset = _align(offset)
+            fileo.write(section)
+            offset += len(section)
+    os.replace(tmp_path, path)
+
+
+def read_arpa(arpa_path, encoding='utf8'):
+    """Return the ``(words, prob, bow)`` triples of the ARPA file at
+    ``arpa_path`` and its maximum order. Parses as :func:`load_arpa` does.
+    """
+    ngrams = []
+    order = max_order = 0
+    with codecs.open(arpa_path, encoding=encoding) as filei:
+        for line in filei:
+            line = line.strip()
+            if line.startswith('ngram'):
+                max_order = int(re.sub(r'^ngram\s+(\d+)=.*$', r'\1', line))
+            if order > 0 and not line.startswith('\\') and line:
+                parts = line.split('\t')
+                bow = 0.0
+                if order < max_order and len(parts) == 3:
+                    bow = float(parts[-1])
+                ngrams.append((tuple(parts[1].split(' ')), float(parts[0]),
+                               bow))
+            if re.match(r'^\\\d+', line):
+                order = int(re.sub(r'^\\(\d+).*$', r'\1', line))
+    return ngrams, max_order
+
+
+def arpa_to_binary_lm(arpa_path, path, encoding='utf8'):
+    """Convert the ARPA file at ``arpa_path`` to a binary LM file at
+    ``path``.
+    """
+    ngrams, max_order = read_arpa(arpa_path, encoding)
+    write_binary_lm(ngrams, path, max_order)
+
+
+def iter_lmtree(lmtree):
+    """Yield the ``(words, prob, bow)`` triples of the nodes of an
+    :class:`LMTree`.
+    """
+    stack = [((), lmtree)]
+    while stack:
+        words, node = stack.pop()
+        for word, child in node.children.items():
+            child_words = words + (word,)
+            yield child_words, child.prob, child.bow
+            stack.append((child_words, child))
+
+
+def lmtree_to_binary_lm(lmtree, path):
+    """Write the :class:`LMTree` ``lmtree`` to a binary LM file at
+    ``path``.
+    """
+    write_binary_lm(iter_lmtree(lmtree), path, lmtree.max_order)
+
+
+def pickle_to_binary_lm(pickle_path, path):
+    """Convert a pickled :class:`LMTree` at ``pickle_path`` to a binary LM
+    file at ``path``.
+    """
+    with open(pickle_path, 'rb') as filei:
+        lmtree = pickle.load(filei)
+    if not isinstance(lmtree, LMTree):
+        raise ValueError('%s does not contain a pickled LMTree.' % pickle_path)
+    lmtree_to_binary_lm(lmtree, path)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='Convert an ARPA file or a pickled LMTree to a binary LM'
+                    ' file.')
+    parser.add_argument('source', help='An ARPA file or an LMTree pickle.')
+    parser.add_argument('destination', help='The binary LM file to write.')
+    parser.add_argument('--encoding', default='utf8',
+                        help='The encoding of the ARPA file.')
+    args = parser.parse_args()
+    if args.source.endswith('.pickle'):
+        pickle_to_binary_lm(args.source, args.destination)
+    else:
+        arpa_to_binary_lm(args.source, args.destination, args.encoding)
@@ -0,0 +1,322 @@
+# Copyright 2016 Joel Dunham
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""Capture of slow searches.
+
+The search actions (resource, corpus, remembered forms and TGrep2 searches)
+run their searches via :func:`capture_search`. While a search runs, the
+pagination functions of :mod:`old.lib.dbutils` report the query they
+paginate (:func:`record_query`) and time their phases (:func:`phase`):
+
+- ``count``: counting the matches;
+- ``page``: fetching the models of the page; and
+- ``serialize``: converting them to dicts.
+
+If the search takes ``slow_search_threshold`` milliseconds or more, a capture
+is appended as a JSON line to ``slow_searches.log`` in the
+``slow_searches/`` directory of the OLD's store. It has the OLD's name, the
+user's id, the kind of search, the searched model, the JSON query, the id of
+its shape (cf. ``SQLAQueryBuilder.get_query_shape_id``; searches that differ
+only in their values share a shape), the SQL of the query with its bound
+values, the duration of the search and of its phases, and the numbers of
+matches (if counted) and of items returned. The log is rotated when it
+exceeds ``slow_search_log_max_mb`` megabytes, keeping
+``slow_search_log_backups`` old logs.
+
+:func:`aggregate_captures` summarizes the captures by shape (``GET
+/<old_name>/slowsearches``, cf. :mod:`old.views.slowsearches`) so that
+administrators can see which searches would gain from an index or a cache.
+"""
+
+from contextlib import contextmanager
+import datetime
+import json
+import logging
+from logging.handlers import RotatingFileHandler
+import os
+import threading
+import time
+
+from old.lib.utils import get_old_directory_path, make_directory_safely
+
+
+LOGGER = logging.getLogger(__name__)
+
+DEFAULT_THRESHOLD = 1000  # milliseconds
+DEFAULT_LOG_MAX_MB = 10
+DEFAULT_LOG_BACKUPS = 3
+LOG_FILE = 'slow_searches.log'
+PHASES = ('count', 'page', 'serialize')
+
+_CURRENT = threading.local()
+_HANDLERS = {}
+_HANDLERS_LOCK = threading.Lock()
+
+
+def get_threshold(settings):
+    """Return the ``slow_search_threshold`` setting in seconds or ``None``
+    if it is empty or negative, i.e., if captures are disabled.
+    """
+    value = settings.get('slow_search_threshold', DEFAULT_THRESHOLD)
+    if value in (None, ''):
+        return None
+    try:
+        threshold = float(value)
+    except ValueError:
+        return None
+    return threshold / 1000 if threshold >= 0 else None
+
+
+class SearchCapture(object):
+    """The measurements of one search."""
+
+    def __init__(self, kind, model_name, query, get_shape_id=None):
+        self.kind = kind
+        self.model_name = model_name
+        self.query = query
+        self._get_shape_id = get_shape_id
+        self.phases = dict.fromkeys(PHASES, 0.0)
+        self.sql_query = None
+        self.duration = None
+
+    def get_shape_id(self):
+        """Return the id of the shape of the query (computed only for the
+        searches that are captured) or ``None``.
+        """
+        if self._get_shape_id is None:
+            return None
+        try:
+            return self._get_shape_id()
+        except Exception as error:  # The shape is only informative.
+            LOGGER.debug('Unable to get the shape of %s: %s', self.query,
+                         error)
+            return None
+
+    def get_sql(self):
+        """Return the SQL of the recorded query with its bound values."""
+        if self.sql_query is None:
+            return None
+        return compile_query(self.sql_query)
+
+
+def get_current_capture():
+    return getattr(_CURRENT, 'capture', None)
+
+
+def record_query(query):
+    """Record ``query`` as the query of the current search, if any."""
+    capture = get_current_capture()
+    if capture is not None and capture.sql_query is None:
+        capture.sql_query = query
+
+
+@contextmanager
+def phase(name):
+    """Add the duration of the block to the ``name`` phase of the current
+    search, if any.
+    """
+    capture = get_current_capture()
+    if capture is None:
+        yield
+        return
+    start = time.time()
+    try:
+        yield
+    finally:
+        capture.phases[name] += time.time() - start
+
+
+def compile_query(query):
+    """Return the SQL of the SQLAlchemy ORM ``query`` with its bound values
+    inlined or, if they cannot be (e.g., for some types), followed by them.
+    """
+    dialect = query.session.get_bind().dialect
+    # pylint: disable=protected-access
+    statement = query.statement.params(query._params)
+    try:
+        return str(statement.compile(
+            dialect=dialect, compile_kwargs={'literal_binds': True}))
+    except Exception:  # The SQL is only informative.
+        compiled = statement.compile(dialect=dialect)
+        return '%s -- %s' % (compiled, json.dumps(compiled.params,
+                                                  default=str))
+
+
+def _get_result_counts(result):
+    """Return the number of matches (if counted) and of items of the
+    ``result`` of a search.
+    """
+    if isinstance(result, dict) and isinstance(result.get('items'), list):
+        return result.get('paginator', {}).get('count'), len(result['items'])
+    if isinstance(result, list):
+        return len(result), len(result)
+    return None, None
+
+
+def capture_search(request, kind, model_name, query, search,
+                   get_shape_id=None):
+    """Return ``search()``, capturing the search of ``model_name`` models
+    with ``query`` (the JSON request body) if it is slow. ``get_shape_id``
+    returns the id of the shape of ``query``.
+    """
+    settings = request.settings
+    threshold = get_threshold(settings)
+    if threshold is None:
+        return search()
+    capture = SearchCapture(kind, model_name, query, get_shape_id)
+    previous = get_current_capture()
+    _CURRENT.capture = capture
+    start = time.time()
+    try:
+        result = search()
+    finally:
+        capture.duration = time.time() - start
+        _CURRENT.capture = previous
+    if capture.duration >= threshold and request.response.status_int == 200:
+        try:
+            save_capture(request, capture, result)
+        except Exception as error:  # Capturing must not break the search.
+            LOGGER.warning('Unable to capture the slow %s of %s: %s %s',
+                           kind, model_name, error.__class__.__name__, error)
+    return result
+
+
+###############################################################################
+# Storage
+###############################################################################
+
+def get_log_path(settings, old_name):
+    return os.path.join(get_old_directory_path(
+        'slow_searches', dict(settings, old_name=old_name)), LOG_FILE)
+
+
+def _get_handler(settings, path):
+    """Return the (cached) rotating handler of the log at ``path``."""
+    with _HANDLERS_LOCK:
+        handler = _HANDLERS.get(path)
+        if handler is None:
+            make_directory_safely(os.path.dirname(path))
+            try:
+                max_bytes = int(float(settings.get(
+                    'slow_search_log_max_mb', DEFAULT_LOG_MAX_MB)) *
+                                1024 * 1024)
+                backups = int(settings.get('slow_search_log_backups',
+                                           DEFAULT_LOG_BACKUPS))
+            except ValueError:
+                max_bytes = DEFAULT_LOG_MAX_MB * 1024 * 1024
+                backups = DEFAULT_LOG_BACKUPS
+            handler = _HANDLERS[path] = RotatingFileHandler(
+                path, maxBytes=max_bytes, backupCount=backups,
+                encoding='utf8', delay=True)
+        return handler
+
+
+def close_logs():
+    """Close the handlers of the logs, e.g., before they are deleted."""
+    with _HANDLERS_LOCK:
+        for handler in _HANDLERS.values():
+            handler.close()
+        _HANDLERS.clear()
+
+
+def save_capture(request, capture, result):
+    old_name = request.matchdict['old_name']
+    count, rows = _get_result_counts(result)
+    user = request.session.get('user') or {}
+    record = {
+        'datetime': datetime.datetime.utcnow().isoformat(),
+        'old_name': old_name,
+        'user_id': user.get('id'),
+        'kind': capture.kind,
+        'model': capture.model_name,
+        'shape_id': capture.get_shape_id(),
+        'query': capture.query,
+        'sql': capture.get_sql(),
+        'duration': round(1000 * capture.duration, 3),
+        'phases': {name: round(1000 * seconds, 3)
+                   for name, seconds in capture.phases.items()},
+        'count': count,
+        'rows': rows,
+    }
+    settings = request.settings
+    _get_handler(settings, get_log_path(settings, old_name)).handle(
+        logging.makeLogRecord({'msg': json.dumps(record, default=str),
+                               'levelno': logging.INFO,
+                               'levelname': 'INFO'}))
+    LOGGER.info('Captured a slow %s of %s (%.0f ms).', capture.kind,
+                capture.model_name, 1000 * capture.duration)
+
+
+def get_captures(settings, old_name):
+    """Return the captures of the OLD ``old_name``, oldest first."""
+    path = get_log_path(settings, old_name)
+    try:
+        backups = int(settings.get('slow_search_log_backups',
+                                   DEFAULT_LOG_BACKUPS))
+    except ValueError:
+        backups = DEFAULT_LOG_BACKUPS
+    paths = ['%s.%d' % (path, index) for index in range(backups, 0, -1)]
+    captures = []
+    for path_ in paths + [path]:
+        try:
+            with open(path_, encoding='utf8') as file_:
+                for line in file_:
+                    try:
+                        captures.append(json.loads(line))
+                    except ValueError:
+                        continue  # e.g., a line being written
+        except OSError:
+            continue
+    return captures
+
+
+def aggregate_captures(captures):
+    """Return the summaries of ``captures`` by kind, model and shape, those
+    that took the most time in total first. Each summary has the number of
+    captures, their total, mean and maximum durations, their mean phase
+    durations, their maximum numbers of matches and rows, the datetime of
+    the last one and the slowest one itself.
+    """
+    groups = {}
+    for capture in captures:
+        key = (capture.get('kind'), capture.get('model'),
+               capture.get('shape_id'))
+        groups.setdefault(key, []).append(capture)
+    summaries = []
+    for (kind, model, shape_id), group in groups.items():
+        durations = [capture['duration'] for capture in group]
+        summary = {
+            'kind': kind,
+            'model': model,
+            'shape_id': shape_id,
+            'captures': len(group),
+            'total_duration': round(sum(durations), 3),
+            'mean_duration': round(sum(durations) / len(group), 3),
+            'max_duration': max(durations),
+            'mean_phases': {
+                name: round(sum(capture.get('phases', {}).get(name, 0)
+                                for capture in group) / len(group), 3)
+                for name in PHASES},
+            'max_count': max((capture.get('count') or 0
+                              for capture in group), default=0),
+            'max_rows': max((capture.get('rows') or 0 for capture in group),
+                            default=0),
+            'last_seen': max(capture.get('datetime') or ''
+                             for capture in group),
+            'slowest': max(group, key=lambda capture: capture['duration']),
+        }
+        summaries.append(summary)
+    summaries.sort(key=lambda summary: (-summary['total_duration'],
+                                        -summary['captures']))
+    return summaries
@@ -0,0 +1,629 @@
+# Copyright 2021 Joel Dunham
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""Synchronization of a follower OLD with a leader OLD.
+
+Leader side (cf. :mod:`old.views.sync`):
+
+- :func:`get_last_modified` returns the ids and modification date-times of
+  every row of every synchronized table, i.e., a full snapshot;
+- :func:`get_changes` returns, per table, only the rows modified and the rows
+  deleted since a watermark, plus the watermark that the follower should pass
+  next time. Deletions are read from the ``tombstone`` table, which is
+  populated by :func:`record_tombstones` whenever rows of a synchronized table
+  are deleted. Tombstones are kept for ``TOMBSTONE_RETENTION``; a watermark
+  older than that gets every row and the ``full_sync`` flag instead;
+- :func:`iter_rows` yields full rows, page by page, so that they can be
+  streamed as newline-delimited JSON (NDJSON, cf. :func:`dump_row_line`)
+  with bounded memory.
+
+Follower side:
+
+- :func:`apply_deltas` deletes and upserts rows. Applying the same deltas
+  twice leaves the follower's database as applying them once does;
+- :class:`Follower` fetches the deltas from a leader (via a
+  :class:`LeaderClient` or any object with the same methods) and applies
+  them. Example usage::
+
+      client = LeaderClient('https://leader.example.com/old', 'user', 'pass')
+      follower = Follower(dbsession, client)
+      watermark = follower.sync()  # full sync
+      ...
+      watermark = follower.sync(since=watermark)  # incremental sync
+"""
+
+import base64
+import datetime
+from itertools import islice
+import json
+import logging
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.sql import bindparam, func, or_, select, text
+from sqlalchemy.sql.elements import BinaryExpression, BindParameter
+from sqlalchemy.sql.expression import Delete
+from sqlalchemy.types import Date, DateTime
+
+import old.lib.constants as oldc
+import old.models as old_models
+
+
+LOGGER = logging.getLogger(__name__)
+
+
+MODELS = (
+    'ApplicationSettings',
+    'ApplicationSettingsUser',
+    'Collection',
+    'CollectionBackup',
+    'CollectionFile',
+    'CollectionForm',
+    'CollectionTag',
+    'Corpus',
+    'CorpusBackup',
+    'CorpusFile',
+    'CorpusForm',
+    'CorpusTag',
+    'ElicitationMethod',
+    'File',
+    'FileTag',
+    'Form',
+    'FormBackup',
+    'FormFile',
+    'FormSearch',
+    'FormTag',
+    'Keyboard',
+    # 'Language': {}, # Language is special (immutable) ...
+    'MorphemeLanguageModel',
+    'MorphemeLanguageModelBackup',
+    'MorphologicalParser',
+    'MorphologicalParserBackup',
+    'Morphology',
+    'MorphologyBackup',
+    'Orthography',
+    'Page',
+    'Parse',
+    'Phonology',
+    'PhonologyBackup',
+    'Source',
+    'Speaker',
+    'SyntacticCategory',
+    'Tag',
+    'Translation',
+    'User',
+    'UserForm',
+)
+
+
+TABLES = tuple(getattr(old_models, mname).__table__.name for mname in MODELS)
+TABLE_OBJECTS = {
+    getattr(old_models, mname).__table__.name:
+    getattr(old_models, mname).__table__ for mname in MODELS}
+
+# Number of rows fetched (leader) or written (follower) per statement.
+PAGE_SIZE = 1000
+# Watermarks lag the time they are issued at by this much: a row modified by a
+# transaction that was still open at that time is then re-sent by the next
+# incremental sync rather than missed.
+WATERMARK_LAG = datetime.timedelta(seconds=60)
+# Tombstones older than this are pruned, so that the table does not grow
+# without bounds. Followers must sync more often than this to get deltas.
+TOMBSTONE_RETENTION = datetime.timedelta(days=90)
+# Tombstones are pruned by a deleting transaction at most this often.
+PRUNE_INTERVAL = datetime.timedelta(hours=1)
+
+
+def date_string(date_thing):
+    """Given a "date", return a string, where the date may already be a string
+    or it may be a `datetime.datetime` instance.
+    """
+    if isinstance(date_thing, str):
+        return date_thing.replace(' ', 'T')
+    return date_thing.strftime(oldc.ISO_STRFTIME)
+
+
+def parse_datetime(string):
+    """Return the ``datetime.datetime`` of an ISO 8601 date-time string, e.g.,
+    a watermark. Raise ``ValueError`` if it is not one.
+    """
+    string = string.strip().replace(' ', 'T')
+    for format_ in (oldc.ISO_STRFTIME, '%Y-%m-%dT%H:%M:%S', '%Y-%m-%d'):
+        try:
+            return datetime.datetime.strptime(string, format_)
+        except ValueError:
+            continue
+    raise ValueError('Invalid date-time: %s' % string)
+
+
+###############################################################################
+# Tombstones
+###############################################################################
+
+def _get_deleted_ids(connection, delete, param_sets):
+    """Return the ids of the rows that ``delete`` is about to delete."""
+    table = delete.table
+    whereclause = criterion = delete._whereclause
+    # The ORM deletes rows by primary key, one parameter set per row.
+    clauses = getattr(criterion, 'clauses', None)
+    if clauses is not None and len(clauses) == 1:
+        criterion = clauses[0]
+    if (isinstance(criterion, BinaryExpression) and
+            criterion.left is table.c.id and
+            isinstance(criterion.right, BindParameter)):
+        key = criterion.right.key
+        if all(key in params for params in param_sets):
+            return [params[key] for params in param_sets]
+    query = select([table.c.id])
+    if whereclause is not None:
+        query = query.where(whereclause)
+    ids = []
+    for params in param_sets:
+        ids.extend(row[0] for row in connection.execute(query, params))
+    return ids
+
+
+# Whether the database of each URL has a tombstone table.
+_TOMBSTONE_TABLES = {}
+# The last time that the tombstones of each database were pruned, by URL.
+_LAST_PRUNED = {}
+
+
+def has_tombstone_table(connection):
+    """Return ``True`` if the database of ``connection`` has a tombstone
+    table. Databases created before it do not have one until it is created;
+    their deletes are not recorded meanwhile. The answer is cached per
+    database: a tombstone table created by another process, e.g., by the
+    2.1.0 update script, is only noticed once this process is restarted.
+    """
+    url = str(connection.engine.url)
+    try:
+        return _TOMBSTONE_TABLES[url]
+    except KeyError:
+        pass
+    exists = connection.dialect.has_table(
+        connection, old_models.Tombstone.__tablename__)
+    if not exists:
+        LOGGER.warning('The database has no tombstone table; deletes are not'
+                       ' recorded for incremental sync.')
+    _TOMBSTONE_TABLES[url] = exists
+    return exists
+
+
+@event.listens_for(old_models.Tombstone.__table__, 'after_create')
+def tombstone_table_created(target, connection, **kwargs):
+    # pylint: disable=unused-argument
+    _TOMBSTONE_TABLES[str(connection.engine.url)] = True
+
+
+@event.listens_for(old_models.Tombstone.__table__, 'after_drop')
+def tombstone_table_dropped(target, connection, **kwargs):
+    # pylint: disable=unused-argument
+    _TOMBSTONE_TABLES[str(connection.engine.url)] = False
+
+
+@event.listens_for(Engine, 'before_execute')
+def record_tombstones(connection, clauseelement, multiparams, params):
+    """Insert a tombstone for every row of a synchronized table that is about
+    to be deleted, in the deleting transaction. This covers ORM deletes
+    (including those of association table rows) and Core ``delete()``
+    statements, but not deletes issued as raw SQL strings. Nothing is
+    recorded if the database has no tombstone table.
+    """
+    if (not isinstance(clauseelement, Delete) or
+            clauseelement.table.name not in TABLE_OBJECTS or
+            not has_tombstone_table(connection)):
+        return
+    if multiparams and isinstance(multiparams[0], (list, tuple)):
+        param_sets = list(multiparams[0])
+    elif multiparams:
+        param_sets = list(multiparams)
+    else:
+        param_sets = [params or {}]
+    ids = _get_deleted_ids(connection, clauseelement, param_sets)
+    if not ids:
+        return
+    now = datetime.datetime.utcnow()
+    table_name = clauseelement.table.name
+    connection.execute(old_models.Tombstone.__table__.insert(), [
+        {'table_name': table_name, 'row_id': id_, 'datetime_deleted': now}
+        for id_ in ids])
+    url = str(connection.engine.url)
+    if now - _LAST_PRUNED.get(url, datetime.datetime.min) >= PRUNE_INTERVAL:
+        _LAST_PRUNED[url] = now
+        prune_tombstones(connection, now - TOMBSTONE_RETENTION)
+
+
+def get_tombstone_cutoff():
+    """Return the date-time before which tombstones may have been pruned."""
+    return datetime.datetime.utcnow() - TOMBSTONE_RETENTION
+
+
+def prune_tombstones(connection, before=None):
+    """Delete the tombstones of the rows deleted before date-time ``before``
+    (by default, :func:`get_tombstone_cutoff`) and return their number.
+    """
+    tombstone = old_models.Tombstone.__table__
+    before = before or get_tombstone_cutoff()
+    count = connection.execute(tombstone.delete().where(
+        tombstone.c.datetime_deleted < before)).rowcount
+    if count:
+        LOGGER.info('Pruned %d tombstones of rows deleted before %s.', count,
+                    date_string(before))
+    return count
+
+
+###############################################################################
+# Leader
+###############################################################################
+
+def get_last_modified(connection):
+    """Return a dict whose keys are table names and whose values are dicts
+    from row IDs to row last_modified date-time strings.
+    """
+    tables = {}
+    for tname in TABLES:
+        tables[tname] = {
+            r['id']: date_string(r['datetime_modified']) for
+            r in connection.execute(
+                text('select id, datetime_modified from {}'.format(tname)))}
+    return tables
+
+
+def encode_watermark(since, max_ids):
+    """Return an opaque, URL-safe watermark for the state of the OLD as of
+    date-time ``since``, when the greatest row ids of the synchronized tables
+    were ``max_ids``.
+    """
+    return base64.urlsafe_b64encode(json.dumps(
+        [date_string(since), max_ids]).encode('utf8')).decode('ascii')
+
+
+def decode_watermark(watermark):
+    """Return the ``(since, max_ids)`` pair encoded in ``watermark``. A plain
+    ISO 8601 date-time is accepted too; rows are then only compared by their
+    ``datetime_modified`` values. Raise ``ValueError`` if ``watermark`` is
+    neither.
+    """
+    try:
+        return parse_datetime(watermark), {}
+    except ValueError:
+        pass
+    try:
+        since, max_ids = json.loads(base64.urlsafe_b64decode(
+            watermark.encode('ascii')).decode('utf8'))
+        return parse_datetime(since), {
+            str(tname): int(max_id) for tname, max_id in max_ids.items()}
+    except Exception:
+        raise ValueError('Invalid watermark: %s' % watermark)
+
+
+def get_changes(connection, watermark=None):
+    """Return the rows of each synchronized table that were modified or
+    deleted since ``watermark``, as returned by :func:`decode_watermark`
+    (all rows if ``watermark`` is ``None``)::
+
+        {'watermark': 'WyIyMDIxLTAxLTAy...',
+         'full_sync': False,
+         'tables': {'form': {'changed': {'1': '2021-01-01T12:00:00.000000'},
+                             'deleted': [2]},
+                    ...}}
+
+    The ``watermark`` value is the ``since`` value to request next. Changes
+    made between the two requests are reported by both, so the follower must
+    apply them idempotently (cf. :func:`apply_deltas`). Rows whose ids exceed
+    those of the watermark are reported too since some new rows, e.g.,
+    backups, keep the ``datetime_modified`` values of the rows they copy.
+
+    If ``watermark`` is older than the tombstones kept (cf.
+    :func:`get_tombstone_cutoff`), the deletions since then are not all
+    known. Every row is then returned as changed and ``full_sync`` is true:
+    the follower must resynchronize fully, i.e., also delete the rows that
+    are not returned.
+    """
+    now = datetime.datetime.utcnow() - WATERMARK_LAG
+    since, max_ids = watermark or (None, {})
+    full_sync = since is None or since < get_tombstone_cutoff()
+    if full_sync:
+        since, max_ids = None, {}
+    tombstone = old_models.Tombstone.__table__
+    deleted = {}
+    if since is not None:
+        for table_name, row_id in connection.execute(
+                select([tombstone.c.table_name, tombstone.c.row_id])
+                .where(tombstone.c.datetime_deleted >= since)
+                .order_by(tombstone.c.id)):
+            deleted.setdefault(table_name, []).append(row_id)
+    tables = {}
+    new_max_ids = {}
+    for tname in TABLES:
+        table = TABLE_OBJECTS[tname]
+        new_max_ids[tname] = connection.execute(
+            select([func.max(table.c.id)])).scalar() or 0
+        query = select([table.c.id, table.c.datetime_modified])
+        if since is not None:
+            criterion = table.c.datetime_modified >= since
+            if tname in max_ids:
+                criterion = or_(criterion, table.c.id > max_ids[tname])
+            query = query.where(criterion)
+        tables[tname] = {
+            'changed': {row.id: date_string(row.datetime_modified)
+                        for row in connection.execute(query)},
+            'deleted': sorted(set(deleted.get(tname, [])))}
+    return {'watermark': encode_watermark(now, new_max_ids),
+            'full_sync': full_sync,
+            'tables': tables}
+
+
+def validate_table_ids(tables):
+    """Raise ``ValueError`` unless ``tables`` is ``'*'`` or an object from
+    table names to lists of integer ids.
+    """
+    if tables == '*':
+        return
+    if not isinstance(tables, dict):
+        raise ValueError("The value of 'tables' must be '*' or an object")
+    for ids in tables.values():
+        if (not isinstance(ids, list) or
+                not all(isinstance(id_, int) for id_ in ids)):
+            raise ValueError('Table name must resolve to a list of integers')
+
+
+def iter_rows(connection, tables, page_size=PAGE_SIZE):
+    """Yield ``(table_name, row_dict)`` pairs for the rows requested in
+    ``tables`` ('*' for all rows of all synchronized tables or an object from
+    table names to lists of ids). At most ``page_size`` rows are held in
+    memory at a time.
+    """
+    for tname in TABLES:
+        table = TABLE_OBJECTS[tname]
+        if tables == '*':
+            last_id = None
+            while True:
+                query = select([table]).order_by(table.c.id).limit(page_size)
+                if last_id is not None:
+                    query = query.where(table.c.id > last_id)
+                rows = connection.execute(query).fetchall()
+                if not rows:
+                    break
+                for row in rows:
+                    yield tname, dict(row)
+                last_id = rows[-1]['id']
+        else:
+            ids = iter(sorted(set(tables.get(tname) or [])))
+            while True:
+                chunk = list(islice(ids, page_size))
+                if not chunk:
+                    break
+                for row in connection.execute(
+                        select([table]).where(table.c.id.in_(chunk))
+                        .order_by(table.c.id)).fetchall():
+                    yield tname, dict(row)
+
+
+def _json_default(obj):
+    if isinstance(obj, datetime.datetime):
+        return obj.strftime(oldc.ISO_STRFTIME)
+    if isinstance(obj, datetime.date):
+        return obj.isoformat()
+    if isinstance(obj, bytes):
+        return obj.decode('utf8')
+    raise TypeError('%r is not JSON serializable' % obj)
+
+
+def dump_row_line(table_name, row):
+    """Return the NDJSON line (as bytes) of a row of table ``table_name``."""
+    return (json.dumps({'table': table_name, 'row': row},
+                       default=_json_default) + '\n').encode('utf8')
+
+
+def iter_ndjson(connection, tables, page_size=PAGE_SIZE):
+    """Yield the NDJSON lines of the rows requested in ``tables``, followed
+    by a line that counts them, i.e., ``{"end": true, "rows": n}``; its
+    absence tells the consumer that the stream was truncated.
+    """
+    count = 0
+    for table_name, row in iter_rows(connection, tables, page_size):
+        count += 1
+        yield dump_row_line(table_name, row)
+    yield (json.dumps({'end': True, 'rows': count}) + '\n').encode('utf8')
+
+
+###############################################################################
+# Follower
+###############################################################################
+
+def load_ndjson(lines):
+    """Yield the ``(table_name, row_dict)`` pairs of NDJSON ``lines``. Raise
+    ``ValueError`` if the terminating line is missing.
+    """
+    ended = False
+    for line in lines:
+        if isinstance(line, bytes):
+            line = line.decode('utf8')
+        if not line.strip():
+            continue
+        item = json.loads(line)
+        if item.get('end'):
+            ended = True
+            continue
+        yield item['table'], item['row']
+    if not ended:
+        raise ValueError('The NDJSON stream of rows was truncated')
+
+
+def _get_converters(table):
+    converters = {}
+    for column in table.columns:
+        if isinstance(column.type, DateTime):
+            converters[column.name] = parse_datetime
+        elif isinstance(column.type, Date):
+            converters[column.name] = lambda value: parse_datetime(
+                value).date()
+    return converters
+
+
+def _convert(row, converters):
+    for name, converter in converters.items():
+        value = row.get(name)
+        if isinstance(value, str):
+            row[name] = converter(value)
+    return row
+
+
+def _delete_ids(connection, table, ids):
+    ids = list(ids)
+    for start in range(0, len(ids), PAGE_SIZE):
+        connection.execute(
+            table.delete().where(table.c.id.in_(ids[start:start + PAGE_SIZE])))
+
+
+def _upsert(connection, table, rows):
+    ids = [row['id'] for row in rows]
+    existing = {row[0] for row in connection.execute(
+        select([table.c.id]).where(table.c.id.in_(ids)))}
+    inserts = [row for row in rows if row['id'] not in existing]
+    updates = [row for row in rows if row['id'] in existing]
+    if inserts:
+        connection.execute(table.insert(), inserts)
+    if updates:
+        names = [column.name for column in table.columns if column.name != 'id']
+        connection.execute(
+            table.update().where(table.c.id == bindparam('id_'))
+            .values(**{name: bindparam(name) for name in names}),
+            [dict({name: row.get(name) for name in names}, id_=row['id'])
+             for row in updates])
+
+
+def apply_deltas(connection, changes, rows, prune=False):
+    """Apply the deltas of a leader to the follower database of
+    ``connection``: delete the rows in ``changes`` (as returned by
+    :func:`get_changes`) that the leader deleted and insert or update the
+    ``(table_name, row_dict)`` pairs of ``rows``. If ``prune`` is true (a full
+    sync), also delete the rows that the leader does not have. Return the
+    numbers of rows deleted and upserted per table.
+    """
+    stats = {}
+    foreign_key_checks = connection.dialect.name == 'mysql'
+    if foreign_key_checks:
+        connection.execute(text('SET FOREIGN_KEY_CHECKS = 0'))
+    try:
+        for tname, delta in changes['tables'].items():
+            table = TABLE_OBJECTS.get(tname)
+            if table is None:
+                continue
+            deleted = set(delta.get('deleted') or [])
+            if prune:
+                leader_ids = {int(id_) for id_ in delta['changed']}
+                deleted |= {row[0] for row in connection.execute(
+                    select([table.c.id]))} - leader_ids
+            _delete_ids(connection, table, sorted(deleted))
+            stats[tname] = {'deleted': len(deleted), 'upserted': 0}
+        batch_table = None
+        batch = []
+        converters = {}
+        for tname, row in rows:
+            table = TABLE_OBJECTS.get(tname)
+            if table is None:
+                continue
+            if table is not batch_table or len(batch) >= PAGE_SIZE:
+                if batch:
+                    _upsert(connection, batch_table, batch)
+                batch_table, batch = table, []
+                if tname not in converters:
+                    converters[tname] = _get_converters(table)
+            batch.append(_convert(row, converters[tname]))
+            stats.setdefault(tname, {'deleted': 0, 'upserted': 0})
+            stats[tname]['upserted'] += 1
+        if batch:
+            _upsert(connection, batch_table, batch)
+    finally:
+        if foreign_key_checks:
+            connection.execute(text('SET FOREIGN_KEY_CHECKS = 1'))
+    return stats
+
+
+class LeaderClient:
+    """HTTP client of the /sync/ endpoints of a leader OLD, e.g.,
+    ``LeaderClient('https://leader.example.com/old', 'user', 'pass')``.
+    """
+
+    def __init__(self, url, username, password):
+        import requests
+        self.url = url.rstrip('/')
+        self.session = requests.Session()
+        response = self.session.post(
+            '%s/login/authenticate' % self.url,
+            json={'username': username, 'password': password})
+        response.raise_for_status()
+        if not response.json().get('authenticated'):
+            raise ValueError('Unable to log in to %s' % self.url)
+
+    def get_changes(self, since=None):
+        response = self.session.get(
+            '%s/sync/last_modified' % self.url,
+            params={'since': since or ''})
+        response.raise_for_status()
+        return response.json()
+
+    def iter_rows(self, tables):
+        response = self.session.post(
+            '%s/sync/tables' % self.url,
+            json={'tables': tables, 'format': 'ndjson'}, stream=True)
+        response.raise_for_status()
+        return load_ndjson(response.iter_lines())
+
+
+class Follower:
+    """Synchronizes the database of ``dbsession`` with a leader OLD via
+    ``client`` (cf. :class:`LeaderClient`).
+    """
+
+    def __init__(self, dbsession, client, page_size=10 * PAGE_SIZE):
+        self.dbsession = dbsession
+        self.client = client
+        self.page_size = page_size
+        self.stats = {}
+
+    def sync(self, since=None):
+        """Apply the leader's changes since watermark ``since`` (all of its
+        rows if ``since`` is ``None`` or if the leader requires a full
+        resynchronization) and return the next watermark.
+        """
+        changes = self.client.get_changes(since)
+        connection = self.dbsession.connection()
+        self.stats = apply_deltas(
+            connection, changes, self._iter_rows(changes),
+            prune=since is None or changes.get('full_sync', False))
+        self.dbsession.commit()
+        LOGGER.info('Synchronized with the leader as of %s: %s',
+                    changes['watermark'],
+                    {tname: stats for tname, stats in self.stats.items()
+                     if any(stats.values())})
+        return changes['watermark']
+
+    def _iter_rows(self, changes):
+        """Request the changed rows in batches of at most ``page_size`` ids.
+        """
+        batch = {}
+        size = 0
+        for tname, delta in changes['tables'].items():
+            for id_ in delta['changed']:
+                batch.setdefault(tname, []).append(int(id_))
+                size += 1
+                if size >= self.page_size:
+                    yield from self.client.iter_rows(batch)
+                    batch, size = {}, 0
+        if batch:
+            yield from self.client.iter_rows(batch)
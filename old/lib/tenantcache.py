@@ -0,0 +1,313 @@
+# Copyright 2016 Joel Dunham
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""Process-level cache of the per-OLD (i.e., per-tenant) data that validation
+and access control need on almost every request:
+
+- a snapshot of the current application settings,
+- the ids of the users who are unrestricted,
+- the ids of the "restricted" and "foreign word" tags,
+- the transcriptions of the foreign word forms, and
+- the transcription inventories (i.e., validation regexes) built from these.
+
+The data of an OLD are held in a :class:`TenantData` instance, which
+:func:`get_tenant_data` returns. OLDs are keyed by their full database URL
+(:func:`get_tenant_key`). A cached instance that has not been revalidated for
+``WATERMARK_TTL`` seconds is revalidated by a single query for the OLD's
+watermarks (:func:`get_watermark`): the counts and latest
+``datetime_modified`` values of the rows that the data are built from. A
+change made by another process therefore becomes visible within
+``WATERMARK_TTL`` seconds.
+
+Changes made by this process are noticed sooner: a flush or a statement that
+writes application settings, tags, orthographies or foreign word forms
+invalidates the OLD's cached data immediately, cf. :func:`invalidate`.
+"""
+
+from collections import namedtuple
+import logging
+import threading
+import time
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+from sqlalchemy.sql import func, select
+from sqlalchemy.sql.expression import Delete, Insert, Update
+
+import old.models as old_models
+from old.models.applicationsettings import build_transcription_inventory
+
+
+LOGGER = logging.getLogger(__name__)
+
+
+FOREIGN_WORD_TAG_NAME = 'foreign word'
+RESTRICTED_TAG_NAME = 'restricted'
+# The number of seconds for which cached data are used without revalidating
+# them against the database.
+WATERMARK_TTL = 2
+
+FWTrans = namedtuple('FWTrans', ['narrow_phonetic',
+                                 'broad_phonetic',
+                                 'orthographic',
+                                 'morpheme_break'])
+
+
+class AppSetSnapshot:
+    """A read-only copy of the column values (and of the derived lists) of an
+    ``ApplicationSettings`` model. Unlike the model, it can be shared across
+    sessions and threads.
+    """
+
+    def __init__(self, app_set):
+        for column in old_models.ApplicationSettings.__table__.columns:
+            setattr(self, column.key, getattr(app_set, column.key))
+        # The list properties of the model raise if their source columns are
+        # NULL.
+        for name in ('morpheme_delimiters_list', 'punctuation_list',
+                     'grammaticalities_list', 'storage_orthography_list'):
+            try:
+                setattr(self, name, getattr(app_set, name))
+            except (AttributeError, TypeError):
+                setattr(self, name, [])
+        self.unrestricted_user_ids = frozenset(
+            user.id for user in app_set.unrestricted_users)
+
+    def __repr__(self):
+        return '<AppSetSnapshot (%s)>' % self.id
+
+
+class TenantData:
+    """The cached data of one OLD, as of ``watermark``. Inventories are built
+    on first use.
+    """
+
+    def __init__(self, watermark, app_set, restricted_tag_id,
+                 foreign_word_tag_id, foreign_word_form_ids,
+                 foreign_word_transcriptions):
+        self.watermark = watermark
+        self.validated = time.time()
+        self.app_set = app_set
+        self.restricted_tag_id = restricted_tag_id
+        self.foreign_word_tag_id = foreign_word_tag_id
+        self.foreign_word_form_ids = foreign_word_form_ids
+        self.foreign_word_transcriptions = foreign_word_transcriptions
+        self.invalidated = False
+        self._inventories = {}
+        self._lock = threading.Lock()
+
+    @property
+    def app_set_id(self):
+        return self.app_set and self.app_set.id
+
+    @property
+    def unrestricted_user_ids(self):
+        if self.app_set:
+            return self.app_set.unrestricted_user_ids
+        return frozenset()
+
+    def get_transcription_inventory(self, type_):
+        """Return the ``Inventory`` of the current application settings for
+        the transcription type ``type_``, cf.
+        ``ApplicationSettings.get_transcription_inventory``.
+        """
+        try:
+            return self._inventories[type_]
+        except KeyError:
+            with self._lock:
+                if type_ not in self._inventories:
+                    self._inventories[type_] = build_transcription_inventory(
+                        self.app_set, type_, self.foreign_word_transcriptions)
+                return self._inventories[type_]
+
+
+TENANT_DATA = {}
+TENANT_DATA_LOCK = threading.Lock()
+
+
+def get_tenant_key(bind):
+    """Return the key of the OLD whose database ``bind`` (a session, an engine
+    or a connection) is bound to, i.e., the full URL of the database without
+    its password. Unlike the database name, it tells apart the databases of
+    different servers and the SQLite files of different directories.
+    """
+    if isinstance(bind, Session):
+        bind = bind.get_bind()
+    # The repr of a URL masks its password.
+    return repr(bind.engine.url)
+
+
+def get_watermark(dbsession):
+    """Return a tuple that changes whenever the data that a ``TenantData``
+    instance is built from change. It is fetched with a single query.
+    """
+    app_set = old_models.ApplicationSettings.__table__
+    app_set_user = old_models.ApplicationSettingsUser.__table__
+    tag = old_models.Tag.__table__
+    orthography = old_models.Orthography.__table__
+    form = old_models.Form.__table__
+    form_tag = old_models.FormTag.__table__
+    foreign_word_tags = form_tag.join(
+        tag, (form_tag.c.tag_id == tag.c.id) &
+        (tag.c.name == FOREIGN_WORD_TAG_NAME))
+    scalars = [
+        select([func.max(app_set.c.id)]),
+        select([func.max(app_set.c.datetime_modified)]),
+        select([func.count(app_set_user.c.id)]),
+        select([func.max(app_set_user.c.datetime_modified)]),
+        select([func.count(tag.c.id)]),
+        select([func.max(tag.c.datetime_modified)]),
+        select([func.max(orthography.c.datetime_modified)]),
+        select([func.count(form_tag.c.id)]).select_from(foreign_word_tags),
+        select([func.max(form_tag.c.datetime_modified)]).select_from(
+            foreign_word_tags),
+        select([func.max(form.c.datetime_modified)]).select_from(
+            foreign_word_tags.join(form, form.c.id == form_tag.c.form_id)),
+    ]
+    return tuple(dbsession.execute(
+        select([scalar.as_scalar() for scalar in scalars])).first())
+
+
+def load_tenant_data(dbsession, watermark):
+    """Build the ``TenantData`` of the OLD of ``dbsession`` from its
+    database.
+    """
+    app_set = dbsession.query(old_models.ApplicationSettings).order_by(
+        old_models.ApplicationSettings.id.desc()).first()
+    tag = old_models.Tag.__table__
+    tag_ids = dict(dbsession.execute(
+        select([tag.c.name, tag.c.id])
+        .where(tag.c.name.in_([RESTRICTED_TAG_NAME, FOREIGN_WORD_TAG_NAME]))
+        .order_by(tag.c.id.desc())).fetchall())
+    foreign_word_tag_id = tag_ids.get(FOREIGN_WORD_TAG_NAME)
+    foreign_word_form_ids = set()
+    transcriptions = FWTrans([], [], [], [])
+    if foreign_word_tag_id:
+        form = old_models.Form.__table__
+        form_tag = old_models.FormTag.__table__
+        rows = dbsession.execute(
+            select([form.c.id, form.c.narrow_phonetic_transcription,
+                    form.c.phonetic_transcription, form.c.transcription,
+                    form.c.morpheme_break])
+            .select_from(form.join(form_tag, form_tag.c.form_id == form.c.id))
+            .where(form_tag.c.tag_id == foreign_word_tag_id)
+            .order_by(form.c.id))
+        for id_, narrow_phonetic, broad_phonetic, orthographic, \
+                morpheme_break in rows:
+            if id_ in foreign_word_form_ids:
+                continue
+            foreign_word_form_ids.add(id_)
+            if narrow_phonetic:
+                transcriptions.narrow_phonetic.append(narrow_phonetic)
+            if broad_phonetic:
+                transcriptions.broad_phonetic.append(broad_phonetic)
+            if morpheme_break:
+                transcriptions.morpheme_break.append(morpheme_break)
+            transcriptions.orthographic.append(orthographic)
+    return TenantData(
+        watermark,
+        app_set and AppSetSnapshot(app_set),
+        tag_ids.get(RESTRICTED_TAG_NAME),
+        foreign_word_tag_id,
+        frozenset(foreign_word_form_ids),
+        transcriptions)
+
+
+def get_tenant_data(dbsession):
+    """Return the ``TenantData`` of the OLD of ``dbsession``, from the cache
+    if it was validated less than ``WATERMARK_TTL`` seconds ago or if its
+    watermark is still current.
+    """
+    tenant = get_tenant_key(dbsession)
+    tenant_data = TENANT_DATA.get(tenant)
+    now = time.time()
+    if (tenant_data is not None and
+            now - tenant_data.validated < WATERMARK_TTL):
+        return tenant_data
+    watermark = get_watermark(dbsession)
+    if tenant_data is not None and tenant_data.watermark == watermark:
+        tenant_data.validated = now
+        return tenant_data
+    LOGGER.debug('Loading the cached data of OLD %s.', tenant)
+    tenant_data = load_tenant_data(dbsession, watermark)
+    with TENANT_DATA_LOCK:
+        TENANT_DATA[tenant] = tenant_data
+    return tenant_data
+
+
+def invalidate(tenant=None):
+    """Discard the cached data of OLD ``tenant`` or, if no tenant is given, of
+    all OLDs.
+    """
+    with TENANT_DATA_LOCK:
+        tenants = list(TENANT_DATA) if tenant is None else [tenant]
+        for tenant_ in tenants:
+            tenant_data = TENANT_DATA.pop(tenant_, None)
+            if tenant_data is not None:
+                tenant_data.invalidated = True
+
+
+def _affects_tenant_data(instance, tenant_data):
+    if isinstance(instance, (old_models.ApplicationSettings,
+                             old_models.Tag, old_models.Orthography)):
+        return True
+    if isinstance(instance, old_models.Form):
+        if instance.id in tenant_data.foreign_word_form_ids:
+            return True
+        # Only look at tags that are loaded: changed tags always are.
+        tags = instance.__dict__.get('tags') or []
+        return any(tag.name == FOREIGN_WORD_TAG_NAME for tag in tags)
+    return False
+
+
+@event.listens_for(Session, 'after_flush')
+def invalidate_on_flush(session, flush_context):
+    """Invalidate the cached data of the OLD that ``session`` writes to if the
+    flush changes any of the rows that they are built from.
+    """
+    # pylint: disable=unused-argument
+    if not TENANT_DATA:
+        return
+    try:
+        tenant = get_tenant_key(session)
+    except Exception:  # E.g., an unbound session.
+        return
+    tenant_data = TENANT_DATA.get(tenant)
+    if tenant_data is None:
+        return
+    for instance in (
+            list(session.new) + list(session.dirty) + list(session.deleted)):
+        if _affects_tenant_data(instance, tenant_data):
+            invalidate(tenant)
+            return
+
+
+# The tables whose rows the cached data are built from, less form.
+TENANT_DATA_TABLES = frozenset(['applicationsettings',
+                                'applicationsettingsuser', 'tag',
+                                'orthography', 'formtag'])
+
+
+@event.listens_for(Engine, 'before_execute')
+def invalidate_on_execute(connection, clauseelement, multiparams, params):
+    """Invalidate the cached data of the OLD that ``connection`` writes to if
+    the statement, e.g., a bulk update or delete, writes to one of the tables
+    that they are built from.
+    """
+    # pylint: disable=unused-argument
+    if (TENANT_DATA and
+            isinstance(clauseelement, (Insert, Update, Delete)) and
+            clauseelement.table.name in TENANT_DATA_TABLES):
+        invalidate(get_tenant_key(connection))
@@ -0,0 +1,220 @@
+# Copyright 2016 Joel Dunham
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""Derive from a regular expression the substrings that every string that
+it matches must contain, as a query of the trigram indexes of
+:mod:`old.models.fulltext`.
+
+On SQLite, the ``regex`` relation of ``SQLAQueryBuilder`` calls a Python
+function for every row. With a trigram index, a search like
+``["Form", "morpheme_break", "regex", "-s( |-|$)"]`` first finds the rows
+whose ``morpheme_break`` contains ``-s `` or ``-s-`` (or ends with ``-s``,
+which a trigram cannot express, so there is no prefilter in that case) and
+only calls the function on those.
+
+The analysis follows the approach of Russ Cox's "Regular Expression Matching
+with a Trigram Index". Each node of the parsed expression (Python's own
+parser is used since SQLite's ``regexp`` function is Python's ``re``) is
+described by
+
+- ``exact``: the set of all of the strings it matches, if that is small, and
+- ``query``: a boolean query of substrings that any string it matches
+  contains (``None`` if there is none).
+
+A query is a ``('substring', string)``, ``('and', (query, ...))`` or
+``('or', (query, ...))`` tuple; :func:`get_trigram_query` renders it as an FTS5 query of a
+trigram table, in which a quoted string of three or more characters matches
+the values that contain it.
+"""
+
+import functools
+import itertools
+import logging
+import re
+
+try:
+    import re._parser as sre_parse
+    from re._constants import (
+        ASSERT, ASSERT_NOT, AT, BRANCH, IN, LITERAL, MAX_REPEAT, MIN_REPEAT,
+        RANGE, SUBPATTERN)
+except ImportError:  # Python < 3.11
+    import sre_parse
+    from sre_constants import (
+        ASSERT, ASSERT_NOT, AT, BRANCH, IN, LITERAL, MAX_REPEAT, MIN_REPEAT,
+        RANGE, SUBPATTERN)
+
+
+LOGGER = logging.getLogger(__name__)
+
+# The largest exact set kept; larger sets are turned into queries.
+MAX_EXACT = 64
+# The largest character class expanded into an exact set of characters.
+MAX_CLASS = 8
+# Trigram tables do not match substrings shorter than this.
+MIN_SUBSTRING = 3
+
+ANYTHING = (None, None)  # (exact, query) of a node that tells us nothing
+
+
+def analyze(pattern):
+    """Return the query of the substrings that every string matched by the
+    regular expression ``pattern`` contains, or ``None``.
+    """
+    try:
+        parsed = sre_parse.parse(pattern)
+    except (re.error, TypeError, ValueError, RecursionError):
+        return None
+    if parsed.state.flags & re.IGNORECASE:
+        return None
+    try:
+        return _to_query(*_analyze_sequence(parsed))
+    except _CaseInsensitive:
+        return None
+
+
+class _CaseInsensitive(Exception):
+    """Raised on a group that is matched case-insensitively."""
+
+
+def _analyze_sequence(items):
+    """Return the ``(exact, query)`` pair of a sequence of parsed items. The
+    exact sets of consecutive items are combined as long as they are small;
+    when that is impossible, the strings combined so far are turned into a
+    query and a new run starts.
+    """
+    exact, query, complete = {''}, None, True
+    for item in items:
+        item_exact, item_query = _analyze_item(*item)
+        query = _and(query, item_query)
+        if item_exact is None:
+            query = _and(query, _to_query(exact, None))
+            exact, complete = {''}, False
+        elif len(exact) * len(item_exact) <= MAX_EXACT:
+            exact = {x + y for x, y in itertools.product(exact, item_exact)}
+        else:
+            query = _and(query, _to_query(exact, None))
+            exact, complete = item_exact, False
+    if complete:
+        return exact, query
+    return None, _and(query, _to_query(exact, None))
+
+
+def _analyze_item(op, av):
+    if op == LITERAL:
+        return {chr(av)}, None
+    if op == IN:
+        return _analyze_class(av), None
+    if op in (AT, ASSERT, ASSERT_NOT):
+        # Anchors and lookarounds consume nothing.
+        return {''}, None
+    if op == SUBPATTERN:
+        _, add_flags, _, items = av
+        if add_flags & re.IGNORECASE:
+            raise _CaseInsensitive()
+        return _analyze_sequence(items)
+    if op == BRANCH:
+        branches = [_analyze_sequence(items) for items in av[1]]
+        if all(exact is not None for exact, _ in branches):
+            exact = set().union(*(exact for exact, _ in branches))
+            if len(exact) <= MAX_EXACT:
+                return exact, _or([query for _, query in branches])
+        return None, _or([_to_query(*branch) for branch in branches])
+    if op in (MAX_REPEAT, MIN_REPEAT) or \
+            getattr(sre_parse, 'POSSESSIVE_REPEAT', None) == op:
+        minimum, maximum, items = av
+        exact, query = _analyze_sequence(items)
+        if minimum == 0:
+            if maximum == 1 and exact is not None:
+                return exact | {''}, None
+            return ANYTHING
+        if minimum == maximum and exact is not None and \
+                len(exact) ** minimum <= MAX_EXACT:
+            return {''.join(strings) for strings in
+                    itertools.product(exact, repeat=minimum)}, query
+        return None, _to_query(exact, query)
+    return ANYTHING  # e.g., ".", "[^a]" or a back reference
+
+
+def _analyze_class(items):
+    chars = set()
+    for op, av in items:
+        if op == LITERAL:
+            chars.add(chr(av))
+        elif op == RANGE and av[1] - av[0] < MAX_CLASS:
+            chars.update(chr(code) for code in range(av[0], av[1] + 1))
+        else:  # NEGATE, CATEGORY or a large range
+            return None
+        if len(chars) > MAX_CLASS:
+            return None
+    return chars
+
+
+def _to_query(exact, query):
+    """Return the query that the strings of ``exact`` (if known) and
+    ``query`` require.
+    """
+    if exact is None:
+        return query
+    return _and(query, _or([
+        ('substring', string) if len(string) >= MIN_SUBSTRING else None
+        for string in exact]))
+
+
+def _and(first, second):
+    queries = [query for query in (first, second) if query is not None]
+    if not queries:
+        return None
+    if len(queries) == 1:
+        return queries[0]
+    children = []
+    for query in queries:
+        children.extend(query[1] if query[0] == 'and' else [query])
+    return ('and', _unique(children))
+
+
+def _or(queries):
+    """Return the disjunction of ``queries``; it is ``None`` (i.e.,
+    requires nothing) if any of them is.
+    """
+    if not queries or any(query is None for query in queries):
+        return None
+    children = []
+    for query in queries:
+        children.extend(query[1] if query[0] == 'or' else [query])
+    children = _unique(children)
+    return children[0] if len(children) == 1 else ('or', children)
+
+
+def _unique(queries):
+    return tuple(sorted(set(queries), key=repr))
+
+
+def to_fts5(query):
+    kind = query[0]
+    if kind == 'substring':
+        return '"%s"' % query[1].replace('"', '""')
+    return '(%s)' % (' %s ' % kind.upper()).join(
+        to_fts5(child) for child in query[1])
+
+
+@functools.lru_cache(maxsize=1024)
+def get_trigram_query(pattern):
+    """Return the FTS5 query of a trigram table that selects (a superset of)
+    the values that the regular expression ``pattern`` matches, or ``None``
+    if the index cannot narrow them down.
+    """
+    query = analyze(pattern)
+    if query is None:
+        return None
+    return to_fts5(query)
@@ -15,7 +15,9 @@ from .elicitationmethod import ElicitationMethod
 from .file import File, FileTag
 from .form import Form, FormFile, FormTag, CollectionForm
 from .formbackup import FormBackup
+from .formmorpheme import FormMorpheme
 from .formsearch import FormSearch
+from .job import Job
 from .keyboard import Keyboard
 from .language import Language
 from .model import Model
@@ -33,8 +35,11 @@ from .source import Source
 from .speaker import Speaker
 from .syntacticcategory import SyntacticCategory
 from .tag import Tag
+from .tombstone import Tombstone
 from .translation import Translation
 from .user import User, UserForm
+# the full-text indexes are created and dropped along with their tables
+from . import fulltext
 
 # run configure_mappers after defining all of the models to ensure
 # all relationships can be setup
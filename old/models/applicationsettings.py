@@ -24,8 +24,8 @@ class ApplicationSettingsUser(Base):
         Sequence('applicationsettingsuser_seq_id', optional=True),
         primary_key=True)
     applicationsettings_id = Column(
-        Integer, ForeignKey('applicationsettings.id'))
-    user_id = Column(Integer, ForeignKey('user.id'))
+        Integer, ForeignKey('applicationsettings.id'), index=True)
+    user_id = Column(Integer, ForeignKey('user.id'), index=True)
     datetime_modified = Column(mysql.DATETIME(fsp=6), default=now)
 
 
@@ -69,7 +69,8 @@ class ApplicationSettings(Base):
     output_orthography = relation(
         'Orthography',
         primaryjoin='ApplicationSettings.output_orthography_id==Orthography.id')
-    datetime_modified = Column(mysql.DATETIME(fsp=6), default=now)
+    datetime_modified = Column(mysql.DATETIME(fsp=6), default=now,
+                               index=True)
     # pylint: disable=no-member
     unrestricted_users = relation(
         'User', secondary=ApplicationSettingsUser.__table__)
@@ -141,42 +142,51 @@ class ApplicationSettings(Base):
         'morpheme_break'. The ``db`` var (a ``DBUtils`` instance) must be
         supplied.
         """
-        fwt = db.foreign_word_transcriptions
         attr = '_' + type_ + '_inv'
         inv = getattr(self, attr, None)
         if inv:
             return inv
-        if type_ == 'narrow_phonetic':
-            setattr(self, attr, Inventory(
-                getattr(fwt, type_) +
-                [' '] +
-                self.narrow_phonetic_inventory.split(',')))
-        elif type_ == 'broad_phonetic':
-            setattr(self, attr, Inventory(
-                getattr(fwt, type_) +
-                [' '] +
-                self.broad_phonetic_inventory.split(',')))
-        elif type_ == 'orthographic':
-            setattr(self, attr, Inventory(
-                getattr(fwt, type_) +
-                self.punctuation_list +
-                [' '] +
-                self.storage_orthography_list))
-        else:
-            if self.morpheme_break_is_orthographic:
-                setattr(self, attr, Inventory(
-                    getattr(fwt, type_) +
-                    self.morpheme_delimiters_list +
-                    [' '] +
-                    self.storage_orthography_list))
-            else:
-                setattr(self, attr, Inventory(
-                    getattr(fwt, type_) +
-                    self.morpheme_delimiters_list +
-                    [' '] +
-                    self.phonemic_inventory.split(',')))
+        setattr(self, attr, build_transcription_inventory(
+            self, type_, db.foreign_word_transcriptions))
         return getattr(self, attr)
 
+
+def build_transcription_inventory(app_set, type_, fwt):
+    """Return an ``Inventory`` instance for the transcription type ``type_``
+    (cf. ``ApplicationSettings.get_transcription_inventory``) given the
+    application settings ``app_set`` (a model or a snapshot of one, cf.
+    ``old.lib.tenantcache``) and the transcriptions of the foreign words
+    ``fwt``.
+    """
+    if type_ == 'narrow_phonetic':
+        return Inventory(
+            getattr(fwt, type_) +
+            [' '] +
+            app_set.narrow_phonetic_inventory.split(','))
+    if type_ == 'broad_phonetic':
+        return Inventory(
+            getattr(fwt, type_) +
+            [' '] +
+            app_set.broad_phonetic_inventory.split(','))
+    if type_ == 'orthographic':
+        return Inventory(
+            getattr(fwt, type_) +
+            app_set.punctuation_list +
+            [' '] +
+            app_set.storage_orthography_list)
+    if app_set.morpheme_break_is_orthographic:
+        return Inventory(
+            getattr(fwt, type_) +
+            app_set.morpheme_delimiters_list +
+            [' '] +
+            app_set.storage_orthography_list)
+    return Inventory(
+        getattr(fwt, type_) +
+        app_set.morpheme_delimiters_list +
+        [' '] +
+        app_set.phonemic_inventory.split(','))
+
+
 def _get_regex_validator(input_list):
     """Returns a regex that matches only strings composed of zero or more
     of the graphemes in the inventory (plus the space character).
@@ -14,8 +14,8 @@ class CollectionFile(Base):
 
     id = Column(Integer, Sequence('collectionfile_seq_id', optional=True),
                 primary_key=True)
-    collection_id = Column(Integer, ForeignKey('collection.id'))
-    file_id = Column(Integer, ForeignKey('file.id'))
+    collection_id = Column(Integer, ForeignKey('collection.id'), index=True)
+    file_id = Column(Integer, ForeignKey('file.id'), index=True)
     datetime_modified = Column(mysql.DATETIME(fsp=6), default=now)
 
 
@@ -25,8 +25,8 @@ class CollectionTag(Base):
 
     id = Column(Integer, Sequence('collectiontag_seq_id', optional=True),
                 primary_key=True)
-    collection_id = Column(Integer, ForeignKey('collection.id'))
-    tag_id = Column(Integer, ForeignKey('tag.id'))
+    collection_id = Column(Integer, ForeignKey('collection.id'), index=True)
+    tag_id = Column(Integer, ForeignKey('tag.id'), index=True)
     datetime_modified = Column(mysql.DATETIME(fsp=6), default=now)
 
 
@@ -58,7 +58,8 @@ class Collection(Base):
     modifier = relation('User', primaryjoin='Collection.modifier_id==User.id')
     date_elicited = Column(Date)
     datetime_entered = Column(mysql.DATETIME(fsp=6))
-    datetime_modified = Column(mysql.DATETIME(fsp=6), default=now)
+    datetime_modified = Column(mysql.DATETIME(fsp=6), default=now,
+                               index=True)
     tags = relation('Tag', secondary=CollectionTag.__table__)
     files = relation('File', secondary=CollectionFile.__table__, backref='collections')
     # forms attribute is defined in a relation/backref in the form model
@@ -36,8 +36,8 @@ class CollectionBackup(Base):
         return "<CollectionBackup (%s)>" % self.id
 
     id = Column(Integer, Sequence('collectionbackup_seq_id', optional=True), primary_key=True)
-    collection_id = Column(Integer)
-    UUID = Column(Unicode(36))
+    collection_id = Column(Integer, index=True)
+    UUID = Column(Unicode(36), index=True)
     title = Column(Unicode(255))
     type = Column(Unicode(255))
     url = Column(Unicode(255))
@@ -33,8 +33,8 @@ class CorpusForm(Base):
 
     id = Column(Integer, Sequence('corpusform_seq_id', optional=True),
                 primary_key=True)
-    corpus_id = Column(Integer, ForeignKey('corpus.id'))
-    form_id = Column(Integer, ForeignKey('form.id'))
+    corpus_id = Column(Integer, ForeignKey('corpus.id'), index=True)
+    form_id = Column(Integer, ForeignKey('form.id'), index=True)
     datetime_modified = Column(mysql.DATETIME(fsp=6), default=now)
 
 
@@ -44,8 +44,8 @@ class CorpusTag(Base):
 
     id = Column(Integer, Sequence('corpustag_seq_id', optional=True),
                 primary_key=True)
-    corpus_id = Column(Integer, ForeignKey('corpus.id'))
-    tag_id = Column(Integer, ForeignKey('tag.id'))
+    corpus_id = Column(Integer, ForeignKey('corpus.id'), index=True)
+    tag_id = Column(Integer, ForeignKey('tag.id'), index=True)
     datetime_modified = Column(mysql.DATETIME(fsp=6), default=now)
 
 
@@ -83,7 +83,8 @@ class Corpus(Base):
     form_search_id = Column(Integer, ForeignKey('formsearch.id', ondelete='SET NULL'))
     form_search = relation('FormSearch')
     datetime_entered = Column(mysql.DATETIME(fsp=6))
-    datetime_modified = Column(mysql.DATETIME(fsp=6), default=now)
+    datetime_modified = Column(mysql.DATETIME(fsp=6), default=now,
+                               index=True)
     tags = relation('Tag', secondary=CorpusTag.__table__)
     forms = relation('Form', secondary=CorpusForm.__table__, backref='corpora')
 
@@ -158,6 +159,12 @@ class CorpusFile(Base):
     datetime_modified = Column(mysql.DATETIME(fsp=6), default=now)
     datetime_created = Column(mysql.DATETIME(fsp=6))
     restricted = Column(Boolean)
+    # Status of the file's (asynchronous) export: 'queued', 'writing', 'ready'
+    # or 'failed', cf. ``old.lib.corpusexport``.
+    status = Column(Unicode(40))
+    forms_written = Column(Integer, default=0)
+    forms_total = Column(Integer)
+    message = Column(UnicodeText)
 
     def get_dict(self):
         """Return a Python dictionary representation of the corpus file."""
@@ -170,5 +177,9 @@ class CorpusFile(Base):
             'modifier': self.get_mini_user_dict(self.modifier),
             'datetime_modified': self.datetime_modified,
             'datetime_entered': self.datetime_entered,
-            'restricted': self.restricted
+            'restricted': self.restricted,
+            'status': self.status,
+            'forms_written': self.forms_written,
+            'forms_total': self.forms_total,
+            'message': self.message
         }
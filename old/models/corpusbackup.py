@@ -41,8 +41,8 @@ class CorpusBackup(Base):
         return "<CorpusBackup (%s)>" % self.id
 
     id = Column(Integer, Sequence('corpusbackup_seq_id', optional=True), primary_key=True)
-    corpus_id = Column(Integer)
-    UUID = Column(Unicode(36))
+    corpus_id = Column(Integer, index=True)
+    UUID = Column(Unicode(36), index=True)
     name = Column(Unicode(255))
     type = Column(Unicode(255))
     description = Column(UnicodeText)
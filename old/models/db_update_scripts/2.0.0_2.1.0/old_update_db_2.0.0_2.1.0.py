@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+
+# Copyright 2016 Joel Dunham
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""This executable updates an OLD 2.0.0 database (MySQL or SQLite) and makes
+it compatible with the OLD 2.1.0 data structure. All of the changes are
+additive, so the update can be run more than once:
+
+- the tables added since 2.0.0 are created (``form_morpheme``, ``job`` and
+  ``tombstone``);
+- the columns added since 2.0.0 are added (e.g., the ``status``,
+  ``forms_written``, ``forms_total`` and ``message`` columns of
+  ``corpusfile``); and
+- the secondary indexes declared by the models are created (backup
+  ``UUID`` values, ``datetime_modified`` values, the foreign keys of the
+  association tables, form breaks and glosses, parses, etc.). Creating the
+  indexes of large tables may take a while; and
+- the full-text indexes of the free-text columns of forms, translations and
+  collections are created (cf. ``old.models.fulltext``): FTS5 tables and
+  their triggers on SQLite, ``FULLTEXT`` indexes on MySQL. On SQLite, the
+  trigram tables that speed up regex searches of forms and translations are
+  created too.
+
+Usage::
+
+    $ ./old_update_db_2.0.0_2.1.0.py config.ini old_name [--dry-run]
+
+With ``--dry-run``, the SQL statements are printed but not executed.
+"""
+
+import argparse
+import sys
+
+from pyramid.paster import get_appsettings
+from sqlalchemy import inspect
+from sqlalchemy.schema import CreateColumn, CreateIndex, CreateTable
+
+from old import (
+    db_session_factory_registry,
+    override_settings_with_env_vars
+)
+from old.lib.indexadvisor import get_missing_declared_indexes
+from old.models.fulltext import get_missing_fulltext_statements
+from old.models.meta import Base
+
+
+def get_update_statements(connection):
+    """Return the SQL statements that bring the database of ``connection`` up
+    to date with the models.
+    """
+    dialect = connection.dialect
+    inspector = inspect(connection)
+    table_names = set(inspector.get_table_names())
+    statements = []
+    for table in Base.metadata.sorted_tables:
+        if table.name not in table_names:
+            statements.append(str(CreateTable(table).compile(dialect=dialect)))
+            statements.extend(
+                str(CreateIndex(index).compile(dialect=dialect))
+                for index in sorted(table.indexes,
+                                    key=lambda index: index.name))
+            continue
+        existing = {column['name'] for column in
+                    inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing:
+                statements.append('ALTER TABLE %s ADD COLUMN %s' % (
+                    dialect.identifier_preparer.format_table(table),
+                    CreateColumn(column).compile(dialect=dialect)))
+    statements.extend(
+        str(CreateIndex(index).compile(dialect=dialect))
+        for index in get_missing_declared_indexes(connection))
+    statements.extend(get_missing_fulltext_statements(connection))
+    return [statement.strip() for statement in statements]
+
+
+def update(connection, dry_run=False):
+    """Execute (unless ``dry_run``) and return the statements of
+    :func:`get_update_statements`.
+    """
+    statements = get_update_statements(connection)
+    if not dry_run:
+        for statement in statements:
+            connection.execute(statement)
+    return statements
+
+
+def get_args():
+    parser = argparse.ArgumentParser(
+        description='Update an OLD 2.0.0 database to OLD 2.1.0.')
+    parser.add_argument(
+        'config_file', metavar='CONFIG_FILE',
+        help='Path (relative or absolute) to the OLD config file, e.g.,'
+             'config.ini')
+    parser.add_argument(
+        'old_name', metavar='OLD_NAME',
+        help='The name of the OLD instance whose database should be updated.')
+    parser.add_argument(
+        '--dry-run', action='store_true',
+        help='Print the SQL statements without executing them.')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = get_args()
+    settings = get_appsettings(args.config_file, options={})
+    settings['old_name'] = args.old_name
+    settings = override_settings_with_env_vars(settings)
+    dbsession = db_session_factory_registry.get_session(settings)()
+    try:
+        for statement in update(dbsession.connection(), args.dry_run):
+            print('%s;' % statement)
+        dbsession.commit()
+    except Exception as error:
+        dbsession.rollback()
+        sys.exit('Unable to update the database of OLD "%s": %s' % (
+            args.old_name, error))
+    finally:
+        dbsession.close()
@@ -29,4 +29,5 @@ class ElicitationMethod(Base):
     id = Column(Integer, Sequence('elicitationmethod_seq_id', optional=True), primary_key=True)
     name = Column(Unicode(255))
     description = Column(UnicodeText)
-    datetime_modified = Column(mysql.DATETIME(fsp=6), default=now)
+    datetime_modified = Column(mysql.DATETIME(fsp=6), default=now,
+                               index=True)
@@ -32,8 +32,8 @@ class FileTag(Base):
     __tablename__ = 'filetag'
 
     id = Column(Integer, Sequence('filetag_seq_id', optional=True), primary_key=True)
-    file_id = Column(Integer, ForeignKey('file.id'))
-    tag_id = Column(Integer, ForeignKey('tag.id'))
+    file_id = Column(Integer, ForeignKey('file.id'), index=True)
+    tag_id = Column(Integer, ForeignKey('tag.id'), index=True)
     datetime_modified = Column(mysql.DATETIME(fsp=6), default=now)
 
 
@@ -64,7 +64,8 @@ class File(Base):
     description = Column(UnicodeText)
     date_elicited = Column(Date)
     datetime_entered = Column(mysql.DATETIME(fsp=6))
-    datetime_modified = Column(mysql.DATETIME(fsp=6), default=now)
+    datetime_modified = Column(mysql.DATETIME(fsp=6), default=now,
+                               index=True)
     enterer_id = Column(Integer, ForeignKey('user.id', ondelete='SET NULL'))
     enterer = relation('User', primaryjoin='File.enterer_id==User.id')
     elicitor_id = Column(Integer, ForeignKey('user.id', ondelete='SET NULL'))
@@ -14,7 +14,7 @@
 
 """Form model"""
 
-from sqlalchemy import Column, Sequence, ForeignKey
+from sqlalchemy import Column, Sequence, ForeignKey, Index
 from sqlalchemy.dialects import mysql
 from sqlalchemy.types import Integer, Unicode, UnicodeText, Date
 from sqlalchemy.orm import relation
@@ -29,8 +29,8 @@ class FormFile(Base):
     __tablename__ = 'formfile'
 
     id = Column(Integer, Sequence('formfile_seq_id', optional=True), primary_key=True)
-    form_id = Column(Integer, ForeignKey('form.id'))
-    file_id = Column(Integer, ForeignKey('file.id'))
+    form_id = Column(Integer, ForeignKey('form.id'), index=True)
+    file_id = Column(Integer, ForeignKey('file.id'), index=True)
     datetime_modified = Column(mysql.DATETIME(fsp=6), default=now)
 
 
@@ -39,8 +39,8 @@ class FormTag(Base):
     __tablename__ = 'formtag'
 
     id = Column(Integer, Sequence('formtag_seq_id', optional=True), primary_key=True)
-    form_id = Column(Integer, ForeignKey('form.id'))
-    tag_id = Column(Integer, ForeignKey('tag.id'))
+    form_id = Column(Integer, ForeignKey('form.id'), index=True)
+    tag_id = Column(Integer, ForeignKey('tag.id'), index=True)
     datetime_modified = Column(mysql.DATETIME(fsp=6), default=now)
 
 
@@ -49,14 +49,23 @@ class CollectionForm(Base):
     __tablename__ = 'collectionform'
 
     id = Column(Integer, Sequence('collectionform_seq_id', optional=True), primary_key=True)
-    collection_id = Column(Integer, ForeignKey('collection.id'))
-    form_id = Column(Integer, ForeignKey('form.id'))
+    collection_id = Column(Integer, ForeignKey('collection.id'), index=True)
+    form_id = Column(Integer, ForeignKey('form.id'), index=True)
     datetime_modified = Column(mysql.DATETIME(fsp=6), default=now)
 
 
 class Form(Base):
 
     __tablename__ = "form"
+    # Lexical matching (cf. ``get_perfect_matches``) looks forms up by break
+    # and gloss; MySQL can only index a prefix of these long columns.
+    __table_args__ = (
+        Index('ix_form_break', 'morpheme_break',
+              mysql_length={'morpheme_break': 255}),
+        Index('ix_form_gloss', 'morpheme_gloss',
+              mysql_length={'morpheme_gloss': 255}),
+        Base.__table_args__
+    )
 
     def __repr__(self):
         return "<Form (%s)>" % self.id
@@ -73,7 +82,8 @@ class Form(Base):
     grammaticality = Column(Unicode(255))
     date_elicited = Column(Date)
     datetime_entered = Column(mysql.DATETIME(fsp=6))
-    datetime_modified = Column(mysql.DATETIME(fsp=6), default=now)
+    datetime_modified = Column(mysql.DATETIME(fsp=6), default=now,
+                               index=True)
     syntactic_category_string = Column(Unicode(510))
     morpheme_break_ids = Column(UnicodeText)
     morpheme_gloss_ids = Column(UnicodeText)
@@ -93,7 +103,7 @@ class Form(Base):
     speaker = relation('Speaker')
     elicitationmethod_id = Column(Integer, ForeignKey('elicitationmethod.id', ondelete='SET NULL'))
     elicitation_method = relation('ElicitationMethod')
-    syntacticcategory_id = Column(Integer, ForeignKey('syntacticcategory.id', ondelete='SET NULL'))
+    syntacticcategory_id = Column(Integer, ForeignKey('syntacticcategory.id', ondelete='SET NULL'), index=True)
     syntactic_category = relation('SyntacticCategory', backref='forms')
     source_id = Column(Integer, ForeignKey('source.id', ondelete='SET NULL'))
     source = relation('Source')
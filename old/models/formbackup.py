@@ -46,8 +46,8 @@ class FormBackup(Base):
         return "<FormBackup (%s)>" % self.id
 
     id = Column(Integer, Sequence('formbackup_seq_id', optional=True), primary_key=True)
-    form_id = Column(Integer)
-    UUID = Column(Unicode(36))
+    form_id = Column(Integer, index=True)
+    UUID = Column(Unicode(36), index=True)
     transcription = Column(Unicode(510), nullable=False)
     phonetic_transcription = Column(Unicode(510))
     narrow_phonetic_transcription = Column(Unicode(510))
@@ -0,0 +1,72 @@
+# Copyright 2016 Joel Dunham
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""FormMorpheme model: an inverted index from morphemes to the forms whose
+morphological analyses contain them. There is one row per (form, word index,
+morpheme index); the ``shape``, ``gloss`` and ``category`` values are the
+morpheme's segments of the form's ``morpheme_break``, ``morpheme_gloss`` and
+``syntactic_category_string`` values. The table is derived data: it is
+maintained by the forms view and can be rebuilt with the
+``backfill_old_form_morphemes`` command.
+"""
+
+from sqlalchemy import Column, Sequence, ForeignKey
+from sqlalchemy.dialects import mysql
+from sqlalchemy.types import Integer, Unicode
+from sqlalchemy.orm import relation
+from .meta import Base, now
+
+
+class FormMorpheme(Base):
+
+    __tablename__ = 'form_morpheme'
+
+    def __repr__(self):
+        return '<FormMorpheme (%s, %s, %s)>' % (
+            self.form_id, self.word_index, self.morpheme_index)
+
+    id = Column(Integer, Sequence('form_morpheme_seq_id', optional=True),
+                primary_key=True)
+    form_id = Column(Integer, ForeignKey('form.id'), index=True)
+    form = relation('Form')
+    word_index = Column(Integer)
+    morpheme_index = Column(Integer)
+    shape = Column(Unicode(255), index=True)
+    gloss = Column(Unicode(255), index=True)
+    category = Column(Unicode(255))
+    datetime_modified = Column(mysql.DATETIME(fsp=6), default=now)
+
+    # Maximum length of indexed shape, gloss and category values; longer
+    # values are truncated, both when indexing and when looking up.
+    max_length = 255
+
+    def get_dict(self):
+        form = self.form
+        return {
+            'id': self.id,
+            'word_index': self.word_index,
+            'morpheme_index': self.morpheme_index,
+            'shape': self.shape,
+            'gloss': self.gloss,
+            'category': self.category,
+            'form': {
+                'id': form.id,
+                'transcription': form.transcription,
+                'morpheme_break': form.morpheme_break,
+                'morpheme_gloss': form.morpheme_gloss,
+                'syntactic_category_string': form.syntactic_category_string,
+                'translations': [{'id': t.id, 'transcription': t.transcription}
+                                 for t in form.translations]
+            }
+        }
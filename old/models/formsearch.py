@@ -40,7 +40,8 @@ class FormSearch(Base):
     description = Column(UnicodeText)
     enterer_id = Column(Integer, ForeignKey('user.id', ondelete='SET NULL'))
     enterer = relation('User')
-    datetime_modified = Column(mysql.DATETIME(fsp=6), default=now)
+    datetime_modified = Column(mysql.DATETIME(fsp=6), default=now,
+                               index=True)
 
     def get_dict(self):
         return {
@@ -0,0 +1,252 @@
+# Copyright 2016 Joel Dunham
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""Full-text indexes of the free-text columns searched by the ``match``
+relation of ``SQLAQueryBuilder`` and trigram indexes of the columns searched
+by its ``regex`` relation.
+
+On SQLite, each table in :data:`FULLTEXT_COLUMNS` gets an external content
+FTS5 table (e.g., ``form_fts``) whose rowids are the ids of the table's rows
+and which is kept current by ``AFTER INSERT``, ``AFTER DELETE`` and ``AFTER
+UPDATE`` triggers. On MySQL, each column gets its own ``FULLTEXT`` index,
+since ``MATCH (col) AGAINST (...)`` requires an index over exactly the
+columns matched.
+
+Similarly, on SQLite, each table in :data:`TRIGRAM_COLUMNS` gets an FTS5
+table that uses the trigram tokenizer (e.g., ``form_trigram``). It is used to
+find the rows that contain the substrings that a regular expression requires
+(cf. :mod:`old.lib.trigrams`), so that the (Python) ``regexp`` function is
+only called on those. MySQL has a native ``REGEXP``, so it gets no trigram
+indexes.
+
+The indexes are created along with their tables (``Base.metadata.
+create_all``); :func:`get_missing_fulltext_statements` returns the
+statements that add them to an existing database, cf. the 2.0.0 to 2.1.0
+update script.
+
+Not every SQLite library has FTS5, and the trigram tokenizer needs SQLite
+3.34 or later. :func:`sqlite_supports` probes the library once per kind of
+FTS5 table; the tables (and triggers) of an unsupported kind are not
+created, and regex searches then scan their tables.
+"""
+
+from collections import OrderedDict
+import logging
+import sqlite3
+
+from sqlalchemy import event, inspect
+from sqlalchemy.sql import column, table
+
+from .meta import Base
+
+
+LOGGER = logging.getLogger(__name__)
+
+# Maps table names to the names of their full-text indexed columns.
+FULLTEXT_COLUMNS = OrderedDict([
+    ('form', ('transcription', 'phonetic_transcription',
+              'narrow_phonetic_transcription', 'morpheme_break',
+              'morpheme_gloss', 'comments', 'speaker_comments')),
+    ('translation', ('transcription',)),
+    ('collection', ('title', 'description')),
+])
+
+# Maps table names to the names of their trigram indexed columns.
+TRIGRAM_COLUMNS = OrderedDict([
+    ('form', ('transcription', 'phonetic_transcription',
+              'narrow_phonetic_transcription', 'morpheme_break',
+              'morpheme_gloss')),
+    ('translation', ('transcription',)),
+])
+
+# Diacritics are significant in linguistic data, so the FTS5 tokenizer keeps
+# them. Regular expressions are case-sensitive, and so are their trigrams.
+FTS5_TOKENIZER = 'unicode61 remove_diacritics 0'
+TRIGRAM_TOKENIZER = 'trigram case_sensitive 1'
+
+# Maps the kinds of SQLite FTS5 tables to the suffixes of their names, the
+# columns they index and their tokenizers.
+FTS5_TABLES = OrderedDict([
+    ('fts', (FULLTEXT_COLUMNS, FTS5_TOKENIZER)),
+    ('trigram', (TRIGRAM_COLUMNS, TRIGRAM_TOKENIZER)),
+])
+
+
+# Maps the kinds of FTS5 tables to whether the SQLite library supports them.
+_SQLITE_SUPPORT = {}
+
+
+def sqlite_supports(kind='fts'):
+    """Return ``True`` if the SQLite library can create the FTS5 tables of
+    the given kind, i.e., if it has FTS5 and the kind's tokenizer. The
+    library is probed once per process and kind.
+    """
+    try:
+        return _SQLITE_SUPPORT[kind]
+    except KeyError:
+        pass
+    connection = sqlite3.connect(':memory:')
+    try:
+        connection.execute(
+            "CREATE VIRTUAL TABLE probe USING fts5(value, tokenize='%s')" %
+            FTS5_TABLES[kind][1])
+        supported = True
+    except sqlite3.Error as error:
+        LOGGER.warning('SQLite %s cannot create the %s FTS5 tables (%s); they'
+                       ' are not created.', sqlite3.sqlite_version, kind,
+                       error)
+        supported = False
+    finally:
+        connection.close()
+    _SQLITE_SUPPORT[kind] = supported
+    return supported
+
+
+def get_fts_table_name(table_name, kind='fts'):
+    return '%s_%s' % (table_name, kind)
+
+
+def get_fts_table(table_name, kind='fts'):
+    """Return a lightweight ``TableClause`` of the FTS5 table of
+    ``table_name`` of the given kind for use in SQLite queries.
+    """
+    columns = FTS5_TABLES[kind][0][table_name]
+    return table(get_fts_table_name(table_name, kind), column('rowid'),
+                 *[column(name) for name in columns])
+
+
+def get_fulltext_index_name(table_name, column_name):
+    return 'ix_%s_fulltext_%s' % (table_name, column_name)
+
+
+def _get_sqlite_triggers(table_name, kind):
+    """Return the ``(name, statement)`` pairs of the triggers that keep the
+    FTS5 table of ``table_name`` of the given kind current.
+    """
+    fts_table_name = get_fts_table_name(table_name, kind)
+    columns = FTS5_TABLES[kind][0][table_name]
+    names = ', '.join(columns)
+    insert = 'INSERT INTO %s(rowid, %s) VALUES (new.id, %s);' % (
+        fts_table_name, names, ', '.join('new.%s' % name for name in columns))
+    delete = "INSERT INTO %s(%s, rowid, %s) VALUES ('delete', old.id, %s);" % (
+        fts_table_name, fts_table_name, names,
+        ', '.join('old.%s' % name for name in columns))
+    triggers = (
+        ('insert', 'AFTER INSERT ON %s' % table_name, insert),
+        ('delete', 'AFTER DELETE ON %s' % table_name, delete),
+        ('update', 'AFTER UPDATE OF %s ON %s' % (names, table_name),
+         delete + ' ' + insert))
+    return [('%s_%s' % (fts_table_name, event_name),
+             'CREATE TRIGGER IF NOT EXISTS %s_%s %s BEGIN %s END' % (
+                 fts_table_name, event_name, timing, body))
+            for event_name, timing, body in triggers]
+
+
+def _get_sqlite_create_statements(table_name, kind):
+    columns, tokenizer = FTS5_TABLES[kind]
+    return [
+        "CREATE VIRTUAL TABLE IF NOT EXISTS %s USING fts5(%s,"
+        " content='%s', content_rowid='id', tokenize='%s')" % (
+            get_fts_table_name(table_name, kind),
+            ', '.join(columns[table_name]), table_name, tokenizer)
+    ] + [statement for _, statement in _get_sqlite_triggers(table_name, kind)]
+
+
+def get_create_statements(table_name, dialect_name):
+    """Return the statements that create the full-text and trigram
+    index(es) of the ``table_name`` table in a ``dialect_name`` database.
+    """
+    if dialect_name == 'sqlite':
+        return [statement for kind, (columns, _) in FTS5_TABLES.items()
+                if table_name in columns and sqlite_supports(kind)
+                for statement in _get_sqlite_create_statements(
+                    table_name, kind)]
+    if dialect_name == 'mysql':
+        return ['CREATE FULLTEXT INDEX %s ON %s (%s)' % (
+            get_fulltext_index_name(table_name, name), table_name, name)
+                for name in FULLTEXT_COLUMNS.get(table_name, ())]
+    return []
+
+
+def get_missing_fulltext_statements(connection):
+    """Return the statements that create the full-text and trigram indexes
+    (and, on SQLite, the triggers) that the existing tables of the database
+    of ``connection`` lack. On SQLite, a new FTS5 table is also filled with
+    the existing rows.
+    """
+    dialect_name = connection.dialect.name
+    inspector = inspect(connection)
+    table_names = set(inspector.get_table_names())
+    statements = []
+    if dialect_name == 'sqlite':
+        triggers = {row[0] for row in connection.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'trigger'")}
+        for kind, (columns, _) in FTS5_TABLES.items():
+            if not sqlite_supports(kind):
+                continue
+            for table_name in columns:
+                if table_name not in table_names:
+                    continue
+                fts_table_name = get_fts_table_name(table_name, kind)
+                if fts_table_name not in table_names:
+                    statements.extend(
+                        _get_sqlite_create_statements(table_name, kind))
+                    statements.append(
+                        "INSERT INTO %s(%s) VALUES ('rebuild')" % (
+                            fts_table_name, fts_table_name))
+                    continue
+                statements.extend(
+                    statement for name, statement in
+                    _get_sqlite_triggers(table_name, kind)
+                    if name not in triggers)
+    elif dialect_name == 'mysql':
+        for table_name, columns in FULLTEXT_COLUMNS.items():
+            if table_name not in table_names:
+                continue
+            existing = {index['name'] for index in
+                        inspector.get_indexes(table_name)}
+            statements.extend(
+                statement for name, statement in zip(
+                    columns, get_create_statements(table_name, 'mysql'))
+                if get_fulltext_index_name(table_name, name) not in existing)
+    return statements
+
+
+def create_fulltext_index(target, connection, **kwargs):
+    """Create the full-text and trigram index(es) of the ``target`` table
+    after the table is created.
+    """
+    # pylint: disable=unused-argument
+    for statement in get_create_statements(
+            target.name, connection.dialect.name):
+        connection.execute(statement)
+
+
+def drop_fulltext_index(target, connection, **kwargs):
+    """Drop the FTS5 tables of the ``target`` table before the table is
+    dropped; its triggers and MySQL indexes are dropped with it.
+    """
+    # pylint: disable=unused-argument
+    if connection.dialect.name == 'sqlite':
+        for kind, (columns, _) in FTS5_TABLES.items():
+            if target.name in columns:
+                connection.execute('DROP TABLE IF EXISTS %s' %
+                                   get_fts_table_name(target.name, kind))
+
+
+for _table_name in sorted(set(FULLTEXT_COLUMNS) | set(TRIGRAM_COLUMNS)):
+    event.listen(Base.metadata.tables[_table_name], 'after_create',
+                 create_fulltext_index)
+    event.listen(Base.metadata.tables[_table_name], 'before_drop',
+                 drop_fulltext_index)
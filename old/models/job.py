@@ -0,0 +1,74 @@
+# Copyright 2016 Joel Dunham
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""Job model: a background task (e.g., the compilation of a phonology) that
+has been queued for, is being run by, or has been run by the job scheduler,
+cf. :mod:`old.lib.jobs`. The row doubles as the job's result record.
+"""
+
+from sqlalchemy import Column, Sequence, ForeignKey
+from sqlalchemy.dialects import mysql
+from sqlalchemy.types import Integer, Unicode, UnicodeText
+from sqlalchemy.orm import relation
+
+from old.models.meta import Base, now
+
+
+class Job(Base):
+
+    __tablename__ = 'job'
+
+    def __repr__(self):
+        return '<Job (%s, %s, %s)>' % (self.id, self.kind, self.status)
+
+    id = Column(Integer, Sequence('job_seq_id', optional=True),
+                primary_key=True)
+    # The name of the registered handler that runs the job, e.g.,
+    # 'compile_phonology'.
+    kind = Column(Unicode(255), index=True)
+    # One of 'queued', 'running', 'succeeded' or 'failed'.
+    status = Column(Unicode(40), index=True, default='queued')
+    # Queued jobs with higher priorities are claimed first.
+    priority = Column(Integer, default=0)
+    args = Column(UnicodeText)      # The handler's keyword arguments as JSON
+    result = Column(UnicodeText)    # The handler's return value as JSON
+    error = Column(UnicodeText)
+    attempts = Column(Integer, default=0)
+    # Identifies the process and thread that claimed the job.
+    worker = Column(Unicode(255))
+    enterer_id = Column(Integer, ForeignKey('user.id', ondelete='SET NULL'))
+    enterer = relation('User')
+    datetime_entered = Column(mysql.DATETIME(fsp=6), default=now)
+    datetime_started = Column(mysql.DATETIME(fsp=6))
+    datetime_finished = Column(mysql.DATETIME(fsp=6))
+    # Touched periodically while the job runs, i.e., the job's heartbeat.
+    datetime_modified = Column(mysql.DATETIME(fsp=6), default=now)
+
+    def get_dict(self):
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'status': self.status,
+            'priority': self.priority,
+            'args': self.json_loads(self.args),
+            'result': self.json_loads(self.result),
+            'error': self.error,
+            'attempts': self.attempts,
+            'worker': self.worker,
+            'enterer': self.get_mini_user_dict(self.enterer),
+            'datetime_entered': self.datetime_entered,
+            'datetime_started': self.datetime_started,
+            'datetime_finished': self.datetime_finished,
+            'datetime_modified': self.datetime_modified
+        }
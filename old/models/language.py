@@ -34,7 +34,8 @@ class Language(Base):
     Type = Column(Unicode(1))
     Ref_Name = Column(Unicode(150))
     Comment = Column(Unicode(150))
-    datetime_modified = Column(mysql.DATETIME(fsp=6), default=now)
+    datetime_modified = Column(mysql.DATETIME(fsp=6), default=now,
+                               index=True)
 
     def get_dict(self):
         return {
@@ -125,7 +125,8 @@ class Model(object):
     table_name2core_attributes = {
         'corpus': ['id', 'name'],
         'corpusfile': ['id', 'filename', 'datetime_modified', 'format',
-                       'restricted'],
+                       'restricted', 'status', 'forms_written',
+                       'forms_total', 'message'],
         'elicitationmethod': ['id', 'name'],
         'file': ['id', 'name', 'filename', 'MIME_type', 'size', 'url',
                  'lossy_filename'],
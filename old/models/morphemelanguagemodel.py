@@ -54,7 +54,8 @@ class MorphemeLanguageModel(LanguageModel, Base):
     modifier_id = Column(Integer, ForeignKey('user.id', ondelete='SET NULL'))
     modifier = relation('User', primaryjoin='MorphemeLanguageModel.modifier_id==User.id')
     datetime_entered = Column(mysql.DATETIME(fsp=6))
-    datetime_modified = Column(mysql.DATETIME(fsp=6), default=now)
+    datetime_modified = Column(mysql.DATETIME(fsp=6), default=now,
+                               index=True)
     generate_succeeded = Column(Boolean, default=False)
     generate_message = Column(Unicode(255))
     generate_attempt = Column(Unicode(36)) # a UUID
@@ -38,8 +38,8 @@ class MorphemeLanguageModelBackup(Base):
     id = Column(
         Integer, Sequence('morphemelanguagemodelbackup_seq_id', optional=True),
         primary_key=True)
-    morphemelanguagemodel_id = Column(Integer)
-    UUID = Column(Unicode(36))
+    morphemelanguagemodel_id = Column(Integer, index=True)
+    UUID = Column(Unicode(36), index=True)
     name = Column(Unicode(255))
     description = Column(UnicodeText)
     corpus = Column(UnicodeText)
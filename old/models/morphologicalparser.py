@@ -37,6 +37,8 @@ with the parser's cache is mediated via a ``Cache`` instance (see below) that
 provides a standardized interface to cached parses (i.e., self.cache[k],
 self.cache[k] = v, self.cache.get(k, default), self.cache.update() and
 self.cache.clear()), cf. ``lib/parser.py`` for a pickle-based Cache class.
+In front of the ``parse`` table, each process keeps the most recently used
+parses of each parser in memory.
 
 The following attributes are those crucial to parsing functionality. (Note
 that the files that are crucial to a parser's parsing functionality are
@@ -97,16 +99,21 @@ that the files that are crucial to a parser's parsing functionality are
     and to pass a suitable input to the ``get_most_probable`` method.
 """
 
+import base64
 import codecs
+from collections import OrderedDict
 from hashlib import md5
 import json
 import logging
 import os
 import re
 from shutil import copyfile
+import threading
 from uuid import uuid4
+import zlib
 
-from sqlalchemy import Column, Sequence, ForeignKey
+from sqlalchemy import Column, Sequence, ForeignKey, Index
+from sqlalchemy.sql import select
 from sqlalchemy.dialects import mysql
 from sqlalchemy.types import Integer, Unicode, UnicodeText, Boolean
 from sqlalchemy.orm import relation
@@ -126,6 +133,11 @@ class Parse(Base):
     """
 
     __tablename__ = 'parse'
+    __table_args__ = (
+        Index('ix_parse_parser_id_transcription', 'parser_id',
+              'transcription', mysql_length={'transcription': 255}),
+        Base.__table_args__
+    )
 
     def __repr__(self):
         return '<Parse (%s)>' % self.id
@@ -255,7 +267,7 @@ class MorphologicalParser(MorphologicalParser_, Base):
         1. Generate and write to disk the morphophonology script
         2. Make copies of the phonology, morphology and LM attributes relevant
            to parsing behaviour
-        3. Copy the language model's pickled trie file
+        3. Copy the language model's binary LM (trie) file
         4. Copy the morphology's pickled dictionary file (if lacking rich
            morpheme representations)
         """
@@ -319,14 +331,17 @@ class MorphologicalParser(MorphologicalParser_, Base):
                 f.write('define morphophonology ?*;\n')
 
     def replicate_lm(self):
-        """Copy the parser's LM's trie pickle and ARPA files to the parser's
-        directory.
+        """Copy the parser's LM's binary LM (trie) and ARPA files to the
+        parser's directory.
 
-        If this results in a new trie pickle or arpa file being written, set
+        If this results in a new trie or arpa file being written, set
         ``self.changed = True``.
         """
         trie_path = self.language_model.get_file_path('trie')
         arpa_path = self.language_model.get_file_path('arpa')
+        if not os.path.isfile(trie_path):
+            # The LM was generated by an earlier version; convert its pickle.
+            self.language_model.trie
         my_language_model = LanguageModel(parent_directory=self.directory)
         replicated_trie_path = my_language_model.get_file_path('trie')
         replicated_arpa_path = my_language_model.get_file_path('arpa')
@@ -388,6 +403,10 @@ class MorphologicalParser(MorphologicalParser_, Base):
         expensive) check for a change to the destination file if
         ``self.changed`` is ``False``, i.e., if the core attributes of our
         parser have not yet changed.
+
+        The copy is written next to ``dst`` and then renamed so that processes
+        that have memory-mapped the file at ``dst`` (e.g., the LM) keep a
+        consistent view of it.
         """
         dst_existed = False
         pre_hash = None
@@ -395,7 +414,9 @@ class MorphologicalParser(MorphologicalParser_, Base):
             if os.path.isfile(dst):
                 dst_existed = True
                 pre_hash = self.get_hash(dst)
-        copyfile(src, dst)
+        tmp_path = '%s.%d.tmp' % (dst, os.getpid())
+        copyfile(src, tmp_path)
+        os.replace(tmp_path, dst)
         if not self.changed:
             if dst_existed:
                 post_hash = self.get_hash(dst)
@@ -524,6 +545,122 @@ class MorphologicalParser(MorphologicalParser_, Base):
         self._cache = value
 
 
+################################################################################
+# Parse cache
+################################################################################
+
+# Candidate lists whose JSON serialization is longer than this many characters
+# are stored zlib-compressed (and base64-encoded), prefixed by
+# ``COMPRESSED_PREFIX``.
+COMPRESSION_THRESHOLD = 1024
+COMPRESSED_PREFIX = 'zlib:'
+
+# ``parse.candidates`` is a TEXT column in MySQL, i.e., at most 65,535 bytes.
+MAX_CANDIDATES_LENGTH = 65000
+
+# Maximum number of transcriptions in one ``IN`` clause or multi-row INSERT.
+BATCH_SIZE = 500
+
+# Default maximum number of parses held in memory per parser and process, cf.
+# the ``parse_cache_size`` setting.
+DEFAULT_MEMORY_CACHE_SIZE = 10000
+
+
+def dumps_candidates(candidates):
+    """Serialize the list of parse candidates ``candidates`` for storage in
+    ``parse.candidates``. Long serializations are compressed. If a value does
+    not fit in the column even then, the least probable candidates are dropped
+    until it does.
+    """
+    while True:
+        value = json.dumps(candidates)
+        if len(value) > COMPRESSION_THRESHOLD:
+            value = COMPRESSED_PREFIX + base64.b64encode(
+                zlib.compress(value.encode('utf8'), 9)).decode('ascii')
+        if len(value) <= MAX_CANDIDATES_LENGTH:
+            return value
+        LOGGER.warning('Dropping the %d least probable of %d parse candidates'
+                       ' so that they can be cached.',
+                       len(candidates) - len(candidates) // 2, len(candidates))
+        candidates = candidates[:len(candidates) // 2]
+
+
+def loads_candidates(value):
+    """Deserialize a ``parse.candidates`` value, cf. ``dumps_candidates``."""
+    if not value:
+        return []
+    if value.startswith(COMPRESSED_PREFIX):
+        value = zlib.decompress(base64.b64decode(
+            value[len(COMPRESSED_PREFIX):])).decode('utf8')
+    candidates = json.loads(value)
+    # Earlier versions stored over-long candidate lists as truncated strings.
+    if not isinstance(candidates, list):
+        return []
+    return candidates
+
+
+class MemoryCache(object):
+    """The in-process tier of a parser's cache: a thread-safe map from
+    transcriptions to ``(parse, candidates)`` tuples that holds at most
+    ``max_size`` of them, evicting the least recently used.
+    """
+
+    def __init__(self, max_size=DEFAULT_MEMORY_CACHE_SIZE):
+        self.max_size = max_size
+        self._store = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._store)
+
+    def get_many(self, keys):
+        found = {}
+        with self._lock:
+            for key in keys:
+                try:
+                    found[key] = self._store[key]
+                except KeyError:
+                    continue
+                self._store.move_to_end(key)
+        return found
+
+    def update(self, dict_):
+        with self._lock:
+            for key, value in dict_.items():
+                self._store[key] = value
+                self._store.move_to_end(key)
+            while len(self._store) > self.max_size:
+                self._store.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._store.clear()
+
+
+MEMORY_CACHES = {}
+MEMORY_CACHES_LOCK = threading.Lock()
+
+
+def get_memory_cache(settings, parser):
+    """Return the memory tier of the cache of ``parser``, which is shared by
+    all of the threads of this process, or ``None`` if the
+    ``parse_cache_size`` setting is 0. Since the tier is keyed by the parser's
+    ``datetime_modified`` value, a parser that has been re-generated (e.g., by
+    another process) starts with an empty memory tier.
+    """
+    max_size = int(settings.get('parse_cache_size',
+                                DEFAULT_MEMORY_CACHE_SIZE))
+    if max_size <= 0:
+        return None
+    key = settings.get('sqlalchemy.url'), parser.id
+    with MEMORY_CACHES_LOCK:
+        version, memory_cache = MEMORY_CACHES.get(key, (None, None))
+        if memory_cache is None or version != parser.datetime_modified:
+            memory_cache = MemoryCache(max_size)
+            MEMORY_CACHES[key] = parser.datetime_modified, memory_cache
+        return memory_cache
+
+
 class Cache(object):
     """For caching parses; an interface to the MorphologicalParser().parses
     collection, a one-to-many relation.
@@ -536,87 +673,144 @@ class Cache(object):
     - ``__setitem__(k, v)``
     - ``__getitem__(k)``
     - ``get(k, default)``
+    - ``get_many(keys)``
     - ``persist()``
     - ``clear()``
+
+    Parses are looked up first in memory, in the LRU tier that all caches of
+    the parser in this process share (cf. ``get_memory_cache``), and then in
+    the ``parse`` table, where all of the transcriptions of a ``get_many``
+    call are looked up together. ``stats`` counts the hits in each tier and
+    the misses.
     """
 
     def __init__(self, parser, settings, session_getter):
-        # LOGGER.warn('DB CACHE CONSTRUCTED!')
         self.updated = False # means that ``self._store`` is in sync with persistent cache
         self.parser = parser
+        self.parser_id = parser.id
         self._store = {}
+        self._unpersisted = set()
         self.settings = settings
         self.session_getter = session_getter
+        self.memory = get_memory_cache(settings, parser)
+        self.stats = {'memory_hits': 0, 'database_hits': 0, 'misses': 0}
 
     def __setitem__(self, k, v):
-        # LOGGER.warn('DB_CACHE[%s] = %s CALLED' % (k, v))
-        if k not in self._store:
-            self.updated = True
-        self._store[k] = v
+        self.update({k: v})
 
     def __getitem__(self, k):
-        try:
-            return self._store[k]
-        except KeyError as e:
-            try:
-                dbsession = self.session_getter(self.settings)
-                dbsession.expunge_all()
-                parse = dbsession.query(Parse).filter(
-                    Parse.parser_id == self.parser.id).filter(
-                        Parse.transcription == k).first()
-                if parse:
-                    # LOGGER.warn('GOT %s FROM DB IN DB_CACHE' % k)
-                    self._store[k] = parse.parse, json.loads(parse.candidates)
-                    return self._store[k]
-                else:
-                    raise e
-            finally:
-                dbsession.commit()
-                dbsession.close()
+        return self.get_many([k])[k]
 
     def get(self, k, default=None):
         try:
             return self[k]
         except KeyError:
-            # LOGGER.warn('DB_CACHE.get(%s, %s) RETURNED %s' % (k, default, default))
             return default
 
+    def get_many(self, keys):
+        """Return a dict from those of the transcriptions in ``keys`` that
+        are cached to their ``(parse, candidates)`` tuples.
+        """
+        found = {}
+        missing = []
+        for key in keys:
+            try:
+                found[key] = self._store[key]
+            except KeyError:
+                missing.append(key)
+        if missing and self.memory is not None:
+            found.update(self.memory.get_many(missing))
+            missing = [key for key in missing if key not in found]
+        self.stats['memory_hits'] += len(found)
+        if missing:
+            persisted = self._select(missing)
+            if self.memory is not None:
+                self.memory.update(persisted)
+            self._store.update(persisted)
+            found.update(persisted)
+            self.stats['database_hits'] += len(persisted)
+            self.stats['misses'] += len(missing) - len(persisted)
+        return found
+
+    def _select(self, transcriptions):
+        """Return the persisted parses of ``transcriptions``, querying for
+        ``BATCH_SIZE`` transcriptions at a time.
+        """
+        table = Parse.__table__
+        persisted = {}
+        try:
+            dbsession = self.session_getter(self.settings)
+            dbsession.expunge_all()
+            for index in range(0, len(transcriptions), BATCH_SIZE):
+                rows = dbsession.execute(
+                    select([table.c.transcription, table.c.parse,
+                            table.c.candidates])
+                    .where(table.c.parser_id == self.parser_id)
+                    .where(table.c.transcription.in_(
+                        transcriptions[index:index + BATCH_SIZE])))
+                for transcription, parse, candidates in rows:
+                    persisted[transcription] = (
+                        parse, loads_candidates(candidates))
+            return persisted
+        finally:
+            dbsession.commit()
+            dbsession.close()
+
     def update(self, dict_, **kwargs):
-        old_keys = self._store.keys()
-        self._store.update(dict_, **kwargs)
-        if set(old_keys) != set(self._store.keys()):
+        dict_ = dict(dict_, **kwargs)
+        new = set(dict_) - set(self._store)
+        if new:
             self.updated = True
+            self._unpersisted.update(new)
+        self._store.update(dict_)
+        if self.memory is not None:
+            self.memory.update(dict_)
 
     def persist(self):
-        """Update the persistence layer with the value of ``self._store``.
+        """Update the persistence layer with the value of ``self._store``,
+        i.e., insert the parses that have been added since the last call in
+        multi-row INSERTs.
         """
-        if self.updated:
-            try:
-                dbsession = self.session_getter(self.settings)
-                persisted = [
-                    parse.transcription for parse in dbsession.query(Parse).\
-                    filter(Parse.parser_id == self.parser.id).\
-                    filter(Parse.transcription.in_(self._store.keys())).all()]
-                unpersisted = [Parse(transcription=transcription,
-                                     parse=parse,
-                                     candidates=self.json_dumps_candidates(
-                                         candidates),
-                                     parser=self.parser)
-                               for transcription, (parse, candidates)
-                               in self._store.items()
-                               if transcription not in persisted]
-                dbsession.add_all(unpersisted)
-                self.updated = False
-            finally:
-                dbsession.commit()
-                dbsession.close()
+        if not self.updated:
+            return
+        table = Parse.__table__
+        transcriptions = list(self._unpersisted)
+        try:
+            dbsession = self.session_getter(self.settings)
+            persisted = set()
+            for index in range(0, len(transcriptions), BATCH_SIZE):
+                persisted.update(transcription for (transcription,) in
+                                 dbsession.execute(
+                    select([table.c.transcription])
+                    .where(table.c.parser_id == self.parser_id)
+                    .where(table.c.transcription.in_(
+                        transcriptions[index:index + BATCH_SIZE]))))
+            datetime_modified = now()
+            rows = [{'transcription': transcription,
+                     'parse': self._store[transcription][0],
+                     'candidates': dumps_candidates(
+                         self._store[transcription][1]),
+                     'parser_id': self.parser_id,
+                     'datetime_modified': datetime_modified}
+                    for transcription in transcriptions
+                    if transcription not in persisted]
+            for index in range(0, len(rows), BATCH_SIZE):
+                dbsession.execute(table.insert(),
+                                  rows[index:index + BATCH_SIZE])
+            self._unpersisted = set()
+            self.updated = False
+        finally:
+            dbsession.commit()
+            dbsession.close()
 
-    @staticmethod
-    def json_dumps_candidates(candidates):
-        candidates = json.dumps(candidates)
-        if len(candidates) > 65000:
-            return json.dumps(candidates[:500])
-        return candidates
+    def get_stats(self):
+        """Return the hit and miss counts of this cache and its hit rate."""
+        stats = dict(self.stats)
+        lookups = sum(stats.values())
+        stats['hit_rate'] = (
+            (stats['memory_hits'] + stats['database_hits']) / lookups
+            if lookups else None)
+        return stats
 
     def clear(self, persist=False):
         """Clear the cache and its persistence layer.
@@ -627,11 +821,15 @@ class Cache(object):
         changes.
         """
         self._store = {}
+        self._unpersisted = set()
+        self.updated = False
+        if self.memory is not None:
+            self.memory.clear()
         if persist:
             try:
                 dbsession = self.session_getter(self.settings)
                 delete = Parse.__table__.delete().where(
-                    Parse.__table__.c.parser_id == self.parser.id)
+                    Parse.__table__.c.parser_id == self.parser_id)
                 dbsession.execute(delete)
             finally:
                 dbsession.commit()
@@ -641,11 +839,15 @@ class Cache(object):
         """Update the local store with the persistence layer and return the
         store.
         """
+        table = Parse.__table__
         try:
             dbsession = self.session_getter(self.settings)
-            persisted = {p.transcription: (p.parse, json.loads(p.candidates))
-                         for p in dbsession.query(Parse).filter(
-                             Parse.parser_id == self.parser.id).all()}
+            persisted = {
+                transcription: (parse, loads_candidates(candidates))
+                for transcription, parse, candidates in dbsession.execute(
+                    select([table.c.transcription, table.c.parse,
+                            table.c.candidates])
+                    .where(table.c.parser_id == self.parser_id))}
             self._store.update(persisted)
             return self._store
         finally:
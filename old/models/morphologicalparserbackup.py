@@ -33,8 +33,8 @@ class MorphologicalParserBackup(Base):
     id = Column(
         Integer, Sequence('morphologicalparserbackup_seq_id', optional=True),
         primary_key=True)
-    morphologicalparser_id = Column(Integer)
-    UUID = Column(Unicode(36))
+    morphologicalparser_id = Column(Integer, index=True)
+    UUID = Column(Unicode(36), index=True)
     name = Column(Unicode(255))
     description = Column(UnicodeText)
     phonology = Column(UnicodeText)
@@ -48,8 +48,8 @@ class MorphologyBackup(Base):
         return "<MorphologyBackup (%s)>" % self.id
 
     id = Column(Integer, Sequence('morphologybackup_seq_id', optional=True), primary_key=True)
-    morphology_id = Column(Integer)
-    UUID = Column(Unicode(36))
+    morphology_id = Column(Integer, index=True)
+    UUID = Column(Unicode(36), index=True)
     name = Column(Unicode(255))
     description = Column(UnicodeText)
     script_type = Column(Unicode(5))
@@ -31,4 +31,5 @@ class Orthography(Base):
     orthography = Column(UnicodeText)
     lowercase = Column(Boolean, default=False)
     initial_glottal_stops = Column(Boolean, default=True)
-    datetime_modified = Column(mysql.DATETIME(fsp=6), default=now)
+    datetime_modified = Column(mysql.DATETIME(fsp=6), default=now,
+                               index=True)
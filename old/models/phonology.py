@@ -39,7 +39,8 @@ class Phonology(PhonologyFST, Base):
     modifier_id = Column(Integer, ForeignKey('user.id', ondelete='SET NULL'))
     modifier = relation('User', primaryjoin='Phonology.modifier_id==User.id')
     datetime_entered = Column(mysql.DATETIME(fsp=6))
-    datetime_modified = Column(mysql.DATETIME(fsp=6), default=now)
+    datetime_modified = Column(mysql.DATETIME(fsp=6), default=now,
+                               index=True)
     compile_succeeded = Column(Boolean, default=False)
     compile_message = Column(Unicode(255))
     compile_attempt = Column(Unicode(36))
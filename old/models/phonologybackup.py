@@ -43,8 +43,8 @@ class PhonologyBackup(Base):
         return "<PhonologyBackup (%s)>" % self.id
 
     id = Column(Integer, Sequence('phonologybackup_seq_id', optional=True), primary_key=True)
-    phonology_id = Column(Integer)
-    UUID = Column(Unicode(36))
+    phonology_id = Column(Integer, index=True)
+    UUID = Column(Unicode(36), index=True)
     name = Column(Unicode(255))
     description = Column(UnicodeText)
     script = Column(UnicodeText)
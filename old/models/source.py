@@ -39,7 +39,8 @@ class Source(Base):
     file = relation('File')
     crossref_source_id = Column(Integer, ForeignKey('source.id', ondelete='SET NULL'))
     crossref_source = relation('Source', remote_side=[id])
-    datetime_modified = Column(mysql.DATETIME(fsp=6), default=now)
+    datetime_modified = Column(mysql.DATETIME(fsp=6), default=now,
+                               index=True)
 
     # BibTeX data structure
     type = Column(Unicode(20))
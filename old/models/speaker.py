@@ -35,7 +35,8 @@ class Speaker(Base):
     markup_language = Column(Unicode(100))
     page_content = Column(UnicodeText)
     html = Column(UnicodeText)
-    datetime_modified = Column(mysql.DATETIME(fsp=6), default=now)
+    datetime_modified = Column(mysql.DATETIME(fsp=6), default=now,
+                               index=True)
 
     def get_dict(self):
         return {
@@ -34,7 +34,8 @@ class SyntacticCategory(Base):
     name = Column(Unicode(255))
     type = Column(Unicode(60))
     description = Column(UnicodeText)
-    datetime_modified = Column(mysql.DATETIME(fsp=6), default=now)
+    datetime_modified = Column(mysql.DATETIME(fsp=6), default=now,
+                               index=True)
 
     def get_dict(self):
         return {
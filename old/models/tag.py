@@ -17,7 +17,8 @@ class Tag(Base):
     id = Column(Integer, Sequence('tag_seq_id', optional=True), primary_key=True)
     name = Column(Unicode(255), unique=True)
     description = Column(UnicodeText)
-    datetime_modified = Column(mysql.DATETIME(fsp=6), default=now)
+    datetime_modified = Column(mysql.DATETIME(fsp=6), default=now,
+                               index=True)
 
     def get_dict(self):
         return {
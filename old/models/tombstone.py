@@ -0,0 +1,52 @@
+# Copyright 2021 Joel Dunham
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""Tombstone model: records the deletion of a row of a table that followers
+synchronize, so that ``GET /sync/last_modified?since=...`` can report it. The
+rows are inserted by :func:`old.lib.sync.record_tombstones`.
+"""
+
+from sqlalchemy import Column, Index, Sequence
+from sqlalchemy.dialects import mysql
+from sqlalchemy.types import Integer, Unicode
+
+from old.models.meta import Base, now
+
+
+class Tombstone(Base):
+
+    __tablename__ = 'tombstone'
+    __table_args__ = (
+        Index('ix_tombstone_datetime_deleted', 'datetime_deleted'),
+        Index('ix_tombstone_table_name_id', 'table_name', 'id',
+              mysql_length={'table_name': 64}),
+        Base.__table_args__
+    )
+
+    def __repr__(self):
+        return '<Tombstone (%s, %s)>' % (self.table_name, self.row_id)
+
+    id = Column(Integer, Sequence('tombstone_seq_id', optional=True),
+                primary_key=True)
+    table_name = Column(Unicode(255))
+    row_id = Column(Integer)
+    datetime_deleted = Column(mysql.DATETIME(fsp=6), default=now)
+
+    def get_dict(self):
+        return {
+            'id': self.id,
+            'table_name': self.table_name,
+            'row_id': self.row_id,
+            'datetime_deleted': self.datetime_deleted
+        }
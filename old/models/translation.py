@@ -29,5 +29,6 @@ class Translation(Base):
     id = Column(Integer, Sequence('translation_seq_id', optional=True), primary_key=True)
     transcription = Column(UnicodeText, nullable=False)
     grammaticality = Column(Unicode(255))
-    form_id = Column(Integer, ForeignKey('form.id'))
-    datetime_modified = Column(mysql.DATETIME(fsp=6), default=now)
+    form_id = Column(Integer, ForeignKey('form.id'), index=True)
+    datetime_modified = Column(mysql.DATETIME(fsp=6), default=now,
+                               index=True)
@@ -29,8 +29,8 @@ class UserForm(Base):
 
     id = Column(Integer, Sequence('userform_seq_id', optional=True),
                 primary_key=True)
-    form_id = Column(Integer, ForeignKey('form.id'))
-    user_id = Column(Integer, ForeignKey('user.id'))
+    form_id = Column(Integer, ForeignKey('form.id'), index=True)
+    user_id = Column(Integer, ForeignKey('user.id'), index=True)
     datetime_modified = Column(mysql.DATETIME(fsp=6), default=now)
 
 
@@ -63,7 +63,8 @@ class User(Base):
         Integer, ForeignKey('orthography.id', ondelete='SET NULL'))
     output_orthography = relation(
         'Orthography', primaryjoin='User.output_orthography_id==Orthography.id')
-    datetime_modified = Column(mysql.DATETIME(fsp=6), default=now)
+    datetime_modified = Column(mysql.DATETIME(fsp=6), default=now,
+                               index=True)
     # pylint: disable=no-member
     remembered_forms = relation(
         'Form', secondary=UserForm.__table__, backref='memorizers')
@@ -88,10 +89,12 @@ class User(Base):
     def get_full_dict(self):
         return self.get_dict()
 
-    def is_authorized_to_access_model(self, model_object, unrestricted_users):
+    def is_authorized_to_access_model(self, model_object,
+                                      unrestricted_user_ids):
         """Return True if the user is authorized to access the model object.
         Models tagged with the 'restricted' tag are only accessible to
-        administrators, their enterers and unrestricted users.
+        administrators, their enterers and unrestricted users, i.e., those
+        whose ids are in ``unrestricted_user_ids``.
         NOTE: previously named ``user_is_authorized_to_access_model``
         """
         if self.role == 'administrator':
@@ -108,6 +111,6 @@ class User(Base):
         return (
             not tags or
             'restricted' not in tag_names or
-            self in unrestricted_users or
+            self.id in unrestricted_user_ids or
             self.id == enterer_id
         )
@@ -42,6 +42,7 @@ RESOURCES = {
     },
     'formsearch': {'searchable': True},
     'formbackup': {'searchable': True},
+    'job': {'searchable': True},
     'keyboard': {'searchable': True},
     'language': {'searchable': True},
     'morphemelanguagemodel': {
@@ -428,6 +429,24 @@ def _forms_special_routing(config):
                     request_method='PUT',
                     renderer='json',
                     decorator=(authenticate, authorize(['administrator'])))
+    config.add_route('update_morpheme_references_status',
+                     '/{old_name}/forms/update_morpheme_references',
+                     request_method='GET')
+    config.add_view('old.views.forms.Forms',
+                    attr='update_morpheme_references_status',
+                    route_name='update_morpheme_references_status',
+                    request_method='GET',
+                    renderer='json',
+                    decorator=(authenticate, authorize(['administrator'])))
+    config.add_route('form_concordance',
+                     '/{old_name}/forms/concordance',
+                     request_method='GET')
+    config.add_view('old.views.forms.Forms',
+                    attr='concordance',
+                    route_name='form_concordance',
+                    request_method='GET',
+                    renderer='json',
+                    decorator=authenticate)
 
 
 def _authentication_routing(config):
@@ -702,6 +721,38 @@ def _rf_special_routing(config):
 
 
 def includeme(config):
+    config.add_route('metrics', '/metrics', request_method='GET')
+    config.add_view('old.views.metrics.Metrics',
+                    attr='index',
+                    route_name='metrics',
+                    request_method='GET',
+                    renderer='json')
+
+    config.add_route('index_profiles', '/{old_name}/profiles',
+                     request_method='GET')
+    config.add_view('old.views.profiles.Profiles',
+                    attr='index',
+                    route_name='index_profiles',
+                    request_method='GET',
+                    renderer='json',
+                    decorator=(authenticate, authorize(['administrator'])))
+    config.add_route('show_profile', '/{old_name}/profiles/{id}',
+                     request_method='GET')
+    config.add_view('old.views.profiles.Profiles',
+                    attr='show',
+                    route_name='show_profile',
+                    request_method='GET',
+                    renderer='json',
+                    decorator=(authenticate, authorize(['administrator'])))
+    config.add_route('index_slowsearches', '/{old_name}/slowsearches',
+                     request_method='GET')
+    config.add_view('old.views.slowsearches.SlowSearches',
+                    attr='index',
+                    route_name='index_slowsearches',
+                    request_method='GET',
+                    renderer='json',
+                    decorator=(authenticate, authorize(['administrator'])))
+
     config.add_route('info', '/{old_name}/', request_method='GET')
     config.add_view('old.views.info.Info',
                     attr='index',
@@ -0,0 +1,79 @@
+# Copyright 2018 Joel Dunham
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""Create (if necessary) and populate the ``form_morpheme`` table of an
+existing OLD instance. The forms view keeps this table up to date, but OLDs
+created before it existed need to have it built once.
+"""
+
+import argparse
+import logging
+import sys
+
+from pyramid.paster import (
+    get_appsettings,
+    setup_logging,
+)
+
+from old import (
+    db_session_factory_registry,
+    override_settings_with_env_vars
+)
+from old.lib.dbutils import DBUtils
+from old.models import FormMorpheme
+
+
+LOGGER = logging.getLogger(__name__)
+
+
+def get_args():
+    parser = argparse.ArgumentParser(
+        description='Build the form-morpheme index (the form_morpheme table)'
+                    ' of an existing OLD instance.')
+    parser.add_argument(
+        'config_file', metavar='CONFIG_FILE',
+        help='Path (relative or absolute) to the OLD config file, e.g.,'
+             'config.ini',
+        default='config.ini')
+    parser.add_argument(
+        'old_name', metavar='OLD_NAME',
+        help='The name of the OLD instance whose forms should be indexed.',
+        default='old')
+    parser.add_argument(
+        '--chunk-size', type=int, default=1000,
+        help='The number of forms to read from the database at a time.')
+    return parser.parse_args()
+
+
+def main(argv=None):
+    args = get_args()
+    setup_logging(args.config_file)
+    settings = get_appsettings(args.config_file, options={})
+    settings['old_name'] = args.old_name
+    settings = override_settings_with_env_vars(settings)
+    dbsession = db_session_factory_registry.get_session(settings)()
+    try:
+        FormMorpheme.__table__.create(bind=dbsession.bind, checkfirst=True)
+        count = DBUtils(dbsession, settings).rebuild_form_morpheme_index(
+            chunk_size=args.chunk_size)
+        dbsession.commit()
+        LOGGER.info('Indexed the morphemes of %d forms in OLD "%s".', count,
+                    args.old_name)
+    except Exception as error:
+        dbsession.rollback()
+        LOGGER.error('Unable to build the form-morpheme index of OLD "%s":'
+                     ' %s', args.old_name, error)
+        sys.exit(1)
+    finally:
+        dbsession.close()
@@ -0,0 +1,89 @@
+# Copyright 2016 Joel Dunham
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""Replay the search queries logged by ``SQLAQueryBuilder`` against an OLD
+instance and report missing and unused indexes, cf.
+:mod:`old.lib.indexadvisor`::
+
+    $ old_index_advisor config.ini old /var/log/old/old.log
+
+"""
+
+import argparse
+from collections import Counter
+import json
+import logging
+import sys
+
+from pyramid.paster import (
+    get_appsettings,
+    setup_logging,
+)
+
+from old import (
+    db_session_factory_registry,
+    override_settings_with_env_vars
+)
+from old.lib.indexadvisor import advise, format_report, parse_query_log
+
+
+LOGGER = logging.getLogger(__name__)
+
+
+def get_args():
+    parser = argparse.ArgumentParser(
+        description='Replay the logged search queries of an OLD instance and'
+                    ' report missing and unused indexes.')
+    parser.add_argument(
+        'config_file', metavar='CONFIG_FILE',
+        help='Path (relative or absolute) to the OLD config file, e.g.,'
+             'config.ini',
+        default='config.ini')
+    parser.add_argument(
+        'old_name', metavar='OLD_NAME',
+        help='The name of the OLD instance whose queries should be replayed.',
+        default='old')
+    parser.add_argument(
+        'log_files', metavar='LOG_FILE', nargs='+',
+        help='Log files containing the queries logged by SQLAQueryBuilder.')
+    parser.add_argument(
+        '--json', action='store_true',
+        help='Print the report as JSON instead of text.')
+    return parser.parse_args()
+
+
+def main(argv=None):
+    args = get_args()
+    setup_logging(args.config_file)
+    settings = get_appsettings(args.config_file, options={})
+    settings['old_name'] = args.old_name
+    settings = override_settings_with_env_vars(settings)
+    entries = Counter()
+    for log_file in args.log_files:
+        with open(log_file, encoding='utf8', errors='replace') as file_:
+            entries.update(parse_query_log(file_))
+    dbsession = db_session_factory_registry.get_session(settings)()
+    try:
+        report = advise(dbsession, entries, settings)
+    except Exception as error:
+        LOGGER.error('Unable to replay the queries of OLD "%s": %s',
+                     args.old_name, error)
+        sys.exit(1)
+    finally:
+        dbsession.rollback()
+        dbsession.close()
+    if args.json:
+        print(json.dumps(report, indent=2, sort_keys=True))
+    else:
+        print(format_report(report))
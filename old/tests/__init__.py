@@ -42,6 +42,7 @@ from old import (
     override_settings_with_env_vars
 )
 import old.lib.helpers as h
+from old.lib import querystats, tenantcache
 from old.lib.dbutils import (
     get_model_names,
     DBUtils
@@ -55,7 +56,8 @@ import old.models as old_models
 LOGGER = logging.getLogger(__name__)
 
 
-__all__ = ['TestView', 'add_SEARCH_to_web_test_valid_methods', 'get_file_size']
+__all__ = ['TestView', 'add_SEARCH_to_web_test_valid_methods', 'get_file_size',
+           'QueryCounter']
 
 
 def add_SEARCH_to_web_test_valid_methods():
@@ -86,6 +88,10 @@ if old_name_2_tests:
     Session2 = db_session_factory_registry.get_session(SETTINGS_2)
 
 
+# The value of a setting that the app under test does not have.
+_UNSET = object()
+
+
 class TestView(TestCase):
     """Base test view for testing OLD Pyramid views.
 
@@ -114,6 +120,7 @@ class TestView(TestCase):
 
     def tearDown(self, **kwargs):
         """Clean up after a test."""
+        self.restore_registry_settings()
         db = DBUtils(self.dbsession, self.settings)
         clear_all_tables = kwargs.get('clear_all_tables', False)
         dirs_to_clear = kwargs.get('dirs_to_clear', [])
@@ -163,12 +170,15 @@ class TestView(TestCase):
         if Session2:
             self.dbsession2 = Session2()
         self.app = APP
+        self.registry_settings = APP.app.app.registry.settings
+        self._original_settings = {}
         setup_logging('config.ini#loggers')
         self._setattrs()
         self._setcreateparams()
 
     def create_db(self):
         # Create the database tables
+        tenantcache.invalidate()
         h.create_OLD_directories(self.settings)
         languages = omb.get_language_objects(self.settings['here'],
                                              truncated=True)
@@ -197,6 +207,41 @@ class TestView(TestCase):
             self.dbsession2.add_all(languages + [administrator, contributor, viewer])
             self.dbsession2.commit()
 
+    def set_registry_settings(self, **settings):
+        """Change the settings of the app under test (i.e., of its registry)
+        for the rest of the test; ``tearDown`` restores their original values.
+        """
+        for key, value in settings.items():
+            self._original_settings.setdefault(
+                key, self.registry_settings.get(key, _UNSET))
+            self.registry_settings[key] = value
+
+    def restore_registry_settings(self):
+        """Undo the changes made by ``set_registry_settings``."""
+        for key, value in self._original_settings.items():
+            if value is _UNSET:
+                self.registry_settings.pop(key, None)
+            else:
+                self.registry_settings[key] = value
+        self._original_settings = {}
+
+    def add_default_forms(self, count=0):
+        """Add the default application settings and ``count`` default forms,
+        entered by the administrator and transcribed ``'form <index>'``, to
+        the session (without committing) and return the forms.
+        """
+        self.dbsession.add(omb.generate_default_application_settings())
+        enterer = self.dbsession.query(old_models.User).filter(
+            old_models.User.role == 'administrator').first()
+        forms = []
+        for index in range(count):
+            form = omb.generate_default_form()
+            form.transcription = 'form %d' % index
+            form.enterer = enterer
+            forms.append(form)
+        self.dbsession.add_all(forms)
+        return forms
+
     @staticmethod
     def clear_all_models(dbsession, retain=('Language',)):
         """Convenience function for removing all OLD models from the database.
@@ -572,3 +617,48 @@ def get_file_size(file_path):
         return os.path.getsize(file_path)
     except (OSError, TypeError):
         return None
+
+
+class QueryCounter(querystats.QueryStats):
+    """Context manager that records the SQL statements that the current
+    thread executes while it is active (cf. ``old.lib.querystats``)::
+
+        with QueryCounter() as counter:
+            self.app.get(url('index'), ...)
+        assert counter.count == 3
+
+    If ``max_queries`` is given, it fails if more statements than that are
+    executed or if one of them is repeated enough to be a probable N+1
+    pattern, unless ``n_plus_one`` is true.
+    """
+
+    def __init__(self, max_queries=None, n_plus_one=False):
+        super().__init__()
+        self.max_queries = max_queries
+        self.n_plus_one = n_plus_one
+        self.statements = []
+        self._collector = None
+
+    def record(self, statement, seconds):
+        super().record(statement, seconds)
+        self.statements.append(statement)
+
+    def __enter__(self):
+        self._collector = querystats.collect(self)
+        self._collector.__enter__()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._collector.__exit__(*exc_info)
+        if exc_info[0] is not None or self.max_queries is None:
+            return
+        assert self.count <= self.max_queries, (
+            '%d queries exceed the budget of %d:\n%s' % (
+                self.count, self.max_queries,
+                '\n'.join('%d x %s' % (count, shape) for shape, count in
+                          self.shapes.most_common())))
+        if not self.n_plus_one:
+            n_plus_one = self.get_n_plus_one()
+            assert not n_plus_one, 'Probable N+1 queries:\n%s' % '\n'.join(
+                '%d x %s (%s)' % (count, shape, ', '.join(relationships))
+                for shape, count, relationships in n_plus_one)
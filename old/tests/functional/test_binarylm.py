@@ -0,0 +1,143 @@
+# Copyright 2016 Joel Dunham
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""Tests of the binary (memory-mapped) n-gram LM format of
+:mod:`old.lib.simplelm.binarylm`: it must score morpheme sequences as the
+pickled ``LMTree`` it replaces does.
+"""
+
+import codecs
+import os
+import pickle
+import random
+import shutil
+import tempfile
+from unittest import TestCase
+
+from old.lib import simplelm
+from old.lib.parser import LanguageModel
+
+
+def write_arpa(path, order=3, vocabulary_size=30, seed=0):
+    """Write a random (unnormalized) ARPA file with backoff weights."""
+    rng = random.Random(seed)
+    vocabulary = ['<s>', '</s>'] + [
+        'm⦀%s⦀N' % ''.join(rng.choice('aeiouptkʔ') for _ in range(3))
+        + str(i) for i in range(vocabulary_size)]
+    ngrams = [[(word,) for word in vocabulary]]
+    for _ in range(1, order):
+        ngrams.append(sorted({
+            ngram + (rng.choice(vocabulary),)
+            for ngram in ngrams[-1] for _ in range(rng.randint(0, 3))}))
+    with codecs.open(path, 'w', 'utf8') as fileo:
+        fileo.write('\n\\data\\\n')
+        for index, ngrams_ in enumerate(ngrams):
+            fileo.write('ngram %d=%d\n' % (index + 1, len(ngrams_)))
+        for index, ngrams_ in enumerate(ngrams):
+            fileo.write('\n\\%d-grams:\n' % (index + 1))
+            for ngram in ngrams_:
+                line = '%.6f\t%s' % (-rng.random() * 3, ' '.join(ngram))
+                if index + 1 < order:
+                    line += '\t%.6f' % (-rng.random())
+                fileo.write(line + '\n')
+        fileo.write('\n\\end\\\n')
+    return vocabulary
+
+
+class TestBinaryLM(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.arpa_path = os.path.join(self.directory, 'lm.arpa')
+        self.vocabulary = write_arpa(self.arpa_path)
+        self.lmtree = simplelm.load_arpa(self.arpa_path, 'utf8')
+        self.sentences = self.get_sentences()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def get_sentences(self, count=200):
+        rng = random.Random(1)
+        words = self.vocabulary[2:] + ['oov1', 'oov2']
+        return [['<s>'] + [rng.choice(words) for _ in range(rng.randint(0, 8))]
+                + ['</s>'] for _ in range(count)]
+
+    def assert_equivalent(self, binary_lm):
+        assert binary_lm.max_order == self.lmtree.max_order == 3
+        for sentence in self.sentences:
+            expected = simplelm.compute_sentence_prob(
+                self.lmtree, list(sentence))
+            assert abs(binary_lm.compute_sentence_prob(sentence) -
+                       expected) < 1e-4, sentence
+            # ``compute_sentence_prob`` works with either model.
+            assert abs(simplelm.compute_sentence_prob(
+                binary_lm, list(sentence)) - expected) < 1e-4
+            for start in range(len(sentence) - 1):
+                ngram = sentence[start:start + 3]
+                prob, is_prob = binary_lm.get_ngram_p(ngram)
+                expected_prob, expected_is_prob = self.lmtree.get_ngram_p(ngram)
+                assert is_prob == expected_is_prob
+                assert abs(prob - expected_prob) < 1e-6
+
+    def test_arpa(self):
+        path = os.path.join(self.directory, 'lm.trie')
+        simplelm.arpa_to_binary_lm(self.arpa_path, path)
+        binary_lm = simplelm.BinaryLM(path)
+        assert binary_lm.vocab_size == len(self.vocabulary)
+        assert binary_lm.word(binary_lm.word_id(self.vocabulary[5])) == \
+            self.vocabulary[5]
+        assert binary_lm.word_id('oov1') is None
+        self.assert_equivalent(binary_lm)
+        # Pickling (e.g., for a process pool) re-maps the file.
+        self.assert_equivalent(pickle.loads(pickle.dumps(binary_lm)))
+        # The binary file is much smaller than the pickled LMTree.
+        assert os.path.getsize(path) < len(pickle.dumps(self.lmtree)) / 2
+        binary_lm.close()
+
+    def test_pickle(self):
+        pickle_path = os.path.join(self.directory, 'lm.pickle')
+        with open(pickle_path, 'wb') as fileo:
+            pickle.dump(self.lmtree, fileo)
+        path = os.path.join(self.directory, 'lm.trie')
+        simplelm.pickle_to_binary_lm(pickle_path, path)
+        self.assert_equivalent(simplelm.BinaryLM(path))
+
+    def test_invalid(self):
+        path = os.path.join(self.directory, 'lm.trie')
+        with open(path, 'wb') as fileo:
+            fileo.write(b'not a language model')
+        with self.assertRaises(ValueError):
+            simplelm.BinaryLM(path)
+
+    def test_language_model(self):
+        """Tests that ``LanguageModel.trie`` generates the binary LM from the
+        ARPA file or converts the LMTree pickle of an earlier version.
+        """
+        language_model = LanguageModel(parent_directory=self.directory)
+        shutil.copyfile(self.arpa_path, language_model.get_file_path('arpa'))
+        with open(language_model.get_file_path('trie_pickle'), 'wb') as fileo:
+            pickle.dump(self.lmtree, fileo)
+        os.remove(language_model.get_file_path('arpa'))
+        assert isinstance(language_model.trie, simplelm.BinaryLM)
+        assert os.path.isfile(language_model.get_file_path('trie'))
+        self.assert_equivalent(language_model.trie)
+        sequence = ' '.join(self.sentences[0][1:-1])
+        assert abs(language_model.get_probabilities(sequence)[sequence] -
+                   simplelm.compute_sentence_prob(
+                       self.lmtree, list(self.sentences[0]))) < 1e-4
+
+        language_model = LanguageModel(parent_directory=self.directory)
+        shutil.copyfile(self.arpa_path, language_model.get_file_path('arpa'))
+        language_model.generate_trie()
+        self.assert_equivalent(language_model.trie)
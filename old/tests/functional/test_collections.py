@@ -1569,6 +1569,51 @@ class TestCollectionsView(TestView):
         assert 'There is no collection with id %s' % id in response.json_body['error']
         assert response.content_type == 'application/json'
 
+    def test_repeated_form_references(self):
+        """Tests that a collection that references a form more than once,
+        directly or via another collection, relates to it once and can be
+        updated and deleted.
+        """
+        self.dbsession.add(omb.generate_default_application_settings())
+        self.dbsession.commit()
+        params = self.form_create_params.copy()
+        params.update({
+            'transcription': 'repeated',
+            'translations': [{'transcription': 'repeated', 'grammaticality': ''}]
+        })
+        response = self.app.post(forms_url('create'), json.dumps(params),
+                                 self.json_headers, self.extra_environ_admin)
+        form_id = response.json_body['id']
+
+        params = self.collection_create_params.copy()
+        params.update({'title': 'Referenced',
+                       'contents': 'form[%d]' % form_id})
+        response = self.app.post(url('create'), json.dumps(params),
+                                 self.json_headers, self.extra_environ_admin)
+        referenced_id = response.json_body['id']
+
+        params = self.collection_create_params.copy()
+        params.update({'title': 'Referencing', 'contents': '\n'.join([
+            'form[%d]' % form_id, 'form[%d]' % form_id,
+            'collection[%d]' % referenced_id])})
+        response = self.app.post(url('create'), json.dumps(params),
+                                 self.json_headers, self.extra_environ_admin)
+        resp = response.json_body
+        collection_id = resp['id']
+        assert [form['id'] for form in resp['forms']] == [form_id]
+
+        params.update({'title': 'Referencing (updated)'})
+        response = self.app.put(url('update', id=collection_id),
+                                json.dumps(params), self.json_headers,
+                                self.extra_environ_admin)
+        assert [form['id'] for form in response.json_body['forms']] == [
+            form_id]
+
+        self.app.delete(url('delete', id=collection_id),
+                        extra_environ=self.extra_environ_admin)
+        assert self.dbsession.query(old_models.Collection).get(
+            collection_id) is None
+
     def test_show(self):
         """Tests that GET /collection/id returns a JSON collection object, null or 404
         depending on whether the id is valid, invalid or unspecified, respectively.
@@ -0,0 +1,218 @@
+# Copyright 2016 Joel Dunham
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""Tests of the corpus file writer (:mod:`old.lib.corpusexport`) and of the
+sync and async modes of ``PUT /corpora/id/writetofile``.
+"""
+
+import datetime
+import gzip
+import json
+import os
+from time import sleep
+from unittest.mock import patch
+
+import old.lib.corpusexport as corpusexport
+import old.lib.helpers as h
+import old.models as old_models
+import old.models.modelbuilders as omb
+from old.models import Corpus
+from old.tests import TestView
+
+
+url = Corpus._url(old_name=TestView.old_name)
+
+
+class TestCorpusExport(TestView):
+
+    def tearDown(self):
+        super().tearDown(dirs_to_destroy=['user', 'corpus'])
+
+    def setUp(self):
+        super().setUp()
+        h.destroy_all_directories('corpora', self.settings)
+
+    def add_forms(self, count=300):
+        restricted_tag = omb.generate_restricted_tag()
+        forms = []
+        for index in range(count):
+            form = omb.generate_default_form()
+            form.transcription = 'sentence %d' % index
+            form.syntax = '(S (NP n%d) (VP v%d))' % (index, index)
+            if index == 7:
+                form.tags.append(restricted_tag)
+            forms.append(form)
+        self.dbsession.add_all(forms)
+        self.dbsession.commit()
+        return [form.id for form in forms]
+
+    def create_corpus(self, content):
+        params = self.corpus_create_params.copy()
+        params.update({'name': 'Corpus', 'content': content})
+        return self.app.post(url('create'), json.dumps(params),
+                             self.json_headers,
+                             self.extra_environ_admin).json_body['id']
+
+    def get_corpus_dir(self, corpus_id):
+        return corpusexport.get_corpus_directory_path(corpus_id, self.settings)
+
+    def test_writer(self):
+        """Tests that ``CorpusFileWriter`` streams the forms in content order
+        and writes a multi-member gzip file that decompresses to the plain
+        file.
+        """
+        form_ids = self.add_forms()
+        references = form_ids[::-1] + form_ids[:50]
+        corpus_id = self.create_corpus(','.join(map(str, references)))
+        forms = {form.id: form for form in
+                 self.dbsession.query(old_models.Form).all()}
+        expected = ''.join('(TOP-%d %s)\n' % (id_, forms[id_].syntax)
+                           for id_ in references).encode('utf8')
+        settings = dict(self.settings, corpus_export_chunk_size='40',
+                        corpus_export_processes='2')
+        progress = []
+        writer = corpusexport.CorpusFileWriter(
+            self.dbsession, settings, corpus_id, 'treebank',
+            progress=lambda written, total: progress.append((written, total)))
+        with patch.object(corpusexport, 'BLOCK_SIZE', 1000):
+            result = writer.run()
+        assert result == {'filename': 'corpus_%d.tbk' % corpus_id,
+                          'forms_written': len(references),
+                          'restricted': True}
+        assert progress[0] == (40, len(references))
+        assert progress[-1] == (len(references), len(references))
+        with open(writer.path, 'rb') as file_:
+            assert file_.read() == expected
+        with open('%s.gz' % writer.path, 'rb') as file_:
+            compressed = file_.read()
+        assert compressed.count(b'\x1f\x8b\x08') > 1
+        assert gzip.decompress(compressed) == expected
+        assert not [name for name in os.listdir(self.get_corpus_dir(corpus_id))
+                    if name.endswith('.part')]
+
+        # Inline compression yields the same content.
+        settings['corpus_export_processes'] = '1'
+        corpusexport.CorpusFileWriter(
+            self.dbsession, settings, corpus_id, 'transcriptions only').run()
+        path = os.path.join(self.get_corpus_dir(corpus_id),
+                            'corpus_%d_transcriptions.txt' % corpus_id)
+        with gzip.open('%s.gz' % path, 'rb') as file_:
+            assert file_.read().decode('utf8').splitlines() == [
+                forms[id_].transcription for id_ in references]
+
+    def test_compressed_writer(self):
+        """Tests that the gzip members have no timestamp and that closing a
+        compressor after a failed write discards the pending blocks.
+        """
+        member = corpusexport.compress_block(b'block')
+        assert member[4:8] == b'\x00\x00\x00\x00'
+        assert gzip.decompress(member) == b'block'
+
+        class FailingFile:
+            def write(self, member):
+                raise OSError('No space left on device')
+
+        compressor = corpusexport.CompressedWriter(FailingFile(), 2)
+        for _ in range(4):
+            compressor.write(b'block')
+        with self.assertRaises(OSError):
+            compressor.close()
+        assert compressor.pool is None
+        assert compressor.pending == []
+
+    def test_async(self):
+        """Tests that ``PUT /corpora/id/writetofile`` in async mode queues a
+        job whose progress and completion are reported on the corpus's
+        ``files`` entry.
+        """
+        form_ids = self.add_forms()
+        corpus_id = self.create_corpus(','.join(map(str, form_ids)))
+        writetofile_url = '/%s/corpora/%d/writetofile' % (
+            self.old_name, corpus_id)
+        resp = self.app.put(
+            writetofile_url,
+            json.dumps({'format': 'treebank', 'mode': 'async'}),
+            self.json_headers, self.extra_environ_admin).json_body
+        assert len(resp['files']) == 1
+        corpus_file = resp['files'][0]
+        assert corpus_file['status'] == 'queued'
+        assert corpus_file['forms_written'] == 0
+        for _ in range(100):
+            corpus_file = self.app.get(
+                url('show', id=corpus_id), headers=self.json_headers,
+                extra_environ=self.extra_environ_admin
+            ).json_body['files'][0]
+            if corpus_file['status'] in ('ready', 'failed'):
+                break
+            sleep(0.2)
+        assert corpus_file['status'] == 'ready', corpus_file
+        assert corpus_file['forms_written'] == corpus_file['forms_total'] == \
+            len(form_ids)
+        assert corpus_file['restricted'] is True
+        job = self.dbsession.query(old_models.Job).filter(
+            old_models.Job.kind == 'write_corpus_file').one()
+        assert job.status == 'succeeded'
+
+        serve_url = '/%s/corpora/%d/servefile/%d' % (
+            self.old_name, corpus_id, corpus_file['id'])
+        self.app.get(serve_url, headers=self.json_headers,
+                     extra_environ=self.extra_environ_contrib, status=403)
+        response = self.app.get(serve_url, headers=self.json_headers,
+                                extra_environ=self.extra_environ_admin)
+        path = os.path.join(self.get_corpus_dir(corpus_id),
+                            'corpus_%d.tbk' % corpus_id)
+        with open(path, 'rb') as file_:
+            assert gzip.decompress(response.body) == file_.read()
+
+        # The sync mode re-writes the same corpus file within the request.
+        resp = self.app.put(
+            writetofile_url,
+            json.dumps({'format': 'treebank', 'mode': 'sync'}),
+            self.json_headers, self.extra_environ_admin).json_body
+        assert [(cf['id'], cf['status']) for cf in resp['files']] == [
+            (corpus_file['id'], 'ready')]
+
+        resp = self.app.put(
+            writetofile_url, json.dumps({'format': 'treebank', 'mode': 'x'}),
+            self.json_headers, self.extra_environ_admin, status=400).json_body
+        assert 'mode' in resp['errors']
+
+    def test_stale_export(self):
+        """Tests that an async export is not queued again while one is pending
+        but is once the pending one has stalled, e.g., because the process
+        writing it died.
+        """
+        form_ids = self.add_forms(3)
+        corpus_id = self.create_corpus(','.join(map(str, form_ids)))
+        writetofile_url = '/%s/corpora/%d/writetofile' % (
+            self.old_name, corpus_id)
+        params = json.dumps({'format': 'treebank', 'mode': 'async'})
+        with patch('old.views.corpora.enqueue_job') as enqueue_job:
+            for _ in range(2):
+                resp = self.app.put(writetofile_url, params, self.json_headers,
+                                    self.extra_environ_admin).json_body
+            assert enqueue_job.call_count == 1
+            corpus_file_id = resp['files'][0]['id']
+            corpus_file_table = old_models.CorpusFile.__table__
+            self.dbsession.execute(
+                corpus_file_table.update()
+                .where(corpus_file_table.c.id == corpus_file_id)
+                .values(status='writing', datetime_modified=h.now() -
+                        datetime.timedelta(
+                            seconds=corpusexport.STALE_AFTER + 1)))
+            self.dbsession.commit()
+            resp = self.app.put(writetofile_url, params, self.json_headers,
+                                self.extra_environ_admin).json_body
+            assert enqueue_job.call_count == 2
+        assert resp['files'][0]['status'] == 'queued'
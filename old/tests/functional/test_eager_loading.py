@@ -0,0 +1,167 @@
+# Copyright 2016 Joel Dunham
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""Query-count regression tests for the eager loading plans of the resource
+views (cf. ``old.lib.dbutils.LOADING_PLANS``): the number of SQL queries
+needed to serialize a resource must not depend on the number of resources
+returned or on the number of related models each of them has.
+"""
+
+from itertools import count
+import json
+import logging
+import shutil
+import tempfile
+
+from sqlalchemy import inspect
+
+from old.lib.dbutils import LOADING_PLANS
+import old.models as old_models
+from old.tests import (
+    TestView,
+    QueryCounter,
+    add_SEARCH_to_web_test_valid_methods
+)
+
+
+LOGGER = logging.getLogger(__name__)
+SERIAL = count(1)
+
+
+# Model name, searchable and has history, for each resource whose queries are
+# counted.
+RESOURCES = (
+    ('Collection', True, True),
+    ('Corpus', False, True),
+    ('File', True, False),
+    ('Form', True, True),
+    ('FormSearch', True, False),
+    ('Keyboard', True, False),
+    ('MorphemeLanguageModel', True, True),
+    ('MorphologicalParser', True, True),
+    ('Morphology', True, True),
+    ('Phonology', True, True),
+    ('Source', True, False),
+    ('User', False, False),
+)
+
+
+def build(model_name, size, depth=2, parent_directory=None):
+    """Return a new ``model_name`` model whose planned relationships are all
+    populated (collections with ``size`` members) with new models, down to
+    ``depth`` levels. FST-backed models (phonologies, morphologies, etc.)
+    create their directories in ``parent_directory``.
+    """
+    model_cls = getattr(old_models, model_name)
+    try:
+        model = model_cls()
+    except TypeError:
+        model = model_cls(parent_directory or tempfile.gettempdir())
+    for attr in ('transcription', 'name', 'username'):
+        if hasattr(model_cls, attr):
+            setattr(model, attr, '%s %s' % (attr, next(SERIAL)))
+    if depth:
+        relationships = inspect(model_cls).relationships
+        plan = LOADING_PLANS.get(model_name, {}).get('default', ())
+        for path in plan:
+            if '.' in path:
+                continue
+            relationship = relationships[path]
+            related_name = relationship.mapper.class_.__name__
+            if relationship.uselist:
+                setattr(model, path, [
+                    build(related_name, size, depth - 1, parent_directory)
+                    for _ in range(size)])
+            else:
+                setattr(model, path, build(
+                    related_name, size, depth - 1, parent_directory))
+    return model
+
+
+class TestEagerLoading(TestView):
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        add_SEARCH_to_web_test_valid_methods()
+
+    def setUp(self):
+        super().setUp()
+        self.parent_directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.parent_directory, ignore_errors=True)
+        super().tearDown()
+
+    def build(self, model_name, size, depth=2):
+        return build(model_name, size, depth, self.parent_directory)
+
+    def count_queries(self, requester):
+        self.dbsession.commit()
+        self.dbsession.expunge_all()
+        with QueryCounter() as counter:
+            response = requester()
+        return counter.count, response.json_body
+
+    def test_query_counts(self):
+        """Tests that index, search and show do not issue queries per resource
+        or per related model.
+        """
+        for model_name, searchable, has_history in RESOURCES:
+            model_cls = getattr(old_models, model_name)
+            url = model_cls._url(old_name=self.old_name)
+            self.dbsession.add_all([self.build(model_name, 1) for _ in range(2)])
+            counts = []
+            for size in (1, 3):
+                models = [self.build(model_name, size) for _ in range(2 * size)]
+                self.dbsession.add_all(models)
+                self.dbsession.commit()
+                show_id = models[-1].id
+                requests = [
+                    ('index', lambda: self.app.get(
+                        url('index'), headers=self.json_headers,
+                        extra_environ=self.extra_environ_admin)),
+                    ('show', lambda: self.app.get(
+                        url('show', id=show_id), headers=self.json_headers,
+                        extra_environ=self.extra_environ_admin))]
+                if searchable:
+                    requests.append(('search', lambda: self.app.post(
+                        url('search_post'),
+                        json.dumps({'query': {'filter': [
+                            model_name, 'id', '>', 0]}}),
+                        self.json_headers, self.extra_environ_admin)))
+                if has_history:
+                    requests.append(('history', lambda: self.app.get(
+                        url('history', id=show_id), headers=self.json_headers,
+                        extra_environ=self.extra_environ_admin)))
+                counts.append({action: self.count_queries(requester)[0]
+                               for action, requester in requests})
+            LOGGER.debug('%s query counts: %s', model_name, counts)
+            assert counts[0] == counts[1], (model_name, counts)
+
+    def test_minimal_index_loads_nothing(self):
+        """Tests that GET /forms?minimal=1 issues a single query for the forms
+        and no eager loading queries.
+        """
+        self.dbsession.add_all([self.build('Form', 2, depth=1) for _ in range(3)])
+        url = old_models.Form._url(old_name=self.old_name)
+        count, forms = self.count_queries(
+            lambda: self.app.get(url('index'), {'minimal': '1'},
+                                 headers=self.json_headers,
+                                 extra_environ=self.extra_environ_admin))
+        full_count, _ = self.count_queries(
+            lambda: self.app.get(url('index'), headers=self.json_headers,
+                                 extra_environ=self.extra_environ_admin))
+        assert len(forms) == 3
+        assert set(forms[0]) == {'id', 'datetime_entered', 'datetime_modified'}
+        assert count < full_count
@@ -0,0 +1,176 @@
+# Copyright 2016 Joel Dunham
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""Tests of the pool of flookup co-processes of
+:mod:`old.lib.flookup_pool`.
+
+The tests do not need foma: a fake ``flookup`` script is put first on the
+``PATH``. Its "binary" is a text file whose first line is a mode (``echo``,
+``crash-once``, ``hang`` or ``files-only``) and whose second line is a tag
+that is prefixed to every output, so that a recompiled binary can be told
+apart. Each start of the fake is recorded in ``<binary>.starts``.
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+from unittest import TestCase
+
+from old.lib.flookup_pool import (
+    FLOOKUP_POOL,
+    FlookupPool,
+    FlookupPoolError,
+    FlookupProcess,
+)
+from old.lib.parser import FomaFST
+
+
+FAKE_FLOOKUP = '''#!%s
+import os
+import sys
+import time
+
+args = sys.argv[1:]
+binary_path = args[-1]
+with open(binary_path) as fileo:
+    mode, tag = fileo.read().split('\\n')[:2]
+with open(binary_path + '.starts', 'a') as fileo:
+    fileo.write('%%s\\n' %% ' '.join(args[:-1]))
+if mode == 'files-only' and '-b' in args:
+    sys.exit(1)
+direction = 'down' if '-i' in args else 'up'
+for line in sys.stdin:
+    if mode == 'hang':
+        time.sleep(60)
+    if mode == 'crash-once' and not os.path.exists(binary_path + '.crashed'):
+        open(binary_path + '.crashed', 'w').close()
+        sys.exit(1)
+    input_ = line.rstrip('\\n')
+    sys.stdout.write('%%s\\t%%s-%%s-%%s\\n\\n' %% (input_, tag, direction, input_))
+    sys.stdout.flush()
+''' % sys.executable
+
+
+class TestFlookupPool(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        bin_directory = os.path.join(self.directory, 'bin')
+        os.mkdir(bin_directory)
+        flookup_path = os.path.join(bin_directory, 'flookup')
+        with open(flookup_path, 'w') as fileo:
+            fileo.write(FAKE_FLOOKUP)
+        os.chmod(flookup_path, 0o755)
+        self.path = os.environ.get('PATH', '')
+        os.environ['PATH'] = os.pathsep.join([bin_directory, self.path])
+        self.binary_path = os.path.join(self.directory, 'fst.foma')
+        self.pool = FlookupPool(timeout=5, batch_size=3)
+
+    def tearDown(self):
+        self.pool.close_all()
+        os.environ['PATH'] = self.path
+        shutil.rmtree(self.directory)
+
+    def write_binary(self, mode, tag='v1', path=None):
+        path = path or self.binary_path
+        with open(path, 'w') as fileo:
+            fileo.write('%s\n%s\n' % (mode, tag))
+
+    def get_starts(self, path=None):
+        try:
+            with open((path or self.binary_path) + '.starts') as fileo:
+                return fileo.read().splitlines()
+        except FileNotFoundError:
+            return []
+
+    def test_batch(self):
+        """Tests that a batch larger than ``batch_size`` is applied by one
+        process per direction, which is reused by later calls.
+        """
+        self.write_binary('echo')
+        inputs = ['a', 'b', 'c', 'd', 'e']
+        assert self.pool.apply(self.binary_path, 'up', inputs) == [
+            '%s\tv1-up-%s' % (input_, input_) for input_ in inputs]
+        assert self.pool.apply(self.binary_path, 'down', ['f']) == [
+            'f\tv1-down-f']
+        assert self.pool.apply(self.binary_path, 'up', ['g']) == [
+            'g\tv1-up-g']
+        assert self.pool.apply(self.binary_path, 'up', []) == []
+        assert self.get_starts() == ['-b', '-b -i']
+        assert len(self.pool) == 2
+
+    def test_crash(self):
+        """Tests that a process that dies mid-batch is restarted and the batch
+        retried once.
+        """
+        self.write_binary('crash-once')
+        assert self.pool.apply(self.binary_path, 'up', ['a', 'b']) == [
+            'a\tv1-up-a', 'b\tv1-up-b']
+        assert len(self.get_starts()) == 2
+        assert self.pool.apply(self.binary_path, 'up', ['c']) == [
+            'c\tv1-up-c']
+        assert len(self.get_starts()) == 2
+
+    def test_stale_binary(self):
+        """Tests that the process of a recompiled binary is replaced."""
+        self.write_binary('echo')
+        assert self.pool.apply(self.binary_path, 'up', ['a']) == [
+            'a\tv1-up-a']
+        process = self.pool.get_process(self.binary_path, 'up')
+        self.write_binary('echo', tag='v2')
+        mtime = os.path.getmtime(self.binary_path) + 10
+        os.utime(self.binary_path, (mtime, mtime))
+        assert process.is_stale()
+        assert self.pool.apply(self.binary_path, 'up', ['a']) == [
+            'a\tv2-up-a']
+        assert len(self.get_starts()) == 2
+        assert not process.is_alive()
+
+    def test_missing_binary(self):
+        with self.assertRaises(FlookupPoolError):
+            self.pool.apply(self.binary_path, 'up', ['a'])
+
+    def test_timeout(self):
+        """Tests that a hung process times out once, even when the writer is
+        blocked on a full pipe, and is killed.
+        """
+        self.write_binary('hang')
+        process = FlookupProcess(self.binary_path, 'up', timeout=1)
+        start = time.time()
+        with self.assertRaises(FlookupPoolError):
+            process.apply(['x' * 100] * 5000)
+        assert time.time() - start < 1.9
+        process.process.wait(5)
+        assert not process.is_alive()
+
+    def test_fallback(self):
+        """Tests that ``FomaFST.apply`` falls back to applying via temporary
+        files when the pool fails.
+        """
+        fst = FomaFST(self.directory)
+        binary_path = fst.get_file_path('binary')
+        self.write_binary('files-only', path=binary_path)
+        try:
+            assert fst.applyup(['a', 'b']) == {'a': ['v1-up-a'],
+                                                'b': ['v1-up-b']}
+            assert fst.applydown('c') == {'c': ['v1-down-c']}
+        finally:
+            FLOOKUP_POOL.evict(binary_path)
+        starts = self.get_starts(path=binary_path)
+        # Both directions: a failed pool start, its retry and the fallback.
+        assert starts == ['-b'] * 2 + [''] + ['-b -i'] * 2 + ['-i']
+        assert not [name for name in os.listdir(self.directory)
+                    if name.startswith(('inputs_', 'outputs_', 'apply_'))]
@@ -18,10 +18,13 @@ import json
 import logging
 import os
 from time import sleep
+from types import SimpleNamespace
+from unittest.mock import patch
 from uuid import uuid4
 
 from sqlalchemy.sql import desc
 
+from old.lib import morpheme_references
 from old.lib.dbutils import DBUtils
 from old.lib.SQLAQueryBuilder import SQLAQueryBuilder
 import old.models.modelbuilders as omb
@@ -2480,8 +2483,7 @@ class TestFormsView(TestView):
         assert [f['syntactic_category_string'] for f in resp] == ['?-?-?', '?-?-?']
 
         # Request PUT /forms/update_morpheme_references and expect nothing to change
-        response = self.app.put(url('/forms/update_morpheme_references'),
-            headers=self.json_headers, extra_environ=self.extra_environ_admin)
+        self._rebuild_morpheme_references(self.extra_environ_admin)
         response = self.app.get(url('index'), headers=self.json_headers,
                                 extra_environ=extra_environ)
         resp2 = response.json_body
@@ -2567,9 +2569,8 @@ class TestFormsView(TestView):
 
         # Request PUT /forms/update_morpheme_references
         sleep(1)
-        response = self.app.put(url('/forms/update_morpheme_references'),
-            headers=self.json_headers, extra_environ=extra_environ)
-        assert response.content_type == 'application/json'
+        assert self._rebuild_morpheme_references(
+            extra_environ)['status'] == 'finished'
 
         # Search for our two original morphologically complex forms
         json_query = json.dumps({'query': {'filter':
@@ -3417,3 +3418,260 @@ class TestFormsView(TestView):
         })
         params = json.dumps(params)
         response = self.app.post(url('create'), params, self.json_headers, extra_environ)
+
+    def test_form_morpheme_index(self):
+        """Tests that the form_morpheme table is kept in sync with the forms
+        and that GET /forms/concordance searches it.
+        """
+        dbsession = self.dbsession
+        db = DBUtils(dbsession, self.settings)
+        N = omb.generate_n_syntactic_category()
+        Num = omb.generate_num_syntactic_category()
+        application_settings = omb.generate_default_application_settings()
+        dbsession.add_all([N, Num, application_settings])
+        dbsession.flush()
+        NId = N.id
+        NumId = Num.id
+        dbsession.commit()
+        extra_environ = {'test.authentication.role': 'administrator',
+                         'test.application_settings': True}
+        concordance_url = '/{}/forms/concordance'.format(self.old_name)
+
+        # A phrasal form gets one row per morpheme.
+        params = self.form_create_params.copy()
+        params.update({
+            'transcription': 'chiens chats',
+            'morpheme_break': 'chien-s chat-s',
+            'morpheme_gloss': 'dog-PL cat-PL',
+            'translations': [{'transcription': 'dogs cats',
+                              'grammaticality': ''}]
+        })
+        response = self.app.post(url('create'), json.dumps(params),
+                                 self.json_headers, extra_environ)
+        phrase_id = response.json_body['id']
+        rows = dbsession.query(old_models.FormMorpheme).filter(
+            old_models.FormMorpheme.form_id == phrase_id).order_by(
+                old_models.FormMorpheme.word_index,
+                old_models.FormMorpheme.morpheme_index).all()
+        assert [(r.word_index, r.morpheme_index, r.shape, r.gloss, r.category)
+                for r in rows] == [
+                    (0, 0, 'chien', 'dog', '?'), (0, 1, 's', 'PL', '?'),
+                    (1, 0, 'chat', 'cat', '?'), (1, 1, 's', 'PL', '?')]
+        assert db.get_ids_of_forms_containing_morphemes(['s']) == [phrase_id]
+
+        # Creating a lexical item percolates (via the index) and updates the
+        # categories stored in the index.
+        params = self.form_create_params.copy()
+        params.update({
+            'transcription': 's',
+            'morpheme_break': 's',
+            'morpheme_gloss': 'PL',
+            'translations': [{'transcription': 'plural',
+                              'grammaticality': ''}],
+            'syntactic_category': NumId
+        })
+        response = self.app.post(url('create'), json.dumps(params),
+                                 self.json_headers, extra_environ)
+        s_id = response.json_body['id']
+        phrase = dbsession.query(Form).get(phrase_id)
+        assert phrase.syntactic_category_string == '?-Num ?-Num'
+        response = self.app.get(concordance_url, {'gloss': 'PL'},
+                                headers=self.json_headers,
+                                extra_environ=self.extra_environ_admin)
+        resp = response.json_body
+        assert [(o['form']['id'], o['word_index'], o['category'])
+                for o in resp] == [(phrase_id, 0, 'Num'),
+                                   (phrase_id, 1, 'Num'),
+                                   (s_id, 0, 'Num')]
+
+        # Pagination and the category parameter.
+        response = self.app.get(
+            concordance_url,
+            {'category': 'Num', 'page': 2, 'items_per_page': 2},
+            headers=self.json_headers, extra_environ=self.extra_environ_admin)
+        resp = response.json_body
+        assert resp['paginator']['count'] == 3
+        assert [o['form']['id'] for o in resp['items']] == [s_id]
+
+        # Updating a form re-indexes it.
+        params = self.form_create_params.copy()
+        params.update({
+            'transcription': 'chien',
+            'morpheme_break': 'chien',
+            'morpheme_gloss': 'dog',
+            'translations': [{'transcription': 'dog', 'grammaticality': ''}],
+            'syntactic_category': NId
+        })
+        self.app.put(url('update', id=phrase_id), json.dumps(params),
+                     self.json_headers, extra_environ)
+        response = self.app.get(concordance_url, {'shape': 's'},
+                                headers=self.json_headers,
+                                extra_environ=self.extra_environ_admin)
+        assert [o['form']['id'] for o in response.json_body] == [s_id]
+
+        # Deleting a form removes its rows.
+        self.app.delete(url('delete', id=s_id), headers=self.json_headers,
+                        extra_environ=extra_environ)
+        assert dbsession.query(old_models.FormMorpheme).filter(
+            old_models.FormMorpheme.form_id == s_id).count() == 0
+
+        # Rebuilding the whole index reproduces the incrementally maintained
+        # rows.
+        before = sorted((r.form_id, r.shape, r.gloss, r.category) for r in
+                        dbsession.query(old_models.FormMorpheme).all())
+        assert db.rebuild_form_morpheme_index() == 1
+        after = sorted((r.form_id, r.shape, r.gloss, r.category) for r in
+                       dbsession.query(old_models.FormMorpheme).all())
+        assert before == after
+
+        # At least one search parameter is required.
+        response = self.app.get(concordance_url, headers=self.json_headers,
+                                extra_environ=self.extra_environ_admin,
+                                status=400)
+        assert 'error' in response.json_body
+
+    def test_update_morpheme_references_whole_db(self):
+        """Tests that PUT /forms/update_morpheme_references recompiles the
+        morphemic analyses of all forms against the (hash-indexed) lexicon.
+        """
+        dbsession = self.dbsession
+        Num = omb.generate_num_syntactic_category()
+        application_settings = omb.generate_default_application_settings()
+        dbsession.add_all([Num, application_settings])
+        dbsession.flush()
+        NumId = Num.id
+        dbsession.commit()
+        extra_environ = {'test.authentication.role': 'administrator',
+                         'test.application_settings': True}
+        ids = []
+        for mb, mg, category in (('chien-s', 'dog-PL', None),
+                                 ('s', 'PL', NumId),
+                                 ('s', 'PL', None),
+                                 ('chien', 'cat', None)):
+            params = self.form_create_params.copy()
+            params.update({
+                'transcription': mb,
+                'morpheme_break': mb,
+                'morpheme_gloss': mg,
+                'translations': [{'transcription': mg, 'grammaticality': ''}],
+                'syntactic_category': category
+            })
+            response = self.app.post(url('create'), json.dumps(params),
+                                     self.json_headers, extra_environ)
+            ids.append(response.json_body['id'])
+        phrase = dbsession.query(Form).get(ids[0])
+        expected = (phrase.morpheme_break_ids, phrase.morpheme_gloss_ids,
+                    phrase.syntactic_category_string)
+        assert phrase.syntactic_category_string == '?-Num'
+        assert json.loads(phrase.morpheme_break_ids) == [
+            [[[ids[3], 'cat', None]],
+             [[ids[1], 'PL', 'Num'], [ids[2], 'PL', None]]]]
+        assert json.loads(phrase.morpheme_gloss_ids)[0][0] == []
+
+        # Nothing to do: the analyses are already up to date.
+        status = self._rebuild_morpheme_references(extra_environ)
+        assert status['status'] == 'finished'
+        assert status['processed'] == status['total'] == 4
+        assert status['updated'] == 0
+        assert status['last_id'] == ids[-1]
+
+        # Corrupt the phrase's analysis and expect the rebuild to restore it.
+        phrase.syntactic_category_string = 'x-x'
+        phrase.morpheme_break_ids = '[]'
+        dbsession.commit()
+        status = self._rebuild_morpheme_references(extra_environ)
+        assert status['updated'] == 1
+        dbsession.expire_all()
+        phrase = dbsession.query(Form).get(ids[0])
+        assert (phrase.morpheme_break_ids, phrase.morpheme_gloss_ids,
+                phrase.syntactic_category_string) == expected
+
+        # An interrupted rebuild resumes after its checkpoint.
+        phrase.syntactic_category_string = 'x-x'
+        dbsession.commit()
+        settings = self.settings.copy()
+        settings['old_name'] = self.old_name
+        morpheme_references.write_status(
+            settings, {'status': 'failed', 'last_id': ids[0], 'processed': 1,
+                       'updated': 0})
+        status = self._rebuild_morpheme_references(extra_environ)
+        assert status['processed'] == 4
+        assert status['resumed'] == 1
+        dbsession.expire_all()
+        assert dbsession.query(Form).get(
+            ids[0]).syntactic_category_string == 'x-x'
+        status = self._rebuild_morpheme_references(
+            extra_environ, restart=True)
+        assert status['updated'] == 1
+        dbsession.expire_all()
+        assert dbsession.query(Form).get(
+            ids[0]).syntactic_category_string == '?-Num'
+
+    def test_morpheme_references_queued(self):
+        """Tests that a rebuild is marked as queued before its job is
+        enqueued and that a second rebuild cannot be queued meanwhile.
+        """
+        self.dbsession.add(omb.generate_default_application_settings())
+        self.dbsession.commit()
+        settings = self.settings.copy()
+        settings['old_name'] = self.old_name
+        statuses = []
+
+        def enqueue_job(*args, **kwargs):
+            statuses.append(morpheme_references.read_status(settings))
+            return SimpleNamespace(id=42)
+
+        path = '/{}/forms/update_morpheme_references'.format(self.old_name)
+        with patch('old.views.forms.enqueue_job', enqueue_job):
+            status = self.app.put(path, headers=self.json_headers,
+                                  extra_environ=self.extra_environ_admin)\
+                .json_body
+            response = self.app.put(path, headers=self.json_headers,
+                                    extra_environ=self.extra_environ_admin,
+                                    status=400)
+        assert [status['status'] for status in statuses] == ['queued']
+        assert status['status'] == 'queued'
+        assert status['job_id'] == 42
+        assert morpheme_references.read_status(settings) == status
+        assert response.json_body['error'] == (
+            'The morpheme references of the forms are already being updated.')
+        os.remove(morpheme_references.get_status_path(settings))
+
+    def test_morpheme_references_heartbeat(self):
+        """Tests that a rebuild whose heartbeat falls on a whole second (no
+        microseconds) is still recognized as running.
+        """
+        class WholeSecondDatetime(datetime.datetime):
+            @classmethod
+            def utcnow(cls):
+                return datetime.datetime(2020, 1, 1, 12, 0, 0)
+        settings = self.settings.copy()
+        settings['old_name'] = self.old_name
+        with patch.object(morpheme_references, 'datetime',
+                          SimpleNamespace(datetime=WholeSecondDatetime)):
+            status = morpheme_references.write_status(
+                settings, {'status': 'running', 'last_id': 0})
+            assert status['datetime_modified'] == '2020-01-01T12:00:00.000000'
+            assert morpheme_references.rebuild_is_running(
+                morpheme_references.read_status(settings))
+        os.remove(morpheme_references.get_status_path(settings))
+
+    def _rebuild_morpheme_references(self, extra_environ, restart=False):
+        """Request a rebuild of all morpheme references and poll its status
+        until it is done.
+        """
+        path = '/{}/forms/update_morpheme_references'.format(self.old_name)
+        if restart:
+            path += '?restart=1'
+        response = self.app.put(path, headers=self.json_headers,
+                                extra_environ=extra_environ)
+        assert response.json_body['status'] == 'queued'
+        for _ in range(120):
+            status = self.app.get(
+                '/{}/forms/update_morpheme_references'.format(self.old_name),
+                headers=self.json_headers,
+                extra_environ=extra_environ).json_body
+            if status['status'] in ('finished', 'failed'):
+                return status
+            sleep(0.5)
+        raise AssertionError('Morpheme references rebuild timed out.')
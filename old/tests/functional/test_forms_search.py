@@ -31,6 +31,7 @@ import platform
 import re
 
 from old.tests import TestView, add_SEARCH_to_web_test_valid_methods
+from old.lib import dbutils, tenantcache
 from old.lib.dbutils import DBUtils
 import old.models as old_models
 import old.lib.helpers as h
@@ -1710,6 +1711,146 @@ class TestFormsSearchView(TestView):
         assert resp['items'][0]['id'] == result_set[16]['id']
         assert resp['items'][-1]['id'] == result_set[31]['id']
 
+    def test_search_ya_count_modes(self):
+        """Tests SEARCH /forms: the count modes of the paginator."""
+
+        dbsession = self.dbsession
+        db = DBUtils(dbsession, self.settings)
+        forms = [f for f in db.get_forms()
+                 if 'T' in f.transcription and f.translations]
+
+        def search(paginator, status=200):
+            return self.app.request(
+                url('search'), method='SEARCH', body=json.dumps({
+                    'query': {'filter': [
+                        'and', [['Form', 'transcription', 'like', '%T%'],
+                                ['Translation', 'transcription', 'like',
+                                 '%']]]},
+                    'paginator': paginator}).encode('utf8'),
+                headers=self.json_headers, environ=self.extra_environ_admin,
+                status=status).json_body
+
+        resp = search({'page': 1, 'items_per_page': 10})
+        assert resp['paginator']['count_mode'] == 'exact'
+        count = resp['paginator']['count']
+        assert count >= len(forms)
+        assert resp['paginator']['has_more'] is True
+        ids = [f['id'] for f in resp['items']]
+
+        # Cached counts are reused until a table of the forms changes.
+        for _ in range(2):
+            resp = search({'page': 1, 'items_per_page': 10,
+                           'count_mode': 'cached'})
+            assert resp['paginator']['count_mode'] == 'cached'
+            assert resp['paginator']['count'] == count
+            assert [f['id'] for f in resp['items']] == ids
+        # They are keyed by the OLD's database URL, like the cached results.
+        tenants = {key[0] for key in dbutils.COUNT_CACHE}
+        assert tenantcache.get_tenant_key(dbsession) in tenants
+        assert dbsession.get_bind().url.database not in tenants
+
+        # SQLite's planner does not estimate counts: cached counts are used.
+        resp = search({'page': 1, 'items_per_page': 10,
+                       'count_mode': 'estimate'})
+        if h.get_RDBMS_name(self.settings) == 'sqlite':
+            assert resp['paginator']['count_mode'] == 'cached'
+            assert resp['paginator']['count'] == count
+        else:
+            assert resp['paginator']['count_mode'] == 'estimate'
+        assert [f['id'] for f in resp['items']] == ids
+
+        # Without a count, the last page is detected by fetching one more item.
+        last_page = (count - 1) // 10 + 1
+        last_ids = [f['id'] for f in search(
+            {'page': last_page, 'items_per_page': 10})['items']]
+        resp = search({'page': last_page, 'items_per_page': 10,
+                       'count_mode': 'none'})
+        assert resp['paginator']['count_mode'] == 'none'
+        assert 'count' not in resp['paginator']
+        assert resp['paginator']['has_more'] is False
+        assert [f['id'] for f in resp['items']] == last_ids
+        resp = search({'page': 1, 'items_per_page': 10, 'count_mode': 'none'})
+        assert resp['paginator']['has_more'] is True
+
+        resp = search({'page': 1, 'items_per_page': 10, 'count_mode': 'fast'},
+                      status=400)
+        assert 'count_mode' in resp['errors']
+
+    def test_search_yb_cursor_paginator(self):
+        """Tests SEARCH /forms and GET /forms: keyset (cursor) pagination."""
+
+        def walk(order_by, items_per_page=7):
+            ids = []
+            cursor = ''
+            while cursor is not None:
+                json_query = json.dumps({
+                    'query': {'filter': ['Form', 'transcription', 'regex', '[tT]'],
+                              'order_by': order_by},
+                    'paginator': {'items_per_page': items_per_page,
+                                  'cursor': cursor}})
+                resp = self.app.post(
+                    url('search_post'), json_query, self.json_headers,
+                    self.extra_environ_admin).json_body
+                assert 'count' not in resp['paginator']
+                assert len(resp['items']) <= items_per_page
+                ids += [f['id'] for f in resp['items']]
+                cursor = resp['paginator']['next_cursor']
+            return ids
+
+        db = DBUtils(self.dbsession, self.settings)
+        forms = db.get_forms()
+
+        # Ties on the sort value are broken by id; NULLs sort first when
+        # ascending and last when descending.
+        assert walk(['Form', 'id', 'desc']) == sorted(
+            [f.id for f in forms], reverse=True)
+        by_date = sorted(forms, key=lambda f: (f.date_elicited is not None,
+                                               f.date_elicited, f.id))
+        assert walk(['Form', 'date_elicited', 'asc']) == [
+            f.id for f in by_date]
+        assert walk(['Form', 'date_elicited', 'desc'], 10) == [
+            f.id for f in reversed(by_date)]
+        by_transcription = sorted(
+            forms, key=lambda f: (f.transcription.lower(), f.id))
+        assert walk(['Form', 'transcription', 'asc'], 30) == [
+            f.id for f in by_transcription]
+
+        # Counts are only computed on request.
+        json_query = json.dumps({
+            'query': {'filter': ['Form', 'transcription', 'regex', '[tT]']},
+            'paginator': {'items_per_page': 10, 'cursor': '',
+                          'with_count': True}})
+        resp = self.app.post(url('search_post'), json_query, self.json_headers,
+                             self.extra_environ_admin).json_body
+        assert resp['paginator']['count'] == 100
+        assert resp['paginator']['cursor'] is None
+        next_cursor = resp['paginator']['next_cursor']
+
+        # GET /forms accepts the same cursor when the ordering is the same.
+        resp = self.app.get(
+            url('index'), {'items_per_page': 10, 'cursor': next_cursor},
+            headers=self.json_headers,
+            extra_environ=self.extra_environ_admin).json_body
+        assert [f['id'] for f in resp['items']] == sorted(
+            f.id for f in forms)[10:20]
+        assert resp['paginator']['cursor'] == next_cursor
+
+        # A cursor for another ordering and a garbled cursor are rejected.
+        resp = self.app.get(
+            url('index'), {'items_per_page': 10, 'cursor': next_cursor,
+                           'order_by_model': 'Form',
+                           'order_by_attribute': 'transcription',
+                           'order_by_direction': 'desc'},
+            headers=self.json_headers, extra_environ=self.extra_environ_admin,
+            status=400).json_body
+        assert resp['errors']['cursor'] == (
+            'The pagination cursor does not match the requested ordering.')
+        resp = self.app.get(
+            url('index'), {'items_per_page': 10, 'cursor': 'garbage'},
+            headers=self.json_headers, extra_environ=self.extra_environ_admin,
+            status=400).json_body
+        assert resp['errors']['cursor'] == 'Invalid pagination cursor.'
+
     def test_search_z_order_by(self):
         """Tests POST /forms/search: order by."""
 
@@ -1952,6 +2093,133 @@ class TestFormsSearchView(TestView):
         assert len(resp) == 1
         assert response.content_type == 'application/json'
 
+    def test_search_zc_plan_cache(self):
+        """Tests SEARCH /forms: searches of the same shape share a plan."""
+
+        def search(filter_, environ):
+            return self.app.request(
+                url('search'), method='SEARCH',
+                body=json.dumps({'query': {'filter': filter_}}).encode('utf8'),
+                headers=self.json_headers, environ=environ, status='*')
+
+        def get_plan_stats(response):
+            return dict(item.split('=') for item in
+                        response.headers['X-OLD-Search-Plan'].split('; '))
+
+        # Different values, same shape: the second search reuses the plan of
+        # the first. The restricted (even-numbered) forms are still filtered
+        # out for the viewer.
+        response = search(
+            ['and', [['Form', 'transcription', 'in',
+                      ['transcription 1', 'transcription 2',
+                       'transcription 3']],
+                     ['Form', 'date_elicited', '!=', None]]],
+            self.extra_environ_admin)
+        assert sorted(f['transcription'] for f in response.json_body) == [
+            'transcription 1', 'transcription 2', 'transcription 3']
+        first = get_plan_stats(response)
+        response = search(
+            ['and', [['Form', 'transcription', 'in',
+                      ['transcription 11', 'transcription 12']],
+                     ['Form', 'date_elicited', '!=', None]]],
+            self.extra_environ_view)
+        assert [f['transcription'] for f in response.json_body] == [
+            'transcription 11']
+        second = get_plan_stats(response)
+        assert second['shape'] == first['shape']
+        assert second['hit'] == '1'
+        assert int(second['hits']) == int(first['hits']) + 1
+
+        # None values are part of the shape.
+        response = search(
+            ['and', [['Form', 'transcription', 'in',
+                      ['transcription 11', 'transcription 12']],
+                     ['Form', 'date_elicited', '=', None]]],
+            self.extra_environ_admin)
+        assert get_plan_stats(response)['shape'] != first['shape']
+
+        # Invalid values are reported for cached plans too.
+        response = search(['Form', 'date_elicited', '=', '2012-01-01'],
+                          self.extra_environ_admin)
+        shape = get_plan_stats(response)['shape']
+        response = search(['Form', 'date_elicited', '=', '2012-01-32'],
+                          self.extra_environ_admin)
+        assert response.status_int == 400
+        assert response.json_body['errors']['date 2012-01-32'] == \
+            'Date search parameters must be valid ISO 8601 date strings.'
+        assert 'X-OLD-Search-Plan' not in response.headers
+        response = search(['Form', 'date_elicited', '=', '2012-01-02'],
+                          self.extra_environ_admin)
+        assert get_plan_stats(response)['shape'] == shape
+
+    def test_search_zd_match(self):
+        """Tests SEARCH /forms: full-text matches."""
+
+        def search(query):
+            return self.app.request(
+                url('search'), method='SEARCH',
+                body=json.dumps({'query': query}).encode('utf8'),
+                headers=self.json_headers, environ=self.extra_environ_admin,
+                status='*')
+
+        # Unlike like, match is case-insensitive and matches whole words (or,
+        # with *, their prefixes).
+        response = search({'filter': ['Form', 'transcription', 'match',
+                                      'transcription']})
+        assert len(response.json_body) == 100
+        response = search({'filter': ['Form', 'comments', 'match',
+                                      'comments 7*']})
+        assert len(response.json_body) == 11
+        response = search({'filter': ['Form', 'comments', 'match',
+                                      '7* NOT (7 OR 70)']})
+        assert sorted(f['comments'] for f in response.json_body) == [
+            'comments %d' % i for i in range(71, 80)]
+        response = search({'filter': ['Form', 'speaker_comments', 'match',
+                                      '"speaker_comments 12"']})
+        assert [f['id'] for f in response.json_body] == [
+            f['id'] for f in search({'filter': [
+                'Form', 'speaker_comments', '=', 'speaker_comments 12']}
+            ).json_body]
+
+        # Matches combine with the other filters, on joined models too.
+        response = search({'filter': ['and', [
+            ['Translation', 'transcription', 'match', 'second'],
+            ['Form', 'tags', 'id', '!=', None]]]})
+        assert [f['transcription'] for f in response.json_body] == [
+            'TRANSCRIPTION 79']
+        response = search({'filter': ['or', [
+            ['Form', 'morpheme_gloss', 'match', '"morpheme_gloss 5"'],
+            ['Form', 'transcription', '=', 'transcription 6']]]})
+        assert sorted(f['transcription'] for f in response.json_body) == [
+            'transcription 5', 'transcription 6']
+        response = search({'filter': ['not', [
+            'Form', 'comments', 'match', 'comments']]})
+        assert [f['transcription'] for f in response.json_body] == ['_%']
+
+        # Ordering by relevance puts the best match first.
+        response = search({
+            'filter': ['Form', 'comments', 'match', '7* OR 7'],
+            'order_by': ['Form', 'comments', 'relevance']})
+        assert len(response.json_body) == 11
+        assert response.json_body[0]['comments'] == 'comments 7'
+
+        # Only full-text indexed attributes can be matched.
+        response = search({'filter': ['Form', 'syntax', 'match', 'S']})
+        assert response.status_int == 400
+        assert response.json_body['errors']['Form.syntax'] == \
+            'There is no full-text index of Form.syntax'
+        response = search({'filter': ['Form', 'comments', 'match',
+                                      '(comments']})
+        assert response.status_int == 400
+        assert response.json_body['errors']['Form.comments.match'] == \
+            "Invalid full-text query '(comments': Unbalanced parentheses"
+        response = search({
+            'filter': ['Form', 'comments', 'like', '%7%'],
+            'order_by': ['Form', 'comments', 'relevance']})
+        assert response.status_int == 400
+        assert response.json_body['errors']['OrderByError'] == \
+            'Ordering by relevance requires a match filter on Form.comments.'
+
     def test_z_cleanup(self):
         """Tests POST /forms/search: clean up the database."""
 
@@ -0,0 +1,302 @@
+# Copyright 2016 Joel Dunham
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""Tests of the secondary indexes declared by the models, of the 2.0.0 to
+2.1.0 database update script that creates them and of the index advisor
+(:mod:`old.lib.indexadvisor`).
+"""
+
+import importlib.util
+import io
+import logging
+import os
+from unittest import TestCase
+from unittest.mock import patch
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from old.lib import indexadvisor
+from old.lib.trigrams import get_trigram_query
+from old.lib.SQLAQueryBuilder import (
+    OLDSearchParseError,
+    QUERY_LOGGER,
+    SQLAQueryBuilder
+)
+import old.models as old_models
+from old.models import fulltext
+from old.models.meta import Base
+
+
+UPDATE_SCRIPT = os.path.join(
+    os.path.dirname(old_models.__file__), 'db_update_scripts', '2.0.0_2.1.0',
+    'old_update_db_2.0.0_2.1.0.py')
+SETTINGS = {'sqlalchemy.url': 'sqlite://'}
+
+
+def load_update_script():
+    spec = importlib.util.spec_from_file_location(
+        'old_update_db_2_0_0_2_1_0', UPDATE_SCRIPT)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class TestIndexes(TestCase):
+
+    def setUp(self):
+        self.engine = create_engine('sqlite://')
+        Base.metadata.create_all(self.engine)
+        self.dbsession = sessionmaker(bind=self.engine)()
+
+    def tearDown(self):
+        self.dbsession.close()
+        self.engine.dispose()
+
+    def get_indexes(self, table_name):
+        return indexadvisor.get_existing_indexes(
+            self.dbsession.connection())[table_name]
+
+    def test_declared_indexes(self):
+        """Tests that the hot lookup columns are indexed."""
+        assert self.get_indexes('formbackup')['ix_formbackup_UUID'] == ['UUID']
+        assert 'ix_form_datetime_modified' in self.get_indexes('form')
+        assert self.get_indexes('form')['ix_form_break'] == ['morpheme_break']
+        assert self.get_indexes('formtag')['ix_formtag_form_id'] == ['form_id']
+        assert self.get_indexes('parse')[
+            'ix_parse_parser_id_transcription'] == ['parser_id',
+                                                    'transcription']
+        assert indexadvisor.get_missing_declared_indexes(
+            self.dbsession.connection()) == []
+
+    def test_update_script(self):
+        """Tests that the update script creates the missing tables, columns
+        and indexes of a 2.0.0 database, and only once.
+        """
+        connection = self.dbsession.connection()
+        connection.execute('DROP INDEX ix_formbackup_UUID')
+        connection.execute('DROP INDEX ix_form_break')
+        connection.execute('DROP TABLE tombstone')
+        connection.execute('DROP TABLE corpusfile')
+        connection.execute('DROP TABLE form_fts')
+        for event_name in ('insert', 'delete', 'update'):
+            connection.execute('DROP TRIGGER form_fts_%s' % event_name)
+        connection.execute(
+            "INSERT INTO form (UUID, transcription, morpheme_break,"
+            " morpheme_gloss) VALUES ('1', 'chien noir', '', '')")
+        connection.execute(
+            'CREATE TABLE corpusfile (id INTEGER NOT NULL PRIMARY KEY,'
+            ' filename VARCHAR(255))')
+        assert sorted(index.name for index in
+                      indexadvisor.get_missing_declared_indexes(connection)) \
+            == ['ix_form_break', 'ix_formbackup_UUID']
+        update_script = load_update_script()
+        statements = update_script.update(connection, dry_run=True)
+        assert 'CREATE INDEX ix_form_break ON form (morpheme_break)' in \
+            statements
+        assert "INSERT INTO form_fts(form_fts) VALUES ('rebuild')" in \
+            statements
+        assert statements == update_script.get_update_statements(connection)
+        update_script.update(connection)
+        assert update_script.get_update_statements(connection) == []
+        assert 'ix_tombstone_datetime_deleted' in self.get_indexes('tombstone')
+        assert connection.execute(
+            "SELECT rowid FROM form_fts WHERE form_fts MATCH 'noir'"
+        ).fetchall() == [(1,)]
+        connection.execute(
+            "INSERT INTO corpusfile (filename, status, forms_written)"
+            " VALUES ('corpus_1.txt', 'ready', 3)")
+
+    def test_fulltext_indexes(self):
+        """Tests that the FTS5 tables follow the inserts, updates and deletes
+        of their tables.
+        """
+        def match(filter_):
+            query = SQLAQueryBuilder(
+                self.dbsession, 'Form', settings=SETTINGS).get_SQLA_query(
+                    {'filter': filter_})
+            return sorted(form.transcription for form in query.all())
+
+        for transcription in ('chien noir', 'chat noir', 'chiens'):
+            form = old_models.Form(
+                UUID=transcription, transcription=transcription,
+                morpheme_break='', morpheme_gloss='')
+            form.translations = [old_models.Translation(
+                transcription='translation of %s' % transcription)]
+            self.dbsession.add(form)
+        self.dbsession.commit()
+        assert match(['Form', 'transcription', 'match', 'noir']) == [
+            'chat noir', 'chien noir']
+        assert match(['Form', 'transcription', 'match', 'chien*']) == [
+            'chien noir', 'chiens']
+        assert match(['Translation', 'transcription', 'match',
+                      '"of chat"']) == ['chat noir']
+        form = self.dbsession.query(old_models.Form).filter(
+            old_models.Form.transcription == 'chat noir').first()
+        form.transcription = 'chat blanc'
+        self.dbsession.delete(self.dbsession.query(old_models.Form).filter(
+            old_models.Form.transcription == 'chiens').first())
+        self.dbsession.commit()
+        assert match(['Form', 'transcription', 'match', 'noir']) == [
+            'chien noir']
+        assert match(['Form', 'transcription', 'match', 'chien* OR blanc']) \
+            == ['chat blanc', 'chien noir']
+
+    def test_missing_fts5(self):
+        """Tests that a database is created without FTS5 tables if SQLite
+        lacks FTS5 and that match searches then fail with a search error.
+        """
+        with patch.dict(fulltext._SQLITE_SUPPORT,
+                        {'fts': False, 'trigram': False}):
+            engine = create_engine('sqlite://')
+            Base.metadata.create_all(engine)
+            table_names = engine.table_names()
+            assert 'form' in table_names
+            assert not [name for name in table_names
+                        if name.endswith(('_fts', '_trigram'))]
+            dbsession = sessionmaker(bind=engine)()
+            dbsession.add(old_models.Form(
+                UUID='chien', transcription='chien', morpheme_break='',
+                morpheme_gloss=''))
+            dbsession.commit()
+            # Without the plan cache, whose plans of earlier match searches
+            # were built while FTS5 was available.
+            settings = dict(SETTINGS, search_plan_cache_size='0')
+            with self.assertRaises(OLDSearchParseError) as context:
+                SQLAQueryBuilder(dbsession, 'Form', settings=settings)\
+                    .get_SQLA_query(
+                        {'filter': ['Form', 'comments', 'match', 'chien']})
+            assert 'FTS5' in str(context.exception.errors)
+            dbsession.close()
+        assert fulltext.sqlite_supports('fts')
+
+    def test_trigram_prefilter(self):
+        """Tests that regex searches of trigram indexed attributes are
+        prefiltered by the substrings that their patterns require.
+        """
+        assert get_trigram_query('k[ai]ta') == '("kata" OR "kita")'
+        assert get_trigram_query('^mata.*-s') == '"mata"'
+        assert get_trigram_query('(abc|de)f') == '("abcf" OR "def")'
+        for pattern in ('-s( |-|$)', 'ma.*si', '(?i)mata', '(kat)*', '[^a]'):
+            assert get_trigram_query(pattern) is None
+
+        old_models.patch_sqlite(SETTINGS)
+        for transcription, phonetic in (('kata-s', 'kats'), ('kita', 'kits'),
+                                        ('chat noir', None)):
+            self.dbsession.add(old_models.Form(
+                UUID=transcription, transcription=transcription,
+                phonetic_transcription=phonetic, morpheme_break='',
+                morpheme_gloss=''))
+        self.dbsession.commit()
+
+        def search(filter_):
+            query = SQLAQueryBuilder(
+                self.dbsession, 'Form', settings=SETTINGS).get_SQLA_query(
+                    {'filter': filter_})
+            return (sorted(form.transcription for form in query.all()),
+                    'form_trigram' in str(query))
+
+        assert search(['Form', 'transcription', 'regex', 'k[ai]ta']) == (
+            ['kata-s', 'kita'], True)
+        assert search(['Form', 'transcription', 'regex', '^k']) == (
+            ['kata-s', 'kita'], False)
+        assert search(['Form', 'syntax', 'regex', 'kat']) == ([], False)
+        # A NULL value matches neither a pattern nor its negation.
+        assert search(['not', ['Form', 'phonetic_transcription', 'regex',
+                               'kat']]) == (['kita'], True)
+        form = self.dbsession.query(old_models.Form).filter(
+            old_models.Form.transcription == 'kita').first()
+        form.transcription = 'kota'
+        self.dbsession.commit()
+        assert search(['Form', 'transcription', 'regex', 'k[aio]ta']) == (
+            ['kata-s', 'kota'], True)
+
+    def test_missing_trigram_tokenizer(self):
+        """Tests that a database is created without trigram tables if SQLite
+        lacks the trigram tokenizer and that regex searches then scan.
+        """
+        fts = fulltext.sqlite_supports('fts')
+        old_models.patch_sqlite(SETTINGS)
+        with patch.dict(fulltext._SQLITE_SUPPORT,
+                        {'fts': fts, 'trigram': False}):
+            engine = create_engine('sqlite://')
+            Base.metadata.create_all(engine)
+            table_names = engine.table_names()
+            assert not [name for name in table_names
+                        if name.endswith('_trigram')]
+            assert ('form_fts' in table_names) == fts
+            assert not [row for row in engine.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'trigger'"
+                " AND name LIKE '%trigram%'")]
+            dbsession = sessionmaker(bind=engine)()
+            for transcription in ('chien', 'chian', 'chat'):
+                dbsession.add(old_models.Form(
+                    UUID=transcription, transcription=transcription,
+                    morpheme_break='', morpheme_gloss=''))
+            dbsession.commit()
+            query = SQLAQueryBuilder(
+                dbsession, 'Form', settings=SETTINGS).get_SQLA_query(
+                    {'filter': ['Form', 'transcription', 'regex',
+                                'ch[ie][ae]n']})
+            assert 'form_trigram' not in str(query)
+            assert sorted(form.transcription for form in query.all()) == [
+                'chian', 'chien']
+            dbsession.close()
+
+    def test_advisor(self):
+        """Tests that logged queries are replayed and that full scans,
+        candidate indexes and unused indexes are reported.
+        """
+        stream = io.StringIO()
+        handler = logging.StreamHandler(stream)
+        handler.setFormatter(logging.Formatter(
+            '%(asctime)s %(levelname)-5.5s [%(name)s:%(lineno)s]'
+            '[%(threadName)s] %(message)s'))
+        level = QUERY_LOGGER.level
+        QUERY_LOGGER.addHandler(handler)
+        QUERY_LOGGER.setLevel(logging.INFO)
+        try:
+            for query in (
+                    {'filter': ['Form', 'transcription', '=', 'chiens']},
+                    {'filter': ['Form', 'transcription', '=', 'chiens']},
+                    {'filter': ['Form', 'morpheme_break', '=', 'chien']},
+                    {'filter': ['Form', 'tags', 'name', '=', 'restricted']},
+                    {'filter': ['Form', 'nonexistent', '=', 'x']}):
+                try:
+                    SQLAQueryBuilder(self.dbsession, 'Form',
+                                     settings=SETTINGS).get_SQLA_query(query)
+                except OLDSearchParseError:
+                    pass
+        finally:
+            QUERY_LOGGER.removeHandler(handler)
+            QUERY_LOGGER.setLevel(level)
+        lines = stream.getvalue().splitlines()
+        assert len(lines) == 4
+        lines.append('%s Form {"filter": ["Form", "nonexistent", "=", "x"]}' %
+                     indexadvisor.QUERY_LOG_MARKER)
+        entries = indexadvisor.parse_query_log(lines + ['unrelated line'])
+        assert sum(entries.values()) == 5
+        report = indexadvisor.advise(self.dbsession, entries, SETTINGS)
+        assert report['queries'] == 4
+        assert report['replayed'] == 3
+        assert report['failed'] == 1
+        assert report['scans']['form'] == 3
+        assert report['missing'] == [('form', 'transcription', 2)]
+        assert report['used']['ix_form_break'] == 1
+        assert report['used']['ix_formtag_tag_id'] == 1
+        unused = [index for _, index, _ in report['unused']]
+        assert 'ix_form_datetime_modified' in unused
+        assert 'ix_form_break' not in unused
+        text = indexadvisor.format_report(report)
+        assert 'form.transcription: 2' in text
@@ -0,0 +1,188 @@
+# Copyright 2016 Joel Dunham
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""Tests of the background job scheduler (:mod:`old.lib.jobs`) and of the
+jobs view.
+"""
+
+import datetime
+import json
+import logging
+from time import sleep
+
+import pytest
+
+from old.lib.jobs import JOB_SCHEDULER, JobScheduler, job_handler
+from old.models import Job, User
+from old.tests import TestView
+
+
+LOGGER = logging.getLogger(__name__)
+
+
+@job_handler('test_echo')
+def echo(**kwargs):
+    return {'value': kwargs['value'], 'old_name': kwargs['settings']['old_name']}
+
+
+@job_handler('test_fail')
+def fail(**kwargs):
+    raise ValueError('bad value %s' % kwargs['value'])
+
+
+class TestJobsView(TestView):
+
+    def get_user(self, role, dbsession=None):
+        return (dbsession or self.dbsession).query(User).filter(
+            User.role == role).first()
+
+    def add_job(self, kind, args, role='administrator', priority=0,
+                dbsession=None, **kwargs):
+        dbsession = dbsession or self.dbsession
+        job = Job(kind=kind, args=json.dumps(args), status='queued',
+                  priority=priority, attempts=0,
+                  enterer=self.get_user(role, dbsession), **kwargs)
+        dbsession.add(job)
+        dbsession.commit()
+        return job.id
+
+    def wait_for(self, job_id, extra_environ=None):
+        """Poll ``GET /jobs/job_id`` until the job has finished."""
+        url = Job._url(old_name=self.old_name)
+        for _ in range(100):
+            job = self.app.get(
+                url('show', id=job_id), headers=self.json_headers,
+                extra_environ=extra_environ or self.extra_environ_admin
+            ).json_body
+            if job['status'] in ('succeeded', 'failed'):
+                return job
+            sleep(0.2)
+        raise AssertionError('Job %d timed out.' % job_id)
+
+    def test_run(self):
+        """Tests that queued jobs are run by their handlers and that their
+        results and errors are recorded.
+        """
+        echo_id = self.add_job('test_echo', {'value': 7})
+        fail_id = self.add_job('test_fail', {'value': 8})
+        unknown_id = self.add_job('test_unknown', {})
+        JOB_SCHEDULER.notify()
+
+        job = self.wait_for(echo_id)
+        assert job['status'] == 'succeeded'
+        assert job['result'] == {'value': 7, 'old_name': self.old_name}
+        assert job['attempts'] == 1
+        assert job['error'] is None
+        assert job['datetime_started'] <= job['datetime_finished']
+        assert job['enterer']['role'] == 'administrator'
+
+        job = self.wait_for(fail_id)
+        assert job['status'] == 'failed'
+        assert job['error'] == 'ValueError: bad value 8'
+        assert job['result'] is None
+
+        job = self.wait_for(unknown_id)
+        assert job['status'] == 'failed'
+        assert 'no handler' in job['error']
+
+    def test_enqueue(self):
+        """Tests that actions enqueue their background work as jobs, e.g.,
+        ``PUT /forms/update_morpheme_references``.
+        """
+        status = self.app.put(
+            '/{}/forms/update_morpheme_references'.format(self.old_name),
+            headers=self.json_headers,
+            extra_environ=self.extra_environ_admin).json_body
+        assert status['status'] == 'queued'
+        job = self.wait_for(status['job_id'])
+        assert job['kind'] == 'rebuild_morpheme_references'
+        assert job['status'] == 'succeeded'
+        assert job['priority'] == -1
+        assert job['result']['processed'] == 0
+        status = self.app.get(
+            '/{}/forms/update_morpheme_references'.format(self.old_name),
+            headers=self.json_headers,
+            extra_environ=self.extra_environ_admin).json_body
+        assert status['status'] == 'finished'
+
+    def test_visibility(self):
+        """Tests that only administrators can see the jobs of other users."""
+        admin_job_id = self.add_job('test_echo', {'value': 1})
+        viewer_job_id = self.add_job('test_echo', {'value': 2}, role='viewer')
+        JOB_SCHEDULER.notify()
+        self.wait_for(admin_job_id)
+        self.wait_for(viewer_job_id)
+        url = Job._url(old_name=self.old_name)
+
+        jobs = self.app.get(url('index'), headers=self.json_headers,
+                            extra_environ=self.extra_environ_admin).json_body
+        assert sorted(job['id'] for job in jobs) == sorted(
+            [admin_job_id, viewer_job_id])
+        jobs = self.app.get(url('index'), headers=self.json_headers,
+                            extra_environ=self.extra_environ_view).json_body
+        assert [job['id'] for job in jobs] == [viewer_job_id]
+        self.app.get(url('show', id=admin_job_id), headers=self.json_headers,
+                     extra_environ=self.extra_environ_view, status=403)
+        jobs = self.app.post(
+            url('search_post'),
+            json.dumps({'query': {'filter': ['Job', 'kind', '=',
+                                             'test_echo']}}),
+            self.json_headers, self.extra_environ_view).json_body
+        assert [job['id'] for job in jobs] == [viewer_job_id]
+        self.app.delete(url('delete', id=viewer_job_id),
+                        headers=self.json_headers,
+                        extra_environ=self.extra_environ_admin, status=404)
+
+    def test_claim(self):
+        """Tests that jobs are claimed in order of priority and age, that a
+        job is claimed only once, and that abandoned jobs are recovered.
+        """
+        # The second OLD is not polled by the application's scheduler, so a
+        # scheduler of our own can claim its jobs without interference.
+        if not self.Session2:
+            pytest.skip('A second test OLD is needed.')
+        dbsession = self.dbsession2
+        settings = self.settings2
+        scheduler = JobScheduler()
+        scheduler.configure({'jobs_stale_after': '60',
+                             'jobs_max_attempts': '2'})
+        scheduler.add_tenant(settings)
+        first_id = self.add_job('test_echo', {'value': 1}, dbsession=dbsession)
+        urgent_id = self.add_job('test_echo', {'value': 2}, priority=5,
+                                 dbsession=dbsession)
+        last_id = self.add_job('test_echo', {'value': 3}, dbsession=dbsession)
+        claimed = [scheduler._claim(settings) for _ in range(4)]
+        assert [job and job['id'] for job in claimed] == [
+            urgent_id, first_id, last_id, None]
+        assert claimed[0]['args'] == {'value': 2}
+        dbsession.expire_all()
+        job = dbsession.query(Job).get(urgent_id)
+        assert job.status == 'running'
+        assert job.attempts == 1
+        assert job.worker == scheduler.worker_id
+
+        # Jobs whose worker has stopped beating are re-queued until they have
+        # been attempted ``jobs_max_attempts`` times.
+        long_ago = datetime.datetime.utcnow() - datetime.timedelta(hours=1)
+        for job in dbsession.query(Job).all():
+            job.datetime_modified = long_ago
+        dbsession.query(Job).get(last_id).attempts = 2
+        dbsession.commit()
+        scheduler.running[settings['old_name']].add(first_id)
+        scheduler._maintain(settings['old_name'], settings)
+        dbsession.expire_all()
+        statuses = {job.id: job.status for job in dbsession.query(Job).all()}
+        assert statuses == {urgent_id: 'queued', first_id: 'running',
+                            last_id: 'failed'}
+        assert dbsession.query(Job).get(first_id).datetime_modified > long_ago
@@ -0,0 +1,160 @@
+# Copyright 2016 Joel Dunham
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""Tests of the metrics registry and the /metrics endpoint, cf.
+:mod:`old.lib.metrics`.
+"""
+
+import json
+import logging
+import os
+import shutil
+import tempfile
+
+from old.lib import metrics
+import old.models as old_models
+from old.tests import TestView, add_SEARCH_to_web_test_valid_methods
+
+
+LOGGER = logging.getLogger(__name__)
+
+url = old_models.Form._url(old_name=TestView.old_name)
+
+
+def get_samples(text):
+    """Return a dict from the sample lines of Prometheus text to their
+    values.
+    """
+    samples = {}
+    for line in text.splitlines():
+        if line and not line.startswith('#'):
+            name, value = line.rsplit(' ', 1)
+            samples[name] = float(value)
+    return samples
+
+
+class TestMetrics(TestView):
+
+    def setUp(self):
+        super().setUp()
+        add_SEARCH_to_web_test_valid_methods()
+        self.set_registry_settings(metrics_enabled='true')
+        self.metrics_dir = tempfile.mkdtemp()
+        self.add_default_forms()
+        self.dbsession.commit()
+
+    def tearDown(self):
+        shutil.rmtree(self.metrics_dir, ignore_errors=True)
+        super().tearDown()
+
+    def test_registry(self):
+        """Tests the counters, gauges and histograms of a registry, their
+        label cardinality limit and their Prometheus text format.
+        """
+        registry = metrics.MetricsRegistry(max_label_values=2)
+        counter = registry.counter('requests_total', 'Requests.', ('old',))
+        for old_name in ('a', 'b', 'a', 'c', 'd'):
+            counter.inc(old=old_name)
+        registry.gauge('size', 'Size.').set(3.5)
+        histogram = registry.histogram('latency_seconds', 'Latency "x".',
+                                       ('route',), buckets=(0.1, 1))
+        for value in (0.05, 0.5, 5):
+            histogram.observe(value, route='index')
+        assert registry.counter('requests_total', 'Requests.') is counter
+        with self.assertRaises(ValueError):
+            registry.gauge('requests_total', 'Requests.')
+        with self.assertRaises(ValueError):
+            counter.inc(route='index')
+
+        text = metrics.render_metrics(registry.to_dict())
+        assert '# TYPE requests_total counter' in text
+        assert '# HELP latency_seconds Latency "x".' in text
+        assert get_samples(text) == {
+            'requests_total{old="a"}': 2,
+            'requests_total{old="b"}': 1,
+            'requests_total{old="other"}': 2,
+            'size': 3.5,
+            'latency_seconds_bucket{route="index",le="0.1"}': 1,
+            'latency_seconds_bucket{route="index",le="1.0"}': 2,
+            'latency_seconds_bucket{route="index",le="+Inf"}': 3,
+            'latency_seconds_sum{route="index"}': 5.55,
+            'latency_seconds_count{route="index"}': 3,
+        }
+
+    def test_merge(self):
+        """Tests that the metrics files of several processes are summed and
+        that the gauges of stale files are ignored.
+        """
+        registry = metrics.MetricsRegistry()
+        registry.counter('requests_total', 'Requests.', ('old',)).inc(
+            2, old='a')
+        registry.gauge('checked_out', 'Connections.').set(1)
+        registry.histogram('latency_seconds', 'Latency.',
+                           buckets=(1,)).observe(0.5)
+        snapshot = registry.to_dict()
+        merged = metrics.merge_metrics([(snapshot, False), (snapshot, False),
+                                        (snapshot, True)])
+        assert get_samples(metrics.render_metrics(merged)) == {
+            'requests_total{old="a"}': 6,
+            'checked_out': 2,
+            'latency_seconds_bucket{le="1.0"}': 3,
+            'latency_seconds_bucket{le="+Inf"}': 3,
+            'latency_seconds_sum': 1.5,
+            'latency_seconds_count': 3,
+        }
+
+    def test_endpoint(self):
+        """Tests that GET /metrics reports the requests, the database pool,
+        the jobs and the caches, including the metrics written by other
+        processes to metrics_dir.
+        """
+        self.app.get(url('index'), headers=self.json_headers,
+                     extra_environ=self.extra_environ_view)
+        self.app.request(url('search'), method='SEARCH', body=json.dumps(
+            {'query': {'filter': ['Form', 'id', '>', 0]}}).encode('utf8'),
+                         headers=self.json_headers,
+                         environ=self.extra_environ_view)
+        response = self.app.get('/metrics')
+        assert response.content_type == 'text/plain'
+        samples = get_samples(response.text)
+        assert samples['old_http_requests_total{old="%s",status="200"}'
+                       % self.old_name] >= 2
+        assert samples['old_http_request_duration_seconds_count'
+                       '{route="index_forms",method="GET"}'] >= 1
+        assert samples['old_http_request_duration_seconds_count'
+                       '{route="search_forms",method="SEARCH"}'] >= 1
+        assert samples['old_db_pool_checkout_seconds_count{old="%s"}'
+                       % self.old_name] >= 1
+        assert 'old_db_pool_checked_out{old="%s"}' % self.old_name in samples
+        assert samples['old_search_plan_cache_lookups_total'
+                       '{result="miss"}'] >= 1
+        assert samples['old_jobs_queued{old="%s"}' % self.old_name] == 0
+
+        # Another process's metrics are added to this one's.
+        other = metrics.MetricsRegistry()
+        other.counter('old_http_requests_total', 'Requests.',
+                      ('old', 'status')).inc(5, old='other_old', status='200')
+        with open(os.path.join(self.metrics_dir, 'metrics-1.json'),
+                  'w') as file_:
+            json.dump(other.to_dict(), file_)
+        self.set_registry_settings(metrics_dir=self.metrics_dir)
+        samples = get_samples(self.app.get('/metrics').text)
+        assert samples[
+            'old_http_requests_total{old="other_old",status="200"}'] == 5
+        assert os.path.isfile(metrics.get_metrics_path(self.metrics_dir))
+
+        # The endpoint (and the recording of metrics) can be disabled.
+        self.set_registry_settings(metrics_enabled='false')
+        response = self.app.get('/metrics', status=404)
+        assert response.json_body['error'] == 'Metrics are not enabled.'
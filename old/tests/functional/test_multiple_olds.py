@@ -22,6 +22,7 @@ import json
 import logging
 import os
 
+from old import MyRequest
 import old.lib.helpers as h
 import old.models as old_models
 from old.models import Form
@@ -189,3 +190,26 @@ class TestMultipleOLDsView(TestView):
         expected_bad_path = os.path.join(self.files_path, filename)
         assert os.path.isfile(expected_good_path)
         assert not os.path.isfile(expected_bad_path)
+
+    def test_request_settings(self):
+        """Tests that each request gets the settings of the OLD of its URL and
+        that requests do not change the settings shared by all OLDs.
+        """
+        registry = self.app.app.app.registry
+        shared = dict(registry.settings)
+        for path in (url('index'), url2('index')):
+            self.app.get(path, headers=self.json_headers,
+                         extra_environ=self.extra_environ_view)
+        assert dict(registry.settings) == shared
+
+        request = MyRequest.blank(url2('index'))
+        request.registry = registry
+        settings = request.settings
+        assert settings['old_name'] == self.old_name_2
+        assert settings['sqlalchemy.url'] == self.settings2['sqlalchemy.url']
+        assert settings['session.url'] == self.settings2['sqlalchemy.url']
+        assert settings['session.key'] == 'old_%s' % self.old_name_2
+        assert h.get_old_directory_path('files', settings=settings) == \
+            h.get_old_directory_path('files', settings=self.settings2)
+        assert h.get_old_directory_path('files', settings=registry.settings) \
+            == self.files_path
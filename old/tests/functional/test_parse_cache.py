@@ -0,0 +1,167 @@
+# Copyright 2016 Joel Dunham
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""Tests of the two-tier (memory and database) cache of morphological parsers,
+cf. :class:`old.models.morphologicalparser.Cache`. These tests do not require
+foma.
+"""
+
+import json
+import logging
+
+from sqlalchemy import inspect
+
+import old.lib.helpers as h
+from old.models import MorphologicalParser, Parse
+from old.models import morphologicalparser as mp_module
+from old.models.morphologicalparser import (
+    Cache,
+    MEMORY_CACHES,
+    dumps_candidates,
+    loads_candidates
+)
+from old.tests import TestView, QueryCounter
+from old.views.morphologicalparsers import session_getter
+
+
+LOGGER = logging.getLogger(__name__)
+
+
+class TestParseCache(TestView):
+
+    def setUp(self):
+        super().setUp()
+        MEMORY_CACHES.clear()
+        parser = MorphologicalParser(
+            parent_directory=h.get_old_directory_path(
+                'morphologicalparsers', self.settings),
+            name='parser', datetime_modified=h.now())
+        self.dbsession.add(parser)
+        self.dbsession.commit()
+        self.parser_id = parser.id
+        self.settings = dict(self.settings)
+
+    def get_cache(self):
+        parser = self.dbsession.query(MorphologicalParser).get(self.parser_id)
+        return Cache(parser, self.settings, session_getter)
+
+    def test_tiers(self):
+        """Tests that parses are found in memory, then in the database, and
+        that a batch of transcriptions is looked up in a single query.
+        """
+        parses = {'word%d' % index: ('w-%d|gloss|N' % index,
+                                     ['w-%d|gloss|N' % index, 'w%d|x|V' % index])
+                  for index in range(1200)}
+        cache = self.get_cache()
+        cache.update(parses)
+        cache['other'] = (None, [])
+        cache.persist()
+        assert not cache.updated
+        assert self.dbsession.query(Parse).filter(
+            Parse.parser_id == self.parser_id).count() == 1201
+        # Persisting again inserts nothing.
+        cache.persist()
+        assert self.dbsession.query(Parse).count() == 1201
+
+        transcriptions = ['word1', 'word2', 'other', 'unknown']
+        cache = self.get_cache()
+        found = cache.get_many(transcriptions)
+        assert found == {key: parses.get(key, (None, []))
+                         for key in transcriptions[:3]}
+        assert cache.get_stats() == {'memory_hits': 3, 'database_hits': 0,
+                                     'misses': 1, 'hit_rate': 0.75}
+
+        MEMORY_CACHES.clear()
+        cache = self.get_cache()
+        with QueryCounter() as counter:
+            found = cache.get_many(transcriptions)
+        assert len(counter.statements) == 1
+        assert found['word2'] == parses['word2']
+        assert cache.get('unknown', 'default') == 'default'
+        assert cache['word1'] == parses['word1']
+        stats = cache.get_stats()
+        assert stats['database_hits'] == 3
+        assert stats['memory_hits'] == 1
+        assert stats['misses'] == 2
+
+        # Parses found in the database are added to the memory tier.
+        cache = self.get_cache()
+        cache.get_many(['word1', 'word2'])
+        assert cache.stats['memory_hits'] == 2
+
+        # The parse table is indexed for these lookups.
+        indexes = inspect(self.dbsession.bind).get_indexes('parse')
+        assert ['parser_id', 'transcription'] in [
+            index['column_names'] for index in indexes]
+
+    def test_memory_tier(self):
+        """Tests that the memory tier is bounded, that it is invalidated when
+        the parser is modified, and that it can be disabled.
+        """
+        self.settings['parse_cache_size'] = '2'
+        cache = self.get_cache()
+        for index in range(3):
+            cache['word%d' % index] = 'w-%d' % index, []
+        assert len(cache.memory) == 2
+        assert self.get_cache().get_many(['word0', 'word1', 'word2']) == {
+            'word1': ('w-1', []), 'word2': ('w-2', [])}
+
+        parser = self.dbsession.query(MorphologicalParser).get(self.parser_id)
+        parser.datetime_modified = h.now()
+        self.dbsession.commit()
+        assert len(self.get_cache().memory) == 0
+
+        self.settings['parse_cache_size'] = '0'
+        cache = self.get_cache()
+        assert cache.memory is None
+        cache['word'] = 'w', []
+        cache.persist()
+        assert self.get_cache()['word'] == ('w', [])
+
+        cache.clear(persist=True)
+        assert self.dbsession.query(Parse).count() == 0
+
+    def test_candidates(self):
+        """Tests that long candidate lists are compressed rather than
+        truncated.
+        """
+        candidates = ['%d-ab-cd|%d-gloss-gloss|N-Agr-Num' % (index, index)
+                      for index in range(5000)]
+        assert len(dumps_candidates(candidates[:2])) < 100
+        assert loads_candidates(dumps_candidates(candidates[:2])) == \
+            candidates[:2]
+        value = dumps_candidates(candidates)
+        assert value.startswith(mp_module.COMPRESSED_PREFIX)
+        assert len(value) <= mp_module.MAX_CANDIDATES_LENGTH
+        assert loads_candidates(value) == candidates
+
+        cache = self.get_cache()
+        cache['word'] = candidates[0], candidates
+        cache.persist()
+        MEMORY_CACHES.clear()
+        assert self.get_cache()['word'] == (candidates[0], candidates)
+
+        # Values that do not fit even when compressed lose their least
+        # probable candidates.
+        mp_module.MAX_CANDIDATES_LENGTH, max_length = (
+            2000, mp_module.MAX_CANDIDATES_LENGTH)
+        try:
+            shortened = loads_candidates(dumps_candidates(candidates))
+        finally:
+            mp_module.MAX_CANDIDATES_LENGTH = max_length
+        assert shortened and shortened == candidates[:len(shortened)]
+
+        # Values truncated by earlier versions are ignored.
+        assert loads_candidates(json.dumps('["a-b|c-d|N-Agr", "a-')) == []
+        assert loads_candidates(None) == []
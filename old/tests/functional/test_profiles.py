@@ -0,0 +1,129 @@
+# Copyright 2016 Joel Dunham
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""Tests of the request profiler (cf. :mod:`old.lib.profiler`) and of the
+profiles view.
+"""
+
+import logging
+import shutil
+import threading
+import time
+from unittest.mock import patch
+
+from old.lib import profiler
+import old.models as old_models
+from old.tests import TestView
+
+
+LOGGER = logging.getLogger(__name__)
+
+url = old_models.Form._url(old_name=TestView.old_name)
+
+
+def busy(seconds):
+    end = time.time() + seconds
+    while time.time() < end:
+        pass
+
+
+class TestProfiles(TestView):
+
+    def setUp(self):
+        super().setUp()
+        self.set_registry_settings(profiling_enabled='true',
+                                   profiling_interval='1')
+        self.add_default_forms()
+        self.dbsession.commit()
+        self.profiles_path = profiler.get_profiles_path(
+            self.registry_settings, self.old_name)
+
+    def tearDown(self):
+        shutil.rmtree(self.profiles_path, ignore_errors=True)
+        super().tearDown()
+
+    def test_sampler(self):
+        """Tests that the sampler records the stacks of a thread."""
+        sampler = profiler.StackSampler(threading.get_ident(), 0.001).start()
+        busy(0.05)
+        sampler.stop()
+        assert sampler.samples > 0
+        assert sum(sampler.stacks.values()) == sampler.samples
+        lines = sampler.to_collapsed().splitlines()
+        assert all(line.rsplit(' ', 1)[1].isdigit() for line in lines)
+        assert any(':TestProfiles.test_sampler:' in line and
+                   line.rsplit(';', 1)[1].split(':')[1] == 'busy'
+                   for line in lines)
+
+    def test_profiles(self):
+        """Tests that administrators' requests are profiled on demand, that
+        the profiles are served to administrators only and that only the
+        most recent ones are kept.
+        """
+        headers = dict(self.json_headers, **{'X-OLD-Profile': '1'})
+        # The header of an unauthenticated client or of a non-administrator
+        # does not start the sampler.
+        self.app.reset()
+        with patch.object(profiler.StackSampler, 'start') as start:
+            self.app.get(url('index'), headers=headers, status=401,
+                         extra_environ={'test.rig.auth': False})
+            self.app.get(url('index'), headers=headers,
+                         extra_environ=self.extra_environ_view)
+            response = self.app.get(url('index'), headers=headers,
+                                    extra_environ=self.extra_environ_view)
+        assert not start.called
+        assert 'X-OLD-Profile' not in response.headers
+        response = self.app.get(url('index'), headers=self.json_headers,
+                                extra_environ=self.extra_environ_admin)
+        assert 'X-OLD-Profile' not in response.headers
+
+        response = self.app.get(url('index'), headers=headers,
+                                extra_environ=self.extra_environ_admin)
+        profile_id = response.headers['X-OLD-Profile']
+        profiles_url = '/%s/profiles' % self.old_name
+        profiles = self.app.get(profiles_url, headers=self.json_headers,
+                                extra_environ=self.extra_environ_admin)\
+            .json_body
+        assert [profile['id'] for profile in profiles] == [profile_id]
+        assert profiles[0]['method'] == 'GET'
+        assert profiles[0]['route'] == 'index_forms'
+        assert profiles[0]['status'] == 200
+        assert profiles[0]['interval'] == 1
+        response = self.app.get('%s/%s' % (profiles_url, profile_id),
+                                headers=self.json_headers,
+                                extra_environ=self.extra_environ_admin)
+        assert response.content_type == 'text/plain'
+        assert sum(int(line.rsplit(' ', 1)[1]) for line in
+                   response.text.splitlines()) == profiles[0]['samples']
+
+        self.app.get(profiles_url, headers=self.json_headers,
+                     extra_environ=self.extra_environ_contrib, status=403)
+        self.app.get('%s/..%%2Fetc' % profiles_url, headers=self.json_headers,
+                     extra_environ=self.extra_environ_admin, status=404)
+        response = self.app.get('%s/nonexistent' % profiles_url,
+                                headers=self.json_headers,
+                                extra_environ=self.extra_environ_admin,
+                                status=404)
+        assert response.json_body['error'] == \
+            'There is no profile with id nonexistent'
+
+        # Sampled requests are profiled without the header; only the most
+        # recent profiles are kept.
+        self.set_registry_settings(profiling_sample_rate='1',
+                                   profiling_max_profiles='2')
+        ids = [self.app.get(url('index'), headers=self.json_headers,
+                            extra_environ=self.extra_environ_view)
+               .headers['X-OLD-Profile'] for _ in range(3)]
+        assert profiler.get_profile_ids(self.registry_settings,
+                                        self.old_name) == ids[1:]
@@ -0,0 +1,117 @@
+# Copyright 2016 Joel Dunham
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""Tests of the per-request SQL query accounting and N+1 detection of
+:mod:`old.lib.querystats`.
+"""
+
+import logging
+
+import pytest
+from sqlalchemy import text
+
+from old.lib import querystats
+import old.models as old_models
+from old.tests import TestView, QueryCounter
+
+
+LOGGER = logging.getLogger(__name__)
+
+url = old_models.Form._url(old_name=TestView.old_name)
+
+
+class TestQueryStats(TestView):
+
+    def setUp(self):
+        super().setUp()
+        for index, form in enumerate(self.add_default_forms(12)):
+            form.tags = [old_models.Tag(name='tag %d' % index)]
+        self.dbsession.commit()
+        self.dbsession.expunge_all()
+
+    def test_headers(self):
+        """Tests that the query accounting headers are only returned if the
+        debug_queries setting is true.
+        """
+        response = self.app.get(url('index'), headers=self.json_headers,
+                                extra_environ=self.extra_environ_view)
+        assert 'X-OLD-Query-Count' not in response.headers
+
+        self.set_registry_settings(debug_queries='true')
+        response = self.app.get(url('index'), headers=self.json_headers,
+                                extra_environ=self.extra_environ_view)
+        assert len(response.json_body) == 12
+        count = int(response.headers['X-OLD-Query-Count'])
+        assert 0 < count < 12
+        assert 0 < int(response.headers['X-OLD-Query-Shapes']) <= count
+        assert float(response.headers['X-OLD-Query-Time']) >= 0
+        assert 'X-OLD-Query-N-Plus-One' not in response.headers
+
+    def test_n_plus_one(self):
+        """Tests that the lazy loads of a relationship of each model are
+        reported as an N+1 pattern of that relationship.
+        """
+        forms = self.dbsession.query(old_models.Form).all()
+        with querystats.collect() as stats:
+            tag_names = [[tag.name for tag in form.tags] for form in forms]
+        assert len(tag_names) == 12
+        assert stats.count == 12
+        assert len(stats.shapes) == 1
+        n_plus_one = stats.get_n_plus_one()
+        assert len(n_plus_one) == 1
+        assert n_plus_one[0][1:] == (12, ['Form.tags'])
+        assert stats.get_headers()['X-OLD-Query-N-Plus-One'] == 'Form.tags=12'
+
+        self.dbsession.expunge_all()
+        forms = self.dbsession.query(old_models.Form).all()
+        with querystats.collect() as stats:
+            enterer_names = [form.enterer.first_name for form in forms]
+        # The identity map serves all but the first lazy load of the enterer.
+        assert len(enterer_names) == 12
+        assert stats.count == 1
+        assert not stats.get_n_plus_one()
+
+        with pytest.raises(AssertionError) as excinfo:
+            with QueryCounter(20):
+                for form in self.dbsession.query(old_models.Form).all():
+                    form.translations  # pylint: disable=pointless-statement
+        assert 'Form.translations' in str(excinfo.value)
+
+    def test_query_budgets(self):
+        """Tests the query budgets of the form index and show requests."""
+        with QueryCounter(10):
+            self.app.get(url('index'), headers=self.json_headers,
+                         extra_environ=self.extra_environ_view)
+        form_id = self.dbsession.query(old_models.Form.id).first()[0]
+        with QueryCounter(10):
+            self.app.get(url('show', id=form_id), headers=self.json_headers,
+                         extra_environ=self.extra_environ_view)
+        with pytest.raises(AssertionError) as excinfo:
+            with QueryCounter(1):
+                self.app.get(url('index'), headers=self.json_headers,
+                             extra_environ=self.extra_environ_view)
+        assert 'exceed the budget of 1' in str(excinfo.value)
+
+    def test_failed_statement(self):
+        """Tests that a statement that fails does not leave its start time
+        behind on the connection.
+        """
+        connection = self.dbsession.connection()
+        with querystats.collect() as stats:
+            with pytest.raises(Exception):
+                connection.execute(text('SELECT * FROM no_such_table'))
+            assert not connection.info.get(querystats.START_TIMES_KEY)
+            connection.execute(text('SELECT 1'))
+        assert stats.count == 1
+        assert not connection.info.get(querystats.START_TIMES_KEY)
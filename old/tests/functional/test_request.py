@@ -0,0 +1,84 @@
+# Copyright 2016 Joel Dunham
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""Tests of the handling of the database session of a request by
+:class:`old.MyRequest`.
+"""
+
+import logging
+from unittest.mock import patch
+
+import pytest
+from sqlalchemy.exc import IntegrityError
+
+from old.models import Tag
+from old.tests import TestView
+from old.views.tags import Tags
+
+
+LOGGER = logging.getLogger(__name__)
+
+url = Tag._url(old_name=TestView.old_name)
+
+
+def add_tags(*names):
+    """Return a replacement of ``Tags.index`` that adds tags named ``names``
+    and flushes them.
+    """
+
+    def index(self):
+        self.request.dbsession.add_all([Tag(name=name) for name in names])
+        self.request.dbsession.flush()
+        return []
+
+    return index
+
+
+def add_tag_and_raise(self):
+    self.request.dbsession.add(Tag(name='raised'))
+    raise ValueError('the view failed')
+
+
+class TestRequest(TestView):
+
+    def get(self):
+        return self.app.get(url('index'), headers=self.json_headers,
+                            extra_environ=self.extra_environ_admin)
+
+    def count_tags(self, name):
+        self.dbsession.expire_all()
+        return self.dbsession.query(Tag).filter(Tag.name == name).count()
+
+    def test_close_dbsession(self):
+        """Tests that the changes of a request are committed, unless its view
+        raises, in which case they are rolled back, the view's exception is
+        the one raised and the thread's session remains usable.
+        """
+        with patch.object(Tags, 'index', add_tags('committed')):
+            self.get()
+        assert self.count_tags('committed') == 1
+
+        with patch.object(Tags, 'index', add_tag_and_raise):
+            with pytest.raises(ValueError):
+                self.get()
+        assert self.count_tags('raised') == 0
+
+        # The flush fails, so the session's transaction is inactive.
+        with patch.object(Tags, 'index', add_tags('duplicate', 'duplicate')):
+            with pytest.raises(IntegrityError):
+                self.get()
+        assert self.count_tags('duplicate') == 0
+
+        assert self.get().json_body
+        assert self.count_tags('committed') == 1
@@ -0,0 +1,200 @@
+# Copyright 2016 Joel Dunham
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""Tests of the cache of the responses of the index and search actions, cf.
+:mod:`old.lib.resultcache`.
+"""
+
+import datetime
+import json
+import logging
+
+from sqlalchemy import text
+
+from old.lib import resultcache
+import old.models as old_models
+import old.models.modelbuilders as omb
+from old.tests import (
+    TestView,
+    QueryCounter,
+    add_SEARCH_to_web_test_valid_methods,
+)
+
+
+LOGGER = logging.getLogger(__name__)
+
+url = old_models.Form._url(old_name=TestView.old_name)
+
+
+class TestResultCache(TestView):
+
+    def setUp(self):
+        super().setUp()
+        add_SEARCH_to_web_test_valid_methods()
+        self.set_registry_settings(result_cache_max_mb='1')
+        resultcache.RESULT_CACHE = None
+        self.dbsession.add(omb.generate_restricted_tag())
+        for index, form in enumerate(self.add_default_forms(3)):
+            form.translations = [old_models.Translation(
+                transcription='translation %d' % index, grammaticality='')]
+        self.dbsession.commit()
+
+    def tearDown(self):
+        resultcache.RESULT_CACHE = None
+        super().tearDown()
+
+    def search(self, query, environ=None, status=200):
+        return self.app.request(
+            url('search'), method='SEARCH',
+            body=json.dumps({'query': query}).encode('utf8'),
+            headers=self.json_headers,
+            environ=environ or self.extra_environ_admin, status=status)
+
+    @staticmethod
+    def get_cache_stats(response):
+        return dict(item.split('=') for item in
+                    response.headers['X-OLD-Result-Cache'].split('; '))
+
+    def test_search(self):
+        """Tests that identical searches are served from the cache until a
+        table that their results depend on is written.
+        """
+        query = {'filter': ['Form', 'transcription', 'like', 'form%']}
+        first = self.search(query)
+        assert self.get_cache_stats(first)['hit'] == '0'
+        second = self.search(query)
+        assert self.get_cache_stats(second)['hit'] == '1'
+        assert second.body == first.body
+        assert second.content_type == 'application/json'
+        # The headers set while searching are replayed.
+        assert second.headers['X-OLD-Search-Plan'] == \
+            first.headers['X-OLD-Search-Plan']
+        assert [f['transcription'] for f in second.json_body] == [
+            'form 0', 'form 1', 'form 2']
+
+        # Users of another restriction class do not share the entry.
+        response = self.search(query, self.extra_environ_view)
+        assert self.get_cache_stats(response)['hit'] == '0'
+
+        # Writing a table that forms do not depend on keeps the entry.
+        self.dbsession.add(old_models.Page(name='page', content='content'))
+        self.dbsession.commit()
+        assert self.get_cache_stats(self.search(query))['hit'] == '1'
+
+        # Writing a translation invalidates it.
+        translation = self.dbsession.query(old_models.Translation).filter(
+            old_models.Translation.transcription == 'translation 1').first()
+        translation.transcription = 'changed'
+        self.dbsession.commit()
+        response = self.search(query)
+        stats = self.get_cache_stats(response)
+        assert stats['hit'] == '0'
+        assert int(stats['stale']) == 1
+        assert response.json_body[1]['translations'][0]['transcription'] == \
+            'changed'
+
+        # A change that another process commits is noticed through the table
+        # watermarks.
+        resultcache.GENERATIONS.clear()
+        self.search(query)
+        assert self.get_cache_stats(self.search(query))['hit'] == '1'
+        self.dbsession.execute(
+            old_models.Form.__table__.delete().where(
+                old_models.Form.__table__.c.transcription == 'form 2'))
+        self.dbsession.commit()
+        resultcache.GENERATIONS.clear()
+        response = self.search(query)
+        assert self.get_cache_stats(response)['hit'] == '0'
+        assert len(response.json_body) == 2
+
+        # So is an association that another process adds.
+        form = self.dbsession.query(old_models.Form).filter(
+            old_models.Form.transcription == 'form 0').first()
+        tag = old_models.Tag(name='tag 1')
+        self.dbsession.add(tag)
+        self.dbsession.commit()
+        form_id, tag_id = form.id, tag.id
+        self.search(query)
+        assert self.get_cache_stats(self.search(query))['hit'] == '1'
+        now = datetime.datetime.utcnow()
+        self.dbsession.execute(text(
+            'INSERT INTO formtag (form_id, tag_id, datetime_modified)'
+            ' VALUES (:form_id, :tag_id, :now)'),
+            {'form_id': form_id, 'tag_id': tag_id, 'now': now})
+        self.dbsession.commit()
+        response = self.search(query)
+        assert self.get_cache_stats(response)['hit'] == '0'
+        assert response.json_body[0]['tags'][0]['name'] == 'tag 1'
+
+        # Errors are not cached.
+        response = self.search(['Form', 'transcription'], status=400)
+        assert 'X-OLD-Result-Cache' not in response.headers
+
+    def test_watermark(self):
+        """Tests that the watermark of the form tables reads the
+        datetime_modified values of the model tables but not those of the
+        (unindexed) association tables, and that responses are not cached
+        without a tombstone table.
+        """
+        tables = resultcache.get_dependent_tables('Form')
+        assert 'formtag' in tables
+        with QueryCounter() as counter:
+            resultcache.get_watermark(self.dbsession, tables)
+        statement = counter.statements[-1]
+        assert 'max(form.datetime_modified)' in statement
+        assert 'max(translation.datetime_modified)' in statement
+        assert 'formtag.datetime_modified' not in statement
+        assert 'formtag.id' in statement
+
+        table = old_models.Tombstone.__table__
+        engine = self.dbsession.bind
+        self.dbsession.close()
+        table.drop(bind=engine)
+        try:
+            assert resultcache.get_watermark(self.dbsession, tables) is None
+            self.dbsession.close()
+            query = {'filter': ['Form', 'transcription', 'like', 'form%']}
+            for _ in range(2):
+                response = self.search(query)
+                assert 'X-OLD-Result-Cache' not in response.headers
+                assert len(response.json_body) == 3
+        finally:
+            self.dbsession.close()
+            table.create(bind=engine)
+
+    def test_index(self):
+        """Tests that index responses are cached per paginator and that the
+        cache stays within its memory budget.
+        """
+        params = {'page': 1, 'items_per_page': 2}
+        response = self.app.get(url('index'), params, headers=self.json_headers,
+                                extra_environ=self.extra_environ_admin)
+        assert self.get_cache_stats(response)['hit'] == '0'
+        assert response.json_body['paginator']['count'] == 3
+        response = self.app.get(url('index'), params, headers=self.json_headers,
+                                extra_environ=self.extra_environ_admin)
+        assert self.get_cache_stats(response)['hit'] == '1'
+        assert len(response.json_body['items']) == 2
+        response = self.app.get(url('index'), {'page': 2, 'items_per_page': 2},
+                                headers=self.json_headers,
+                                extra_environ=self.extra_environ_admin)
+        stats = self.get_cache_stats(response)
+        assert stats['hit'] == '0'
+        assert stats['entries'] == '2'
+
+        cache = resultcache.RESULT_CACHE
+        cache.max_bytes = cache.bytes - 1
+        cache.put(('key',), (), b'x')
+        assert cache.bytes <= cache.max_bytes
+        assert cache.get_stats()['evictions'] >= 1
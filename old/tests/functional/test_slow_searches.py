@@ -0,0 +1,99 @@
+# Copyright 2016 Joel Dunham
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""Tests of the capture of slow searches (cf. :mod:`old.lib.slowsearch`) and
+of the slow searches view.
+"""
+
+import json
+import logging
+import os
+import shutil
+
+from old.lib import slowsearch
+import old.models as old_models
+from old.tests import TestView, add_SEARCH_to_web_test_valid_methods
+
+
+LOGGER = logging.getLogger(__name__)
+
+url = old_models.Form._url(old_name=TestView.old_name)
+
+
+class TestSlowSearches(TestView):
+
+    def setUp(self):
+        super().setUp()
+        add_SEARCH_to_web_test_valid_methods()
+        self.set_registry_settings(slow_search_threshold='0')
+        self.add_default_forms(5)
+        self.dbsession.commit()
+        self.log_path = slowsearch.get_log_path(self.registry_settings,
+                                                self.old_name)
+
+    def tearDown(self):
+        slowsearch.close_logs()
+        shutil.rmtree(os.path.dirname(self.log_path), ignore_errors=True)
+        super().tearDown()
+
+    def _search(self, query, status=200):
+        return self.app.request(
+            url('search'), method='SEARCH',
+            body=json.dumps(query).encode('utf8'), headers=self.json_headers,
+            environ=self.extra_environ_view, status=status)
+
+    def test_captures(self):
+        """Tests that slow searches are captured with their query, SQL,
+        phases and row counts and summarized by shape for administrators.
+        """
+        for value in ('form 1', 'form 2'):
+            self._search({'query': {'filter': [
+                'Form', 'transcription', '=', value]}})
+        self._search({'query': {'filter': [
+            'Form', 'transcription', 'like', 'form%']},
+                      'paginator': {'page': 1, 'items_per_page': 2}})
+        self._search({'query': {'filter': ['Form', 'nonexistent', '=', 1]}},
+                     status=400)
+
+        slowsearches_url = '/%s/slowsearches' % self.old_name
+        self.app.get(slowsearches_url, headers=self.json_headers,
+                     extra_environ=self.extra_environ_view, status=403)
+        summaries = self.app.get(slowsearches_url, headers=self.json_headers,
+                                 extra_environ=self.extra_environ_admin)\
+            .json_body
+        assert len(summaries) == 2
+        by_captures = {summary['captures']: summary for summary in summaries}
+        equals = by_captures[2]
+        assert equals['kind'] == 'search'
+        assert equals['model'] == 'Form'
+        assert equals['max_rows'] == 1
+        assert equals['slowest']['query']['query']['filter'][3] in (
+            'form 1', 'form 2')
+        assert equals['slowest']['shape_id'] == equals['shape_id']
+        assert "'form " in equals['slowest']['sql']
+        like = by_captures[1]
+        assert like['shape_id'] != equals['shape_id']
+        assert like['max_count'] == 5
+        assert like['max_rows'] == 2
+        assert like['slowest']['phases']['count'] > 0
+        assert like['slowest']['phases']['page'] > 0
+        assert like['slowest']['old_name'] == self.old_name
+        assert like['slowest']['user_id'] is not None
+
+        # An empty threshold disables the captures.
+        self.set_registry_settings(slow_search_threshold='')
+        self._search({'query': {'filter': [
+            'Form', 'transcription', '=', 'form 3']}})
+        assert len(slowsearch.get_captures(self.registry_settings,
+                                           self.old_name)) == 3
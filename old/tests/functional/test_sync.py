@@ -18,13 +18,16 @@ import json
 import logging
 import os
 from time import sleep
+from unittest.mock import patch
 from uuid import uuid4
 
+import pytest
 from sqlalchemy.sql import desc
 
 import old.lib.constants as oldc
 from old.lib.dbutils import DBUtils
 from old.lib.SQLAQueryBuilder import SQLAQueryBuilder
+import old.lib.sync as oldsync
 import old.models.modelbuilders as omb
 import old.models as old_models
 from old.tests import TestView
@@ -122,6 +125,29 @@ def human_diff(prev, curr):
     return diff
 
 
+class WebTestLeader:
+    """Adapts the test app to the interface of ``old.lib.sync.LeaderClient``.
+    """
+
+    def __init__(self, test):
+        self.test = test
+
+    def get_changes(self, since=None):
+        return self.test.app.get(
+            '/{}/sync/last_modified'.format(self.test.old_name),
+            {'since': since or ''}, headers=self.test.json_headers,
+            extra_environ=self.test.extra_environ_contrib).json_body
+
+    def iter_rows(self, tables):
+        response = self.test.app.post(
+            '/{}/sync/tables'.format(self.test.old_name),
+            json.dumps({'tables': tables, 'format': 'ndjson'}),
+            headers=self.test.json_headers,
+            extra_environ=self.test.extra_environ_contrib)
+        assert response.content_type == 'application/x-ndjson'
+        return oldsync.load_ndjson(response.body.splitlines())
+
+
 class TestSyncView(TestView):
 
     def __init__(self, *args, **kwargs):
@@ -419,3 +445,216 @@ class TestSyncView(TestView):
         previous_state['translation'].update(needed_state['translation'])
         previous_state['formbackup'].update(needed_state['formbackup'])
         assert previous_state == current_state
+
+    def create_forms(self, count):
+        ids = []
+        for i in range(count):
+            params = self.form_create_params.copy()
+            params.update({
+                'transcription': str(i),
+                'translations': [{'transcription': str(i),
+                                  'grammaticality': ''}]})
+            ids.append(self.app.post(
+                forms_url('create'), json.dumps(params), self.json_headers,
+                self.extra_environ_contrib).json_body['id'])
+        return ids
+
+    def update_form(self, form_id):
+        params = self.form_create_params.copy()
+        params.update({
+            'transcription': 'Updated!',
+            'translations': [{'transcription': 'updated',
+                              'grammaticality': ''}]})
+        self.app.put(forms_url('update', id=form_id), json.dumps(params),
+                     self.json_headers, self.extra_environ_contrib)
+
+    @patch.object(oldsync, 'WATERMARK_LAG', datetime.timedelta(0))
+    def test_since(self):
+        """Tests that ``GET /sync/last_modified?since=...`` returns only the
+        rows changed and deleted since the watermark and that
+        ``POST /sync/tables`` streams rows as NDJSON.
+        """
+        url = '/{}/sync/last_modified'.format(self.old_name)
+        application_settings = omb.generate_default_application_settings()
+        self.dbsession.add(application_settings)
+        self.dbsession.commit()
+        form_ids = self.create_forms(5)
+
+        changes = self.app.get(url, {'since': ''}, headers=self.json_headers,
+                               extra_environ=self.extra_environ_contrib
+                               ).json_body
+        assert sorted(changes['tables']['form']['changed']) == sorted(
+            map(str, form_ids))
+        assert changes['tables']['form']['deleted'] == []
+
+        self.update_form(form_ids[0])
+        self.app.delete(forms_url('delete', id=form_ids[1]),
+                        extra_environ=self.extra_environ_contrib)
+        changes = self.app.get(
+            url, {'since': changes['watermark']}, headers=self.json_headers,
+            extra_environ=self.extra_environ_contrib).json_body
+        tables = changes['tables']
+        assert list(tables['form']['changed']) == [str(form_ids[0])]
+        assert tables['form']['deleted'] == [form_ids[1]]
+        assert len(tables['formbackup']['changed']) == 2
+        # The updated form's previous translation was deleted too.
+        assert len(tables['translation']['changed']) == 1
+        assert len(tables['translation']['deleted']) == 2
+        assert not tables['user']['changed']
+
+        # Nothing has changed since the latest watermark.
+        changes = self.app.get(
+            url, {'since': changes['watermark']}, headers=self.json_headers,
+            extra_environ=self.extra_environ_contrib).json_body
+        assert not any(delta['changed'] or delta['deleted']
+                       for delta in changes['tables'].values())
+
+        resp = self.app.get(url, {'since': 'yesterday'},
+                            headers=self.json_headers, status=400,
+                            extra_environ=self.extra_environ_contrib).json_body
+        assert 'Invalid watermark' in resp['error']
+
+        rows = list(WebTestLeader(self).iter_rows({'form': form_ids}))
+        assert [(table, row['id']) for table, row in rows] == [
+            ('form', id_) for id_ in form_ids if id_ != form_ids[1]]
+        assert rows[0][1]['transcription'] == 'Updated!'
+        rows = list(WebTestLeader(self).iter_rows('*'))
+        assert len([row for table, row in rows if table == 'form']) == 4
+        resp = self.app.post(
+            '/{}/sync/tables'.format(self.old_name),
+            json.dumps({'tables': {'form': ['1']}, 'format': 'ndjson'}),
+            headers=self.json_headers, status=400,
+            extra_environ=self.extra_environ_contrib).json_body
+        assert 'integers' in resp['error']
+
+    def test_missing_tombstone_table(self):
+        """Tests that forms can be deleted from a database without a
+        tombstone table, e.g., one created before it, that the table is only
+        looked for once and that deletions are recorded once it exists.
+        """
+        application_settings = omb.generate_default_application_settings()
+        self.dbsession.add(application_settings)
+        self.dbsession.commit()
+        form_ids = self.create_forms(3)
+        table = old_models.Tombstone.__table__
+        engine = self.dbsession.bind
+        self.dbsession.close()
+        table.drop(bind=engine)
+        assert not oldsync.has_tombstone_table(engine)
+        # As if this process had started without the table.
+        oldsync._TOMBSTONE_TABLES.clear()
+        try:
+            with self.assertLogs('old.lib.sync', 'WARNING') as logs:
+                for form_id in form_ids[:2]:
+                    self.app.delete(forms_url('delete', id=form_id),
+                                    extra_environ=self.extra_environ_contrib)
+            assert len(logs.output) == 1
+        finally:
+            table.create(bind=engine)
+        self.app.delete(forms_url('delete', id=form_ids[2]),
+                        extra_environ=self.extra_environ_contrib)
+        assert [tombstone.row_id for tombstone in self.dbsession.query(
+            old_models.Tombstone).filter(
+                old_models.Tombstone.table_name == 'form')] == [form_ids[2]]
+
+    @patch.object(oldsync, 'WATERMARK_LAG', datetime.timedelta(0))
+    def test_tombstone_retention(self):
+        """Tests that old tombstones are pruned and that a watermark older
+        than the tombstones kept gets every row and the ``full_sync`` flag.
+        """
+        url = '/{}/sync/last_modified'.format(self.old_name)
+        application_settings = omb.generate_default_application_settings()
+        self.dbsession.add(application_settings)
+        self.dbsession.commit()
+        form_ids = self.create_forms(3)
+        self.app.delete(forms_url('delete', id=form_ids[0]),
+                        extra_environ=self.extra_environ_contrib)
+        tombstone = old_models.Tombstone.__table__
+        long_ago = datetime.datetime.utcnow() - datetime.timedelta(days=100)
+        self.dbsession.execute(tombstone.update().values(
+            datetime_deleted=long_ago))
+        self.dbsession.commit()
+
+        changes = self.app.get(
+            url, {'since': oldsync.date_string(long_ago)},
+            headers=self.json_headers,
+            extra_environ=self.extra_environ_contrib).json_body
+        assert changes['full_sync']
+        assert sorted(changes['tables']['form']['changed']) == sorted(
+            map(str, form_ids[1:]))
+        changes = self.app.get(
+            url, {'since': changes['watermark']}, headers=self.json_headers,
+            extra_environ=self.extra_environ_contrib).json_body
+        assert not changes['full_sync']
+        assert not changes['tables']['form']['changed']
+
+        # The next delete prunes the old tombstones.
+        oldsync._LAST_PRUNED.clear()
+        self.app.delete(forms_url('delete', id=form_ids[1]),
+                        extra_environ=self.extra_environ_contrib)
+        assert [tuple(row) for row in self.dbsession.execute(
+            tombstone.select().with_only_columns([
+                tombstone.c.table_name, tombstone.c.row_id]).where(
+                    tombstone.c.table_name == 'form'))] == [
+                        ('form', form_ids[1])]
+        assert oldsync.prune_tombstones(self.dbsession.connection()) == 0
+
+    @patch.object(oldsync, 'WATERMARK_LAG', datetime.timedelta(0))
+    def test_follower(self):
+        """Tests that a follower that applies the leader's deltas ends up with
+        the leader's rows, and that applying them again changes nothing.
+        """
+        if not self.Session2:
+            pytest.skip('A second test OLD is needed.')
+        application_settings = omb.generate_default_application_settings()
+        self.dbsession.add(application_settings)
+        self.dbsession.commit()
+        form_ids = self.create_forms(5)
+        follower = oldsync.Follower(self.dbsession2, WebTestLeader(self),
+                                    page_size=4)
+
+        def assert_synchronized():
+            leader_state = oldsync.get_last_modified(
+                self.dbsession.connection())
+            follower_state = oldsync.get_last_modified(
+                self.dbsession2.connection())
+            assert leader_state == follower_state
+            self.dbsession.commit()
+            self.dbsession2.commit()
+
+        watermark = follower.sync()
+        assert follower.stats['form'] == {'deleted': 0, 'upserted': 5}
+        assert_synchronized()
+
+        self.update_form(form_ids[0])
+        self.app.delete(forms_url('delete', id=form_ids[1]),
+                        extra_environ=self.extra_environ_contrib)
+        changes = WebTestLeader(self).get_changes(watermark)
+        next_watermark = follower.sync(since=watermark)
+        assert follower.stats['form'] == {'deleted': 1, 'upserted': 1}
+        assert_synchronized()
+        assert self.dbsession2.query(old_models.Form).get(
+            form_ids[0]).transcription == 'Updated!'
+
+        # Re-applying the same deltas is harmless.
+        oldsync.apply_deltas(
+            self.dbsession2.connection(), changes,
+            WebTestLeader(self).iter_rows({
+                tname: [int(id_) for id_ in delta['changed']]
+                for tname, delta in changes['tables'].items()}))
+        self.dbsession2.commit()
+        assert_synchronized()
+        assert next_watermark != watermark
+
+        # A follower whose watermark is older than the leader's tombstones
+        # resynchronizes fully, so deletions are not missed.
+        self.app.delete(forms_url('delete', id=form_ids[2]),
+                        extra_environ=self.extra_environ_contrib)
+        oldsync.prune_tombstones(self.dbsession.connection(),
+                                 datetime.datetime.utcnow())
+        self.dbsession.commit()
+        with patch.object(oldsync, 'TOMBSTONE_RETENTION',
+                          datetime.timedelta(0)):
+            follower.sync(since=next_watermark)
+        assert follower.stats['form']['deleted'] == 1
+        assert_synchronized()
@@ -436,3 +436,81 @@ class TestSyntacticcategoriesView(TestView):
         assert chien.syntactic_category_string == '?'
         assert chiens.syntactic_category_string == '?-?'
         assert json.loads(chiens.morpheme_break_ids)[0][0][0][2] is None
+
+    def test_category_percolation_as_set(self):
+        """Tests that renaming a category percolates the change to the forms
+        containing any of its lexical items in one set-based pass whose
+        statistics are returned in the ``X-OLD-Percolation`` header.
+        """
+        dbsession = self.dbsession
+        application_settings = omb.generate_default_application_settings()
+        dbsession.add(application_settings)
+        dbsession.commit()
+        extra_environ = {'test.authentication.role': 'administrator',
+                         'test.application_settings': True}
+
+        def create(url_, params):
+            return self.app.post(url_('create'), json.dumps(params),
+                                 self.json_headers, extra_environ).json_body
+
+        N_id = create(url, {'name': 'N', 'type': 'lexical',
+                            'description': ''})['id']
+        V_id = create(url, {'name': 'V', 'type': 'lexical',
+                            'description': ''})['id']
+        nouns = [('chien', 'dog'), ('chat', 'cat'), ('oiseau', 'bird')]
+        for mb, mg in nouns:
+            params = self.form_create_params.copy()
+            params.update({
+                'transcription': mb, 'morpheme_break': mb,
+                'morpheme_gloss': mg, 'syntactic_category': N_id,
+                'translations': [{'transcription': mg, 'grammaticality': ''}]})
+            create(fm_url, params)
+        params = self.form_create_params.copy()
+        params.update({
+            'transcription': 'mange', 'morpheme_break': 'mange',
+            'morpheme_gloss': 'eat', 'syntactic_category': V_id,
+            'translations': [{'transcription': 'eat', 'grammaticality': ''}]})
+        create(fm_url, params)
+        phrase_ids = []
+        for mb, mg in nouns:
+            params = self.form_create_params.copy()
+            params.update({
+                'transcription': '%s mange' % mb,
+                'morpheme_break': '%s-s mange' % mb,
+                'morpheme_gloss': '%s-PL eat' % mg,
+                'translations': [{'transcription': mg,
+                                  'grammaticality': ''}]})
+            resp = create(fm_url, params)
+            assert resp['syntactic_category_string'] == 'N-? V'
+            phrase_ids.append(resp['id'])
+        unrelated_id = create(fm_url, dict(
+            self.form_create_params, transcription='mange-s',
+            morpheme_break='mange-s', morpheme_gloss='eat-PL',
+            translations=[{'transcription': 'eats',
+                           'grammaticality': ''}]))['id']
+
+        response = self.app.put(
+            url('update', id=N_id),
+            json.dumps({'name': 'Noun', 'type': 'lexical', 'description': ''}),
+            self.json_headers, extra_environ)
+        stats = dict(item.split('=') for item in
+                     response.headers['X-OLD-Percolation'].split('; '))
+        assert stats['lexical_items'] == '3'
+        assert stats['forms'] == '6'
+        assert stats['updated'] == '6'
+        assert float(stats['find_ms']) >= 0
+        for form in dbsession.query(old_models.Form).filter(
+                old_models.Form.id.in_(phrase_ids)).all():
+            assert form.syntactic_category_string == 'Noun-? V'
+            assert form.break_gloss_category.split(' ')[1] == 'mange|eat|V'
+            assert json.loads(form.morpheme_gloss_ids)[0][0][0][2] == 'Noun'
+        unrelated = dbsession.query(old_models.Form).get(unrelated_id)
+        assert unrelated.syntactic_category_string == 'V-?'
+
+        # Updating the description alone percolates nothing.
+        response = self.app.put(
+            url('update', id=N_id),
+            json.dumps({'name': 'Noun', 'type': 'lexical',
+                        'description': 'Nouns'}),
+            self.json_headers, extra_environ)
+        assert 'X-OLD-Percolation' not in response.headers
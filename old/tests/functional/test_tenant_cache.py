@@ -0,0 +1,172 @@
+# Copyright 2016 Joel Dunham
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""Tests of the process-level cache of per-OLD data, cf.
+:mod:`old.lib.tenantcache`.
+"""
+
+import datetime
+import logging
+from unittest.mock import patch
+
+from sqlalchemy import create_engine, text
+
+from old.lib.dbutils import DBUtils
+from old.lib import tenantcache
+from old.models import ApplicationSettings, Tag
+import old.models.modelbuilders as omb
+from old.tests import TestView, QueryCounter
+
+
+LOGGER = logging.getLogger(__name__)
+
+
+class TestTenantCache(TestView):
+
+    def setUp(self):
+        super().setUp()
+        tenantcache.invalidate()
+        self.contributor = self.dbsession.query(omb.old_models.User).filter(
+            omb.old_models.User.role == 'contributor').first()
+        application_settings = omb.generate_default_application_settings(
+            unrestricted_users=[self.contributor])
+        application_settings.orthographic_validation = 'Error'
+        application_settings.storage_orthography = \
+            omb.generate_default_orthography1()
+        self.dbsession.add_all([application_settings,
+                                omb.generate_restricted_tag()])
+        self.dbsession.commit()
+
+    def get_db(self):
+        return DBUtils(self.dbsession, self.settings)
+
+    def test_revalidation(self):
+        """Tests that the cached data are reused for as long as their
+        watermarks are unchanged and are reloaded when they change.
+        """
+        db = self.get_db()
+        tenant_data = db.tenant_data
+        assert db.get_object_language_id() == 'uns'
+        assert db.get_morpheme_delimiters() == ['-', '=']
+        assert db.get_unrestricted_user_ids() == {self.contributor.id}
+        assert db.get_restricted_tag().name == 'restricted'
+        assert db.get_foreign_word_tag() is None
+        assert db.current_app_set.id == db.app_settings.id
+        inventory = db.get_transcription_inventory('orthographic')
+        assert inventory.string_is_valid('pt km.')
+        assert not inventory.string_is_valid('bad')
+
+        # A new DBUtils (i.e., a new request) uses the recently validated
+        # data without a query.
+        db = self.get_db()
+        with QueryCounter() as counter:
+            assert db.tenant_data is tenant_data
+            assert db.get_unrestricted_user_ids() == {self.contributor.id}
+            assert db.get_transcription_inventory('orthographic') is inventory
+        assert counter.count == 0
+
+        # Once the TTL has passed, it revalidates them with a single query.
+        with patch.object(tenantcache, 'WATERMARK_TTL', 0):
+            db = self.get_db()
+            with QueryCounter() as counter:
+                assert db.tenant_data is tenant_data
+                assert db.get_unrestricted_user_ids() == {
+                    self.contributor.id}
+            assert counter.count == 1
+
+        # A change made by another process, i.e., as a plain SQL string that
+        # this process does not inspect, is noticed through the watermarks
+        # after the TTL.
+        self.dbsession.execute(text(
+            "UPDATE applicationsettings SET object_language_id = 'xyz',"
+            " datetime_modified = :now"), {'now': datetime.datetime.utcnow()})
+        self.dbsession.commit()
+        assert not tenant_data.invalidated
+        assert self.get_db().tenant_data is tenant_data
+        tenant_data.validated -= tenantcache.WATERMARK_TTL
+        db = self.get_db()
+        assert db.tenant_data is not tenant_data
+        assert db.get_object_language_id() == 'xyz'
+
+        # A statement of this process invalidates the data at once.
+        tenant_data = db.tenant_data
+        self.dbsession.execute(ApplicationSettings.__table__.update().values(
+            object_language_id='abc'))
+        assert tenant_data.invalidated
+        self.dbsession.commit()
+        assert self.get_db().get_object_language_id() == 'abc'
+
+    def test_tenant_key(self):
+        """Tests that OLDs are keyed by their full database URL, so that
+        databases with the same name are not confused.
+        """
+        key = tenantcache.get_tenant_key(self.dbsession)
+        assert key == tenantcache.get_tenant_key(self.dbsession.get_bind())
+        assert key.startswith('sqlite')
+        keys = {tenantcache.get_tenant_key(create_engine(
+            'sqlite:////tmp/%s/old.sqlite' % directory))
+                for directory in ('old1', 'old2')}
+        assert len(keys) == 2
+
+    def test_invalidation(self):
+        """Tests that writes of tags, application settings and foreign word
+        forms invalidate the cached data.
+        """
+        db = self.get_db()
+        tenant_data = db.tenant_data
+        assert db.get_foreign_word_tag_id() is None
+
+        foreign_word_tag = omb.generate_foreign_word_tag()
+        self.dbsession.add(foreign_word_tag)
+        self.dbsession.flush()
+        assert tenant_data.invalidated
+        assert db.get_foreign_word_tag_id() == foreign_word_tag.id
+        self.dbsession.commit()
+
+        # A foreign word adds its transcription to the inventory.
+        tenant_data = db.tenant_data
+        assert not db.get_transcription_inventory(
+            'orthographic').string_is_valid('Jöhn pt')
+        form = omb.generate_default_form()
+        form.transcription = 'Jöhn'
+        form.tags = [foreign_word_tag]
+        self.dbsession.add(form)
+        self.dbsession.commit()
+        assert tenant_data.invalidated
+        assert db.foreign_word_transcriptions.orthographic == ['Jöhn']
+        assert db.get_transcription_inventory(
+            'orthographic').string_is_valid('Jöhn pt')
+
+        # Writing other forms does not.
+        tenant_data = db.tenant_data
+        self.dbsession.add(omb.generate_default_form())
+        self.dbsession.commit()
+        assert not tenant_data.invalidated
+
+        self.dbsession.delete(form)
+        self.dbsession.commit()
+        assert tenant_data.invalidated
+        assert db.foreign_word_transcriptions.orthographic == []
+
+        tenant_data = db.tenant_data
+        app_set = db.current_app_set
+        app_set.unrestricted_users = []
+        self.dbsession.commit()
+        assert tenant_data.invalidated
+        assert db.get_unrestricted_user_ids() == frozenset()
+        assert not db.user_is_unrestricted(self.contributor)
+
+        self.dbsession.query(Tag).filter(Tag.name == 'restricted').delete()
+        self.dbsession.commit()
+        assert self.get_db().user_is_unrestricted(self.contributor)
@@ -61,7 +61,7 @@ class Applicationsettings(Resources):
         """
         LOGGER.info('Reading all %s', self.hmn_member_name)
         return self._eagerload_model(
-            self.request.dbsession.query(self.model_cls)).order_by(
+            self.request.dbsession.query(self.model_cls), 'index').order_by(
                 asc(self.model_cls.id)).all()
 
     def _get_new_edit_collections(self):
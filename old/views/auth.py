@@ -100,7 +100,7 @@ def email_reset_password(request):
     """
     LOGGER.info('Request for a password reset.')
     schema = PasswordResetSchema()
-    if request.registry.settings.get('readonly') == '1':
+    if request.settings.get('readonly') == '1':
         LOGGER.warning('Attempt to reset a password in read-only mode')
         request.response.status_int = 403
         return READONLY_MODE_MSG
@@ -122,7 +122,7 @@ def email_reset_password(request):
         User.username == username).first()
     if username is not None and user is not None:
         new_password = h.generate_password()
-        app_url = request.route_url('info', old_name=request.registry.settings['old_name'])
+        app_url = request.route_url('info', old_name=request.settings['old_name'])
         salt = user.salt
         if isinstance(salt, str):
             salt = salt.encode('utf8')
@@ -138,7 +138,7 @@ def email_reset_password(request):
         else:
             try:
                 h.send_password_reset_email_to(
-                    user, new_password, request.registry.settings, app_url)
+                    user, new_password, request.settings, app_url)
             except (h.OLDSendEmailError, KeyError, SMTPException,
                     ConnectionRefusedError) as exc:
                 request.dbsession.rollback()
@@ -146,7 +146,7 @@ def email_reset_password(request):
                 LOGGER.warning(exc)
                 return {'error': 'The server is unable to send email.'}
             else:
-                if request.registry.settings.get('testing', '0') == '1':
+                if request.settings.get('testing', '0') == '1':
                     return {'valid_username': True, 'password_reset': True,
                             'new_password': new_password}
                 return {'valid_username': True, 'password_reset': True}
@@ -18,6 +18,7 @@
    :synopsis: Contains the collections view and its auxiliary functions.
 """
 
+from collections import OrderedDict
 import datetime
 import logging
 import re
@@ -266,9 +267,9 @@ class Collections(Resources):
         """Ensure that only authorized users can access the provided
         ``resource_model``.
         """
-        unrestricted_users = self.db.get_unrestricted_users()
+        unrestricted_user_ids = self.db.get_unrestricted_user_ids()
         if not self.logged_in_user.is_authorized_to_access_model(
-                resource_model, unrestricted_users):
+                resource_model, unrestricted_user_ids):
             return True
         return False
 
@@ -437,9 +438,8 @@ class Collections(Resources):
             collection.contents, collections_referenced)
         collection.html = h.get_HTML_from_contents(
             collection.contents_unpacked, collection.markup_language)
-        collection.forms = [self.request.dbsession.query(Form).get(int(id))
-                            for id in
-                            FORM_REFERENCE_PATTERN.findall(
+        collection.forms = [self.request.dbsession.query(Form).get(id)
+                            for id in _get_form_ids(
                                 collection.contents_unpacked)]
 
     def _update_collections_that_reference_this_collection(self, collection,
@@ -599,12 +599,19 @@ def _add_form_ids_list_to_values(values):
     :returns: ``values`` with a ``'forms'`` key whose value is a list of id
         integers.
     """
-    contents_unpacked = get_str('contents_unpacked', values)
-    values['forms'] = [int(id) for id in
-                       FORM_REFERENCE_PATTERN.findall(contents_unpacked)]
+    values['forms'] = _get_form_ids(get_str('contents_unpacked', values))
     return values
 
 
+def _get_form_ids(contents_unpacked):
+    """Return the ids of the forms referenced in ``contents_unpacked``, each
+    once (a form may be referenced by several of the collections expanded in
+    it), in order of first reference.
+    """
+    return list(OrderedDict.fromkeys(
+        int(id_) for id_ in FORM_REFERENCE_PATTERN.findall(contents_unpacked)))
+
+
 def _add_contents_unpacked_to_values(values, collections_referenced):
     """Add a ``'contents_unpacked'`` value to values and return values.
     :param dict values: data for creating a collection.
@@ -4,33 +4,45 @@
    :synopsis: Contains the corpora controller and its auxiliary functions.
 """
 
-import codecs
 from collections import defaultdict
 import datetime
 import json
 import logging
 import os
 from shutil import rmtree
-from subprocess import call, Popen
+from subprocess import Popen
 from uuid import uuid4
 
 from formencode.validators import Invalid
 from pyramid.response import FileResponse
 
 import old.lib.constants as oldc
+from old.lib.corpusexport import (
+    CorpusFileWriter,
+    export_is_pending,
+    get_corpus_directory_path,
+    get_corpus_filename,
+    get_export_mode,
+)
 from old.lib.dbutils import (
     add_pagination,
     eagerload_form,
     _filter_restricted_models_from_query,
 )
 import old.lib.helpers as h
+from old.lib.jobs import enqueue_job
 from old.models import (
     Form,
     CorpusBackup
 )
 from old.models.corpus import CorpusFile
 from old.lib.schemata import CorpusFormatSchema
-from old.lib.SQLAQueryBuilder import SQLAQueryBuilder, OLDSearchParseError
+from old.lib.slowsearch import capture_search
+from old.lib.SQLAQueryBuilder import (
+    get_shape_id as get_shape_id_of_key,
+    OLDSearchParseError,
+    SQLAQueryBuilder
+)
 from old.views.resources import (
     Resources,
     SchemaState
@@ -76,7 +88,7 @@ class Corpora(Resources):
             self._forms_query_builder = SQLAQueryBuilder(
                 self.request.dbsession,
                 'Form',
-                settings=self.request.registry.settings)
+                settings=self.request.settings)
         return self._forms_query_builder
 
     ###########################################################################
@@ -137,6 +149,12 @@ class Corpora(Resources):
             self.request.response.status_int = 400
             LOGGER.warning(oldc.JSONDecodeErrorResponse)
             return oldc.JSONDecodeErrorResponse
+        return self._capture_search(
+            'corpus_search', python_search_params,
+            lambda: self._search_corpus(corpus, python_search_params),
+            self.forms_query_builder)
+
+    def _search_corpus(self, corpus, python_search_params):
         try:
             query = eagerload_form(
                 self.forms_query_builder.get_SQLA_query(
@@ -157,8 +175,16 @@ class Corpora(Resources):
         if not self.db.user_is_unrestricted(user):
             query = _filter_restricted_models_from_query(
                 'Form', query, user)
-        LOGGER.info('Search over the forms in corpus %s complete.', id_)
-        return add_pagination(query, python_search_params.get('paginator'))
+        try:
+            result = add_pagination(
+                query, python_search_params.get('paginator'))
+        except Invalid as error:  # For paginator schema errors.
+            self.request.response.status_int = 400
+            errors = error.unpack_errors()
+            LOGGER.warning(errors)
+            return {'errors': errors}
+        LOGGER.info('Search over the forms in corpus %s complete.', corpus.id)
+        return result
 
     def new_searchx(self):
         """Return the data necessary to search across the form resources within
@@ -209,13 +235,17 @@ class Corpora(Resources):
         """Write the corpus to a file in the format specified in the request
         body.
         :URL: ``PUT /corpora/id/writetofile``
-        :Request body: JSON object of the form ``{"format": "..."}.``
+        :Request body: JSON object of the form ``{"format": "..."}``, with an
+            optional ``"mode"``: "sync" or "async" (the default is the
+            ``corpus_export_mode`` setting). In the async mode, the file is
+            written by a background job and the corpus's ``files`` entry for
+            it reports the job's ``status`` and progress.
         :param str id: the ``id`` value of the corpus.
         :returns: the modified corpus model (or a JSON error message).
         """
         corpus, id_ = self._model_from_id()
         LOGGER.info('Attempting to write corpus %s to a file on disk', id_)
-        if self.request.registry.settings.get('readonly') == '1':
+        if self.request.settings.get('readonly') == '1':
             LOGGER.warning('Attempt to write a corpus to file in read-only mode')
             self.request.response.status_int = 403
             return oldc.READONLY_MODE_MSG
@@ -232,13 +262,15 @@ class Corpora(Resources):
             LOGGER.warning(oldc.JSONDecodeErrorResponse)
             return oldc.JSONDecodeErrorResponse
         try:
-            format_ = schema.to_python(values)['format']
+            values = schema.to_python(values)
         except Invalid as error:
             self.request.response.status_int = 400
             errors = error.unpack_errors()
             LOGGER.warning(errors)
             return {'errors': errors}
-        return self._write_to_file(corpus, format_)
+        mode = values['mode'] or get_export_mode(
+            self.request.settings)
+        return self._write_to_file(corpus, values['format'], mode)
 
     def servefile(self):
         """Return the corpus as a file in the format specified in the URL query
@@ -335,6 +367,20 @@ class Corpora(Resources):
                    ' string value')
             LOGGER.warning(msg)
             return {'errors': {'tgrep2pattern': msg}}
+
+        def get_shape_id():
+            return get_shape_id_of_key((json.dumps(
+                [tgrep2pattern, request_params.get('order_by')]),))
+
+        return capture_search(
+            self.request, 'tgrep2', 'Form', request_params,
+            lambda: self._tgrep2(corpus, corpus_dir_path,
+                                 tgrep2_corpus_file_path, tgrep2pattern,
+                                 request_params),
+            get_shape_id)
+
+    def _tgrep2(self, corpus, corpus_dir_path, tgrep2_corpus_file_path,
+                tgrep2pattern, request_params):
         tmp_path = os.path.join(
             corpus_dir_path,
             '%s%s.txt' % (self.logged_in_user.username, h.generate_salt()))
@@ -368,10 +414,12 @@ class Corpora(Resources):
         elif request_params.get('paginator'):
             paginator = request_params['paginator']
             paginator['count'] = 0
+            if 'cursor' in paginator:
+                paginator['next_cursor'] = None
             result = {'paginator': paginator, 'items': []}
         else:
             result = []
-        LOGGER.info('Searched corpus %d using Tgrep2', id_)
+        LOGGER.info('Searched corpus %d using Tgrep2', corpus.id)
         return result
 
     ###########################################################################
@@ -454,7 +502,7 @@ class Corpora(Resources):
             full_dict=values,
             db=self.db,
             logged_in_user=self.logged_in_user,
-            settings=self.request.registry.settings)
+            settings=self.request.settings)
 
     ###########################################################################
     # Corpus-specific Private Methods
@@ -465,14 +513,13 @@ class Corpora(Resources):
         user = self.logged_in_user
         if (    corpus_file.restricted and
                 user.role != 'administrator' and
-                user not in self.db.get_unrestricted_users()):
+                user.id not in self.db.get_unrestricted_user_ids()):
             return False
         return True
 
     def _get_corpus_dir_path(self, corpus):
-        return os.path.join(
-            h.get_old_directory_path('corpora', self.request.registry.settings),
-            'corpus_%d' % corpus.id)
+        return get_corpus_directory_path(corpus.id,
+                                         self.request.settings)
 
     def _remove_corpus_directory(self, corpus):
         """Remove the directory of the corpus model and everything in it.
@@ -507,124 +554,97 @@ class Corpora(Resources):
                     result[category_sequence].append(form.id)
         return sorted(result.items(), key=lambda t: len(t[1]), reverse=True)
 
-    def _write_to_file(self, corpus, format_):
+    def _write_to_file(self, corpus, format_, mode):
         """Write the corpus to file in the specified format.
-        Write the corpus to a binary file, create or update a corpus file model
-        and associate it to the corpus model (if necessary).
+        Write the corpus to a file (plus its gzipped copy), create or update a
+        corpus file model and associate it to the corpus model (if
+        necessary), cf. :mod:`old.lib.corpusexport`.
         :param corpus: a corpus model.
         :param str format_: the format of the file to be written.
+        :param str mode: 'sync' to write the file within this request, 'async'
+            to have a background job write it; the corpus file's ``status``
+            and ``forms_written`` values then report on the job's progress.
         :returns: the corpus modified appropriately (assuming success)
-        :side effects: may write (a) file(s) to disk and update/create a corpus
-            file model.
-        .. note::
-            It may be desirable/necessary to perform the corpus file writing
-            asynchronously using a dedicated corpus-file-worker.
+        :side effects: may write (a) file(s) to disk (or enqueue a job that
+            will) and update/create a corpus file model.
         """
-        def error_msg(msg):
-            return {
-                'error': 'Unable to write corpus %d to file with format "%s".'
-                         ' (%s)' % (corpus.id, format_, msg)}
-        def update_corpus_file(corpus, filename, modifier, datetime_modified,
-                               restricted):
-            """Update the corpus file model of ``corpus`` that matches
-            ``filename``.
-            """
-            corpus_file = [cf for cf in corpus.files if
-                           cf.filename == filename][0]
-            corpus_file.restricted = restricted
-            corpus_file.modifier = modifier
-            corpus_file.datetime_modified = corpus.datetime_modified = \
-                datetime_modified
-        def generate_new_corpus_file(*args):
-            """Create a corpus file model with ``filename`` and append it to
-            ``corpus.files``.
-            """
-            (corpus, filename, format_, creator, datetime_created,
-             restricted) = args
-            corpus_file = CorpusFile()
-            corpus_file.restricted = restricted
-            corpus.files.append(corpus_file)
-            corpus_file.filename = filename
-            corpus_file.format = format_
-            corpus_file.creator = corpus_file.modifier = creator
-            corpus_file.datetime_created = corpus_file.datetime_modified = \
-                datetime_created
-            corpus.datetime_modified = datetime_created
-        def destroy_file(file_path):
-            try:
-                rmtree(file_path)
-            except Exception:
-                pass
-        corpus_file_path = self._get_corpus_file_path(corpus, format_)
-        update = os.path.exists(corpus_file_path)  # If True, we are upating
-        restricted = False
-        # Create the corpus file on the filesystem
+        corpus_filename = get_corpus_filename(corpus.id, format_)
         try:
-            writer = oldc.CORPUS_FORMATS[format_]['writer']
-            if corpus.form_search:  # ``form_search`` value negates any content.
-                with codecs.open(corpus_file_path, 'w', 'utf8') as file_:
-                    for form in corpus.forms:
-                        if (    not restricted and
-                                'restricted' in [t.name for t in form.tags]):
-                            restricted = True
-                        file_.write(writer(form))
-            else:
-                form_references = corpus.get_form_references(corpus.content)
-                forms = {f.id: f for f in corpus.forms}
-                with codecs.open(corpus_file_path, 'w', 'utf8') as file_:
-                    for id_ in form_references:
-                        form = forms[id_]
-                        if (    not restricted and
-                                'restricted' in [t.name for t in form.tags]):
-                            restricted = True
-                        file_.write(writer(form))
-            gzipped_corpus_file_path = h.compress_file(corpus_file_path)
-            _create_tgrep2_corpus_file(gzipped_corpus_file_path, format_)
-        except Exception as error:
-            destroy_file(corpus_file_path)
-            self.request.response.status_int = 400
-            error = error_msg(error)
-            LOGGER.warning(error['error'])
-            return error
-        # Update/create the corpus_file object
+            corpus_file = [cf for cf in corpus.files if
+                           cf.filename == corpus_filename][0]
+        except IndexError:
+            corpus_file = None
+        if mode == 'async':
+            return self._enqueue_write_to_file(corpus, corpus_file,
+                                               corpus_filename, format_)
+        settings = self.request.settings
         try:
-            now = h.now()
-            user = self.logged_in_user
-            corpus_filename = os.path.split(corpus_file_path)[1]
-            if update:
-                try:
-                    update_corpus_file(corpus, corpus_filename, user, now,
-                                       restricted)
-                except Exception:
-                    generate_new_corpus_file(corpus, corpus_filename, format_,
-                                             user, now, restricted)
-            else:
-                generate_new_corpus_file(corpus, corpus_filename, format_,
-                                         user, now, restricted)
+            writer = CorpusFileWriter(
+                self.request.dbsession, settings, corpus.id, format_)
+            result = writer.run()
         except Exception as error:
-            destroy_file(corpus_file_path)
             self.request.response.status_int = 400
-            error = error_msg(error)
-            LOGGER.warning(error['error'])
-            return error
+            msg = ('Unable to write corpus %d to file with format "%s".'
+                   ' (%s)' % (corpus.id, format_, error))
+            LOGGER.warning(msg)
+            return {'error': msg}
+        now = h.now()
+        user = self.logged_in_user
+        if corpus_file is None:
+            corpus_file = self._new_corpus_file(corpus, corpus_filename,
+                                                format_, user, now)
+        corpus_file.restricted = result['restricted']
+        corpus_file.modifier = user
+        corpus_file.datetime_modified = corpus.datetime_modified = now
+        corpus_file.status = 'ready'
+        corpus_file.forms_written = result['forms_written']
+        corpus_file.forms_total = writer.forms_total
+        corpus_file.message = None
         LOGGER.info('Wrote corpus %s to a file on disk', corpus.id)
         self.request.dbsession.flush()
         return corpus
 
-    def _get_corpus_file_path(self, corpus, format_):
-        """Return the path to a corpus's file of the given format.
-        :param corpus: a corpus model object.
-        :param str format_: the format for writing the corpus file.
-        :returns: an absolute path to the corpus's file.
-        .. note::
+    def _enqueue_write_to_file(self, corpus, corpus_file, corpus_filename,
+                               format_):
+        """Queue a ``write_corpus_file`` job that writes the corpus to file in
+        the specified format, unless such a job is already pending (a job
+        whose export has stalled, e.g., because its process died, is not).
+        """
+        user = self.logged_in_user
+        if corpus_file is None:
+            corpus_file = self._new_corpus_file(
+                corpus, corpus_filename, format_, user, h.now())
+        elif export_is_pending(corpus_file):
+            LOGGER.info('Corpus %s is already being written to file %s',
+                        corpus.id, corpus_filename)
+            return corpus
+        corpus_file.status = 'queued'
+        corpus_file.datetime_modified = h.now()
+        corpus_file.forms_written = 0
+        corpus_file.message = None
+        self.request.dbsession.flush()
+        enqueue_job(self.request, 'write_corpus_file', {
+            'corpus_file_id': corpus_file.id,
+            'user_id': user.id
+        }, user_id=user.id)
+        LOGGER.info('Queued the writing of corpus %s to file %s', corpus.id,
+                    corpus_filename)
+        return corpus
 
-            It will be necessary to figure out other formats.
+    @staticmethod
+    def _new_corpus_file(corpus, filename, format_, creator, datetime_created):
+        """Create a corpus file model with ``filename`` and append it to
+        ``corpus.files``.
         """
-        ext = oldc.CORPUS_FORMATS[format_]['extension']
-        sfx = oldc.CORPUS_FORMATS[format_]['suffix']
-        return os.path.join(
-            self._get_corpus_dir_path(corpus),
-            'corpus_%d%s.%s' % (corpus.id, sfx, ext))
+        corpus_file = CorpusFile()
+        corpus.files.append(corpus_file)
+        corpus_file.filename = filename
+        corpus_file.format = format_
+        corpus_file.creator = corpus_file.modifier = creator
+        corpus_file.datetime_created = corpus_file.datetime_modified = \
+            datetime_created
+        corpus.datetime_modified = datetime_created
+        return corpus_file
 
 
 def _get_form_ids_from_tgrep2_output_line(line):
@@ -632,23 +652,3 @@ def _get_form_ids_from_tgrep2_output_line(line):
         return int(line.split('-')[1])
     except Exception:
         return None
-
-
-def _create_tgrep2_corpus_file(gzipped_corpus_file_path, format_):
-    """Use TGrep2 to create a .t2c corpus file from the gzipped file of
-    phrase-structure trees.
-    :param str gzipped_corpus_file_path: absolute path to the gzipped corpus
-        file.
-    :param str format_: the format in which the corpus has just been written to
-        disk.
-    :returns: the absolute path to the .t2c file or ``False``.
-    """
-    if format_ == u'treebank' and h.command_line_program_installed('tgrep2'):
-        out_path = '%s.t2c' % os.path.splitext(gzipped_corpus_file_path)[0]
-        with open(os.devnull, "w") as fnull:
-            call(['tgrep2', '-p', gzipped_corpus_file_path, out_path],
-                 stdout=fnull, stderr=fnull)
-        if os.path.exists(out_path):
-            return out_path
-        return False
-    return False
@@ -23,8 +23,8 @@ class Corpusbackups(ReadonlyResources):
         """Ensure that only authorized users can access the provided
         ``resource_model``.
         """
-        unrestricted_users = self.db.get_unrestricted_users()
+        unrestricted_user_ids = self.db.get_unrestricted_user_ids()
         if not self.logged_in_user.is_authorized_to_access_model(
-                resource_model, unrestricted_users):
+                resource_model, unrestricted_user_ids):
             return True
         return False
@@ -132,7 +132,7 @@ class Files(Resources):
                     LOGGER.warning(msg)
                     return {'error': msg}
             resource.lossy_filename = save_reduced_copy(
-                resource, self.request.registry.settings)
+                resource, self.request.settings)
             self.request.dbsession.add(resource)
             self.request.dbsession.flush()
             self._post_create(resource)
@@ -215,9 +215,9 @@ class Files(Resources):
         """Ensure that only authorized users can access the provided
         ``resource_model``.
         """
-        unrestricted_users = self.db.get_unrestricted_users()
+        unrestricted_user_ids = self.db.get_unrestricted_user_ids()
         if not self.logged_in_user.is_authorized_to_access_model(
-                resource_model, unrestricted_users):
+                resource_model, unrestricted_user_ids):
             return True
         return False
 
@@ -257,7 +257,7 @@ class Files(Resources):
         # base64-decoded during validation
         file_data = data['base64_encoded_file']
         files_path = h.get_old_directory_path(
-            'files', self.request.registry.settings)
+            'files', self.request.settings)
         file_path = os.path.join(files_path, file_.filename)
         file_object, file_path = _get_unique_file_path(file_path)
         file_.filename = os.path.split(file_path)[-1]
@@ -353,7 +353,7 @@ class Files(Resources):
             filename=h.normalize(data['filename']),
             MIME_type=data['MIME_type']
         )
-        files_path=h.get_old_directory_path('files', self.request.registry.settings)
+        files_path=h.get_old_directory_path('files', self.request.settings)
         file_path = os.path.join(files_path, file_.filename)
         file_object, file_path = _get_unique_file_path(file_path)
         file_.filename = os.path.split(file_path)[-1]
@@ -480,13 +480,13 @@ class Files(Resources):
         if getattr(file_model, 'filename', None):
             file_path = os.path.join(
                 h.get_old_directory_path(
-                    'files', self.request.registry.settings),
+                    'files', self.request.settings),
                 file_model.filename)
             os.remove(file_path)
         if getattr(file_model, 'lossy_filename', None):
             file_path = os.path.join(
                 h.get_old_directory_path(
-                    'reduced_files', self.request.registry.settings),
+                    'reduced_files', self.request.settings),
                 file_model.lossy_filename)
             os.remove(file_path)
 
@@ -518,7 +518,7 @@ class Files(Resources):
                 'error': 'The content of file %s is stored elsewhere at %s' % (
                     id_, file_.url)}
         files_dir = h.get_old_directory_path('files',
-                                             self.request.registry.settings)
+                                             self.request.settings)
         if reduced:
             filename = getattr(file_, 'lossy_filename', None)
             if not filename:
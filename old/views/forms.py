@@ -22,13 +22,15 @@
 import logging
 import re
 import json
+import time
 from uuid import uuid4
 
 from formencode.validators import Invalid
 from sqlalchemy import bindparam
-from sqlalchemy.sql import asc, or_
-from sqlalchemy.orm import subqueryload
+from sqlalchemy.sql import asc
+from sqlalchemy.orm import contains_eager, subqueryload
 
+from old.lib import morpheme_references
 from old.lib.constants import (
     DEFAULT_DELIMITER,
     FORM_REFERENCE_PATTERN,
@@ -37,12 +39,18 @@ from old.lib.constants import (
     UNAUTHORIZED_MSG,
     UNKNOWN_CATEGORY,
 )
-from old.lib.dbutils import get_last_modified
+from old.lib.dbutils import (
+    add_pagination,
+    get_last_modified,
+    _filter_restricted_models_from_query
+)
 import old.lib.helpers as h
+from old.lib.jobs import enqueue_job, get_tenant_settings
 from old.lib.schemata import FormIdsSchema
 from old.models import (
     Form,
     FormBackup,
+    FormMorpheme,
     Collection,
     User
 )
@@ -59,6 +67,9 @@ MORPH_ATTRS = (
     'syntactic_category_string',
     'break_gloss_category'
 )
+# Number of shapes/glosses looked up, and of dependent forms updated, at a
+# time when changes to lexical items are percolated.
+PERCOLATION_CHUNK_SIZE = 500
 
 
 class Forms(Resources):
@@ -98,16 +109,19 @@ class Forms(Resources):
         self.request.dbsession.add(form_backup)
 
     def _post_create(self, form_model):
-        """Update any morphologically complex forms that may contain
-        this form as a morpheme.
+        """Index the morphemes of the new form and update any morphologically
+        complex forms that may contain this form as a morpheme.
         """
+        self.index_form_morphemes([form_model])
         self.update_forms_containing_this_form_as_morpheme(form_model)
 
     def _post_update(self, form, form_dict):
-        """If the form has changed, then update any morphologically complex
-        forms that may contain this form as a morpheme.
+        """If the form has changed, then re-index its morphemes and update any
+        morphologically complex forms that may contain this form as a
+        morpheme.
         """
         if update_has_changed_the_analysis(form, form_dict):
+            self.index_form_morphemes([form])
             self.update_forms_containing_this_form_as_morpheme(
                 form, 'update', form_dict)
 
@@ -129,9 +143,9 @@ class Forms(Resources):
         """Ensure that only authorized users can access the provided
         ``resource_model``.
         """
-        unrestricted_users = self.db.get_unrestricted_users()
+        unrestricted_user_ids = self.db.get_unrestricted_user_ids()
         if not self.logged_in_user.is_authorized_to_access_model(
-                resource_model, unrestricted_users):
+                resource_model, unrestricted_user_ids):
             return True
         return False
 
@@ -153,6 +167,7 @@ class Forms(Resources):
         database.
         """
         self.update_forms_containing_this_form_as_morpheme(form, 'delete')
+        self.db.unindex_form_morphemes([form.id])
 
     def _create_new_resource(self, data):
         """Create a new form resource.
@@ -316,7 +331,7 @@ class Forms(Resources):
         """
         LOGGER.info('Attempting to remember forms for a user.')
         schema = FormIdsSchema
-        if self.request.registry.settings.get('readonly') == '1':
+        if self.request.settings.get('readonly') == '1':
             LOGGER.warning('Attempt to remember forms in read-only mode')
             self.request.response.status_int = 403
             return READONLY_MODE_MSG
@@ -366,15 +381,23 @@ class Forms(Resources):
         return ret
 
     def update_morpheme_references(self):
-        """Update the morphological analysis-related attributes of all forms.
+        """Request a rebuild of the morphological analysis-related attributes
+        of all forms.
 
         That is, update the values of the ``morpheme_break_ids``,
         ``morpheme_gloss_ids``, ``syntactic_category_string`` and
-        ``break_gloss_category`` attributes of every form in the database.
+        ``break_gloss_category`` attributes of every form in the database. The
+        rebuild runs in the background (cf.
+        :mod:`old.lib.morpheme_references`); if a previous rebuild was
+        interrupted, it is resumed unless the ``restart`` GET parameter is
+        truthy.
 
         :URL: ``PUT /forms/update_morpheme_references``
-        :returns: a list of ids corresponding to the forms where the update
-            caused a change in the values of the target attributes.
+        :returns: the status of the queued rebuild, cf.
+            :func:`update_morpheme_references_status`, with the id of its job.
+            (This action used to run the update itself and return the ids of
+            the forms it changed; the number of forms updated is now in the
+            status once the rebuild has finished.)
 
         .. warning::
 
@@ -382,23 +405,100 @@ class Forms(Resources):
            references via this action since this should already be accomplished
            automatically by the calls to
            ``update_forms_containing_this_form_as_morpheme`` on all successful
-           update, create and delete requests on form resources.  This action
-           is, therefore, deprecated (read: use it with caution) and may be
-           removed in future versions of the OLD.
+           update, create and delete requests on form resources. It is needed
+           only after the morpheme delimiters have been changed.
         """
         LOGGER.info('Attempting to update the morphological analysis-related'
                     ' attributes of all forms.')
-        if self.request.registry.settings.get('readonly') == '1':
+        if self.request.settings.get('readonly') == '1':
             LOGGER.warning('Attempt to update the morpheme references of the forms in read-only mode')
             self.request.response.status_int = 403
             return READONLY_MODE_MSG
-        forms = self.db.get_forms()
-        return self.update_morpheme_references_of_forms(
-            self.db.get_forms(),
-            self.db.get_morpheme_delimiters(),
-            whole_db=forms,
-            make_backups=False
-        )
+        settings = get_tenant_settings(self.request)
+        status = morpheme_references.read_status(settings)
+        if morpheme_references.rebuild_is_running(status):
+            self.request.response.status_int = 400
+            msg = 'The morpheme references of the forms are already being updated.'
+            LOGGER.warning(msg)
+            return {'error': msg}
+        if (self.request.GET.get('restart') or
+                not morpheme_references.get_resume_point(status)):
+            status = {}
+        # The rebuild is marked as queued before its job exists so that a
+        # concurrent request cannot queue a second one.
+        status['status'] = 'queued'
+        morpheme_references.write_status(settings, status)
+        # The rebuild can take a long time, so it yields to the compilation
+        # jobs that users are waiting on.
+        job = enqueue_job(self.request, 'rebuild_morpheme_references',
+                          {'user_id': self.logged_in_user.id},
+                          user_id=self.logged_in_user.id, priority=-1)
+        # The job is claimed only once this request has committed, so it
+        # cannot have overwritten the status yet.
+        status['job_id'] = job.id
+        status = morpheme_references.write_status(settings, status)
+        LOGGER.info('Queued an update of the morpheme references of all'
+                    ' forms.')
+        return status
+
+    def update_morpheme_references_status(self):
+        """Return the status of the most recent rebuild of the morpheme
+        references of all forms.
+
+        :URL: ``GET /forms/update_morpheme_references``
+        :returns: a dict with a ``status`` value of 'not started', 'queued',
+            'running', 'finished' or 'failed' and, once started, counts of the
+            forms processed and updated, the total number of forms and the id
+            of the last form processed (the checkpoint).
+        """
+        LOGGER.info('Returning the status of the morpheme references update.')
+        return morpheme_references.read_status(
+            get_tenant_settings(self.request))
+
+    def concordance(self):
+        """Return the occurrences of a morpheme across all forms, i.e., a
+        concordance built from the form-morpheme index.
+
+        :URL: ``GET /forms/concordance`` with at least one of the query string
+            parameters ``shape``, ``gloss`` and ``category`` and optional
+            pagination parameters.
+        :returns: a list of morpheme occurrences, each with its word and
+            morpheme indices and a summary of the form it occurs in.
+        """
+        LOGGER.info('Attempting to build a morpheme concordance.')
+        get_params = dict(self.request.GET)
+        conditions = [getattr(FormMorpheme, attr) == get_params[attr]
+                      for attr in ('shape', 'gloss', 'category')
+                      if get_params.get(attr)]
+        if not conditions:
+            self.request.response.status_int = 400
+            msg = ('A concordance request must specify a shape, gloss or'
+                   ' category.')
+            LOGGER.warning(msg)
+            return {'error': msg}
+        query = self.request.dbsession.query(FormMorpheme)\
+            .join(Form, FormMorpheme.form_id == Form.id)\
+            .options(contains_eager(FormMorpheme.form)
+                     .subqueryload(Form.translations))\
+            .filter(*conditions)
+        if not self.db.user_is_unrestricted(self.logged_in_user):
+            query = _filter_restricted_models_from_query(
+                'Form', query, self.logged_in_user)
+        query = query.order_by(asc(FormMorpheme.form_id),
+                               asc(FormMorpheme.word_index),
+                               asc(FormMorpheme.morpheme_index))
+        try:
+            result = add_pagination(query, get_params)
+        except Invalid as error:
+            self.request.response.status_int = 400
+            errors = error.unpack_errors()
+            LOGGER.warning('Attempt to build a morpheme concordance resulted'
+                           ' in an error(s): %s', errors)
+            return {'errors': errors}
+        if isinstance(result, list):
+            result = [occurrence.get_dict() for occurrence in result]
+        LOGGER.info('Built a morpheme concordance.')
+        return result
 
     ###########################################################################
     # Form-specific private methods
@@ -424,7 +524,17 @@ class Forms(Resources):
             database.
         :returns: a list of form ``id`` values corresponding to the forms that
             have been updated.
+
+        The lexical items (or the whole database) are hash-indexed once here,
+        cf. :class:`LexicalIndex`, so that each morpheme lookup made while
+        compiling the analyses of ``forms`` is a dict lookup.
         """
+        if kwargs.get('whole_db') is not None:
+            kwargs['whole_db'] = get_lexical_index(kwargs['whole_db'])
+        elif kwargs.get('lexical_items') or kwargs.get('deleted_lexical_items'):
+            kwargs['lexical_items'] = get_lexical_index(
+                kwargs.get('lexical_items') or [],
+                kwargs.get('deleted_lexical_items') or [])
         form_buffer = []
         formbackup_buffer = []
         make_backups = kwargs.get('make_backups', True)
@@ -468,18 +578,34 @@ class Forms(Resources):
                     formbackup.vivify(form.get_dict())
                     formbackup_buffer.append(formbackup)
         if form_buffer:
-            rdbms_name = h.get_RDBMS_name(self.request.registry.settings)
+            rdbms_name = h.get_RDBMS_name(self.request.settings)
             if rdbms_name == 'mysql':
                 self.request.dbsession.execute('set names utf8;')
             update = form_table.update().where(form_table.c.id==bindparam('id_')).\
                 values(**dict([(k, bindparam(k)) for k in form_buffer[0] if k !=
                                'id_']))
             self.request.dbsession.execute(update, form_buffer)
+            if kwargs.get('whole_db') is None:
+                changed = {f['id_']: f['syntactic_category_string']
+                           for f in form_buffer}
+                self.db.index_form_morphemes(
+                    [(form.id, form.morpheme_break, form.morpheme_gloss,
+                      changed[form.id]) for form in forms
+                     if form.id in changed],
+                    valid_delimiters)
         if make_backups and formbackup_buffer:
             self.request.dbsession.add_all(formbackup_buffer)
             self.request.dbsession.flush()
         return [f['id_'] for f in form_buffer]
 
+    def index_form_morphemes(self, forms):
+        """(Re-)index the morphemes of the form models in ``forms`` in the
+        ``form_morpheme`` table.
+        """
+        self.db.index_form_morphemes(
+            [(form.id, form.morpheme_break, form.morpheme_gloss,
+              form.syntactic_category_string) for form in forms])
+
     def _update_collections_referencing_this_form(self, form):
         """Update all collections that reference the input form in their
         ``contents`` value.
@@ -571,9 +697,11 @@ class Forms(Resources):
         if (morpheme, gloss) in matches_found:
             return matches_found[(morpheme, gloss)], matches_found
         if whole_db:
-            result = [f for f in whole_db if f.morpheme_break == morpheme and
-                      f.morpheme_gloss == gloss]
+            result = get_lexical_index(whole_db).get_perfect_matches(
+                morpheme, gloss)
         elif lexical_items or deleted_lexical_items:
+            lexical_index = get_lexical_index(lexical_items,
+                                              deleted_lexical_items)
             extant_morpheme_break_ids = json.loads(form.morpheme_break_ids)
             extant_morpheme_gloss_ids = json.loads(form.morpheme_gloss_ids)
             # Extract extant perfect matches as quadruples: (id, mb, mg, sc)
@@ -587,12 +715,10 @@ class Forms(Resources):
             # may have been deleted or updated
             extant_perfect_matches = [
                 get_fake_form(m) for m in extant_perfect_matches_originally
-                if m[0] not in [f.id for f in lexical_items +
-                                deleted_lexical_items]
+                if m[0] not in lexical_index.changed_ids
             ]
-            perfect_matches_in_lexical_items = [
-                f for f in lexical_items if f.morpheme_break == morpheme and
-                f.morpheme_gloss == gloss]
+            perfect_matches_in_lexical_items = \
+                lexical_index.get_perfect_matches(morpheme, gloss)
             perfect_matches_now = sorted(
                 extant_perfect_matches + perfect_matches_in_lexical_items,
                 key=lambda f: f.id)
@@ -665,8 +791,11 @@ class Forms(Resources):
         if (morpheme, gloss) in matches_found:
             return matches_found[(morpheme, gloss)], matches_found
         if whole_db:
-            result = [f for f in whole_db if getattr(f, attribute) == value]
+            result = get_lexical_index(whole_db).get_partial_matches(
+                attribute, value)
         elif lexical_items or deleted_lexical_items:
+            lexical_index = get_lexical_index(lexical_items,
+                                              deleted_lexical_items)
             if value in force_query:
                 result = self.request.dbsession.query(Form)\
                     .filter(getattr(Form, attribute)==value)\
@@ -684,10 +813,9 @@ class Forms(Resources):
                 # that may have been deleted or updated
                 extant_partial_matches = [
                     get_fake_form(m) for m in extant_partial_matches
-                    if m[0] not in [f.id for f in lexical_items +
-                                    deleted_lexical_items]]
-                partial_matches_in_lexical_items = [
-                    f for f in lexical_items if getattr(f, attribute) == value]
+                    if m[0] not in lexical_index.changed_ids]
+                partial_matches_in_lexical_items = \
+                    lexical_index.get_partial_matches(attribute, value)
                 result = sorted(
                     extant_partial_matches + partial_matches_in_lexical_items,
                     key=lambda f: f.id)
@@ -782,6 +910,11 @@ class Forms(Resources):
         # as a byproduct of get_perfect_matches and get_partial_matches
         matches_found = kwargs.get('cache', {})
         whole_db = kwargs.get('whole_db')
+        if whole_db is not None:
+            whole_db = get_lexical_index(whole_db)
+        elif lexical_items or deleted_lexical_items:
+            lexical_items = get_lexical_index(lexical_items,
+                                              deleted_lexical_items)
         morpheme_break_ids = []
         morpheme_gloss_ids = []
         syntactic_category_string = []
@@ -904,58 +1037,77 @@ class Forms(Resources):
             update.
         :returns: ``None``
         """
-        if self.is_lexical(form):
-            # Here we construct the query to get all forms that may have been
-            # affected by the change to the lexical item (i.e., form).
-            morpheme_delimiters = self.db.get_morpheme_delimiters()
-            escaped_morpheme_delimiters = [
-                h.esc_RE_meta_chars(d) for d in morpheme_delimiters]
-            if (    len(escaped_morpheme_delimiters) == 1 and not
-                    escaped_morpheme_delimiters[0]):
-                start_patt = '(%s)' % '|'.join([' ', '^'])
-                end_patt = '(%s)' % '|'.join([' ', '$'])
-            else:
-                start_patt = '(%s)' % '|'.join(
-                    escaped_morpheme_delimiters + [' ', '^'])
-                end_patt = '(%s)' % '|'.join(
-                    escaped_morpheme_delimiters + [' ', '$'])
-            morpheme_patt = '%s%s%s' % (
-                start_patt, form.morpheme_break, end_patt)
-            gloss_patt = '%s%s%s' % (start_patt, form.morpheme_gloss, end_patt)
-            disjunctive_conditions = [
-                Form.morpheme_break.op('regexp')(morpheme_patt),
-                Form.morpheme_gloss.op('regexp')(gloss_patt)]
-            matches_query = self.request.dbsession.query(Form).options(
-                subqueryload(Form.syntactic_category))
-            # Updates entail a wider range of possibly affected forms
-            if previous_version and self.is_lexical(previous_version):
-                if previous_version['morpheme_break'] != form.morpheme_break:
-                    morpheme_patt_pv = '%s%s%s' % (
-                        start_patt, previous_version['morpheme_break'],
-                        end_patt)
-                    disjunctive_conditions.append(
-                        Form.morpheme_break.op('regexp')(morpheme_patt_pv))
-                if previous_version['morpheme_gloss'] != form.morpheme_gloss:
-                    gloss_patt_pv = '%s%s%s' % (
-                        start_patt, previous_version['morpheme_gloss'],
-                        end_patt)
-                    disjunctive_conditions.append(
-                        Form.morpheme_gloss.op('regexp')(gloss_patt_pv))
-            matches_query = matches_query.filter(or_(*disjunctive_conditions))
-            #matches = [f for f in matches_query.all() if f.id != form.id]
-            matches = matches_query.all()
-            if change == 'delete':
-                self.update_morpheme_references_of_forms(
-                    matches, morpheme_delimiters, deleted_lexical_items=[form])
-            else:
-                self.update_morpheme_references_of_forms(
-                    matches, morpheme_delimiters, lexical_items=[form])
+        self.update_forms_containing_these_forms_as_morphemes(
+            [form], change=change,
+            previous_versions=[previous_version] if previous_version else ())
+
+    def update_forms_containing_these_forms_as_morphemes(
+            self, forms, change='create', previous_versions=()):
+        """Update the morphological analysis-related attributes of every form
+        containing any of the input forms as morpheme, as a set: the lexical
+        items among ``forms`` are hash-indexed once, the forms that contain
+        them are found with one form-morpheme index lookup per
+        ``PERCOLATION_CHUNK_SIZE`` shapes and glosses, and their analyses are
+        recompiled and written back with one batched UPDATE per
+        ``PERCOLATION_CHUNK_SIZE`` dependent forms.
+
+        :param list forms: form models, e.g., the forms of a syntactic
+            category whose name has changed.
+        :param str change: 'delete' if the forms have just been deleted.
+        :param list previous_versions: representations of (some of) the forms
+            prior to update.
+        :returns: a dict of statistics: the numbers of ``lexical_items``,
+            dependent ``forms`` and ``updated`` forms, and the milliseconds
+            spent finding (``find_ms``) and updating (``update_ms``) them.
+        """
+        start = time.time()
+        stats = {'lexical_items': 0, 'forms': 0, 'updated': 0,
+                 'find_ms': 0.0, 'update_ms': 0.0}
+        lexical_items = [form for form in forms if self.is_lexical(form)]
+        if not lexical_items:
+            return stats
+        shapes = {form.morpheme_break for form in lexical_items}
+        glosses = {form.morpheme_gloss for form in lexical_items}
+        # Updates entail a wider range of possibly affected forms
+        for previous_version in previous_versions:
+            if self.is_lexical(previous_version):
+                shapes.add(previous_version['morpheme_break'])
+                glosses.add(previous_version['morpheme_gloss'])
+        shapes, glosses = sorted(shapes), sorted(glosses)
+        match_ids = set()
+        for index in range(0, max(len(shapes), len(glosses)),
+                           PERCOLATION_CHUNK_SIZE):
+            match_ids.update(self.db.get_ids_of_forms_containing_morphemes(
+                shapes[index:index + PERCOLATION_CHUNK_SIZE],
+                glosses[index:index + PERCOLATION_CHUNK_SIZE]))
+        match_ids = sorted(match_ids)
+        found = time.time()
+        morpheme_delimiters = self.db.get_morpheme_delimiters()
+        if change == 'delete':
+            kwargs = {'deleted_lexical_items': lexical_items}
+        else:
+            kwargs = {'lexical_items': get_lexical_index(lexical_items)}
+        for index in range(0, len(match_ids), PERCOLATION_CHUNK_SIZE):
+            matches = self.request.dbsession.query(Form)\
+                .options(subqueryload(Form.syntactic_category))\
+                .filter(Form.id.in_(
+                    match_ids[index:index + PERCOLATION_CHUNK_SIZE]))\
+                .order_by(asc(Form.id)).all()
+            stats['updated'] += len(self.update_morpheme_references_of_forms(
+                matches, morpheme_delimiters, **dict(kwargs)))
+        stats.update({
+            'lexical_items': len(lexical_items),
+            'forms': len(match_ids),
+            'find_ms': 1000 * (found - start),
+            'update_ms': 1000 * (time.time() - found)})
+        LOGGER.info('Percolated changes to %(lexical_items)d lexical items to'
+                    ' %(forms)d forms (%(updated)d updated) in'
+                    ' %(find_ms).1f + %(update_ms).1f ms', stats)
+        return stats
 
     def form_is_foreign_word(self, form_model):
-        foreign_word_tag = self.db.get_foreign_word_tag()
-        if foreign_word_tag in form_model.tags:
-            return True
-        return False
+        foreign_word_tag_id = self.db.get_foreign_word_tag_id()
+        return any(tag.id == foreign_word_tag_id for tag in form_model.tags)
 
     def is_lexical(self, form):
         """Return True if the input form is lexical, i.e, if neither its
@@ -1115,6 +1267,63 @@ def get_break_gloss_category(morpheme_delimiters, morpheme_break,
         return None
 
 
+class LexicalIndex(object):
+    """Hash index over a collection of (lexical) forms, used when compiling
+    morphemic analyses against a known pool of forms (the whole database or
+    a handful of just-changed lexical items). Forms are indexed by
+    ``(morpheme_break, morpheme_gloss)``, by ``morpheme_break`` and by
+    ``morpheme_gloss``; each index maps to a list of forms sorted by id, so a
+    lookup returns exactly what a linear scan of the forms (in id order)
+    would have.
+
+    :param forms: the forms that may be matched.
+    :param deleted_forms: forms that have been deleted; their ids, together
+        with those of ``forms``, make up ``changed_ids``, i.e., the ids whose
+        extant references must be discarded.
+    """
+
+    def __init__(self, forms, deleted_forms=()):
+        self.forms = sorted(forms, key=lambda f: f.id)
+        self.changed_ids = {f.id for f in self.forms}
+        self.changed_ids.update(f.id for f in deleted_forms)
+        self.by_break_gloss = {}
+        self.by_attribute = {'morpheme_break': {}, 'morpheme_gloss': {}}
+        for form in self.forms:
+            self.by_break_gloss.setdefault(
+                (form.morpheme_break, form.morpheme_gloss), []).append(form)
+            self.by_attribute['morpheme_break'].setdefault(
+                form.morpheme_break, []).append(form)
+            self.by_attribute['morpheme_gloss'].setdefault(
+                form.morpheme_gloss, []).append(form)
+
+    def __len__(self):
+        return len(self.forms)
+
+    def __iter__(self):
+        return iter(self.forms)
+
+    def get_perfect_matches(self, morpheme, gloss):
+        """Return the forms whose break and gloss are ``morpheme`` and
+        ``gloss``.
+        """
+        return list(self.by_break_gloss.get((morpheme, gloss), ()))
+
+    def get_partial_matches(self, attribute, value):
+        """Return the forms whose ``attribute`` ('morpheme_break' or
+        'morpheme_gloss') is ``value``.
+        """
+        return list(self.by_attribute[attribute].get(value, ()))
+
+
+def get_lexical_index(forms, deleted_forms=()):
+    """Return ``forms`` as a :class:`LexicalIndex`, building one only if
+    necessary.
+    """
+    if isinstance(forms, LexicalIndex):
+        return forms
+    return LexicalIndex(forms or [], deleted_forms or [])
+
+
 class FakeForm(object):
 
     def __init__(self, **kwargs):
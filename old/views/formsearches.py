@@ -78,7 +78,7 @@ class Formsearches(Resources):
             full_dict=values,
             db=self.db,
             logged_in_user=self.logged_in_user,
-            settings=self.request.registry.settings)
+            settings=self.request.settings)
 
     def _get_user_data(self, data):
         """User-provided data for creating a form search."""
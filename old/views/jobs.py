@@ -0,0 +1,54 @@
+# Copyright 2016 Joel Dunham
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""Contains the :class:`Jobs` view.
+
+.. module:: jobs
+   :synopsis: Contains the background jobs view.
+"""
+
+import logging
+
+from old.views.resources import ReadonlyResources
+
+
+LOGGER = logging.getLogger(__name__)
+
+
+class Jobs(ReadonlyResources):
+    """Generate responses to requests on background job resources, cf.
+    :mod:`old.lib.jobs`. Jobs are created by the actions that request them
+    (e.g., ``PUT /phonologies/{id}/compile``) and are read-only here.
+    Administrators can see all jobs; other users only see their own.
+    """
+
+    def __init__(self, request):
+        self.model_name = 'Job'
+        self.hmn_member_name = 'job'
+        super().__init__(request)
+
+    def _filter_query(self, query_obj):
+        if self.logged_in_user.role == 'administrator':
+            return query_obj
+        return query_obj.filter(
+            self.model_cls.enterer_id == self.logged_in_user.id)
+
+    def _get_result_cache_restriction(self):
+        if self.logged_in_user.role == 'administrator':
+            return 'administrator'
+        return 'user %d' % self.logged_in_user.id
+
+    def _model_access_unauth(self, resource_model):
+        return (self.logged_in_user.role != 'administrator' and
+                resource_model.enterer_id != self.logged_in_user.id)
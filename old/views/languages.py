@@ -21,6 +21,7 @@ class Languages(ReadonlyResources):
         if eager:
             return (
                 self._eagerload_model(
-                    self.request.dbsession.query(self.model_cls)).get(id_),
+                    self.request.dbsession.query(self.model_cls),
+                    'show').get(id_),
                 id_)
         return self.request.dbsession.query(self.model_cls).get(id_), id_
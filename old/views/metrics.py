@@ -0,0 +1,45 @@
+# Copyright 2016 Joel Dunham
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""Requests to /metrics are routed here. Returns the metrics of the OLD
+processes (cf. :mod:`old.lib.metrics`) in the Prometheus text format.
+"""
+
+import logging
+
+from pyramid.response import Response
+from pyramid.settings import asbool
+
+from old.lib import metrics
+
+
+LOGGER = logging.getLogger(__name__)
+
+
+class Metrics:
+
+    def __init__(self, request):
+        self.request = request
+
+    def index(self):
+        """Return the metrics in the Prometheus text format, or a 404 error
+        if the ``metrics_enabled`` setting is false.
+        """
+        settings = self.request.settings
+        if not asbool(settings.get('metrics_enabled', False)):
+            self.request.response.status_int = 404
+            return {'error': 'Metrics are not enabled.'}
+        response = Response(body=metrics.render(settings).encode('utf8'))
+        response.headers['Content-Type'] = metrics.CONTENT_TYPE
+        return response
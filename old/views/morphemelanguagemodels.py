@@ -7,8 +7,8 @@ from formencode.validators import Invalid
 from pyramid.response import FileResponse
 
 import old.lib.constants as oldc
-from old.lib.foma_worker import FOMA_WORKER_Q
 import old.lib.helpers as h
+from old.lib.jobs import enqueue_job
 from old.lib.schemata import MorphemeSequencesSchema
 from old.models import MorphemeLanguageModelBackup
 from old.views.resources import Resources
@@ -29,7 +29,7 @@ class Morphemelanguagemodels(Resources):
 
     def generate(self):
         """Generate the files that constitute the morpheme language model,
-        crucially the file that holds the pickled LM trie.
+        crucially the binary file that holds the LM trie.
         :URL: ``PUT /morpheme_language_model/id/generate``
         :param str id: the ``id`` value of the morpheme language model whose
             files will be generated.
@@ -39,7 +39,7 @@ class Morphemelanguagemodels(Resources):
         """
         langmod, id_ = self._model_from_id(eager=True)
         LOGGER.info('Attempting to generate morpheme language model %s.', id_)
-        if self.request.registry.settings.get('readonly') == '1':
+        if self.request.settings.get('readonly') == '1':
             LOGGER.warning('Attempt to generate a LM in read-only mode')
             self.request.response.status_int = 403
             return oldc.READONLY_MODE_MSG
@@ -51,16 +51,12 @@ class Morphemelanguagemodels(Resources):
         args = {
             'morpheme_language_model_id': langmod.id,
             'user_id': self.logged_in_user.id,
-            'timeout': oldc.MORPHEME_LANGUAGE_MODEL_GENERATE_TIMEOUT,
-            'settings': self.request.registry.settings
+            'timeout': oldc.MORPHEME_LANGUAGE_MODEL_GENERATE_TIMEOUT
         }
-        FOMA_WORKER_Q.put({
-            'id': h.generate_salt(),
-            'func': 'generate_language_model',
-            'args': args
-        })
-        LOGGER.info('Added generation of morpheme language model %d to the foma'
-                    ' worker queue.', id_)
+        enqueue_job(self.request, 'generate_language_model', args,
+                    user_id=self.logged_in_user.id)
+        LOGGER.info('Added generation of morpheme language model %d to the job'
+                    ' queue.', id_)
         return langmod
 
     def get_probabilities(self):
@@ -114,7 +110,7 @@ class Morphemelanguagemodels(Resources):
         langmod, id_ = self._model_from_id(eager=True)
         LOGGER.info('Attempting to compute the perplexity of morpheme language'
                     ' model %s.', id_)
-        if self.request.registry.settings.get('readonly') == '1':
+        if self.request.settings.get('readonly') == '1':
             LOGGER.warning('Attempt to compute the perplexity of a LM in read-only mode')
             self.request.response.status_int = 403
             return oldc.READONLY_MODE_MSG
@@ -126,16 +122,12 @@ class Morphemelanguagemodels(Resources):
         args = {
             'morpheme_language_model_id': langmod.id,
             'user_id': self.logged_in_user.id,
-            'timeout': oldc.MORPHEME_LANGUAGE_MODEL_GENERATE_TIMEOUT,
-            'settings': self.request.registry.settings
+            'timeout': oldc.MORPHEME_LANGUAGE_MODEL_GENERATE_TIMEOUT
         }
-        FOMA_WORKER_Q.put({
-            'id': h.generate_salt(),
-            'func': 'compute_perplexity',
-            'args': args
-        })
+        enqueue_job(self.request, 'compute_perplexity', args,
+                    user_id=self.logged_in_user.id)
         LOGGER.info('Added computation of perplexity of morpheme language model'
-                    ' %d to the foma worker queue.', id_)
+                    ' %d to the job queue.', id_)
         return langmod
 
     def serve_arpa(self):
@@ -178,7 +170,7 @@ class Morphemelanguagemodels(Resources):
             return True
         if not langmod.restricted:
             return True
-        if self.logged_in_user in self.db.get_unrestricted_users():
+        if self.logged_in_user.id in self.db.get_unrestricted_user_ids():
             return True
         return False
 
@@ -206,7 +198,7 @@ class Morphemelanguagemodels(Resources):
         user_model = self.logged_in_user
         user_data.update({
             'parent_directory': h.get_old_directory_path(
-                'morphemelanguagemodels', self.request.registry.settings),
+                'morphemelanguagemodels', self.request.settings),
             'rare_delimiter': oldc.RARE_DELIMITER,
             'start_symbol': oldc.LM_START,
             'end_symbol': oldc.LM_END,
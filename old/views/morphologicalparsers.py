@@ -10,8 +10,9 @@ from pyramid.response import FileResponse
 
 from old import db_session_factory_registry
 import old.lib.constants as oldc
-from old.lib.foma_worker import FOMA_WORKER_Q
 import old.lib.helpers as h
+from old.lib.jobs import enqueue_job
+from old.lib.metrics import REGISTRY
 from old.lib.schemata import (
     TranscriptionsSchema,
     MorphemeSequencesSchema
@@ -28,6 +29,26 @@ def session_getter(settings):
     return db_session_factory_registry.get_session(settings)()
 
 
+def format_cache_stats(stats):
+    """Format the statistics of a parse cache as a header value."""
+    return '; '.join(
+        '{}={}'.format(key, '{:.2f}'.format(stats[key])
+                       if isinstance(stats[key], float) else stats[key])
+        for key in ('memory_hits', 'database_hits', 'misses', 'hit_rate'))
+
+
+def record_cache_metrics(stats):
+    """Add the lookups of a parse cache to the parse cache metrics."""
+    lookups = REGISTRY.counter(
+        'old_parse_cache_lookups_total',
+        'Parse cache lookups by result (memory_hit, database_hit or miss).',
+        ('result',))
+    for key, result in (('memory_hits', 'memory_hit'),
+                        ('database_hits', 'database_hit'),
+                        ('misses', 'miss')):
+        lookups.inc(stats[key], result=result)
+
+
 class Morphologicalparsers(Resources):
 
     def __init__(self, request):
@@ -57,7 +78,7 @@ class Morphologicalparsers(Resources):
         morphparser_dict = morphparser.get_dict()
         if self.request.GET.get('script') == '1':
             morphparser_dir_path = h.get_model_directory_path(
-                morphparser, self.request.registry.settings)
+                morphparser, self.request.settings)
             morphparser_script_path = h.get_model_file_path(
                 morphparser, morphparser_dir_path, file_type='script')
             if os.path.isfile(morphparser_script_path):
@@ -84,7 +105,7 @@ class Morphologicalparsers(Resources):
             :mod:`onlinelinguisticdatabase.lib.foma_worker`.
         """
         LOGGER.info('Attempting to generate and compile a morphological parser.')
-        if self.request.registry.settings.get('readonly') == '1':
+        if self.request.settings.get('readonly') == '1':
             LOGGER.warning('Attempt to generate and compile a parser in read-only mode')
             self.request.response.status_int = 403
             return oldc.READONLY_MODE_MSG
@@ -103,7 +124,7 @@ class Morphologicalparsers(Resources):
             generation task has terminated.
         """
         LOGGER.info('Attempting to generate a morphological parser.')
-        if self.request.registry.settings.get('readonly') == '1':
+        if self.request.settings.get('readonly') == '1':
             LOGGER.warning('Attempt to generate a parser in read-only mode')
             self.request.response.status_int = 403
             return oldc.READONLY_MODE_MSG
@@ -156,6 +177,10 @@ class Morphologicalparsers(Resources):
             JSON object of the form ``{t1: p1, t2: p2, ...}`` where ``t1`` and
             ``t2`` are transcriptions of words from the request body and ``p1``
             and ``p2`` are the most probable morphological parsers of t1 and t2.
+            The ``X-OLD-Parse-Cache`` response header counts the
+            transcriptions that were found in the parser's memory and database
+            caches and those that had to be parsed, e.g.,
+            ``memory_hits=2; database_hits=1; misses=1; hit_rate=0.75``.
         """
         morphparser, id_ = self._model_from_id(eager=True)
         LOGGER.info('Attempting to call parse against morphological parser %d',
@@ -174,7 +199,7 @@ class Morphologicalparsers(Resources):
             inputs = json.loads(self.request.body.decode(self.request.charset))
             morphparser.cache = Cache(
                 morphparser,
-                self.request.registry.settings,
+                self.request.settings,
                 session_getter
             )
             LOGGER.warning(
@@ -186,6 +211,10 @@ class Morphologicalparsers(Resources):
             # TODO: allow for a param which causes the candidates to be
             # returned as well as/instead of only the most probable parse
             # candidate.
+            cache_stats = morphparser.cache.get_stats()
+            record_cache_metrics(cache_stats)
+            self.request.response.headers['X-OLD-Parse-Cache'] = \
+                format_cache_stats(cache_stats)
             LOGGER.info('Called parse against morphological parser %d', id_)
             return {transcription: parse for transcription, (parse, candidates)
                     in parses.items()}
@@ -258,7 +287,7 @@ class Morphologicalparsers(Resources):
         try:
             morphparser.cache = Cache(
                 morphparser,
-                self.request.registry.settings,
+                self.request.settings,
                 session_getter
             )
             directory = morphparser.directory
@@ -366,19 +395,14 @@ class Morphologicalparsers(Resources):
             msg = 'Foma and flookup are not installed.'
             LOGGER.warning(msg)
             return {'error': msg}
-        FOMA_WORKER_Q.put({
-            'id': h.generate_salt(),
-            'func': 'generate_and_compile_parser',
-            'args': {
-                'morphological_parser_id': morphparser.id,
-                'compile': compile_,
-                'user_id': self.logged_in_user.id,
-                'timeout': oldc.MORPHOLOGICAL_PARSER_COMPILE_TIMEOUT,
-                'settings': self.request.registry.settings
-            }
-        })
+        enqueue_job(self.request, 'generate_and_compile_parser', {
+            'morphological_parser_id': morphparser.id,
+            'compile': compile_,
+            'user_id': self.logged_in_user.id,
+            'timeout': oldc.MORPHOLOGICAL_PARSER_COMPILE_TIMEOUT
+        }, user_id=self.logged_in_user.id)
         LOGGER.info('Added generation (and possible compilation) of'
-                    ' morphological parser %d to the foma worker queue.', id_)
+                    ' morphological parser %d to the job queue.', id_)
         return morphparser
 
     def _post_create(self, parser):
@@ -402,7 +426,7 @@ class Morphologicalparsers(Resources):
         user_model = self.logged_in_user
         user_data.update({
             'parent_directory': h.get_old_directory_path(
-                'morphologicalparsers', self.request.registry.settings),
+                'morphologicalparsers', self.request.settings),
             'UUID': str(uuid4()),
             'enterer': user_model,
             'modifier': user_model,
@@ -9,8 +9,8 @@ from formencode.validators import Invalid
 from pyramid.response import FileResponse
 
 from old.models import MorphologyBackup
-from old.lib.foma_worker import FOMA_WORKER_Q
 import old.lib.helpers as h
+from old.lib.jobs import enqueue_job
 import old.lib.constants as oldc
 from old.lib.schemata import MorphemeSequencesSchema
 from old.views.resources import Resources
@@ -71,7 +71,7 @@ class Morphologies(Resources):
             :mod:`old.lib.foma_worker`.
         """
         LOGGER.info('Attempting to generate and compile a morphology.')
-        if self.request.registry.settings.get('readonly') == '1':
+        if self.request.settings.get('readonly') == '1':
             LOGGER.warning('Attempt to generate and compile a morphology in read-only mode')
             self.request.response.status_int = 403
             return oldc.READONLY_MODE_MSG
@@ -87,7 +87,7 @@ class Morphologies(Resources):
             determine when the generation task has terminated.
         """
         LOGGER.info('Attempting to generate a morphology.')
-        if self.request.registry.settings.get('readonly') == '1':
+        if self.request.settings.get('readonly') == '1':
             LOGGER.warning('Attempt to generate a morphology in read-only mode')
             self.request.response.status_int = 403
             return oldc.READONLY_MODE_MSG
@@ -105,19 +105,14 @@ class Morphologies(Resources):
             msg = 'Foma and flookup are not installed.'
             LOGGER.warning(msg)
             return {'error': msg}
-        FOMA_WORKER_Q.put({
-            'id': h.generate_salt(),
-            'func': 'generate_and_compile_morphology',
-            'args': {
-                'morphology_id': morphology.id,
-                'compile': compile_,
-                'user_id': self.logged_in_user.id,
-                'timeout': oldc.MORPHOLOGY_COMPILE_TIMEOUT,
-                'settings': self.request.registry.settings
-            }
-        })
+        enqueue_job(self.request, 'generate_and_compile_morphology', {
+            'morphology_id': morphology.id,
+            'compile': compile_,
+            'user_id': self.logged_in_user.id,
+            'timeout': oldc.MORPHOLOGY_COMPILE_TIMEOUT
+        }, user_id=self.logged_in_user.id)
         LOGGER.info('Added generation (and possible compilation) of'
-                    ' morphology %d to the foma worker queue.', id_)
+                    ' morphology %d to the job queue.', id_)
         return morphology
 
     def servecompiled(self):
@@ -254,7 +249,7 @@ class Morphologies(Resources):
         user_model = self.logged_in_user
         user_data.update({
             'parent_directory': h.get_old_directory_path(
-                'morphologies', self.request.registry.settings),
+                'morphologies', self.request.settings),
             # TODO: the Pylons app implied that this constant could change...
             'word_boundary_symbol': oldc.WORD_BOUNDARY_SYMBOL,
             'rare_delimiter': oldc.RARE_DELIMITER,
@@ -7,8 +7,8 @@ from formencode.validators import Invalid
 from pyramid.response import FileResponse
 
 import old.lib.constants as oldc
-from old.lib.foma_worker import FOMA_WORKER_Q
 import old.lib.helpers as h
+from old.lib.jobs import enqueue_job
 from old.lib.schemata import MorphophonemicTranscriptionsSchema
 from old.models import PhonologyBackup
 from old.views.resources import Resources
@@ -32,7 +32,7 @@ class Phonologies(Resources):
         """
         phonology, id_ = self._model_from_id(eager=True)
         LOGGER.info('Attempting to compile phonology %d', id_)
-        if self.request.registry.settings.get('readonly') == '1':
+        if self.request.settings.get('readonly') == '1':
             LOGGER.warning('Attempt to compile a phonology in read-only mode')
             self.request.response.status_int = 403
             return oldc.READONLY_MODE_MSG
@@ -46,18 +46,12 @@ class Phonologies(Resources):
             msg = 'Foma and flookup are not installed.'
             LOGGER.warning(msg)
             return {'error': msg}
-        FOMA_WORKER_Q.put({
-            'id': h.generate_salt(),
-            'func': 'compile_phonology',
-            'args': {
-                'phonology_id': phonology.id,
-                'user_id': self.logged_in_user.id,
-                'timeout': oldc.PHONOLOGY_COMPILE_TIMEOUT,
-                'settings': self.request.registry.settings
-            }
-        })
-        LOGGER.info('Added compilation of phonolgy %d to the foma worker'
-                    ' queue.', id_)
+        enqueue_job(self.request, 'compile_phonology', {
+            'phonology_id': phonology.id,
+            'user_id': self.logged_in_user.id,
+            'timeout': oldc.PHONOLOGY_COMPILE_TIMEOUT
+        }, user_id=self.logged_in_user.id)
+        LOGGER.info('Added compilation of phonolgy %d to the job queue.', id_)
         return phonology
 
     def servecompiled(self):
@@ -196,7 +190,7 @@ class Phonologies(Resources):
         user_model = self.logged_in_user
         user_data.update({
             'parent_directory': h.get_old_directory_path(
-                'phonologies', self.request.registry.settings),
+                'phonologies', self.request.settings),
             # TODO: the Pylons app implied that this constant could change...
             'word_boundary_symbol': oldc.WORD_BOUNDARY_SYMBOL,
             'UUID': str(uuid4()),
@@ -0,0 +1,64 @@
+# Copyright 2016 Joel Dunham
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""Requests to /<old_name>/profiles are routed here. Administrators can list
+the stored request profiles of an OLD and get their collapsed stacks, cf.
+:mod:`old.lib.profiler`.
+"""
+
+import logging
+
+from pyramid.response import FileResponse
+
+from old.lib import profiler
+
+
+LOGGER = logging.getLogger(__name__)
+
+
+class Profiles:
+
+    def __init__(self, request):
+        self.request = request
+
+    def index(self):
+        """Return the metadata of the stored profiles, most recent first: their
+        ids, the method, path, route, status and duration of their requests,
+        and their sample counts and intervals (milliseconds).
+        """
+        settings = self.request.settings
+        old_name = self.request.matchdict['old_name']
+        profiles = []
+        for profile_id in reversed(profiler.get_profile_ids(settings,
+                                                            old_name)):
+            try:
+                profiles.append(profiler.get_profile_meta(
+                    settings, old_name, profile_id))
+            except (OSError, ValueError):
+                continue  # deleted or being written
+        return profiles
+
+    def show(self):
+        """Return the collapsed stacks of a profile as text."""
+        settings = self.request.settings
+        profile_id = self.request.matchdict['id']
+        path = profiler.get_profile_path(
+            settings, self.request.matchdict['old_name'], profile_id)
+        if path is None:
+            self.request.response.status_int = 404
+            msg = 'There is no profile with id {}'.format(profile_id)
+            LOGGER.warning(msg)
+            return {'error': msg}
+        return FileResponse(path, request=self.request,
+                            content_type='text/plain')
@@ -95,7 +95,7 @@ class Rememberedforms(Resources):
             msg = 'There is no user with id {}'.format(id_)
             LOGGER.warning(msg)
             return {'error': msg}
-        query = get_eagerloader('Form')(
+        query = get_eagerloader('Form', 'index')(
             self.request.dbsession.query(Form))\
                 .filter(Form.memorizers.contains(user))
         get_params = dict(self.request.GET)
@@ -128,7 +128,7 @@ class Rememberedforms(Resources):
         id_ = self.request.matchdict['id']
         LOGGER.info('Attempting to update the forms remembered by user %d.',
                     id_)
-        if self.request.registry.settings.get('readonly') == '1':
+        if self.request.settings.get('readonly') == '1':
             LOGGER.warning('Attempt to update remembered forms in read-only mode')
             self.request.response.status_int = 403
             return READONLY_MODE_MSG
@@ -159,11 +159,11 @@ class Rememberedforms(Resources):
             LOGGER.warning(errors)
             return {'errors': errors}
         forms = [f for f in data['forms'] if f]
-        unrestricted_users = self.db.get_unrestricted_users()
+        unrestricted_user_ids = self.db.get_unrestricted_user_ids()
         unrestricted_forms = [
             f for f in forms
             if self.logged_in_user.is_authorized_to_access_model(
-                f, unrestricted_users)]
+                f, unrestricted_user_ids)]
         if set(user.remembered_forms) != set(unrestricted_forms):
             user.remembered_forms = unrestricted_forms
             user.datetime_modified = h.now()
@@ -203,14 +203,19 @@ class Rememberedforms(Resources):
             self.request.response.status_int = 400
             LOGGER.warning(JSONDecodeErrorResponse)
             return JSONDecodeErrorResponse
-        query = get_eagerloader('Form')(
+        return self._capture_search(
+            'remembered_forms_search', python_search_params,
+            lambda: self._search_remembered_forms(user, python_search_params))
+
+    def _search_remembered_forms(self, user, python_search_params):
+        query = get_eagerloader('Form', 'search')(
             self.query_builder.get_SQLA_query(python_search_params.get('query')))
         query = query.filter(Form.memorizers.contains(user))
         query = self._filter_restricted_models(query)
         try:
             ret = add_pagination(query, python_search_params.get('paginator'))
             LOGGER.info('Performed search over the forms remembered by user'
-                        ' %d.', id_)
+                        ' %d.', user.id)
             return ret
         except (OLDSearchParseError, Invalid) as error:
             self.request.response.status_int = 400
@@ -5,6 +5,8 @@ import logging
 
 from formencode.validators import Invalid
 import inflect
+from pyramid.renderers import render
+from pyramid.response import Response
 from sqlalchemy.sql import asc
 from sqlalchemy.exc import OperationalError, InternalError
 
@@ -21,6 +23,12 @@ from old.lib.constants import (
     USER_ROLES,
     UTTERANCE_TYPES
 )
+from old.lib.resultcache import (
+    get_dependent_tables,
+    get_result_cache,
+    get_watermark
+)
+from old.lib.slowsearch import capture_search
 from old.lib.SQLAQueryBuilder import SQLAQueryBuilder, OLDSearchParseError
 from old.lib.bibtex import ENTRY_TYPES
 from old.lib.dbutils import (
@@ -32,6 +40,7 @@ from old.lib.dbutils import (
 )
 import old.lib.helpers as h
 import old.lib.schemata as old_schemata
+from old.lib.tenantcache import get_tenant_key
 import old.models as old_models
 
 
@@ -47,6 +56,23 @@ READONLY_RSLT = {'error': 'This resource is read-only.'}
 ResCol = namedtuple('ResCol', ['model_name', 'getter'])
 
 
+def format_result_cache_stats(hit, stats):
+    """Format whether a response came from the result cache and the
+    statistics of the cache as a header value.
+    """
+    return 'hit={}; hits={}; misses={}; stale={}; entries={}; bytes={}'.format(
+        int(hit), stats['hits'], stats['misses'], stats['stale'],
+        stats['entries'], stats['bytes'])
+
+
+def format_search_plan_stats(plan, hit):
+    """Format the statistics of the cached plan of a search's query shape as a
+    header value.
+    """
+    return 'shape={}; hit={}; hits={}; misses={}'.format(
+        plan.shape_id, int(hit), plan.hits, plan.misses)
+
+
 class ReadonlyResources:
     """Super-class of ABC ``Resources`` and all read-only OLD resource views.
     RESTful CRUD(S) interface based on the Atom protocol:
@@ -77,6 +103,10 @@ class ReadonlyResources:
 
     inflect_p = inflect.engine()
     inflect_p.classical()
+    # Action-specific overrides of the model's eager loading plan, e.g.,
+    # ``{'index': ('enterer', ('tags', 'subquery'))}``; cf.
+    # ``old.lib.dbutils.LOADING_PLANS``.
+    loading_plan = None
 
     def __init__(self, request):
         self.request = request
@@ -106,7 +136,7 @@ class ReadonlyResources:
     def db(self):
         if not self._db:
             self._db = DBUtils(self.request.dbsession,
-                               self.request.registry.settings)
+                               self.request.settings)
         return self._db
 
     @property
@@ -116,7 +146,7 @@ class ReadonlyResources:
                 self.request.dbsession,
                 model_name=self.model_name,
                 primary_key=self.primary_key,
-                settings=self.request.registry.settings)
+                settings=self.request.settings)
         return self._query_builder
 
     @property
@@ -152,9 +182,14 @@ class ReadonlyResources:
         :returns: a JSON-serialized array of resources objects.
         """
         LOGGER.info('Attempting to read all %s', self.hmn_collection_name)
-        query = self._eagerload_model(
-            self.request.dbsession.query(self.model_cls))
         get_params = dict(self.request.GET)
+        return self._get_cached_result(
+            'index', get_params, lambda: self._index(get_params))
+
+    def _index(self, get_params):
+        query = self._eagerload_model(
+            self.request.dbsession.query(self.model_cls),
+            'minimal' if get_params.get('minimal') else 'index')
         try:
             query = self.add_order_by(query, get_params)
             query = self._filter_query(query)
@@ -231,6 +266,13 @@ class ReadonlyResources:
             self.request.response.status_int = 400
             LOGGER.warning('Request body was not valid JSON')
             return JSONDecodeErrorResponse
+        return self._get_cached_result(
+            'search', python_search_params,
+            lambda: self._capture_search(
+                'search', python_search_params,
+                lambda: self._search(python_search_params)))
+
+    def _search(self, python_search_params):
         try:
             sqla_query = self.query_builder.get_SQLA_query(
                 python_search_params.get('query'))
@@ -251,7 +293,14 @@ class ReadonlyResources:
             self.request.response.status_int = 400
             return {'error': 'The specified search parameters generated an'
                              ' invalid database query'}
-        query = self._eagerload_model(sqla_query)
+        if self.query_builder.plan is not None:
+            self.request.response.headers['X-OLD-Search-Plan'] = \
+                format_search_plan_stats(self.query_builder.plan,
+                                         self.query_builder.plan_hit)
+        paginator = python_search_params.get('paginator')
+        query = self._eagerload_model(
+            sqla_query,
+            'minimal' if paginator and paginator.get('minimal') else 'search')
         query = self._filter_query(query)
         try:
             ret = add_pagination(query, python_search_params.get('paginator'))
@@ -304,9 +353,13 @@ class ReadonlyResources:
     def _get_update_dict(self, resource_model):
         return self._get_create_dict(resource_model)
 
-    def _eagerload_model(self, query_obj):
-        """Override this in a subclass with model-specific eager loading."""
-        return get_eagerloader(self.model_name)(query_obj)
+    def _eagerload_model(self, query_obj, action=None):
+        """Add the eager loading options of the model's loading plan for
+        ``action`` to ``query_obj``. Set ``loading_plan`` or override this in
+        a subclass for view-specific eager loading.
+        """
+        return get_eagerloader(self.model_name, action, self.loading_plan)(
+            query_obj)
 
     def _filter_query(self, query_obj):
         """Override this in a subclass with model-specific query filtering.
@@ -349,7 +402,8 @@ class ReadonlyResources:
         if eager:
             return (
                 self._eagerload_model(
-                    self.request.dbsession.query(self.model_cls)).get(id_),
+                    self.request.dbsession.query(self.model_cls),
+                    'show').get(id_),
                 id_)
         return self.request.dbsession.query(self.model_cls).get(id_), id_
 
@@ -364,6 +418,71 @@ class ReadonlyResources:
         return _filter_restricted_models_from_query(self.model_name, query,
                                                     user)
 
+    def _get_result_cache_restriction(self):
+        """Return the restriction class of the logged in user: users of the
+        same class get the same results from ``index`` and ``search``. Views
+        whose ``_filter_query`` filters by something other than restricted
+        tags must override this.
+        """
+        user = self.logged_in_user
+        if self.db.user_is_unrestricted(user):
+            return 'unrestricted'
+        return 'user %d' % user.id
+
+    def _capture_search(self, kind, params, search, query_builder=None):
+        """Return ``search()``, capturing the search with the JSON request
+        body ``params`` if it is slow, cf. :mod:`old.lib.slowsearch`.
+        """
+        query_builder = query_builder or self.query_builder
+
+        def get_shape_id():
+            return query_builder.get_query_shape_id(params.get('query'))
+
+        return capture_search(self.request, kind, query_builder.model_name,
+                              params, search, get_shape_id)
+
+    def _get_cached_result(self, action, params, get_result):
+        """Return the response of ``get_result()`` for ``action`` with
+        ``params``, from the result cache if its tables have not changed since
+        it was cached, cf. :mod:`old.lib.resultcache`. Only successful
+        responses are cached, together with the headers that ``get_result``
+        sets. The ``X-OLD-Result-Cache`` header reports whether the response
+        was a hit and the statistics of the cache.
+        """
+        cache = get_result_cache(self.request.settings)
+        if cache is None:
+            return get_result()
+        dbsession = self.request.dbsession
+        key = (get_tenant_key(dbsession), self.model_name, action,
+               json.dumps(params, sort_keys=True, default=str),
+               self._get_result_cache_restriction())
+        watermark = get_watermark(dbsession,
+                                  get_dependent_tables(self.model_name))
+        if watermark is None:
+            return get_result()
+        response = self.request.response
+        cached = cache.get(key, watermark)
+        hit = cached is not None
+        if hit:
+            body, headers = cached
+            response.headers.update(headers)
+        else:
+            header_names = set(response.headers.keys())
+            result = get_result()
+            if response.status_int != 200 or isinstance(result, Response):
+                return result
+            body = render('json', result, request=self.request).encode('utf8')
+            headers = [
+                (name, value) for name, value in response.headers.items()
+                if name not in header_names and
+                name.lower() not in ('content-type', 'content-length')]
+            cache.put(key, watermark, body, headers)
+        response.headers['X-OLD-Result-Cache'] = format_result_cache_stats(
+            hit, cache.get_stats())
+        response.content_type = 'application/json'
+        response.body = body
+        return response
+
     def _rsrc_not_exist(self, id_):
         return 'There is no %s with %s %s' % (self.hmn_member_name,
                                               self.primary_key, id_)
@@ -448,7 +567,7 @@ class Resources(abc.ABC, ReadonlyResources):
         """
         LOGGER.info('Attempting to create a new %s.', self.hmn_member_name)
         schema = self.schema_cls()
-        if self.request.registry.settings.get('readonly') == '1':
+        if self.request.settings.get('readonly') == '1':
             LOGGER.warning('Attempt to create a resource in read-only mode')
             self.request.response.status_int = 403
             return READONLY_MODE_MSG
@@ -503,7 +622,7 @@ class Resources(abc.ABC, ReadonlyResources):
         """
         resource_model, id_ = self._model_from_id(eager=True)
         LOGGER.info('Attempting to update %s %s.', self.hmn_member_name, id_)
-        if self.request.registry.settings.get('readonly') == '1':
+        if self.request.settings.get('readonly') == '1':
             LOGGER.warning('Attempt to update a resource in read-only mode')
             self.request.response.status_int = 403
             return READONLY_MODE_MSG
@@ -588,7 +707,7 @@ class Resources(abc.ABC, ReadonlyResources):
         """
         resource_model, id_ = self._model_from_id(eager=True)
         LOGGER.info('Attempting to delete %s %s.', self.hmn_member_name, id_)
-        if self.request.registry.settings.get('readonly') == '1':
+        if self.request.settings.get('readonly') == '1':
             LOGGER.warning('Attempt to delete a resource in read-only mode')
             self.request.response.status_int = 403
             return READONLY_MODE_MSG
@@ -642,7 +761,8 @@ class Resources(abc.ABC, ReadonlyResources):
         id_ = self.request.matchdict['id']
         LOGGER.info('Requesting history of %s %s.', self.hmn_member_name, id_)
         resource_model, previous_versions = self.db\
-            .get_model_and_previous_versions(self.model_name, id_)
+            .get_model_and_previous_versions(self.model_name, id_,
+                                             self.loading_plan)
         if resource_model or previous_versions:
             unrestricted_previous_versions = [
                 pv for pv in previous_versions
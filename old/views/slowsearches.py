@@ -0,0 +1,44 @@
+# Copyright 2016 Joel Dunham
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""Requests to /<old_name>/slowsearches are routed here. Administrators can
+get the captured slow searches of an OLD summarized by query shape, cf.
+:mod:`old.lib.slowsearch`.
+"""
+
+import logging
+
+from old.lib import slowsearch
+
+
+LOGGER = logging.getLogger(__name__)
+
+
+class SlowSearches:
+
+    def __init__(self, request):
+        self.request = request
+
+    def index(self):
+        """Return the summaries of the captured slow searches by kind, model
+        and query shape, those that took the most time in total first. Each
+        has the number of captures, their total, mean and maximum durations
+        and mean phase durations (milliseconds), their maximum numbers of
+        matches and rows, the datetime of the last one and the slowest one,
+        with its JSON query and SQL.
+        """
+        settings = self.request.settings
+        old_name = self.request.matchdict['old_name']
+        return slowsearch.aggregate_captures(
+            slowsearch.get_captures(settings, old_name))
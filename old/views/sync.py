@@ -19,70 +19,22 @@ helping a follower OLD to synchronize with a leader.
 import json
 import logging
 
+from pyramid.response import Response
 from sqlalchemy import text
-from sqlalchemy.orm.attributes import InstrumentedAttribute
 
-import old.lib.constants as oldc
-import old.models as old_models
-
-
-LOGGER = logging.getLogger(__name__)
-
-
-MODELS = (
-    'ApplicationSettings',
-    'ApplicationSettingsUser',
-    'Collection',
-    'CollectionBackup',
-    'CollectionFile',
-    'CollectionForm',
-    'CollectionTag',
-    'Corpus',
-    'CorpusBackup',
-    'CorpusFile',
-    'CorpusForm',
-    'CorpusTag',
-    'ElicitationMethod',
-    'File',
-    'FileTag',
-    'Form',
-    'FormBackup',
-    'FormFile',
-    'FormSearch',
-    'FormTag',
-    'Keyboard',
-    # 'Language': {}, # Language is special (immutable) ...
-    'MorphemeLanguageModel',
-    'MorphemeLanguageModelBackup',
-    'MorphologicalParser',
-    'MorphologicalParserBackup',
-    'Morphology',
-    'MorphologyBackup',
-    'Orthography',
-    'Page',
-    'Parse',
-    'Phonology',
-    'PhonologyBackup',
-    'Source',
-    'Speaker',
-    'SyntacticCategory',
-    'Tag',
-    'Translation',
-    'User',
-    'UserForm',
+# pylint: disable=unused-import
+from old.lib.sync import (
+    MODELS,
+    TABLES,
+    decode_watermark,
+    get_changes,
+    get_last_modified,
+    iter_ndjson,
+    validate_table_ids,
 )
 
 
-TABLES = tuple(getattr(old_models, mname).__table__.name for mname in MODELS)
-
-
-def date_string(date_thing):
-    """Given a "date", return a string, where the date may already be a string
-    or it may be a `datetime.datetime` instance.
-    """
-    if isinstance(date_thing, str):
-        return date_thing.replace(' ', 'T')
-    return date_thing.strftime(oldc.ISO_STRFTIME)
+LOGGER = logging.getLogger(__name__)
 
 
 class Sync:
@@ -93,14 +45,31 @@ class Sync:
     def last_modified(self):
         """Return a dict whose keys are table names and whose values are dicts
         from row IDs to row last_modified date-time strings.
+
+        If the ``since`` GET parameter is supplied (a watermark returned
+        earlier or an ISO 8601 date-time), return only what changed since
+        then instead, together with the ``watermark`` to supply as ``since``
+        next time; an empty ``since`` value returns every row as changed. So
+        does a ``since`` value older than the tombstones of deleted rows are
+        kept for, with ``full_sync`` set: the follower must then delete the
+        rows that are not returned. Cf. :func:`old.lib.sync.get_changes`::
+
+            {'watermark': '...',
+             'full_sync': False,
+             'tables': {'form': {'changed': {'1': '...'}, 'deleted': [2]}}}
         """
+        since = self.request.params.get('since')
+        if since is not None:
+            try:
+                watermark = decode_watermark(since) if since.strip() else None
+            except ValueError as error:
+                self.request.response.status_int = 400
+                LOGGER.warning(str(error))
+                return {'error': str(error)}
+            LOGGER.info('Returning the changes to this OLD since %s.', since)
+            return get_changes(self.request.dbsession.connection(), watermark)
         LOGGER.info('Returning last_modified information about this OLD.')
-        tables = {}
-        for tname in TABLES:
-            tables[tname] = {
-                r['id']: date_string(r['datetime_modified']) for
-                r in self.request.dbsession.execute(
-                    text('select id, datetime_modified from {}'.format(tname)))}
+        tables = get_last_modified(self.request.dbsession.connection())
         LOGGER.info('Returned last_modified information about this OLD.')
         return tables
 
@@ -122,6 +91,11 @@ class Sync:
             {'form': {'1': {'id': 1}
                       '8': {'id': 8}},
              'corpus': {'3': {'id': 3}}}
+
+        If the request body has ``"format": "ndjson"`` (or the request accepts
+        ``application/x-ndjson``), the rows are streamed instead, one
+        ``{"table": ..., "row": {...}}`` object per line, followed by an
+        ``{"end": true, "rows": n}`` line.
         """
         LOGGER.info('Returning all tables in this OLD matching the supplied IDs.')
         params = json.loads(self.request.body.decode(self.request.charset))
@@ -131,9 +105,13 @@ class Sync:
             LOGGER.error(msg)
             self.request.response.status_int = 400
             return {'error': msg}
+        if (params.get('format') == 'ndjson' or
+                'application/x-ndjson' in self.request.headers.get(
+                    'Accept', '')):
+            return self._stream_tables(tables)
         ret = {}
         if tables == '*':
-            LOGGER.warn('Returning all tables')
+            LOGGER.warning('Returning all tables')
             for tname in TABLES:
                 ret[tname] = {
                     r['id']: dict(r)
@@ -157,3 +135,27 @@ class Sync:
                             ', '.join(str(i) for i in ids))))}
         LOGGER.info('Returned all tables in this OLD matching the supplied request.')
         return ret
+
+    def _stream_tables(self, tables):
+        """Return a response that streams the requested rows as NDJSON. The
+        rows are read page by page over a connection of the response's own:
+        the request's session is closed before the body is sent.
+        """
+        try:
+            validate_table_ids(tables)
+        except ValueError as error:
+            self.request.response.status_int = 400
+            LOGGER.warning(str(error))
+            return {'error': str(error)}
+        engine = self.request.dbsession.get_bind()
+
+        def app_iter():
+            connection = engine.connect()
+            try:
+                yield from iter_ndjson(connection, tables)
+            finally:
+                connection.close()
+
+        LOGGER.info('Streaming the requested tables of this OLD.')
+        return Response(app_iter=app_iter(),
+                        content_type='application/x-ndjson', charset='utf-8')
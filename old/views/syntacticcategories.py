@@ -22,7 +22,8 @@ class Syntacticcategories(Resources):
         return ('syntactic_category_types',)
 
     def _post_update(self, syntactic_category, previous_resource_dict):
-        self._update_forms_referencing_this_category(syntactic_category)
+        if previous_resource_dict.get('name') != syntactic_category.name:
+            self._update_forms_referencing_this_category(syntactic_category)
 
     def _post_delete(self, syntactic_category):
         self._update_forms_referencing_this_category(syntactic_category)
@@ -49,10 +50,22 @@ class Syntacticcategories(Resources):
         :returns: ``None``
         .. note::
             This function is only called when a syntactic category is deleted or
-            when its name is changed.
+            when its name is changed. The changes are percolated as a set, cf.
+            ``Forms.update_forms_containing_these_forms_as_morphemes``, and
+            its statistics are returned in the ``X-OLD-Percolation`` header.
         """
         from old.views.forms import Forms
         form_view = Forms(self.request)
-        forms_of_this_category = syntactic_category.forms
-        for form in forms_of_this_category:
-            form_view.update_forms_containing_this_form_as_morpheme(form)
+        stats = form_view.update_forms_containing_these_forms_as_morphemes(
+            syntactic_category.forms)
+        self.request.response.headers['X-OLD-Percolation'] = \
+            format_percolation_stats(stats)
+
+
+def format_percolation_stats(stats):
+    """Format the statistics of a percolation as a header value."""
+    return '; '.join(
+        '{}={}'.format(key, '{:.1f}'.format(stats[key])
+                       if isinstance(stats[key], float) else stats[key])
+        for key in ('lexical_items', 'forms', 'updated', 'find_ms',
+                    'update_ms'))
@@ -39,7 +39,7 @@ class Users(Resources):
             if username != resource_model.username:
                 h.rename_user_directory(
                     resource_model.username, username,
-                    self.request.registry.settings)
+                    self.request.settings)
             user_data['username'] = username
         for attr, val in user_data.items():
             if self._distinct(attr, val, getattr(resource_model, attr)):
@@ -62,7 +62,7 @@ class Users(Resources):
         return update_state
 
     def _post_create(self, user):
-        h.create_user_directory(user, self.request.registry.settings)
+        h.create_user_directory(user, self.request.settings)
 
     def _get_user_data(self, data):
         result = {
@@ -96,4 +96,4 @@ class Users(Resources):
         return user_data
 
     def _pre_delete(self, user):
-        h.destroy_user_directory(user, self.request.registry.settings)
+        h.destroy_user_directory(user, self.request.settings)
@@ -112,4 +112,6 @@ setup(name='old',
       main = old:main
       [console_scripts]
       initialize_old = old.scripts.initialize:main
+      backfill_old_form_morphemes = old.scripts.backfill_form_morphemes:main
+      old_index_advisor = old.scripts.index_advisor:main
       """)